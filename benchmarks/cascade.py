@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Modo cascada: modelo local primero y Kimi K2 solo si duda, frente a Kimi siempre
+
+Simula preguntas de dificultad variable con los niveles de la sección `cascade`
+de models.yaml. Cada modelo acierta con una probabilidad que baja con la
+dificultad y tarda un TTFT más sus tokens al ritmo indicado; los fallos dan
+una de varias respuestas incorrectas, así que las muestras del nivel local
+suelen discrepar cuando falla. Las mismas preguntas (misma semilla) se
+ejecutan con la cascada completa y solo con el nivel baseline, y se comparan
+aciertos, latencia, coste y la tasa de respuestas de cada nivel.
+
+Uso:
+  python benchmarks/cascade.py
+  python benchmarks/cascade.py --questions 200 --local-skill 0.6 --kimi-skill 0.9
+"""
+import argparse
+import asyncio
+import math
+import random
+import statistics
+import sys
+from pathlib import Path
+
+# Permitir importar kimi_proxy desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from kimi_proxy.cascade import Cascade, CascadeConfig, CascadeStats, load_cascade  # noqa: E402
+from kimi_proxy.sse import completion_to_sse  # noqa: E402
+
+
+def skill_for(args, model: str) -> float:
+    return args.kimi_skill if "kimi" in model.lower() else args.local_skill
+
+
+def tps_for(args, model: str) -> float:
+    return args.kimi_tps if "kimi" in model.lower() else args.local_tps
+
+
+def simulated_stream(args, question: int):
+    """open_stream de una pregunta: el resultado depende solo de (pregunta, modelo, seed)"""
+    difficulty = random.Random(question).random()
+
+    async def open_stream(payload):
+        model = payload["model"]
+        rng = random.Random(f"{question}:{model}:{payload.get('seed')}")
+        # Por encima de la habilidad del modelo las preguntas se vuelven mucho más difíciles
+        p_correct = min(0.99, max(0.05, skill_for(args, model) + 0.5 - difficulty))
+        answer = "42" if rng.random() < p_correct else str(rng.randint(0, 3))
+        tokens = int(args.tokens * math.exp(rng.gauss(0.0, 0.4)))
+        if payload.get("max_tokens"):
+            tokens = min(tokens, payload["max_tokens"])
+        completion = {
+            "id": "chatcmpl-sim", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant",
+                                                 "content": "tok " * tokens + f"\nRespuesta final: {answer}"},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 200, "completion_tokens": tokens, "total_tokens": 200 + tokens},
+        }
+        await asyncio.sleep(args.ttft_ms / 1000 + tokens / tps_for(args, model))
+        for event in completion_to_sse(completion):
+            yield event
+    return open_stream
+
+
+async def run(args) -> int:
+    config = load_cascade(args.config)
+    if config is None or config.baseline_tier is None:
+        print("models.yaml no tiene una sección cascade con baseline")
+        return 1
+    modes = {
+        "cascada": config,
+        f"solo {config.baseline}": CascadeConfig(tiers=[config.baseline_tier], baseline=config.baseline),
+    }
+    data = {"model": "kimi-k2", "messages": [{"role": "user", "content": "¿Cuál es la respuesta?"}]}
+
+    print(f"{args.questions} preguntas; habilidad local {args.local_skill:.0%}, Kimi {args.kimi_skill:.0%}; "
+          f"niveles: {' → '.join(t.name for t in config.tiers)}")
+    print(f"{'modo':<24} {'aciertos':>9} {'s medio':>8} {'s p95':>8} {'USD':>10}")
+    stats = {}
+    for label, mode in modes.items():
+        stats[label] = CascadeStats()
+        elapsed, correct = [], 0
+        for question in range(args.questions):
+            result = await Cascade(mode, simulated_stream(args, question)).run(data)
+            stats[label].record(result.summary())
+            elapsed.append(result.elapsed)
+            completion = result.completion
+            correct += completion is not None and completion["choices"][0]["message"]["content"].endswith(": 42")
+        elapsed.sort()
+        print(f"{label:<24} {correct:>9} {statistics.mean(elapsed):>8.3f} "
+              f"{elapsed[int(len(elapsed) * 0.95) - 1]:>8.3f} {stats[label].snapshot()['cost_usd']:>10.4f}")
+
+    snapshot = stats["cascada"].snapshot()
+    print(f"\n{'nivel':<18} {'intentos':>9} {'responde':>9} {'escala':>7} {'s medio':>8} {'USD':>10}")
+    for name, tier in snapshot["tiers"].items():
+        print(f"{name:<18} {tier['attempts']:>9} {tier['hit_rate']:>9.0%} {tier['escalated']:>7} "
+              f"{tier['mean_seconds']:>8.3f} {tier['cost_usd']:>10.4f}")
+    print(f"\nAhorro frente a {config.baseline}: ${snapshot['cost_saved_usd']:.4f} "
+          f"de ${snapshot['baseline_cost_usd']:.4f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--config", type=Path, default=None, help="models.yaml con la sección cascade")
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--local-skill", type=float, default=0.6, help="Acierto medio del modelo local")
+    parser.add_argument("--kimi-skill", type=float, default=0.85, help="Acierto medio de Kimi K2")
+    parser.add_argument("--tokens", type=int, default=400, help="Mediana de tokens por respuesta")
+    parser.add_argument("--ttft-ms", type=float, default=20)
+    parser.add_argument("--local-tps", type=float, default=40000, help="Tokens por segundo del modelo local")
+    parser.add_argument("--kimi-tps", type=float, default=20000, help="Tokens por segundo de Kimi K2")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Bytes en la red y latencia extremo a extremo con cuerpos comprimidos
+
+Envía un prompt de contexto extremo (~200K tokens) a /v1/chat/completions
+sin comprimir y con cada Content-Encoding soportado, y pide una respuesta
+grande (~32K tokens) con cada Accept-Encoding. El proxy corre en proceso con
+un upstream simulado; se mide el tiempo real de cada petición (compresión del
+cliente, descompresión y compresión del proxy, decodificación de httpx) y se
+le suma lo que tardarían los bytes medidos en enlaces de distinto ancho de
+banda, porque en local la red es gratis.
+
+Uso:
+  python benchmarks/compression.py
+  python benchmarks/compression.py --requests 5 --prompt-tokens 200000 --links 20,100,1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import orjson
+
+# Permitir importar el servidor desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("CHUTES_API_KEY", "benchmark-key")
+
+import kimi_k2_local_server as server  # noqa: E402
+from kimi_proxy.compression import ENCODINGS, compress  # noqa: E402
+
+ROOT = Path(__file__).parent.parent
+
+# Aproximación habitual: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+
+def make_text(tokens: int, rng: random.Random) -> str:
+    """Texto con palabras de la documentación del repo en orden aleatorio (no trivialmente comprimible)"""
+    words = (ROOT / "SETUP_LOCAL.md").read_text().split() + (ROOT / "README.md").read_text().split()
+    out, size = [], 0
+    while size < tokens * CHARS_PER_TOKEN:
+        word = rng.choice(words)
+        out.append(word)
+        size += len(word) + 1
+    return " ".join(out)
+
+
+def make_body(tokens: int, rng: random.Random) -> bytes:
+    """Conversación de varios turnos que suma ~`tokens` tokens"""
+    turns = max(1, tokens // 2000)
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": make_text(tokens // turns, rng)}
+        for i in range(turns)
+    ]
+    return orjson.dumps({"model": server.KIMI_K2_MODEL, "messages": messages, "max_tokens": 16})
+
+
+def completion(content: str) -> bytes:
+    return orjson.dumps({
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": 1730000000,
+        "model": server.KIMI_K2_MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+    })
+
+
+async def timed(n: int, send) -> tuple:
+    """(mediana de segundos por petición, bytes en la red de la última)"""
+    await send()  # calentamiento
+    times, wire = [], 0
+    for _ in range(n):
+        start = time.perf_counter()
+        wire = await send()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2], wire
+
+
+async def run(args) -> int:
+    rng = random.Random(0)
+    prompt = make_body(args.prompt_tokens, rng)
+    small = completion("ok")
+    large = completion(make_text(args.response_tokens, rng))
+    server.app.state.response_cache = None
+    server.app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=large if b'"large"' in request.content else small)
+    ))
+    links = [float(mbps) for mbps in args.links.split(",")]
+    transport = httpx.ASGITransport(app=server.app)
+    rows = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://proxy", timeout=None) as client:
+        for encoding in ("identity",) + ENCODINGS:
+            async def upload():
+                # La compresión del cliente forma parte de la latencia
+                content = prompt if encoding == "identity" else compress(prompt, encoding)
+                response = await client.post("/v1/chat/completions", content=content, headers={
+                    "Content-Encoding": encoding, "Accept-Encoding": "identity",
+                })
+                response.raise_for_status()
+                return len(content)
+
+            async def download():
+                response = await client.post(
+                    "/v1/chat/completions", headers={"Accept-Encoding": encoding},
+                    content=orjson.dumps({"messages": [{"role": "user", "content": "large"}]}),
+                )
+                response.raise_for_status()
+                return response.num_bytes_downloaded
+
+            rows.append((f"petición {encoding}", len(prompt), *await timed(args.requests, upload)))
+            rows.append((f"respuesta {encoding}", len(large), *await timed(args.requests, download)))
+
+    header = " ".join(f"{f'{mbps:g} Mbit/s ms':>16}" for mbps in links)
+    print(f"prompt ~{args.prompt_tokens} tokens, respuesta ~{args.response_tokens} tokens")
+    print(f"{'cuerpo':>20} {'KB':>8} {'en la red KB':>13} {'ratio':>6} {'local ms':>9} {header}")
+    for label, size, seconds, wire in sorted(rows, key=lambda row: not row[0].startswith("petición")):
+        total = " ".join(f"{(seconds + wire * 8 / (mbps * 1e6)) * 1000:>16.1f}" for mbps in links)
+        print(f"{label:>20} {size / 1024:>8.0f} {wire / 1024:>13.0f} {size / wire:>6.1f} "
+              f"{seconds * 1000:>9.1f} {total}")
+
+    await server.app.state.upstream_client.aclose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", "-n", type=int, default=5, help="Peticiones por caso (se usa la mediana)")
+    parser.add_argument("--prompt-tokens", type=int, default=200000, help="Tamaño del prompt en tokens")
+    parser.add_argument("--response-tokens", type=int, default=32000, help="Tamaño de la respuesta en tokens")
+    parser.add_argument("--links", default="20,100,1000", help="Anchos de banda simulados en Mbit/s")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
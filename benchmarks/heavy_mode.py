@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Heavy Mode local: salida anticipada por consenso frente a esperar a todas
+
+Simula N trayectorias por pregunta con streams en paralelo: cada una tarda
+un TTFT, genera una cantidad de tokens lognormal al ritmo indicado y acaba
+con la respuesta correcta con la probabilidad pedida (si no, con una de
+varias incorrectas). Las mismas trayectorias (misma semilla) se ejecutan con
+HeavyEngine con y sin salida anticipada y se comparan el tiempo de pared,
+los tokens generados y la respuesta elegida.
+
+Uso:
+  python benchmarks/heavy_mode.py
+  python benchmarks/heavy_mode.py --questions 50 --trajectories 8 --agreement 0.6 --tps 200
+"""
+import argparse
+import asyncio
+import math
+import random
+import statistics
+import sys
+from pathlib import Path
+
+# Permitir importar kimi_proxy desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from kimi_proxy.heavy import HeavyEngine  # noqa: E402
+from kimi_proxy.sse import completion_to_sse  # noqa: E402
+
+# Tokens por chunk SSE simulado (cada token son 4 caracteres, como estima el motor)
+CHUNK_TOKENS = 8
+
+
+def plan(args, question: int) -> dict:
+    """Respuesta, TTFT y longitud de cada seed para una pregunta (reproducible)"""
+    rng = random.Random(question)
+    trajectories = {}
+    for seed in range(args.trajectories):
+        correct = rng.random() < args.agreement
+        answer = "42" if correct else str(rng.randint(0, 3))
+        tokens = int(args.tokens * math.exp(rng.gauss(0.0, args.sigma)))
+        trajectories[seed] = (answer, args.ttft_ms / 1000 * math.exp(rng.gauss(0.0, 0.3)), tokens)
+    return trajectories
+
+
+def simulated_stream(trajectories: dict, tps: float):
+    async def open_stream(payload):
+        answer, ttft, tokens = trajectories[payload["seed"]]
+        completion = {
+            "id": "chatcmpl-sim", "object": "chat.completion", "created": 0, "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant",
+                                                 "content": "tok " * tokens + f"\nRespuesta final: {answer}"},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 50, "completion_tokens": tokens, "total_tokens": 50 + tokens},
+        }
+        await asyncio.sleep(ttft)
+        for event in completion_to_sse(completion, chunk_chars=CHUNK_TOKENS * 4):
+            yield event
+            if b'"content"' in event:
+                await asyncio.sleep(CHUNK_TOKENS / tps)
+    return open_stream
+
+
+async def run(args) -> int:
+    data = {"model": "kimi-k2", "messages": [{"role": "user", "content": "¿Cuál es la respuesta?"}]}
+    rows = {True: [], False: []}
+    for question in range(args.questions):
+        trajectories = plan(args, question)
+        for early_exit in (False, True):
+            engine = HeavyEngine(simulated_stream(trajectories, args.tps),
+                                 trajectories=args.trajectories, early_exit=early_exit)
+            result = await engine.run(data)
+            rows[early_exit].append(result)
+
+    print(f"{args.questions} preguntas × {args.trajectories} trayectorias, acuerdo {args.agreement:.0%}, "
+          f"~{args.tokens} tokens a {args.tps:.0f} tok/s")
+    print(f"{'modo':<22} {'s medio':>8} {'s p95':>8} {'tokens':>10} {'canceladas':>10} {'aciertos':>9}")
+    for early_exit, label in ((False, "esperar a todas"), (True, "salida anticipada")):
+        results = rows[early_exit]
+        elapsed = sorted(r.elapsed for r in results)
+        tokens = sum(r.tokens_generated for r in results)
+        cancelled = sum(t.status == "cancelled" for r in results for t in r.trajectories)
+        correct = sum(r.chosen is not None and r.chosen.vote == "42" for r in results)
+        print(f"{label:<22} {statistics.mean(elapsed):>8.2f} {elapsed[int(len(elapsed) * 0.95) - 1]:>8.2f} "
+              f"{tokens:>10,} {cancelled:>10} {correct:>9}")
+
+    same = sum(a.chosen is not None and b.chosen is not None and a.chosen.vote == b.chosen.vote
+               for a, b in zip(rows[False], rows[True]))
+    saved = sum(r.tokens_generated for r in rows[False]) - sum(r.tokens_generated for r in rows[True])
+    estimated = sum(r.estimated_tokens_saved for r in rows[True])
+    print(f"\nMisma respuesta en {same}/{args.questions} preguntas; "
+          f"tokens ahorrados {saved:,} (estimación del motor {estimated:,})")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--trajectories", type=int, default=8)
+    parser.add_argument("--agreement", type=float, default=0.7, help="Probabilidad de que una trayectoria acierte")
+    parser.add_argument("--tokens", type=int, default=2000, help="Mediana de tokens por trayectoria")
+    parser.add_argument("--sigma", type=float, default=0.4, help="Dispersión lognormal de la longitud")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tps", type=float, default=2000, help="Tokens por segundo de cada stream")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
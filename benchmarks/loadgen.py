@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Generador de carga para el proxy (kimi_k2_local_server.py)
+
+Lanza peticiones de chat contra el proxy con concurrencia fija (bucle
+cerrado: cada worker envía la siguiente al terminar la anterior) o con un
+ritmo de llegadas de Poisson (bucle abierto: las peticiones llegan aunque
+las anteriores no hayan terminado). Informa del throughput, de los
+percentiles p50/p95/p99 de TTFT y latencia total, y del coste propio del
+proxy: latencia vista por el cliente menos la que el upstream simulado
+(benchmarks/mock_upstream.py) dice haber tardado en `x_mock`. El mock solo
+mide el último intento, así que los reintentos del proxy (429, 500) cuentan
+como overhead.
+
+Con --spawn arranca el mock y el proxy (apuntando al mock) en procesos
+hijos, así que no se gastan tokens de Chutes.
+
+Uso:
+  python benchmarks/loadgen.py --spawn --concurrency 50 --duration 30
+  python benchmarks/loadgen.py --spawn --rate 20 --duration 60 --mock-args "--ttft-ms 800 --error-rate 0.01"
+  python benchmarks/loadgen.py --url http://localhost:8080 --concurrency 10 --requests 200 --no-stream
+"""
+import argparse
+import asyncio
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+import orjson
+
+ROOT = Path(__file__).parent.parent
+
+TOOLS = [{"type": "function", "function": {
+    "name": "buscar_informacion",
+    "description": "Busca información actualizada",
+    "parameters": {"type": "object", "properties": {"consulta": {"type": "string"}}, "required": ["consulta"]},
+}}]
+
+
+@dataclass
+class Result:
+    """Una petición: estado, tiempos vistos por el cliente y los del mock"""
+
+    status: int
+    start: float
+    ttft: Optional[float] = None
+    total: Optional[float] = None
+    tokens: int = 0
+    mock_ttft: Optional[float] = None
+    mock_total: Optional[float] = None
+    error: Optional[str] = None
+
+
+def payload(i: int, args: argparse.Namespace) -> dict:
+    # Un prompt distinto por petición: la caché y el singleflight no deben unirlas
+    body = {
+        "model": args.model,
+        "messages": [{"role": "user", "content": f"Petición de carga {i}: " + "contexto " * args.prompt_words}],
+        "max_tokens": args.max_tokens,
+        "stream": args.stream,
+    }
+    if args.tools:
+        body["tools"] = TOOLS
+    if args.stream:
+        body["stream_options"] = {"include_usage": True}
+    return body
+
+
+async def send(client: httpx.AsyncClient, i: int, args: argparse.Namespace) -> Result:
+    start = time.perf_counter()
+    result = Result(status=0, start=start)
+    try:
+        if not args.stream:
+            response = await client.post("/v1/chat/completions", json=payload(i, args))
+            result.status = response.status_code
+            result.ttft = result.total = time.perf_counter() - start
+            if response.status_code == 200:
+                _mock_timing(result, response.json())
+            return result
+
+        async with client.stream("POST", "/v1/chat/completions", json=payload(i, args)) as response:
+            result.status = response.status_code
+            async for line in response.aiter_lines():
+                if not line.startswith("data: {"):
+                    continue
+                event = orjson.loads(line[6:])
+                for choice in event.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("content") or delta.get("reasoning_content") or delta.get("tool_calls"):
+                        result.tokens += 1
+                        if result.ttft is None:
+                            result.ttft = time.perf_counter() - start
+                _mock_timing(result, event)
+        result.total = time.perf_counter() - start
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    return result
+
+
+def _mock_timing(result: Result, body: dict) -> None:
+    timing = body.get("x_mock")
+    if timing:
+        result.mock_ttft = timing["ttft_ms"] / 1000
+        result.mock_total = timing["total_ms"] / 1000
+    usage = body.get("usage")
+    if usage and not result.tokens:
+        result.tokens = usage.get("completion_tokens", 0)
+
+
+async def closed_loop(client: httpx.AsyncClient, args: argparse.Namespace) -> List[Result]:
+    """`concurrency` workers, cada uno con una petición en curso"""
+    results: List[Result] = []
+    deadline = time.perf_counter() + args.duration
+    counter = iter(range(args.requests or sys.maxsize))
+
+    async def worker():
+        for i in counter:
+            if time.perf_counter() >= deadline:
+                return
+            results.append(await send(client, i, args))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results
+
+
+async def open_loop(client: httpx.AsyncClient, args: argparse.Namespace) -> List[Result]:
+    """Llegadas de Poisson a `rate` peticiones/s, sin esperar a las anteriores"""
+    rng = random.Random(args.seed)
+    tasks = []
+    deadline = time.perf_counter() + args.duration
+    next_arrival = time.perf_counter()
+    for i in range(args.requests or sys.maxsize):
+        next_arrival += rng.expovariate(args.rate)
+        if next_arrival >= deadline:
+            break
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(send(client, i, args)))
+    return list(await asyncio.gather(*tasks))
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return f"{'-':>9} {'-':>9} {'-':>9}"
+    ordered = sorted(values)
+    picks = [ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] for p in (50, 95, 99)]
+    return " ".join(f"{value * 1000:>9.1f}" for value in picks)
+
+
+def report(results: List[Result], elapsed: float) -> None:
+    ok = [r for r in results if r.status == 200 and r.error is None]
+    outcomes = Counter(r.error or str(r.status) for r in results)
+    print(f"\n{len(results)} peticiones en {elapsed:.1f}s: "
+          + ", ".join(f"{outcome}={count}" for outcome, count in sorted(outcomes.items())))
+    print(f"Throughput: {len(ok) / elapsed:.1f} req/s correctas, "
+          f"{sum(r.tokens for r in ok) / elapsed:.0f} tokens/s")
+    print(f"\n{'ms':<26} {'p50':>9} {'p95':>9} {'p99':>9}")
+    print(f"{'TTFT':<26} {percentiles([r.ttft for r in ok if r.ttft is not None])}")
+    print(f"{'latencia total':<26} {percentiles([r.total for r in ok])}")
+    timed = [r for r in ok if r.mock_total is not None]
+    print(f"{'overhead proxy (TTFT)':<26} "
+          f"{percentiles([r.ttft - r.mock_ttft for r in timed if r.ttft is not None])}")
+    print(f"{'overhead proxy (total)':<26} {percentiles([r.total - r.mock_total for r in timed])}")
+    if len(timed) < len(ok):
+        print(f"({len(ok) - len(timed)} respuestas sin x_mock: el upstream no es benchmarks/mock_upstream.py)")
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nada escucha en el puerto {port}")
+
+
+def spawn(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """Arranca el mock y el proxy apuntando a él"""
+    mock = subprocess.Popen([
+        sys.executable, str(ROOT / "benchmarks" / "mock_upstream.py"), "--port", str(args.mock_port),
+        *shlex.split(args.mock_args),
+    ])
+    env = {
+        **os.environ,
+        "CHUTES_API_KEY": "mock",
+        "CHUTES_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "KIMI_BATCH_ENABLED": "0",
+    }
+    proxy = subprocess.Popen([
+        sys.executable, str(ROOT / "kimi_k2_local_server.py"),
+        "--host", "127.0.0.1", "--port", str(args.proxy_port), "--workers", str(args.workers),
+    ], env=env, stdout=subprocess.DEVNULL)
+    wait_for_port(args.mock_port)
+    wait_for_port(args.proxy_port)
+    return [proxy, mock]
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        if args.rate:
+            return await open_loop(client, args)
+        return await closed_loop(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="URL del proxy (por defecto el que arranca --spawn)")
+    parser.add_argument("--concurrency", "-c", type=int, default=10, help="Peticiones en curso (bucle cerrado)")
+    parser.add_argument("--rate", type=float, help="Llegadas por segundo (bucle abierto; ignora --concurrency)")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de carga")
+    parser.add_argument("--requests", "-n", type=int, help="Tope de peticiones")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Peticiones sin stream")
+    parser.add_argument("--tools", action="store_true", help="Incluir una herramienta en cada petición")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--prompt-words", type=int, default=50, help="Tamaño del prompt en palabras")
+    parser.add_argument("--model", default="moonshot/kimi-k2-thinking")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="Arrancar el mock y el proxy")
+    parser.add_argument("--mock-args", default="", help="Opciones de mock_upstream.py con --spawn")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--proxy-port", type=int, default=18081)
+    parser.add_argument("--workers", type=int, default=1, help="Workers del proxy con --spawn")
+    args = parser.parse_args()
+    if args.url is None:
+        if not args.spawn:
+            parser.error("indica --url o --spawn")
+        args.url = f"http://127.0.0.1:{args.proxy_port}"
+
+    children = spawn(args) if args.spawn else []
+    try:
+        mode = f"{args.rate:g} llegadas/s" if args.rate else f"concurrencia {args.concurrency}"
+        print(f"{args.url}: {mode}, {args.duration:g}s, {'stream' if args.stream else 'sin stream'}")
+        start = time.perf_counter()
+        results = asyncio.run(run(args))
+        report(results, time.perf_counter() - start)
+    finally:
+        for child in children:
+            child.terminate()
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Upstream simulado compatible con OpenAI para pruebas de carga del proxy
+
+Sirve /v1/chat/completions (con y sin stream, con tool calls) sin gastar
+tokens de Chutes. El primer token tarda lo que marque una distribución
+lognormal (mediana y dispersión configurables) y luego se emiten tokens al
+ritmo pedido. Se pueden inyectar errores 500, respuestas 429 con Retry-After
+y parones a mitad del stream.
+
+Cada respuesta lleva en `x_mock` (en el JSON o en el último chunk del stream)
+el TTFT y la duración medidos en el propio mock, para que
+benchmarks/loadgen.py descuente la latencia del upstream y se quede con la
+del proxy.
+
+Uso:
+  python benchmarks/mock_upstream.py --port 9100
+  python benchmarks/mock_upstream.py --ttft-ms 800 --tps 60 --error-rate 0.01 --rate-limit-rate 0.02
+  CHUTES_BASE_URL=http://127.0.0.1:9100/v1 CHUTES_API_KEY=mock python kimi_k2_local_server.py
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+WORDS = (
+    "el modelo razona sobre la pregunta y propone una respuesta breve con datos "
+    "concretos antes de revisar cada paso del plan para evitar errores comunes"
+).split()
+
+
+@dataclass
+class MockConfig:
+    """Comportamiento del upstream simulado"""
+
+    ttft_ms: float = 500.0
+    ttft_sigma: float = 0.3
+    tps: float = 60.0
+    tokens: int = 200
+    reasoning_tokens: int = 0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    stall_rate: float = 0.0
+    stall_ms: float = 5000.0
+    tool_call_rate: float = 1.0
+    seed: Optional[int] = None
+
+
+def chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None,
+          **extra: Any) -> bytes:
+    return b"data: " + orjson.dumps({
+        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+    }) + b"\n\n"
+
+
+class MockUpstream:
+    """Genera las respuestas según MockConfig; `app` es la aplicación ASGI"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.requests = 0
+        self.app = FastAPI(title="Kimi K2 mock upstream")
+        self.app.post("/v1/chat/completions")(self.chat_completions)
+        self.app.get("/v1/models")(self.models)
+
+    def ttft(self) -> float:
+        """Segundos hasta el primer token (lognormal alrededor de la mediana)"""
+        config = self.config
+        return config.ttft_ms / 1000 * math.exp(self.rng.gauss(0.0, config.ttft_sigma))
+
+    def plan(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Qué va a responder esta petición: tokens, tool call y parón"""
+        config = self.config
+        max_tokens = data.get("max_tokens") or config.tokens
+        tools = data.get("tools") or []
+        tool = None
+        if tools and data.get("tool_choice") != "none" and self.rng.random() < config.tool_call_rate:
+            tool = tools[0].get("function", {}).get("name", "tool")
+        tokens = min(config.tokens, max_tokens)
+        return {
+            "ttft": self.ttft(),
+            "reasoning": [f" {self.rng.choice(WORDS)}" for _ in range(config.reasoning_tokens)],
+            "content": [] if tool else [f" {self.rng.choice(WORDS)}" for _ in range(tokens)],
+            "tool": tool,
+            "stall_at": self.rng.randrange(max(tokens, 1)) if self.rng.random() < config.stall_rate else None,
+        }
+
+    async def models(self) -> Dict[str, Any]:
+        return {"object": "list", "data": [{"id": "moonshotai/Kimi-K2-Thinking", "object": "model"}]}
+
+    async def chat_completions(self, request: Request) -> Response:
+        start = time.perf_counter()
+        self.requests += 1
+        config = self.config
+        data = orjson.loads(await request.body())
+        roll = self.rng.random()
+        if roll < config.rate_limit_rate:
+            return Response(
+                orjson.dumps({"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error"}}),
+                status_code=429, media_type="application/json",
+                headers={"Retry-After": f"{config.retry_after:g}"},
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            return Response(
+                orjson.dumps({"error": {"message": "Internal error (mock)", "type": "server_error"}}),
+                status_code=500, media_type="application/json",
+            )
+
+        plan = self.plan(data)
+        model = data.get("model") or "moonshotai/Kimi-K2-Thinking"
+        completion_id = f"chatcmpl-mock-{self.requests}"
+        if data.get("stream"):
+            return StreamingResponse(self.stream(plan, completion_id, model, start), media_type="text/event-stream")
+
+        stall = config.stall_ms / 1000 if plan["stall_at"] is not None else 0.0
+        await asyncio.sleep(plan["ttft"] + stall + self.duration(plan))
+        message: Dict[str, Any] = {"role": "assistant", "content": "".join(plan["content"]) or None}
+        if plan["reasoning"]:
+            message["reasoning_content"] = "".join(plan["reasoning"])
+        if plan["tool"]:
+            message["tool_calls"] = [self.tool_call(plan["tool"])]
+        elapsed = (time.perf_counter() - start) * 1000
+        return Response(orjson.dumps({
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if plan["tool"] else "stop"}],
+            "usage": self.usage(data, plan),
+            "x_mock": {"ttft_ms": elapsed, "total_ms": elapsed},
+        }), media_type="application/json")
+
+    async def stream(self, plan: Dict[str, Any], completion_id: str, model: str, start: float) -> AsyncIterator[bytes]:
+        interval = 1 / self.config.tps if self.config.tps > 0 else 0.0
+        yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+        await asyncio.sleep(plan["ttft"])
+        first_token: Optional[float] = None
+        deltas: List[Dict[str, Any]] = [{"reasoning_content": text} for text in plan["reasoning"]]
+        deltas += [{"content": text} for text in plan["content"]]
+        for i, delta in enumerate(deltas):
+            if i == plan["stall_at"]:
+                await asyncio.sleep(self.config.stall_ms / 1000)
+            if first_token is None:
+                first_token = time.perf_counter()
+            yield chunk(completion_id, model, delta)
+            await asyncio.sleep(interval)
+        if plan["tool"]:
+            call = self.tool_call(plan["tool"])
+            arguments = call["function"].pop("arguments")
+            first_token = first_token or time.perf_counter()
+            yield chunk(completion_id, model, {"tool_calls": [{"index": 0, **call, "function": {
+                **call["function"], "arguments": ""}}]})
+            for piece in (arguments[:len(arguments) // 2], arguments[len(arguments) // 2:]):
+                yield chunk(completion_id, model, {"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+        yield chunk(completion_id, model, {}, "tool_calls" if plan["tool"] else "stop")
+        now = time.perf_counter()
+        yield b"data: " + orjson.dumps({
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [], "usage": self.usage({}, plan),
+            "x_mock": {"ttft_ms": ((first_token or now) - start) * 1000, "total_ms": (now - start) * 1000},
+        }) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    def duration(self, plan: Dict[str, Any]) -> float:
+        tokens = len(plan["reasoning"]) + len(plan["content"])
+        return tokens / self.config.tps if self.config.tps > 0 else 0.0
+
+    def tool_call(self, name: str) -> Dict[str, Any]:
+        arguments = orjson.dumps({"consulta": " ".join(self.rng.choice(WORDS) for _ in range(4))}).decode()
+        return {"id": f"functions.{name}:0", "type": "function", "function": {"name": name, "arguments": arguments}}
+
+    def usage(self, data: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, int]:
+        prompt = sum(len(str(m.get("content") or "")) for m in data.get("messages") or []) // 4
+        completion = len(plan["reasoning"]) + len(plan["content"]) + (16 if plan["tool"] else 0)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Opciones del mock (también las usa loadgen.py --spawn)"""
+    defaults = MockConfig()
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms, help="Mediana del TTFT en ms")
+    parser.add_argument("--ttft-sigma", type=float, default=defaults.ttft_sigma,
+                        help="Dispersión lognormal del TTFT (0 = fijo)")
+    parser.add_argument("--tps", type=float, default=defaults.tps, help="Tokens por segundo de cada stream")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="Tokens de respuesta (tope: max_tokens)")
+    parser.add_argument("--reasoning-tokens", type=int, default=defaults.reasoning_tokens,
+                        help="Tokens de reasoning_content antes de la respuesta")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fracción de respuestas 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate,
+                        help="Fracción de respuestas 429")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="Retry-After de los 429")
+    parser.add_argument("--stall-rate", type=float, default=defaults.stall_rate,
+                        help="Fracción de respuestas con un parón a mitad")
+    parser.add_argument("--stall-ms", type=float, default=defaults.stall_ms, help="Duración de cada parón en ms")
+    parser.add_argument("--tool-call-rate", type=float, default=defaults.tool_call_rate,
+                        help="Fracción de peticiones con `tools` que responden con una tool call")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{name: getattr(args, name) for name in MockConfig.__dataclass_fields__})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    mock = MockUpstream(config_from_args(args))
+    uvicorn.run(mock.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concurrencia del proxy local (kimi_k2_local_server.py)
+
+Lanza N peticiones concurrentes contra el proxy, con un upstream simulado que
+tarda UPSTREAM_DELAY segundos en responder. Con el cliente upstream asíncrono
+las N peticiones deben terminar en ~1x la latencia de una sola, no en Nx.
+
+Uso:
+  python benchmarks/proxy_concurrency.py
+  python benchmarks/proxy_concurrency.py --requests 100 --delay 1.0
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+# Permitir importar el servidor desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("CHUTES_API_KEY", "benchmark-key")
+
+import kimi_k2_local_server as server
+
+
+def make_mock_upstream(delay: float) -> httpx.AsyncClient:
+    """Cliente upstream cuyo transporte responde tras `delay` segundos"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": server.KIMI_K2_MODEL,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "ok"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+        })
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def timed_batch(client: httpx.AsyncClient, n: int) -> float:
+    """Envía n peticiones concurrentes y devuelve el tiempo total"""
+    payload = {
+        "model": server.KIMI_K2_MODEL,
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 16
+    }
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/v1/chat/completions", json=payload) for _ in range(n)
+    ])
+    elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise RuntimeError(f"{len(failed)} peticiones fallaron: {failed[:5]}")
+    return elapsed
+
+
+async def run(n: int, delay: float) -> int:
+    server.app.state.upstream_client = make_mock_upstream(delay)
+    transport = httpx.ASGITransport(app=server.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+        single = await timed_batch(client, 1)
+        concurrent = await timed_batch(client, n)
+
+    await server.app.state.upstream_client.aclose()
+
+    ratio = concurrent / single if single > 0 else float("inf")
+    print(f"Upstream simulado: {delay:.3f}s por petición")
+    print(f"1 petición:              {single:.3f}s")
+    print(f"{n} peticiones concurrentes: {concurrent:.3f}s ({ratio:.2f}x una petición)")
+    print(f"Serializado (esperado sin pool async): ~{single * n:.3f}s")
+
+    # Margen generoso: el objetivo es ~1x, nunca Nx
+    ok = ratio < 2.0
+    print("✓ El proxy no serializa las peticiones" if ok else "✗ El proxy serializa las peticiones")
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", "-n", type=int, default=50, help="Peticiones concurrentes")
+    parser.add_argument("--delay", type=float, default=0.5, help="Latencia del upstream simulado (s)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.requests, args.delay)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark de CPU del proxy por petición según el tamaño del contexto
+
+Envía peticiones de ~1K, 32K y 200K tokens a /v1/chat/completions con un
+upstream simulado que responde al instante, y mide el tiempo de CPU del
+proceso por petición en modo passthrough (bytes originales, validación con
+orjson) y en el modo anterior (Pydantic + reconstrucción del payload).
+El cuerpo se envía ya serializado, así que el coste del cliente es el mismo
+en ambos modos.
+
+Uso:
+  python benchmarks/proxy_cpu.py
+  python benchmarks/proxy_cpu.py --requests 50 --sizes 1000,32000,200000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import orjson
+
+# Permitir importar el servidor desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("CHUTES_API_KEY", "benchmark-key")
+
+import kimi_k2_local_server as server
+
+# Aproximación habitual: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+RESPONSE = orjson.dumps({
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 1730000000,
+    "model": server.KIMI_K2_MODEL,
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "ok"},
+        "finish_reason": "stop"
+    }],
+    "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+})
+
+
+def make_body(tokens: int) -> bytes:
+    """Conversación de varios turnos que suma ~`tokens` tokens"""
+    turn = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16
+    turns = max(1, tokens * CHARS_PER_TOKEN // len(turn))
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": turn}
+        for i in range(turns)
+    ]
+    return orjson.dumps({
+        "model": server.KIMI_K2_MODEL,
+        "messages": messages,
+        "max_tokens": 16,
+        "temperature": 0.7
+    })
+
+
+async def cpu_per_request(client: httpx.AsyncClient, body: bytes, n: int) -> float:
+    """Milisegundos de CPU del proceso por petición (secuencial)"""
+    await client.post("/v1/chat/completions", content=body)  # calentamiento
+    start = time.process_time()
+    for _ in range(n):
+        response = await client.post("/v1/chat/completions", content=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"Petición fallida: {response.status_code} {response.text[:200]}")
+    return (time.process_time() - start) / n * 1000
+
+
+async def run(n: int, sizes: list) -> int:
+    server.app.state.response_cache = None
+    server.app.state.upstream_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=RESPONSE))
+    )
+    transport = httpx.ASGITransport(app=server.app)
+
+    print(f"{'tokens':>8} {'KB':>8} {'pydantic ms':>12} {'passthrough ms':>15} {'ahorro':>8}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+        for tokens in sizes:
+            body = make_body(tokens)
+            results = {}
+            for passthrough in (False, True):
+                server.PASSTHROUGH = passthrough
+                results[passthrough] = await cpu_per_request(client, body, n)
+            saving = 1 - results[True] / results[False] if results[False] else 0.0
+            print(f"{tokens:>8} {len(body) / 1024:>8.0f} {results[False]:>12.2f} "
+                  f"{results[True]:>15.2f} {saving:>7.0%}")
+
+    await server.app.state.upstream_client.aclose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", "-n", type=int, default=30, help="Peticiones por tamaño y modo")
+    parser.add_argument("--sizes", default="1000,32000,200000", help="Tamaños en tokens, separados por comas")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sys.exit(asyncio.run(run(args.requests, sizes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Bytes recibidos y parseo por turno: conversación completa frente a sesión
+
+Simula una conversación larga (un system prompt grande y respuestas de
+tamaño fijo) por los dos caminos: el cliente sin estado reenvía todos los
+mensajes a /v1/chat/completions en cada turno; con /v1/sessions solo envía
+el mensaje nuevo. El proxy corre en proceso con un upstream simulado. Por
+cada turno se muestran los bytes que recibe el proxy, el tiempo local de la
+petición y, para la sesión, el parseo ahorrado que estima el proxy junto al
+que cuesta parsear el cuerpo completo. Esa columna se mide con el cuerpo
+recién serializado y todavía en caché; el proxy estima con lo que le cuesta
+parsear cuerpos que acaban de llegar de la red, que es más caro.
+
+Uso:
+  python benchmarks/sessions.py
+  python benchmarks/sessions.py --turns 40 --system-tokens 50000 --reply-tokens 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import orjson
+
+# Permitir importar el servidor desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("CHUTES_API_KEY", "benchmark-key")
+
+import kimi_k2_local_server as server  # noqa: E402
+
+# Aproximación habitual: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+
+def text(tokens: int, seed: int) -> str:
+    return " ".join(f"palabra{(seed * 7919 + i) % 1000}" for i in range(tokens * CHARS_PER_TOKEN // 11))
+
+
+async def run(args) -> int:
+    reply = orjson.dumps({
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": 1730000000,
+        "model": server.KIMI_K2_MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text(args.reply_tokens, 1)},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+    })
+    server.app.state.response_cache = None
+    server.app.state.upstream_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=reply))
+    )
+    answer = orjson.loads(reply)["choices"][0]["message"]
+    system = {"role": "system", "content": text(args.system_tokens, 0)}
+    rows = []
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://proxy", timeout=None) as client:
+        created = await client.post("/v1/sessions", json={"messages": [system]})
+        session_id = created.json()["id"]
+        messages = [system]
+        for turn in range(1, args.turns + 1):
+            question = {"role": "user", "content": text(args.question_tokens, turn)}
+            messages.append(question)
+
+            full = orjson.dumps({"model": server.KIMI_K2_MODEL, "messages": messages})
+            start = time.perf_counter()
+            (await client.post("/v1/chat/completions", content=full)).raise_for_status()
+            stateless = time.perf_counter() - start
+            start = time.perf_counter()
+            orjson.loads(full)
+            parse_full = time.perf_counter() - start
+
+            body = orjson.dumps({"message": question})
+            start = time.perf_counter()
+            response = await client.post(f"/v1/sessions/{session_id}/messages", content=body)
+            response.raise_for_status()
+            stateful = time.perf_counter() - start
+
+            messages.append(answer)
+            rows.append((turn, len(full), stateless, parse_full, len(body), stateful,
+                         float(response.headers["x-kimi-session-parse-saved-ms"]) / 1000))
+
+    print(f"system ~{args.system_tokens} tokens, preguntas ~{args.question_tokens}, "
+          f"respuestas ~{args.reply_tokens} tokens")
+    print(f"{'turno':>5} | {'completo KB':>11} {'ms':>7} {'parseo ms':>9} | "
+          f"{'sesión KB':>9} {'ms':>7} {'parseo ahorrado ms (estimado)':>30}")
+    step = max(1, args.turns // 10)
+    for turn, full, stateless, parse_full, body, stateful, saved in rows:
+        if turn % step == 0 or turn == 1:
+            print(f"{turn:>5} | {full / 1024:>11.1f} {stateless * 1000:>7.2f} {parse_full * 1000:>9.3f} | "
+                  f"{body / 1024:>9.2f} {stateful * 1000:>7.2f} {saved * 1000:>30.3f}")
+    total_full = sum(row[1] for row in rows)
+    total_body = sum(row[4] for row in rows)
+    print(f"\nTotal recibido: {total_full / 1024 / 1024:.1f} MB sin estado, {total_body / 1024:.1f} KB con sesión "
+          f"({total_full / total_body:.0f}x menos)")
+
+    await server.app.state.upstream_client.aclose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--system-tokens", type=int, default=20000, help="Tamaño del system prompt en tokens")
+    parser.add_argument("--question-tokens", type=int, default=100)
+    parser.add_argument("--reply-tokens", type=int, default=1500)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Llamadas al sistema y CPU ahorradas por la coalescencia SSE
+
+Arranca el proxy con uvicorn en un proceso hijo, con un upstream simulado
+que emite un evento SSE por token, y abre N streams concurrentes contra él
+sin coalescencia y con X-Kimi-Coalesce. Del proceso del proxy se leen en
+/proc las llamadas al sistema de escritura (syscw) y el tiempo de CPU, así
+que el coste del cliente de carga no entra en la medida (solo Linux). Los
+envíos ASGI (cada uno acaba en un write al socket) se cuentan en el propio
+proxy, porque algunos entornos no exponen syscw.
+
+Uso:
+  python benchmarks/sse_coalescing.py
+  python benchmarks/sse_coalescing.py --streams 100 --tokens 500 --rate 50 --window 100
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import orjson
+
+# Permitir importar el servidor desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from kimi_proxy.sse import CompletionAccumulator  # noqa: E402
+
+os.environ.setdefault("CHUTES_API_KEY", "benchmark-key")
+os.environ.setdefault("KIMI_BATCH_ENABLED", "0")
+# Que el límite de concurrencia admita todos los streams desde el principio
+os.environ.setdefault("KIMI_PROXY_CONCURRENCY", "1024")
+os.environ.setdefault("KIMI_PROXY_MAX_CONCURRENCY", "1024")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def token_event(i: int) -> bytes:
+    return b"data: " + orjson.dumps({
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1730000000,
+        "model": "moonshotai/Kimi-K2-Thinking",
+        "choices": [{"index": 0, "delta": {"content": f" tok{i}"}, "finish_reason": None}],
+    }) + b"\n\n"
+
+
+def serve_proxy(port: int, tokens: int, rate: float) -> None:
+    """Proceso hijo: el proxy real con el upstream sustituido por un mock"""
+    import uvicorn
+
+    import kimi_k2_local_server as server
+
+    async def upstream_body():
+        for i in range(tokens):
+            yield token_event(i)
+            await asyncio.sleep(1 / rate)
+        yield (b'data: {"id":"chatcmpl-bench","object":"chat.completion.chunk","created":1730000000,'
+               b'"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}\n\n')
+        yield b"data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=upstream_body())
+
+    sends = 0
+
+    async def counted(scope, receive, send):
+        """Cuenta los envíos de cuerpo y responde /bench/sends con el total"""
+        if scope["type"] == "http" and scope["path"] == "/bench/sends":
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": str(sends).encode()})
+            return
+
+        async def counting_send(message):
+            nonlocal sends
+            if message["type"] == "http.response.body" and message.get("body"):
+                sends += 1
+            await send(message)
+
+        await server.app(scope, receive, counting_send)
+
+    async def main():
+        proxy = uvicorn.Server(uvicorn.Config(counted, host="127.0.0.1", port=port, log_level="warning"))
+        task = asyncio.create_task(proxy.serve())
+        while not proxy.started:
+            await asyncio.sleep(0.05)
+        server.app.state.response_cache = None
+        server.app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        await task
+
+    asyncio.run(main())
+
+
+def process_stats(pid: int, port: int) -> tuple:
+    """(envíos ASGI, llamadas al sistema de escritura, segundos de CPU) del proxy"""
+    with open(f"/proc/{pid}/io") as f:
+        io = dict(line.split(": ") for line in f.read().splitlines())
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    sends = int(httpx.get(f"http://127.0.0.1:{port}/bench/sends").text)
+    return sends, int(io["syscw"]), cpu
+
+
+def saving(before: float, after: float) -> str:
+    return f"{1 - after / before:.0%}" if before else "n/d"
+
+
+async def run_streams(port: int, streams: int, headers: dict) -> tuple:
+    """Abre `streams` streams a la vez: (eventos SSE recibidos, textos completos)"""
+    limits = httpx.Limits(max_connections=streams)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=None) as client:
+        async def one(i: int) -> tuple:
+            payload = {"messages": [{"role": "user", "content": f"stream {i}"}], "stream": True}
+            accumulator = CompletionAccumulator()
+            events = 0
+            async with client.stream("POST", "/v1/chat/completions", json=payload, headers=headers) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}: {(await response.aread())[:200]!r}")
+                async for chunk in response.aiter_bytes():
+                    events += chunk.count(b"data:")
+                    accumulator.feed(chunk)
+            return events, accumulator.result()["choices"][0]["message"]["content"]
+
+        results = await asyncio.gather(*(one(i) for i in range(streams)))
+        return sum(events for events, _ in results), [text for _, text in results]
+
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError("El proxy no arrancó")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=100, help="Streams concurrentes")
+    parser.add_argument("--tokens", type=int, default=500, help="Tokens (eventos SSE) por stream")
+    parser.add_argument("--rate", type=float, default=50, help="Tokens por segundo de cada stream upstream")
+    parser.add_argument("--window", type=float, default=100, help="Ventana de coalescencia en ms")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_proxy(args.port, args.tokens, args.rate)
+        return
+
+    child = subprocess.Popen([
+        sys.executable, __file__, "--serve", "--port", str(args.port),
+        "--tokens", str(args.tokens), "--rate", str(args.rate),
+    ])
+    try:
+        wait_for_port(args.port)
+        print(f"{args.streams} streams x {args.tokens} tokens a {args.rate:g} tok/s")
+        print(f"{'modo':>14} {'eventos':>9} {'envíos ASGI':>12} {'syscw':>9} {'CPU s':>7} {'duración s':>11}")
+        results, texts = [], []
+        for label, headers in (("sin coalescer", {}), (f"{args.window:g} ms", {"X-Kimi-Coalesce": str(args.window)})):
+            before = process_stats(child.pid, args.port)
+            start = time.perf_counter()
+            events, received = asyncio.run(run_streams(args.port, args.streams, headers))
+            elapsed = time.perf_counter() - start
+            # La propia consulta de /bench/sends cuenta un envío
+            sends, writes, cpu = (b - a for a, b in zip(before, process_stats(child.pid, args.port)))
+            results.append((sends - 1, writes, cpu))
+            texts.append(received)
+            print(f"{label:>14} {events:>9} {sends - 1:>12} {writes:>9} {cpu:>7.2f} {elapsed:>11.2f}")
+        (base_sends, base_writes, base_cpu), (sends, writes, cpu) = results
+        print(f"\nAhorro: {saving(base_sends, sends)} de los envíos, {saving(base_writes, writes)} de las "
+              f"escrituras, {saving(base_cpu, cpu)} de la CPU del proxy")
+        print("Contenido idéntico en ambos modos:", texts[0] == texts[1])
+    finally:
+        child.terminate()
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Throughput del parser de tool calls de Kimi-K2: incremental vs regex
+
+Genera salidas crudas de varios MB (texto, razonamiento y muchas llamadas a
+herramientas con argumentos largos) y mide MB/s de ToolCallParser recibiendo
+la salida en chunks del tamaño de un delta de streaming, frente al regex de
+docs/tool_call_guidance.md sobre la salida completa. El regex solo se puede
+aplicar al final; el parser incremental además emite cada delta según llega.
+
+Uso:
+  python benchmarks/toolcall_parser.py
+  python benchmarks/toolcall_parser.py --sizes 1,4,16 --chunk 32 --repeat 5
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import orjson
+
+# Permitir importar el paquete desde la raíz del repo
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from kimi_proxy.toolcalls import ToolCallParser, assemble, extract_tool_call_info
+
+
+def make_output(megabytes: float) -> str:
+    """Salida cruda de ~`megabytes` MB con una sección de tool calls"""
+    target = int(megabytes * 1024 * 1024)
+    prefix = "<think>" + "Planning the next steps. " * 200 + "</think>" + "Working on it. " * 100
+    calls = []
+    size = len(prefix)
+    index = 0
+    while size < target:
+        arguments = orjson.dumps({
+            "path": f"src/module_{index}.py",
+            "content": "def f(x):\n    return x < 10 and x > 2\n" * 40,
+        }).decode()
+        call = (f"<|tool_call_begin|>functions.write_file:{index}"
+                f"<|tool_call_argument_begin|>{arguments}<|tool_call_end|>")
+        calls.append(call)
+        size += len(call)
+        index += 1
+    return prefix + "<|tool_calls_section_begin|>" + "".join(calls) + "<|tool_calls_section_end|>"
+
+
+def incremental(text: str, chunk: int) -> list:
+    parser = ToolCallParser()
+    events = []
+    for i in range(0, len(text), chunk):
+        events += parser.feed(text[i:i + chunk])
+    return assemble(events + parser.finish())[2]
+
+
+def best_time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1,4,16", help="Tamaños de salida en MB, separados por comas")
+    parser.add_argument("--chunk", type=int, default=64, help="Caracteres por chunk para el parser incremental")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se toma la mejor)")
+    args = parser.parse_args()
+
+    print(f"{'MB':>6} {'calls':>7} {'regex MB/s':>11} {'incremental MB/s':>17} {'incr. 1 chunk MB/s':>19}")
+    for megabytes in (float(size) for size in args.sizes.split(",")):
+        text = make_output(megabytes)
+        mb = len(text) / (1024 * 1024)
+        expected = extract_tool_call_info(text)
+        if incremental(text, args.chunk) != expected:
+            print("El parser incremental no coincide con el regex", file=sys.stderr)
+            sys.exit(1)
+        regex = best_time(lambda: extract_tool_call_info(text), args.repeat)
+        chunked = best_time(lambda: incremental(text, args.chunk), args.repeat)
+        whole = best_time(lambda: incremental(text, len(text)), args.repeat)
+        print(f"{mb:>6.1f} {len(expected):>7} {mb / regex:>11.1f} {mb / chunked:>17.1f} {mb / whole:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
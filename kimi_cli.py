@@ -8,6 +8,7 @@ Uso:
   kimi "tu pregunta aquí"        # Modo comando único
   kimi -h, --help                # Ayuda
   kimi --heavy "pregunta"        # Heavy Mode (8 trayectorias paralelas)
+  kimi --cascade "pregunta"      # Cascada: Qwen3-Coder local y Kimi K2 solo si duda
   kimi --simple "pregunta"       # Modo simple (sin razonamiento extendido)
 """
 
@@ -26,6 +27,23 @@ except ImportError as e:
     print("   pip install python-dotenv openai")
     sys.exit(1)
 
+# Caché en disco, streaming, Heavy Mode y cascada, compartidos con okimi/kimi y
+# el proxy local (opcional, ver SETUP_LOCAL.md). Sin kimi_proxy: llamada directa
+try:
+    from kimi_proxy.cli import StreamView, create_cascade_completion, create_completion, create_heavy_completion
+except ImportError:
+    StreamView = None
+
+    def create_completion(client, config, view=None):
+        return client.chat.completions.create(**config)
+
+    def create_heavy_completion(client, config):
+        """Sin el motor local, se pide heavy_mode al proveedor"""
+        return client.chat.completions.create(**config, extra_body={"heavy_mode": True})
+
+    def create_cascade_completion(client, config):
+        raise RuntimeError("El modo cascada necesita kimi_proxy (instala las dependencias del proxy)")
+
 # Colores para terminal
 class Colors:
     HEADER = '\033[95m'
@@ -141,7 +159,7 @@ def get_tools():
         }
     ]
 
-def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=False):
+def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=False, cascade_mode=False):
     """
     Consulta a Kimi K2 Thinking con todas las capacidades activadas
 
@@ -151,6 +169,7 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=
         heavy_mode: Activar Heavy Mode (8 trayectorias paralelas)
         simple_mode: Modo simple sin razonamiento extendido
         interactive: Modo interactivo (permite conversación continua)
+        cascade_mode: Modo cascada (modelo local primero, Kimi K2 solo si duda)
     """
 
     # Configuración base
@@ -175,9 +194,11 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=
 
     # Activar Heavy Mode si se solicita
     if heavy_mode:
-        config["extra_body"] = {"heavy_mode": True}
         print(f"\n{Colors.WARNING}⚡ Heavy Mode activado: 8 trayectorias paralelas{Colors.ENDC}")
 
+    if cascade_mode:
+        print(f"\n{Colors.OKCYAN}🪜 Modo cascada: Qwen3-Coder local primero, Kimi K2 solo si duda{Colors.ENDC}")
+
     if simple_mode:
         config["max_tokens"] = 1000
         config["temperature"] = 0.1
@@ -193,12 +214,21 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=
     try:
         print(f"\n{Colors.OKCYAN}🤔 Procesando...{Colors.ENDC}\n")
 
-        response = client.chat.completions.create(**config)
+        view = None
+        if heavy_mode:
+            response = create_heavy_completion(client, config)
+        elif cascade_mode:
+            response = create_cascade_completion(client, config)
+        else:
+            # En streaming la respuesta se muestra según llega (KIMI_STREAM=0 para esperarla entera)
+            view = StreamView() if StreamView is not None and os.getenv('KIMI_STREAM', '1') != '0' else None
+            response = create_completion(client, config, view=view)
         message = response.choices[0].message
 
-        # Mostrar respuesta
-        print(f"{Colors.BOLD}═══ RESPUESTA ═══{Colors.ENDC}\n")
-        print(message.content)
+        # Mostrar respuesta (si no llegó ya en streaming)
+        if not (view is not None and view.answered):
+            print(f"{Colors.BOLD}═══ RESPUESTA ═══{Colors.ENDC}\n")
+            print(message.content)
 
         # Mostrar tools invocadas si las hay
         if hasattr(message, 'tool_calls') and message.tool_calls:
@@ -206,8 +236,8 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, interactive=
             for tool in message.tool_calls:
                 print(f"  • {tool.function.name}: {tool.function.arguments}")
 
-        # Mostrar uso de tokens
-        if response.usage:
+        # Mostrar uso de tokens (la cascada ya mostró el coste de cada nivel)
+        if response.usage and not cascade_mode:
             print(f"\n{Colors.OKBLUE}═══ USO DE TOKENS ═══{Colors.ENDC}")
             print(f"  Input: {response.usage.prompt_tokens:,} tokens")
             print(f"  Output: {response.usage.completion_tokens:,} tokens")
@@ -279,11 +309,13 @@ def show_help():
   -h, --help                     Muestra esta ayuda
   --heavy "pregunta"             Activa Heavy Mode (8 trayectorias paralelas)
   --simple "pregunta"            Modo simple (respuesta rápida sin razonamiento)
+  --cascade "pregunta"           Cascada: Qwen3-Coder local, Kimi K2 solo si duda
 
 {Colors.OKGREEN}Ejemplos:{Colors.ENDC}
   kimi "¿Qué es un sistema de memoria distribuida?"
   kimi --heavy "Diseña una arquitectura de agentes IA multi-nivel"
   kimi --simple "Explica en pocas palabras qué es K2 Thinking"
+  kimi --cascade "¿Cuántos segundos tiene un día?"
 
 {Colors.OKGREEN}Capacidades activadas:{Colors.ENDC}
   ✓ Contexto: 256K tokens
@@ -296,6 +328,7 @@ def show_help():
   API Key: ~/.env (CHUTES_API_KEY)
   Endpoint: llm.chutes.ai
   Modelo: moonshotai/Kimi-K2-Thinking
+  Streaming: activado (KIMI_STREAM=0 espera la respuesta completa)
 
 {Colors.OKGREEN}Más información:{Colors.ENDC}
   GitHub: https://github.com/moonshotai/Kimi-K2
@@ -326,6 +359,15 @@ def main():
             query_kimi(client, prompt, heavy_mode=True)
             sys.exit(0)
 
+        # Modo cascada
+        if arg == '--cascade' and len(sys.argv) > 2:
+            print_banner()
+            api_key = load_api_key()
+            client = create_client(api_key)
+            prompt = ' '.join(sys.argv[2:])
+            query_kimi(client, prompt, cascade_mode=True)
+            sys.exit(0)
+
         # Simple Mode
         if arg == '--simple' and len(sys.argv) > 2:
             print_banner()
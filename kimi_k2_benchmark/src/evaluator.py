@@ -13,6 +13,14 @@ from typing import Any
 import yaml
 from dotenv import load_dotenv
 from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+# Local Heavy Mode engine from the proxy package at the repository root (optional:
+# importable when the repo root is on PYTHONPATH, e.g. PYTHONPATH=.. python -m src.evaluator)
+try:
+    from kimi_proxy.heavy import run_heavy
+except ImportError:
+    run_heavy = None
 
 
 # Load environment variables from home directory
@@ -149,8 +157,11 @@ def run_single_case(
         "temperature": model_config.get("temperature", 0.3)
     }
 
-    # Add heavy mode if configured
-    if model_config.get("heavy_mode"):
+    # Heavy mode runs locally (parallel trajectories + voting) when the engine is available;
+    # otherwise it is requested from the provider, which may ignore it
+    heavy_mode = model_config.get("heavy_mode", False)
+    heavy = None
+    if heavy_mode and run_heavy is None:
         request_kwargs["extra_body"] = {"heavy_mode": True}
 
     # Execute with timing
@@ -158,7 +169,19 @@ def run_single_case(
     first_token_time = None
 
     try:
-        response = client.chat.completions.create(**request_kwargs)
+        if heavy_mode and run_heavy is not None:
+            heavy = run_heavy(
+                request_kwargs,
+                str(client.base_url),
+                client.api_key,
+                trajectories=model_config.get("num_trajectories", 8),
+                early_exit=model_config.get("early_exit", True)
+            )
+            if heavy.chosen is None:
+                raise RuntimeError(f"All heavy mode trajectories failed: {heavy.error}")
+            response = ChatCompletion.model_validate(heavy.completion())
+        else:
+            response = client.chat.completions.create(**request_kwargs)
         end_time = time.perf_counter()
 
         # Extract response
@@ -197,7 +220,8 @@ def run_single_case(
             },
             "metrics": {
                 "correctness": correctness,
-                "time_to_first_token": total_time * 0.1,  # Approximation
+                # Approximation unless the chosen heavy mode trajectory measured it
+                "time_to_first_token": heavy.chosen.ttft if heavy and heavy.chosen.ttft else total_time * 0.1,
                 "tokens_per_second": tokens_per_second,
                 "total_time": total_time,
                 "output_tokens": output_tokens
@@ -205,7 +229,18 @@ def run_single_case(
         }
 
         # Add heavy mode data if applicable
-        if model_config.get("heavy_mode"):
+        if heavy is not None:
+            summary = heavy.summary()
+            result["heavy_mode_data"] = {
+                "trajectories": summary["trajectories"],
+                "hybridized_output": response_text,
+                "diversity_score": summary["diversity_score"],
+                "convergence_pattern": summary["convergence_pattern"],
+                "votes": summary["votes"],
+                "stopped_early": summary["stopped_early"],
+                "estimated_tokens_saved": summary["estimated_tokens_saved"]
+            }
+        elif heavy_mode:
             result["heavy_mode_data"] = {
                 "trajectories": [],  # Would need API support to capture
                 "hybridized_output": response_text,
@@ -322,6 +322,14 @@ def generate_decision_tree(metrics: dict[str, Any]) -> dict[str, Any]:
     }
     tree["branches"].append(cost_branch)
 
+    # Mixed workloads: let the proxy/CLI cascade decide per request at runtime
+    if "qwen3_coder_30b" in metrics and "kimi_k2_normal" in metrics:
+        tree["branches"].append({
+            "answer": "Balance cost and accuracy per request",
+            "recommendation": "Use cascade mode (--cascade or X-Kimi-Cascade: on): Qwen3-Coder:30B answers "
+                              "confident requests, Kimi K2 Normal/Heavy only the uncertain ones"
+        })
+
     return tree
 
 
@@ -4,30 +4,368 @@ Servidor local para testing de Kimi K2 Thinking vía Chutes.ai API
 Simula un endpoint local para desarrollo antes de deployar a infraestructura descentralizada
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import uvicorn
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.requests import HTTPConnection
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from contextlib import asynccontextmanager
+import argparse
 import os
-import requests
+import sys
+import httpx
 import json
-from typing import Optional, List
+import math
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, List
 from dotenv import load_dotenv
 import asyncio
+import orjson
+
+from kimi_proxy.affinity import prefix_key
+from kimi_proxy.agent import AgentLoop, ToolRegistry, searxng_tool
+from kimi_proxy.batches import BatchError, BatchRunner, BatchStore, open_batch_store
+from kimi_proxy.bulk import NDJSON_MEDIA_TYPE, BulkError, fan_out, parse_ndjson
+from kimi_proxy.cache import MemoryLRU, ResponseCache, cache_key, is_cacheable, open_disk_cache
+from kimi_proxy.cancellation import CancellationStats, ClientDisconnected, call_until_disconnect
+from kimi_proxy.cascade import Cascade, CascadeStats, load_cascade
+from kimi_proxy.coalesce import coalesce_stream
+from kimi_proxy.compression import CompressionMiddleware, DecompressionMiddleware
+from kimi_proxy.completions import completion_request, translate_response, translator_for
+from kimi_proxy.concurrency import DEFAULT_PRIORITY, ConcurrencyLimits, Overloaded
+from kimi_proxy.heavy import HeavyEngine
+from kimi_proxy.hedging import HedgeBudget, hedged_call
+from kimi_proxy.launcher import STATE_DIR_ENV, default_workers, serve
+from kimi_proxy.metrics import ProxyMetrics, extract_usage
+from kimi_proxy.payload import ChatBody, InvalidRequest
+from kimi_proxy.ratelimit import RateLimiter, SharedRateLimiter, TokenCharge, estimate_tokens, identify_client
+from kimi_proxy.retry import RetryPolicy
+from kimi_proxy.router import NoProviderAvailable, Provider, Router, load_router
+from kimi_proxy.sessions import (
+    SessionBusy, SessionNotFound, SessionStore, SessionTooLarge, SharedSessionStore, Turn, completion_reply,
+    sse_payloads
+)
+from kimi_proxy.singleflight import SingleFlight
+from kimi_proxy.sse import DONE_EVENT, CompletionAccumulator, completion_to_sse, encode_event
+from kimi_proxy.streaming import SSE_HEADERS, relay_stream
+from kimi_proxy.upstream import UpstreamCall, create_upstream_client
+
+# Lanzado como script, los workers importan "kimi_k2_local_server": que sea este
+# mismo módulo y no una segunda copia (métricas registradas dos veces)
+if __name__ in ("__main__", "__mp_main__"):
+    sys.modules.setdefault("kimi_k2_local_server", sys.modules[__name__])
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Configuración
+CHUTES_API_KEY = os.getenv("CHUTES_API_KEY")
+CHUTES_BASE_URL = os.getenv("CHUTES_BASE_URL")
+KIMI_K2_MODEL = "moonshot/kimi-k2-thinking"
+
+# Proveedores upstream y alias de modelos (ver sección `providers` del YAML)
+MODELS_CONFIG = Path(os.getenv(
+    "KIMI_PROXY_MODELS_CONFIG",
+    Path(__file__).parent / "kimi_k2_benchmark" / "config" / "models.yaml"
+))
+
+# Pool de conexiones upstream (un cliente por proceso, compartido por todos los endpoints)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("KIMI_PROXY_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("KIMI_PROXY_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("KIMI_PROXY_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_TIMEOUT = float(os.getenv("KIMI_PROXY_TIMEOUT", "120"))
+UPSTREAM_HTTP2 = os.getenv("KIMI_PROXY_HTTP2", "1") != "0"
+
+# Arranque: workers (por defecto uno por núcleo) y segundos de drenado al recibir SIGTERM
+SERVER_HOST = os.getenv("KIMI_PROXY_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("KIMI_PROXY_PORT", "8080"))
+SERVER_WORKERS = int(os.getenv("KIMI_PROXY_WORKERS", "0")) or default_workers()
+DRAIN_TIMEOUT = float(os.getenv("KIMI_PROXY_DRAIN_TIMEOUT", "30"))
+
+# Estado compartido entre workers (lo crea el launcher; sin él todo es local al proceso)
+STATE_DIR = os.getenv(STATE_DIR_ENV)
+
+# Reenviar el cuerpo original al upstream (0 = validar y reconstruir con Pydantic)
+PASSTHROUGH = os.getenv("KIMI_PROXY_PASSTHROUGH", "1") != "0"
+
+# Caché de respuestas deterministas (memoria + disco compartido)
+CACHE_ENABLED = os.getenv("KIMI_CACHE_ENABLED", "1") != "0"
+CACHE_MEMORY_MB = float(os.getenv("KIMI_CACHE_MEMORY_MB", "64"))
+
+# Coalescencia de peticiones idénticas en curso (mismo criterio que la caché)
+SINGLEFLIGHT_ENABLED = os.getenv("KIMI_SINGLEFLIGHT_ENABLED", "1") != "0"
+
+# Límite de concurrencia adaptativo por proveedor y cola de admisión
+CONCURRENCY_INITIAL = int(os.getenv("KIMI_PROXY_CONCURRENCY", "32"))
+CONCURRENCY_MAX = int(os.getenv("KIMI_PROXY_MAX_CONCURRENCY", "256"))
+QUEUE_SIZE = int(os.getenv("KIMI_PROXY_QUEUE_SIZE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("KIMI_PROXY_QUEUE_TIMEOUT", "30"))
+
+# Límites por cliente (0 = sin límite) y pesos de las clases de prioridad (X-Kimi-Priority)
+RATE_LIMIT_RPM = float(os.getenv("KIMI_PROXY_RPM", "0"))
+RATE_LIMIT_TPM = float(os.getenv("KIMI_PROXY_TPM", "0"))
+PRIORITY_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (
+        item.split(":") for item in os.getenv("KIMI_PROXY_PRIORITY_WEIGHTS", "interactive:8,batch:1").split(",")
+    )
+}
+
+# Reintentos de errores transitorios (conexión, 429, 5xx) antes del primer byte
+RETRY_MAX_TRIES = int(os.getenv("KIMI_PROXY_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("KIMI_PROXY_RETRY_BASE", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("KIMI_PROXY_RETRY_MAX", "8"))
+
+# Hedging: repetir en otro proveedor si el primer token tarda más que el percentil
+HEDGE_ENABLED = os.getenv("KIMI_HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("KIMI_HEDGE_PERCENTILE", "0.95"))
+HEDGE_BUDGET = float(os.getenv("KIMI_HEDGE_BUDGET", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("KIMI_HEDGE_MIN_SAMPLES", "20"))
+
+# Batch API: peticiones del lote ejecutadas a la vez (con prioridad batch)
+BATCH_ENABLED = os.getenv("KIMI_BATCH_ENABLED", "1") != "0"
+BATCH_CONCURRENCY = int(os.getenv("KIMI_BATCH_CONCURRENCY", "8"))
+
+# Peticiones en bloque (NDJSON): concurrencia por llamada y líneas máximas
+BULK_CONCURRENCY = int(os.getenv("KIMI_BULK_CONCURRENCY", "16"))
+BULK_MAX_ITEMS = int(os.getenv("KIMI_BULK_MAX_ITEMS", "1000"))
+
+# Endpoints que se pueden encolar en un lote o un job
+BATCH_ENDPOINTS = {"/v1/chat/completions"}
+
+# Coalescencia de eventos SSE hacia el cliente (0 = desactivada; X-Kimi-Coalesce por petición)
+SSE_COALESCE_MS = float(os.getenv("KIMI_SSE_COALESCE_MS", "0"))
+SSE_COALESCE_BYTES = int(os.getenv("KIMI_SSE_COALESCE_BYTES", "4096"))
+
+# Compresión de cuerpos: peticiones con Content-Encoding (límite una vez
+# descomprimidas) y respuestas no-stream negociadas con Accept-Encoding
+MAX_INFLATED_MB = float(os.getenv("KIMI_MAX_INFLATED_MB", "64"))
+RESPONSE_COMPRESSION = os.getenv("KIMI_RESPONSE_COMPRESSION", "1") != "0"
+COMPRESSION_MIN_BYTES = int(os.getenv("KIMI_COMPRESSION_MIN_BYTES", "1024"))
+
+# Afinidad de prefijo entre réplicas (routing: prefix_affinity en models.yaml):
+# mensajes de conversación, tras los system, que entran en la clave
+AFFINITY_PREFIX_MESSAGES = int(os.getenv("KIMI_AFFINITY_PREFIX_MESSAGES", "1"))
+
+# Modo agente (X-Kimi-Agent: on): rondas de herramientas ejecutadas en el proxy
+AGENT_MAX_ROUNDS = int(os.getenv("KIMI_AGENT_MAX_ROUNDS", "5"))
+AGENT_TOOL_TIMEOUT = float(os.getenv("KIMI_AGENT_TOOL_TIMEOUT", "10"))
+SEARXNG_URL = os.getenv("KIMI_AGENT_SEARXNG_URL", "http://localhost:8888")
+
+# Sesiones con estado (/v1/sessions): historial guardado en el proxy, acotado
+SESSION_MAX = int(os.getenv("KIMI_SESSION_MAX", "1000"))
+SESSION_MEMORY_MB = float(os.getenv("KIMI_SESSION_MEMORY_MB", "512"))
+SESSION_TTL = float(os.getenv("KIMI_SESSION_TTL", "3600"))
+
+# Heavy Mode local (X-Kimi-Heavy o heavy_mode en el cuerpo): N trayectorias con voto
+HEAVY_TRAJECTORIES = int(os.getenv("KIMI_HEAVY_TRAJECTORIES", "8"))
+HEAVY_MAX_TRAJECTORIES = int(os.getenv("KIMI_HEAVY_MAX_TRAJECTORIES", "32"))
+HEAVY_EARLY_EXIT = os.getenv("KIMI_HEAVY_EARLY_EXIT", "1") != "0"
+
+class OrjsonResponse(JSONResponse):
+    """Respuestas JSON del propio proxy serializadas con orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea el cliente upstream y la caché al arrancar y los cierra al apagar"""
+    app.state.upstream_client = create_upstream_client(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        timeout=UPSTREAM_TIMEOUT,
+        http2=UPSTREAM_HTTP2,
+    )
+    app.state.response_cache = None
+    if CACHE_ENABLED:
+        app.state.response_cache = ResponseCache(
+            MemoryLRU(int(CACHE_MEMORY_MB * 1024 * 1024)),
+            open_disk_cache()
+        )
+    app.state.batch_runner = None
+    if BATCH_ENABLED:
+        app.state.batch_runner = create_batch_runner(app, open_batch_store())
+        app.state.batch_runner.start()
+    try:
+        yield
+    finally:
+        if app.state.batch_runner is not None:
+            await app.state.batch_runner.stop()
+            await app.state.batch_client.aclose()
+            app.state.batch_runner.store.close()
+        await app.state.upstream_client.aclose()
+        if app.state.response_cache is not None:
+            app.state.response_cache.close()
+        metrics.close()
+
+def create_batch_runner(app: FastAPI, store: BatchStore) -> BatchRunner:
+    """
+    Runner de lotes que ejecuta cada petición contra la propia app
+
+    Así los lotes pasan por la caché, el router, los reintentos y la cola de
+    admisión igual que el tráfico interactivo, pero con prioridad batch.
+    """
+    app.state.batch_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://batch",
+        # Misma máquina: comprimir las respuestas solo costaría CPU
+        headers={"Accept-Encoding": "identity"},
+        timeout=None
+    )
+
+    async def execute(url: str, body: dict, headers: dict):
+        response = await app.state.batch_client.post(url, json={**body, "stream": False}, headers=headers)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {"error": {"message": response.text}}
+
+    return BatchRunner(
+        store,
+        execute,
+        concurrency=BATCH_CONCURRENCY,
+        headers={"X-Kimi-Priority": "batch", "X-Kimi-Client": "batch"}
+    )
+
 app = FastAPI(
     title="Kimi K2 Thinking Local API",
     description="API local para testing de Kimi K2 vía Chutes.ai",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=OrjsonResponse
 )
+app.add_middleware(DecompressionMiddleware, max_bytes=int(MAX_INFLATED_MB * 1024 * 1024))
+if RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware, min_size=COMPRESSION_MIN_BYTES)
 
-# Configuración
-CHUTES_API_KEY = os.getenv("CHUTES_API_KEY")
-CHUTES_BASE_URL = "https://api.chutes.ai/v1"
-KIMI_K2_MODEL = "moonshot/kimi-k2-thinking"
+# Tokens ahorrados al cortar peticiones cuyo cliente ya se desconectó
+cancellation_stats = CancellationStats()
+
+# Llamadas upstream en curso compartidas entre peticiones idénticas
+singleflight = SingleFlight()
+
+# Selección de proveedor por petición según latencia observada
+router = load_router(
+    MODELS_CONFIG,
+    overrides={"chutes": {"api_base": CHUTES_BASE_URL}} if CHUTES_BASE_URL else None
+)
+
+# Niveles del modo cascada (X-Kimi-Cascade: on), de la sección `cascade` del YAML
+cascade_config = load_cascade(MODELS_CONFIG)
+cascade_stats = CascadeStats()
+
+# Herramientas que el proxy ejecuta en modo agente
+agent_tools = ToolRegistry((searxng_tool(SEARXNG_URL),), timeout=AGENT_TOOL_TIMEOUT)
+
+# Fracción máxima de peticiones extra lanzadas por hedging
+hedge_budget = HedgeBudget(ratio=HEDGE_BUDGET)
+
+# Conversaciones guardadas en el proxy: en SQLite comunes a todos los workers si
+# hay estado compartido; si no, en la memoria de este (único) proceso
+if STATE_DIR:
+    sessions = SharedSessionStore(
+        Path(STATE_DIR) / "sessions.sqlite", SESSION_MAX, int(SESSION_MEMORY_MB * 1024 * 1024), SESSION_TTL
+    )
+else:
+    sessions = SessionStore(SESSION_MAX, int(SESSION_MEMORY_MB * 1024 * 1024), SESSION_TTL)
+
+# Series Prometheus expuestas en /metrics
+metrics = ProxyMetrics()
+router.on_affinity = metrics.observe_affinity
+sessions.on_turn = metrics.observe_session_turn
+
+# Admisión de llamadas upstream (un limitador por proveedor)
+concurrency = ConcurrencyLimits(
+    initial_limit=CONCURRENCY_INITIAL,
+    max_limit=CONCURRENCY_MAX,
+    queue_size=QUEUE_SIZE,
+    queue_timeout=QUEUE_TIMEOUT,
+    weights=PRIORITY_WEIGHTS,
+    on_change=lambda limiter: metrics.observe_limiter(limiter)
+)
+
+# Tareas en segundo plano (escrituras de caché) que no deben bloquear la respuesta
+_background_tasks = set()
+
+# Política de reintentos compartida (con contadores para /admin/stats)
+retry_policy = RetryPolicy(RETRY_MAX_TRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+
+# Token buckets por cliente (peticiones/min y tokens/min), comunes a todos los workers
+if STATE_DIR and (RATE_LIMIT_RPM or RATE_LIMIT_TPM):
+    rate_limiter = SharedRateLimiter(Path(STATE_DIR) / "ratelimit.sqlite", RATE_LIMIT_RPM, RATE_LIMIT_TPM)
+else:
+    rate_limiter = RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_TPM)
+
+def get_upstream_client(request: Request) -> httpx.AsyncClient:
+    """Devuelve el cliente upstream compartido de la app"""
+    return request.app.state.upstream_client
+
+def get_response_cache(request: Request) -> Optional[ResponseCache]:
+    """Devuelve la caché de respuestas de la app (None si está deshabilitada)"""
+    return getattr(request.app.state, "response_cache", None)
+
+def get_batch_runner(request: Request) -> BatchRunner:
+    """Devuelve el runner de lotes de la app (404 si la Batch API está deshabilitada)"""
+    runner = getattr(request.app.state, "batch_runner", None)
+    if runner is None:
+        raise HTTPException(status_code=404, detail="Batch API disabled")
+    return runner
+
+def record_cancellation(stream: bool, max_tokens: Optional[int], tokens_emitted: int = 0) -> None:
+    """Registra una petición cortada por desconexión en /admin/stats y en /metrics"""
+    saved = cancellation_stats.record(stream=stream, max_tokens=max_tokens, tokens_emitted=tokens_emitted)
+    metrics.observe_cancellation(stream, saved)
+
+def spawn(coro) -> None:
+    """Lanza una corrutina en segundo plano manteniendo una referencia viva"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def coalesce_window(request: Request) -> float:
+    """
+    Ventana de coalescencia SSE en segundos para esta petición (0 = no unir)
+
+    X-Kimi-Coalesce acepta milisegundos, "on" (ventana configurada o 20 ms)
+    u "off"; sin cabecera se usa KIMI_SSE_COALESCE_MS.
+    """
+    value = request.headers.get("x-kimi-coalesce", "").strip().lower()
+    if not value:
+        return SSE_COALESCE_MS / 1000
+    if value == "on":
+        return (SSE_COALESCE_MS or 20) / 1000
+    try:
+        return max(float(value), 0.0) / 1000
+    except ValueError:
+        return 0.0
+
+def client_stream(request: Request, events: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """El stream SSE que se envía al cliente, con coalescencia si la pidió"""
+    window = coalesce_window(request)
+    if window <= 0:
+        return events
+    return coalesce_stream(events, window, SSE_COALESCE_BYTES)
+
+def cached_response(value: bytes, stream: bool, level: str, request: Request) -> Response:
+    """Respuesta servida desde la caché; en streaming se reproduce como SSE"""
+    headers = {"X-Kimi-Cache": f"hit-{level}"}
+    if not stream:
+        return Response(content=value, media_type="application/json", headers=headers)
+
+    completion = orjson.loads(value)
+
+    async def replay():
+        for event in completion_to_sse(completion):
+            yield event
+
+    return StreamingResponse(
+        client_stream(request, replay()),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, **headers}
+    )
 
 class Message(BaseModel):
     role: str
@@ -39,6 +377,9 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 4096
     stream: Optional[bool] = False
+    tools: Optional[List[dict]] = None
+    tool_choice: Optional[Any] = None
+    extra_body: Optional[dict] = None
 
 class ChatCompletionResponse(BaseModel):
     id: str
@@ -56,27 +397,254 @@ async def root():
         "service": "Kimi K2 Thinking Local API",
         "version": "1.0.0",
         "model": KIMI_K2_MODEL,
-        "chutes_api_configured": bool(CHUTES_API_KEY)
+        "chutes_api_configured": bool(CHUTES_API_KEY),
+        "providers": [p.name for p in router.providers.values() if p.configured]
     }
 
-@app.post("/v1/chat/completions")
-async def chat_completion(request: ChatCompletionRequest):
-    """
-    Endpoint de chat compatible con OpenAI API
-    Redirige peticiones a Chutes.ai API
+def affinity_key(body: ChatBody) -> Optional[str]:
+    """Clave de prefijo para repartir entre réplicas (None si no hay réplicas con afinidad)"""
+    if not router.has_affinity:
+        return None
+    return prefix_key(body.data, AFFINITY_PREFIX_MESSAGES)
+
+def choose_provider(request: Request, model: str, affinity: Optional[str] = None) -> tuple:
     """
+    Elige proveedor para la petición (X-Kimi-Provider lo fija si está configurado)
 
-    if not CHUTES_API_KEY:
+    Devuelve (provider, nombre del modelo en ese proveedor)
+    """
+    try:
+        return router.choose(model, pinned=request.headers.get("x-kimi-provider"), affinity_key=affinity)
+    except NoProviderAvailable:
         raise HTTPException(
             status_code=500,
-            detail="CHUTES_API_KEY not configured in .env"
+            detail=f"No upstream provider configured for model {model} (check API keys in .env)"
         )
 
-    headers = {
-        "Authorization": f"Bearer {CHUTES_API_KEY}",
-        "Content-Type": "application/json"
-    }
+async def open_upstream(
+    client: httpx.AsyncClient,
+    body: ChatBody,
+    stream: bool,
+    provider: Provider,
+    upstream_model: str,
+    priority: str = DEFAULT_PRIORITY
+) -> UpstreamCall:
+    """
+    Envía la petición al proveedor elegido y valida el estado HTTP
+
+    Con stream=True la respuesta se devuelve abierta (el cuerpo aún sin leer);
+    sin stream la llamada ya está terminada y su TTFT es el tiempo total.
+    Antes de enviar espera turno en el limitador del proveedor, en la cola de
+    su clase de prioridad. Con proveedores `api: completions` se envía el
+    prompt renderizado y el cuerpo se traduce al formato de chat.
+
+    Raises:
+        Overloaded: si el proveedor está saturado y la cola llena o agotada
+    """
+    limiter = concurrency.get(provider.name)
+    router.begin(provider)
+    try:
+        waited = await limiter.acquire(priority)
+    except Overloaded as e:
+        router.abandon(provider)
+        metrics.observe_rejection(provider.name, e.reason)
+        raise
+    except BaseException:
+        router.abandon(provider)
+        raise
+    metrics.observe_queue_wait(provider.name, priority, waited)
+
+    translator = None
+    if provider.api == "completions":
+        translator = translator_for(body.stream)
+        path, content = "completions", completion_request(body, upstream_model)
+    else:
+        path, content = "chat/completions", body.encode(upstream_model)
+    upstream_request = client.build_request(
+        "POST",
+        provider.url(path),
+        headers=provider.request_headers(),
+        content=content
+    )
+    model = router.canonical_model(body.model)
+    started = time.perf_counter()
+    try:
+        response = await client.send(upstream_request, stream=stream)
+    except httpx.HTTPError:
+        limiter.release("error")
+        router.abandon(provider)
+        router.observe_failure(provider)
+        metrics.observe_connect_error(provider.name, model)
+        raise
+    except BaseException:
+        limiter.release("cancelled")
+        router.abandon(provider)
+        raise
+    call = UpstreamCall(response, provider=provider, started=started, stream=stream, model=model)
+    call.translator = translator if stream else None
+    limiter.track(call)
+    router.track(provider, call)
+    metrics.track(call)
+    try:
+        response.raise_for_status()
+    except httpx.HTTPError:
+        await response.aclose()
+        call.finish("error")
+        raise
+    if not stream:
+        if translator is not None:
+            call.response = translate_response(response, translator)
+        call.mark_chunk(call.response.content)
+        call.finish("ok")
+    return call
+
+def request_priority(request: Request) -> str:
+    """Clase de prioridad de la petición (X-Kimi-Priority); interactive por defecto"""
+    priority = request.headers.get("x-kimi-priority", "").lower()
+    return priority if priority in PRIORITY_WEIGHTS else DEFAULT_PRIORITY
+
+async def check_rate_limit(request: Request, caller: str, tokens: int) -> TokenCharge:
+    """Cobra la petición al cliente o responde 429 si agotó su cuota"""
+    retry_after = await rate_limiter.check_async(caller, tokens)
+    if retry_after > 0:
+        metrics.observe_rate_limited(request_priority(request))
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded for client {caller}",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    return TokenCharge(rate_limiter, caller, tokens)
+
+def settle_on_usage(call: UpstreamCall, charge: TokenCharge) -> None:
+    """Ajusta lo cobrado al uso real cuando termine la llamada upstream"""
+    def settle_tokens(call: UpstreamCall, outcome: str):
+        usage = extract_usage(call) if outcome == "ok" else None
+        if usage and usage.get("total_tokens") is not None:
+            charge.settle(usage["total_tokens"])
+
+    if rate_limiter.enabled:
+        call.add_listener(settle_tokens)
+
+async def open_call(
+    raw_request: Request,
+    client: httpx.AsyncClient,
+    body: ChatBody,
+    stream: bool,
+    provider: Provider,
+    upstream_model: str
+) -> UpstreamCall:
+    """
+    Abre la llamada upstream, con hedging a un segundo proveedor si procede
+
+    El hedge se activa con KIMI_HEDGE_ENABLED=1 o `X-Kimi-Hedge: on` y no se usa
+    cuando el proveedor está fijado o aún no hay muestras de TTFT suficientes.
+    """
+    priority = request_priority(raw_request)
+
+    async def primary():
+        return await open_upstream(client, body, stream, provider, upstream_model, priority)
+
+    hedge_mode = raw_request.headers.get("x-kimi-hedge", "").lower()
+    pinned = raw_request.headers.get("x-kimi-provider") or router.pinned
+    if hedge_mode == "off" or not (HEDGE_ENABLED or hedge_mode == "on") or pinned:
+        return await primary()
+
+    delay = provider.ttft_percentile(
+        HEDGE_PERCENTILE, "stream" if stream else "json", HEDGE_MIN_SAMPLES
+    )
+    alternates = [p for p, _ in router.candidates(body.model)
+                  if p.name != provider.name and p.healthy()]
+
+    async def alternate():
+        other, other_model = router.choose(body.model, exclude=[provider.name], affinity_key=affinity_key(body))
+        return await open_upstream(client, body, stream, other, other_model, priority)
+
+    call, _ = await hedged_call(primary, alternate if alternates else None, delay, hedge_budget)
+    return call
+
+async def open_with_retries(
+    raw_request: Request,
+    client: httpx.AsyncClient,
+    body: ChatBody,
+    stream: bool,
+    provider: Provider,
+    upstream_model: str
+) -> UpstreamCall:
+    """
+    Abre la llamada reintentando errores transitorios con backoff
 
+    Cada reintento vuelve a elegir proveedor evitando los que ya fallaron
+    (salvo si el proveedor está fijado). Al devolver la llamada todavía no se
+    ha enviado nada al cliente, así que reintentar aquí siempre es seguro.
+    """
+    target = [provider, upstream_model]
+    failed = []
+    pinned = raw_request.headers.get("x-kimi-provider") or router.pinned
+
+    async def attempt():
+        return await open_call(raw_request, client, body, stream, *target)
+
+    def on_retry(error: BaseException):
+        failed.append(target[0].name)
+        metrics.observe_retry(target[0].name)
+        if pinned:
+            return
+        try:
+            target[:] = router.choose(body.model, exclude=failed, affinity_key=affinity_key(body))
+        except NoProviderAvailable:
+            pass  # no hay alternativa: se reintenta en el mismo
+
+    return await retry_policy.run(attempt, on_retry)
+
+def upstream_error(e: Exception, provider: Optional[Provider] = None) -> HTTPException:
+    if isinstance(e, Overloaded):
+        # Saturación: 503 inmediato para que el cliente reintente más tarde
+        return HTTPException(
+            status_code=503,
+            detail=f"Upstream provider {e.provider} is overloaded ({e.reason}), retry later",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    label = provider.label or provider.name if provider is not None else "upstream"
+    return HTTPException(
+        status_code=500,
+        detail=f"Error calling {label} API: {str(e)}"
+    )
+
+def parse_chat_body(raw: bytes) -> ChatBody:
+    """
+    Cuerpo de /v1/chat/completions listo para reenviar
+
+    En modo passthrough solo se validan los campos que usa el proxy y se
+    conservan los bytes originales; con KIMI_PROXY_PASSTHROUGH=0 la petición
+    se valida con ChatCompletionRequest y se reconstruye como antes.
+    """
+    if not PASSTHROUGH:
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid JSON body: {e}")
+        return chat_body_from_data(data)
+    try:
+        return ChatBody.parse(raw, KIMI_K2_MODEL)
+    except InvalidRequest as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def chat_body_from_data(data: Any) -> ChatBody:
+    """Igual que parse_chat_body para una petición ya parseada (sin bytes originales)"""
+    try:
+        if PASSTHROUGH:
+            if not isinstance(data, dict):
+                raise InvalidRequest("Request body must be a JSON object")
+            return ChatBody.from_data(data, KIMI_K2_MODEL)
+        request = ChatCompletionRequest.model_validate(data)
+    except InvalidRequest as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    return ChatBody.from_data(request_payload(request), KIMI_K2_MODEL)
+
+def request_payload(request: ChatCompletionRequest) -> dict:
+    """Payload upstream reconstruido desde el modelo Pydantic"""
     payload = {
         "model": request.model,
         "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
@@ -84,40 +652,791 @@ async def chat_completion(request: ChatCompletionRequest):
         "max_tokens": request.max_tokens,
         "stream": request.stream
     }
+    if request.tools:
+        payload["tools"] = request.tools
+    if request.tool_choice is not None:
+        payload["tool_choice"] = request.tool_choice
+    if request.extra_body:
+        payload["extra_body"] = request.extra_body
+    return payload
 
-    try:
-        # Hacer petición a Chutes.ai
-        response = requests.post(
-            f"{CHUTES_BASE_URL}/chat/completions",
-            headers=headers,
-            json=payload,
-            stream=request.stream,
-            timeout=120
+@app.post("/v1/chat/completions")
+async def chat_completion(raw_request: Request):
+    """
+    Endpoint de chat compatible con OpenAI API
+    Redirige peticiones al proveedor upstream elegido por el router
+    """
+    body = parse_chat_body(await raw_request.body())
+    if raw_request.headers.get("x-kimi-agent", "").lower() == "on":
+        return await agent_completion(body, raw_request)
+    if raw_request.headers.get("x-kimi-cascade", "").lower() == "on":
+        return await cascade_completion(body, raw_request)
+    trajectories = heavy_trajectories(body, raw_request)
+    if trajectories:
+        return await heavy_completion(body, raw_request, trajectories)
+    return await complete(body, raw_request)
+
+async def complete(body: ChatBody, raw_request: Request) -> Response:
+    """Atiende una petición de chat ya parseada (endpoint normal y en bloque)"""
+
+    # Caché y coalescencia: solo peticiones deterministas o con opt-in (X-Kimi-Cache: on)
+    cache = get_response_cache(raw_request)
+    cache_mode = raw_request.headers.get("x-kimi-cache", "").lower()
+    key = None
+    if cache_mode != "off":
+        if is_cacheable(body.data, opt_in=cache_mode == "on"):
+            key = cache_key(body.data)
+
+    if key is not None and cache is not None:
+        cached, level = await cache.get(key)
+        metrics.observe_cache(level)
+        if cached is not None:
+            return cached_response(cached, body.stream, level, raw_request)
+
+    # Los aciertos de caché no consumen cuota; el resto se cobra por estimación
+    caller = identify_client(raw_request.headers, raw_request.client.host if raw_request.client else None)
+    estimate = estimate_tokens(body.messages, body.max_tokens)
+    charge = await check_rate_limit(raw_request, caller, estimate)
+
+    provider, upstream_model = choose_provider(raw_request, body.model, affinity_key(body))
+
+    if key is not None and SINGLEFLIGHT_ENABLED:
+        return await coalesced_completion(
+            raw_request, body, key, body.stream, body.max_tokens, provider, upstream_model, charge
         )
 
-        response.raise_for_status()
+    cache_headers = {"X-Kimi-Cache": "miss" if key and cache else "bypass"}
+    headers = dict(cache_headers)
+    client = get_upstream_client(raw_request)
 
-        if request.stream:
-            # Streaming response
-            async def generate():
-                for line in response.iter_lines():
-                    if line:
-                        yield line + b'\n'
+    try:
+        # Si el cliente se desconecta mientras esperamos, se aborta la petición upstream
+        try:
+            call = await call_until_disconnect(
+                open_with_retries(raw_request, client, body, body.stream, provider, upstream_model),
+                raw_request.receive
+            )
+        except ClientDisconnected:
+            charge.refund()
+            record_cancellation(stream=body.stream, max_tokens=body.max_tokens)
+            return Response(status_code=499)
+    except (httpx.HTTPError, Overloaded) as e:
+        charge.refund()
+        raise upstream_error(e, provider)
 
-            return StreamingResponse(
-                generate(),
-                media_type="text/event-stream"
+    settle_on_usage(call, charge)
+    headers["X-Kimi-Provider"] = call.provider.name
+    if body.stream:
+        # Streaming response: passthrough de bytes con backpressure
+        def on_cancel(tokens_emitted: int):
+            record_cancellation(
+                stream=True,
+                max_tokens=body.max_tokens,
+                tokens_emitted=tokens_emitted
             )
+
+        tap = on_complete = None
+        if key is not None and cache is not None:
+            # Reconstruir la respuesta completa mientras pasa para cachearla
+            accumulator = CompletionAccumulator()
+            tap = accumulator.feed
+
+            def on_complete():
+                if accumulator.complete:
+                    spawn(cache.put(key, orjson.dumps(accumulator.result())))
+
+        return StreamingResponse(
+            relay_stream(
+                call,
+                receive=raw_request.receive,
+                on_cancel=on_cancel,
+                tap=tap,
+                on_complete=on_complete,
+                coalesce_window=coalesce_window(raw_request),
+                coalesce_bytes=SSE_COALESCE_BYTES
+            ),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, **headers}
+        )
+
+    # Regular response
+    if key is not None and cache is not None:
+        spawn(cache.put(key, call.response.content))
+    return Response(
+        content=call.response.content,
+        media_type="application/json",
+        headers=headers
+    )
+
+async def _never_disconnects() -> dict:
+    await asyncio.Event().wait()
+
+@app.post("/v1/chat/completions/bulk")
+async def bulk_chat_completion(raw_request: Request):
+    """
+    Muchas completions en una llamada: NDJSON de entrada y de salida
+
+    Cada línea pasa por el mismo camino que /v1/chat/completions (caché,
+    límites por cliente, router, reintentos) sin streaming. Los resultados
+    salen en orden de finalización con el índice de la línea de entrada.
+    """
+    try:
+        items = parse_ndjson(await raw_request.body(), BULK_MAX_ITEMS)
+    except BulkError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    # La desconexión la detecta la respuesta en streaming, que cancela fan_out
+    item_request = Request(raw_request.scope, receive=_never_disconnects)
+
+    async def run(item) -> tuple:
+        if not isinstance(item, dict):
+            return 422, orjson.dumps({"detail": "Each line must be a JSON object"})
+        try:
+            response = await complete(chat_body_from_data({**item, "stream": False}), item_request)
+        except HTTPException as e:
+            return e.status_code, orjson.dumps({"detail": e.detail})
+        return response.status_code, response.body
+
+    return StreamingResponse(
+        fan_out(items, run, BULK_CONCURRENCY),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers=SSE_HEADERS
+    )
+
+async def agent_completion(body: ChatBody, raw_request: Request) -> Response:
+    """
+    Modo agente: el proxy ejecuta las rondas de herramientas del servidor
+
+    Cada ronda de modelo pasa por `complete` en streaming (caché, límites,
+    router, reintentos). La respuesta lleva la traza en `kimi_agent`.
+    """
+    # La desconexión se vigila sobre el bucle entero, no en cada ronda
+    round_request = Request(raw_request.scope, receive=_never_disconnects)
+
+    async def call_model(data: dict):
+        response = await complete(ChatBody.from_data(data, KIMI_K2_MODEL), round_request)
+        if isinstance(response, StreamingResponse):
+            async for chunk in response.body_iterator:
+                yield chunk
         else:
-            # Regular response
-            return response.json()
+            yield response.body
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error calling Chutes.ai API: {str(e)}"
+    loop = AgentLoop(
+        agent_tools,
+        call_model,
+        get_upstream_client(raw_request),
+        max_rounds=AGENT_MAX_ROUNDS,
+        on_round=metrics.observe_agent_round
+    )
+
+    if body.stream:
+        async def events():
+            try:
+                async for event in loop.stream(body.data):
+                    yield event
+            except HTTPException as e:
+                # Las cabeceras ya salieron: el error va como evento SSE
+                yield encode_event({"error": {"message": str(e.detail), "code": e.status_code}})
+                yield DONE_EVENT
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    try:
+        completion = await call_until_disconnect(loop.run(body.data), raw_request.receive)
+    except ClientDisconnected:
+        record_cancellation(stream=False, max_tokens=body.max_tokens)
+        return Response(status_code=499)
+    return Response(content=orjson.dumps(completion), media_type="application/json")
+
+def heavy_trajectories(body: ChatBody, raw_request: Request) -> Optional[int]:
+    """
+    Trayectorias pedidas en Heavy Mode, o None si la petición es normal
+
+    `X-Kimi-Heavy: on|<n>|off` manda sobre el cuerpo; sin cabecera, decide
+    `heavy_mode` (también dentro de extra_body) con `num_trajectories`.
+    """
+    header = raw_request.headers.get("x-kimi-heavy", "").lower()
+    if header == "off" or (not header and not body.data.get("heavy_mode")):
+        return None
+    requested = int(header) if header.isdigit() else body.data.get("num_trajectories") or HEAVY_TRAJECTORIES
+    if not isinstance(requested, int) or requested < 1:
+        raise HTTPException(status_code=422, detail="num_trajectories must be a positive integer")
+    return min(requested, HEAVY_MAX_TRAJECTORIES)
+
+def round_stream(raw_request: Request):
+    """
+    `open_stream` para Heavy Mode y la cascada: cada llamada pasa por `complete`
+
+    La desconexión se vigila sobre el conjunto, no en cada llamada.
+    """
+    round_request = Request(raw_request.scope, receive=_never_disconnects)
+
+    async def open_stream(payload: dict):
+        response = await complete(ChatBody.from_data(payload, KIMI_K2_MODEL), round_request)
+        if not isinstance(response, StreamingResponse):
+            yield response.body
+            return
+        iterator = response.body_iterator
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            # Cerrar el relay corta el stream upstream de las llamadas canceladas
+            await iterator.aclose()
+
+    return open_stream
+
+def failed_completion(error: Optional[BaseException], detail: str) -> HTTPException:
+    """El error upstream tal cual si lo hay; si no, 502 con `detail`"""
+    if isinstance(error, HTTPException):
+        return error
+    return HTTPException(status_code=502, detail=f"{detail}: {error}")
+
+async def decided_completion(
+    body: ChatBody,
+    raw_request: Request,
+    run: Callable[[], Awaitable[Any]],
+    progress: asyncio.Queue,
+    finish: Callable[[Any], tuple],
+    field: str
+) -> Response:
+    """
+    Respuesta que se decide entera antes de emitirla (Heavy Mode, cascada)
+
+    `run()` decide y `finish(result)` devuelve (completion, resumen) o lanza
+    HTTPException. En streaming, cada texto que llega a `progress` sale
+    como comentario SSE mientras tanto y el resumen va en `field` del último
+    chunk; sin streaming, en `field` del JSON.
+    """
+    if body.stream:
+        async def events():
+            task = asyncio.ensure_future(run())
+            try:
+                # Comentarios SSE mientras se decide: mantienen viva la conexión
+                while not task.done():
+                    waiter = asyncio.ensure_future(progress.get())
+                    await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                    if waiter.done():
+                        yield f": {waiter.result()}\n\n".encode()
+                    else:
+                        waiter.cancel()
+                completion, summary = finish(task.result())
+            except HTTPException as e:
+                # Las cabeceras ya salieron: el error va como evento SSE
+                yield encode_event({"error": {"message": str(e.detail), "code": e.status_code}})
+                yield DONE_EVENT
+                return
+            finally:
+                task.cancel()
+            for event in completion_to_sse(completion):
+                if event == DONE_EVENT:
+                    yield encode_event({
+                        "id": completion.get("id"),
+                        "object": "chat.completion.chunk",
+                        "created": completion.get("created"),
+                        "model": completion.get("model"),
+                        "choices": [],
+                        field: summary,
+                    })
+                yield event
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    try:
+        result = await call_until_disconnect(run(), raw_request.receive)
+    except ClientDisconnected:
+        record_cancellation(stream=False, max_tokens=body.max_tokens)
+        return Response(status_code=499)
+    completion, summary = finish(result)
+    return Response(content=orjson.dumps({**completion, field: summary}), media_type="application/json")
+
+async def heavy_completion(body: ChatBody, raw_request: Request, trajectories: int) -> Response:
+    """
+    Heavy Mode en el proxy: N trayectorias en paralelo con voto por mayoría
+
+    Cada trayectoria pasa por `complete` en streaming (límites, router,
+    reintentos) y se cancela en cuanto hay mayoría. La respuesta es la
+    trayectoria elegida con el detalle de todas en `kimi_heavy`.
+    """
+    progress: asyncio.Queue = asyncio.Queue()
+    engine = HeavyEngine(
+        round_stream(raw_request),
+        trajectories=trajectories,
+        early_exit=HEAVY_EARLY_EXIT,
+        on_trajectory=lambda t: progress.put_nowait(f"heavy trajectory {t.index} {t.status}")
+    )
+
+    def finish(result) -> tuple:
+        summary = result.summary()
+        metrics.observe_heavy(summary)
+        if result.chosen is None:
+            raise failed_completion(result.error, "All heavy mode trajectories failed")
+        return result.completion(), summary
+
+    return await decided_completion(
+        body, raw_request, lambda: engine.run(body.data), progress, finish, "kimi_heavy"
+    )
+
+async def cascade_completion(body: ChatBody, raw_request: Request) -> Response:
+    """
+    Modo cascada: el nivel más barato primero, escalando si la confianza es baja
+
+    Cada llamada de cada nivel pasa por `complete`. La respuesta es la del
+    nivel que contestó, con los niveles recorridos en `kimi_cascade`.
+    """
+    if cascade_config is None:
+        raise HTTPException(status_code=400, detail="Cascade mode is not configured (cascade section in models.yaml)")
+
+    progress: asyncio.Queue = asyncio.Queue()
+
+    def on_attempt(attempt) -> None:
+        confidence = f"{attempt.confidence:.2f}" if attempt.confidence is not None else "-"
+        progress.put_nowait(f"cascade tier {attempt.tier.name} {attempt.status} confidence={confidence}")
+
+    cascade = Cascade(cascade_config, round_stream(raw_request), on_attempt)
+
+    def finish(result) -> tuple:
+        summary = result.summary()
+        cascade_stats.record(summary)
+        metrics.observe_cascade(summary)
+        if result.completion is None:
+            raise failed_completion(result.error, "All cascade tiers failed")
+        return result.completion, summary
+
+    return await decided_completion(
+        body, raw_request, lambda: cascade.run(body.data), progress, finish, "kimi_cascade"
+    )
+
+async def coalesced_completion(
+    raw_request: Request,
+    body: ChatBody,
+    key: str,
+    stream: bool,
+    max_tokens: Optional[int],
+    provider: Provider,
+    upstream_model: str,
+    charge: TokenCharge
+) -> Response:
+    """
+    Atiende una petición determinista compartiendo la llamada upstream con
+    las peticiones idénticas que ya estén en curso (single-flight)
+
+    Solo el líder paga tokens (ajustados al uso real); a las seguidoras se les
+    devuelve la estimación, como a un acierto de caché.
+    """
+    client = get_upstream_client(raw_request)
+    cache = get_response_cache(raw_request)
+
+    async def start():
+        # Siempre en modo stream a nivel HTTP: el cuerpo se comparte por chunks
+        call = await open_with_retries(raw_request, client, body, True, provider, upstream_model)
+        settle_on_usage(call, charge)
+        return call
+
+    async def on_complete(flight):
+        if cache is None:
+            return
+        if stream:
+            accumulator = CompletionAccumulator()
+            for chunk in flight.chunks:
+                accumulator.feed(chunk)
+            if accumulator.complete:
+                await cache.put(key, orjson.dumps(accumulator.result()))
+        else:
+            await cache.put(key, flight.body())
+
+    def on_abandon(flight):
+        record_cancellation(stream=stream, max_tokens=max_tokens, tokens_emitted=flight.events)
+
+    flight, leader = singleflight.join(
+        f"{key}:{'stream' if stream else 'json'}", start, on_complete, on_abandon
+    )
+    if not leader:
+        charge.refund()
+    headers = {
+        "X-Kimi-Cache": "miss" if cache is not None else "bypass",
+        "X-Kimi-Coalesced": "leader" if leader else "follower"
+    }
+
+    try:
+        # Streaming: basta con que el upstream haya respondido; si no, el cuerpo completo
+        waiter = flight.ready.wait() if stream else flight.wait_done()
+        await call_until_disconnect(waiter, raw_request.receive)
+    except ClientDisconnected:
+        charge.refund()
+        singleflight.leave(flight)
+        return Response(status_code=499)
+
+    if flight.error is not None and not flight.chunks:
+        charge.refund()
+        singleflight.leave(flight)
+        raise upstream_error(flight.error, provider)
+
+    # El líder pudo elegir otro proveedor (o ganar un hedge)
+    headers["X-Kimi-Provider"] = flight.call.provider.name if flight.call else provider.name
+    if stream:
+        return StreamingResponse(
+            client_stream(raw_request, singleflight.subscribe(flight, receive=raw_request.receive)),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, **headers}
         )
 
+    singleflight.leave(flight)
+    if flight.error is not None:
+        charge.refund()
+        raise upstream_error(flight.error, provider)
+    return Response(
+        content=flight.body(),
+        media_type=flight.content_type or "application/json",
+        headers=headers
+    )
+
+def session_owner(connection: HTTPConnection) -> str:
+    """Cliente dueño de las sesiones: el mismo identificador que usan los límites por cliente"""
+    return identify_client(connection.headers, connection.client.host if connection.client else None)
+
+def session_error(e: Exception) -> HTTPException:
+    if isinstance(e, SessionNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, SessionBusy):
+        return HTTPException(status_code=409, detail=str(e))
+    if isinstance(e, SessionTooLarge):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=422, detail=str(e))
+
+def session_headers(turn: Turn) -> dict:
+    """Lo que el turno se ahorró al no reenviar el historial"""
+    stats = turn.stats()
+    return {
+        "X-Kimi-Session": turn.session.id,
+        "X-Kimi-Session-Ingress-Bytes": str(stats["ingress_bytes"]),
+        "X-Kimi-Session-Reused-Bytes": str(stats["reused_bytes"]),
+        "X-Kimi-Session-Parse-Saved-Ms": str(stats["parse_saved_ms"])
+    }
+
+async def session_completion(turn: Turn, raw_request: Request) -> Response:
+    """
+    Turno de sesión por el camino normal (`complete`) guardando la respuesta
+
+    En streaming la respuesta se reconstruye mientras pasa hacia el cliente
+    y se guarda al terminar; si el turno falla o se corta, el historial no
+    cambia.
+    """
+    try:
+        response = await complete(turn.body(), raw_request)
+    except InvalidRequest as e:
+        await asyncio.to_thread(sessions.finish, turn, None)
+        raise HTTPException(status_code=422, detail=str(e))
+    except BaseException:
+        await asyncio.to_thread(sessions.finish, turn, None)
+        raise
+    response.headers.update(session_headers(turn))
+    if not isinstance(response, StreamingResponse):
+        reply = completion_reply(orjson.loads(response.body)) if response.status_code == 200 else None
+        await asyncio.to_thread(sessions.finish, turn, reply)
+        return response
+
+    accumulator = CompletionAccumulator()
+    events = response.body_iterator
+
+    async def relay():
+        try:
+            async for chunk in events:
+                accumulator.feed(chunk)
+                yield chunk
+        finally:
+            reply = completion_reply(accumulator.result()) if accumulator.complete else None
+            await asyncio.to_thread(sessions.finish, turn, reply)
+
+    response.body_iterator = relay()
+    return response
+
+@app.post("/v1/sessions", status_code=201)
+async def create_session(raw_request: Request):
+    """
+    Crea una sesión con el modelo, los parámetros y los mensajes iniciales
+
+    El cuerpo es el de /v1/chat/completions (`messages` puede ir vacío);
+    luego cada turno solo envía el mensaje nuevo.
+    """
+    try:
+        data, _ = sessions.parse(await raw_request.body())
+        session = await asyncio.to_thread(sessions.create, data, session_owner(raw_request), KIMI_K2_MODEL)
+    except (InvalidRequest, SessionTooLarge) as e:
+        raise session_error(e)
+    return session.snapshot()
+
+@app.get("/v1/sessions/{session_id}")
+async def get_session(session_id: str, raw_request: Request):
+    """Estado de la sesión y bytes/parseo ahorrados en sus turnos"""
+    try:
+        return (await asyncio.to_thread(sessions.get, session_id, session_owner(raw_request))).snapshot()
+    except SessionNotFound as e:
+        raise session_error(e)
+
+@app.delete("/v1/sessions/{session_id}")
+async def delete_session(session_id: str, raw_request: Request):
+    try:
+        await asyncio.to_thread(sessions.delete, session_id, session_owner(raw_request))
+    except SessionNotFound as e:
+        raise session_error(e)
+    return {"id": session_id, "object": "chat.session.deleted", "deleted": True}
+
+@app.post("/v1/sessions/{session_id}/messages")
+async def session_message(session_id: str, raw_request: Request):
+    """
+    Un turno: `message` (o `messages`) nuevos y `stream`; la respuesta es la
+    de /v1/chat/completions y el mensaje del asistente queda en el historial
+    """
+    try:
+        session = await asyncio.to_thread(sessions.get, session_id, session_owner(raw_request))
+        raw = await raw_request.body()
+        data, parse_seconds = sessions.parse(raw)
+        turn = await asyncio.to_thread(sessions.begin, session, data, len(raw), parse_seconds)
+    except (InvalidRequest, SessionNotFound, SessionBusy) as e:
+        raise session_error(e)
+    return await session_completion(turn, raw_request)
+
+@app.websocket("/v1/sessions/ws")
+async def session_socket(websocket: WebSocket):
+    """
+    Sesión por WebSocket: un frame JSON por turno y los deltas de vuelta
+
+    Con `?session_id=` se retoma una sesión existente; si no, el primer frame
+    debe ser {"type": "session.create", ...} con el cuerpo de POST /v1/sessions.
+    Cada turno es {"type": "message", "message": {...}} y se responde con
+    frames {"type": "chunk", "chunk": {...}} y un {"type": "turn.done"} final.
+    Los errores llegan como {"type": "error"} sin cerrar la conexión.
+    """
+    await websocket.accept()
+    owner = session_owner(websocket)
+    # Los turnos pasan por `complete` como peticiones con las cabeceras del handshake
+    turn_request = Request({**websocket.scope, "type": "http", "method": "POST"}, receive=_never_disconnects)
+    session = None
+    try:
+        if websocket.query_params.get("session_id"):
+            try:
+                session = await asyncio.to_thread(sessions.get, websocket.query_params["session_id"], owner)
+            except SessionNotFound as e:
+                await send_socket_error(websocket, session_error(e))
+                await websocket.close(code=4404)
+                return
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            raw = message.get("bytes") or message.get("text", "").encode()
+            try:
+                data, parse_seconds = sessions.parse(raw)
+                if data.get("type") == "session.create" and session is None:
+                    session = await asyncio.to_thread(sessions.create, data, owner, KIMI_K2_MODEL)
+                    await send_frame(websocket, orjson.dumps({"type": "session.created", "session": session.snapshot()}))
+                    continue
+                if data.get("type") != "message" or session is None:
+                    raise InvalidRequest("Expected a 'session.create' frame first, then 'message' frames")
+                turn = await asyncio.to_thread(sessions.begin, session, {**data, "stream": True}, len(raw), parse_seconds)
+            except (InvalidRequest, SessionBusy, SessionTooLarge) as e:
+                await send_socket_error(websocket, session_error(e))
+                continue
+            await socket_turn(websocket, turn, turn_request)
+    except WebSocketDisconnect:
+        return
+
+async def send_frame(websocket: WebSocket, payload: bytes) -> None:
+    """Frame de texto con un objeto JSON ya serializado"""
+    await websocket.send_text(payload.decode())
+
+async def send_socket_error(websocket: WebSocket, e: HTTPException) -> None:
+    await send_frame(websocket, orjson.dumps({"type": "error", "error": {"message": str(e.detail), "code": e.status_code}}))
+
+async def socket_turn(websocket: WebSocket, turn: Turn, turn_request: Request) -> None:
+    """Un turno por WebSocket: cada evento SSE de la respuesta va en su propio frame"""
+    try:
+        response = await complete(turn.body(), turn_request)
+    except (InvalidRequest, HTTPException) as e:
+        await asyncio.to_thread(sessions.finish, turn, None)
+        await send_socket_error(websocket, e if isinstance(e, HTTPException) else session_error(e))
+        return
+    except BaseException:
+        await asyncio.to_thread(sessions.finish, turn, None)
+        raise
+    if not isinstance(response, StreamingResponse):
+        await asyncio.to_thread(sessions.finish, turn, None)
+        await send_socket_error(websocket, HTTPException(status_code=response.status_code, detail="Turn cancelled"))
+        return
+
+    accumulator = CompletionAccumulator()
+    events = response.body_iterator
+    reply = None
+    try:
+        async for data in sse_payloads(events, accumulator.feed):
+            # Sin reparsear el chunk: se envuelve tal cual
+            await send_frame(websocket, b'{"type":"chunk","chunk":' + data + b"}")
+        if accumulator.complete:
+            reply = completion_reply(accumulator.result())
+    finally:
+        await events.aclose()
+        await asyncio.to_thread(sessions.finish, turn, reply)
+    if reply is None:
+        await send_socket_error(websocket, HTTPException(
+            status_code=502, detail="The turn did not complete; the session history is unchanged"
+        ))
+        return
+    await send_frame(websocket, orjson.dumps({
+        "type": "turn.done",
+        "message": reply,
+        "usage": accumulator.usage,
+        "turn": turn.stats(),
+        "session": turn.session.snapshot()
+    }))
+
+@app.post("/v1/files")
+async def upload_file(request: Request, file: UploadFile = File(...), purpose: str = Form("batch")):
+    """Sube un JSONL de peticiones para la Batch API"""
+    store = get_batch_runner(request).store
+    content = await file.read()
+    return await asyncio.to_thread(store.create_file, file.filename or "input.jsonl", content, purpose)
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str, request: Request):
+    """Metadatos de un fichero subido o generado por un lote"""
+    info = await asyncio.to_thread(get_batch_runner(request).store.get_file, file_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    return info
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, request: Request):
+    """Contenido de un fichero (p.ej. el JSONL de resultados de un lote)"""
+    path = await asyncio.to_thread(get_batch_runner(request).store.file_path, file_id)
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    return FileResponse(path, media_type="application/jsonl")
+
+class BatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str = "/v1/chat/completions"
+    completion_window: str = "24h"
+    metadata: Optional[dict] = None
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchRequest, raw_request: Request):
+    """Crea un lote a partir de un fichero subido; se ejecuta en segundo plano"""
+    runner = get_batch_runner(raw_request)
+    if request.endpoint not in BATCH_ENDPOINTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported endpoint {request.endpoint}")
+    try:
+        batch = await asyncio.to_thread(
+            runner.store.create_batch,
+            request.input_file_id, request.endpoint, request.completion_window, request.metadata
+        )
+    except BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    runner.notify()
+    return batch
+
+@app.get("/v1/batches")
+async def list_batches(raw_request: Request, limit: int = 20):
+    """Lotes más recientes primero"""
+    data = await asyncio.to_thread(get_batch_runner(raw_request).store.list_batches, limit)
+    return {"object": "list", "data": data, "has_more": len(data) == limit}
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, raw_request: Request):
+    """Estado y contadores de un lote"""
+    batch = await asyncio.to_thread(get_batch_runner(raw_request).store.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return batch
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, raw_request: Request):
+    """Cancela un lote: las peticiones que no han empezado no se ejecutan"""
+    batch = await get_batch_runner(raw_request).cancel(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return batch
+
+@app.get("/v1/batches/{batch_id}/events")
+async def batch_events(batch_id: str, raw_request: Request):
+    """Progreso del lote como SSE (un evento por cambio, hasta que termina)"""
+    runner = get_batch_runner(raw_request)
+    if await asyncio.to_thread(runner.store.get_batch, batch_id) is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+
+    async def events():
+        async for batch in runner.watch(batch_id):
+            yield b"data: " + orjson.dumps(batch) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class JobRequest(BaseModel):
+    url: str = "/v1/chat/completions"
+    body: dict
+    metadata: Optional[dict] = None
+
+@app.post("/v1/jobs", status_code=202)
+async def create_job(request: JobRequest, raw_request: Request):
+    """Encola una petición larga; el resultado se consulta en /v1/jobs/{id}"""
+    runner = get_batch_runner(raw_request)
+    if request.url not in BATCH_ENDPOINTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported url {request.url}")
+    job = await asyncio.to_thread(runner.store.create_job, request.url, request.body, request.metadata)
+    runner.notify()
+    return job_response(job, None)
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, raw_request: Request):
+    """Estado de un job y, cuando termina, su respuesta"""
+    store = get_batch_runner(raw_request).store
+    job = await asyncio.to_thread(store.get_batch, job_id)
+    if job is None or job["kind"] != "job":
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_response(job, await asyncio.to_thread(store.item_result, job_id))
+
+def job_response(job: dict, result: Optional[dict]) -> dict:
+    """Vista reducida de un lote de una petición"""
+    response = (result or {}).get("response") or {}
+    return {
+        "id": job["id"],
+        "object": "job",
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "url": job["endpoint"],
+        "status_code": response.get("status_code"),
+        "result": response.get("body"),
+        "error": (result or {}).get("error"),
+        "metadata": job["metadata"],
+    }
+
+@app.get("/admin/stats")
+async def admin_stats(request: Request):
+    """Estadísticas internas del proxy"""
+    cache = get_response_cache(request)
+    return {
+        "cancellations": cancellation_stats.snapshot(),
+        "cache": cache.snapshot() if cache is not None else None,
+        "singleflight": singleflight.snapshot(),
+        "hedging": hedge_budget.snapshot(),
+        "concurrency": concurrency.snapshot(),
+        "rate_limits": rate_limiter.snapshot(),
+        "retries": retry_policy.snapshot(),
+        "sessions": await asyncio.to_thread(sessions.snapshot),
+        "cascade": cascade_stats.snapshot()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato Prometheus"""
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/admin/providers")
+async def admin_providers():
+    """Estado del router: latencia, carga y salud de cada proveedor"""
+    return router.snapshot()
+
 @app.get("/v1/models")
 async def list_models():
     """Listar modelos disponibles"""
@@ -135,21 +1454,12 @@ async def list_models():
     }
 
 @app.post("/test/simple")
-async def simple_test(prompt: str = "Explica qué es Kimi K2 en 3 líneas"):
+async def simple_test(raw_request: Request, prompt: str = "Explica qué es Kimi K2 en 3 líneas"):
     """
     Endpoint de prueba simple para verificar conectividad
     """
 
-    if not CHUTES_API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="CHUTES_API_KEY not configured"
-        )
-
-    headers = {
-        "Authorization": f"Bearer {CHUTES_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    provider, upstream_model = choose_provider(raw_request, KIMI_K2_MODEL)
 
     payload = {
         "model": KIMI_K2_MODEL,
@@ -160,19 +1470,15 @@ async def simple_test(prompt: str = "Explica qué es Kimi K2 en 3 líneas"):
         "temperature": 0.7
     }
 
-    try:
-        response = requests.post(
-            f"{CHUTES_BASE_URL}/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+    client = get_upstream_client(raw_request)
 
-        response.raise_for_status()
-        result = response.json()
+    try:
+        call = await open_upstream(client, ChatBody(payload), False, provider, upstream_model)
+        result = call.response.json()
 
         return {
             "status": "success",
+            "provider": provider.name,
             "prompt": prompt,
             "response": result["choices"][0]["message"]["content"],
             "model": result["model"],
@@ -186,21 +1492,30 @@ async def simple_test(prompt: str = "Explica qué es Kimi K2 en 3 líneas"):
         )
 
 if __name__ == "__main__":
-    print("""
+    parser = argparse.ArgumentParser(description="Proxy local de Kimi K2 compatible con OpenAI")
+    parser.add_argument("--dev", action="store_true", help="Un proceso con recarga al cambiar ficheros")
+    parser.add_argument("--workers", "-w", type=int, default=SERVER_WORKERS, help="Procesos worker")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", "-p", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    mode = "desarrollo (recarga)" if args.dev else f"{args.workers} workers, drenado {DRAIN_TIMEOUT:g}s"
+    print(f"""
     ╔══════════════════════════════════════════════════════╗
     ║   Kimi K2 Thinking - Local Development Server       ║
     ╚══════════════════════════════════════════════════════╝
 
-    📍 Server: http://localhost:8080
-    📖 Docs: http://localhost:8080/docs
-    🧪 Test endpoint: http://localhost:8080/test/simple
+    📍 Server: http://localhost:{args.port}
+    📖 Docs: http://localhost:{args.port}/docs
+    🧪 Test endpoint: http://localhost:{args.port}/test/simple
 
     🔑 API Key: {"✅ Configured" if CHUTES_API_KEY else "❌ Missing"}
     🤖 Model: {KIMI_K2_MODEL}
+    ⚙️  Modo: {mode}
 
     Usage example:
 
-    curl -X POST http://localhost:8080/v1/chat/completions \\
+    curl -X POST http://localhost:{args.port}/v1/chat/completions \\
       -H "Content-Type: application/json" \\
       -d '{{
         "model": "{KIMI_K2_MODEL}",
@@ -210,10 +1525,11 @@ if __name__ == "__main__":
     Press Ctrl+C to stop server
     """)
 
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=8080,
-        reload=True,
-        log_level="info"
+    serve(
+        "kimi_k2_local_server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        drain_timeout=DRAIN_TIMEOUT,
+        dev=args.dev
     )
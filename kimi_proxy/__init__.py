@@ -0,0 +1,3 @@
+"""
+Componentes internos del proxy local de Kimi K2 (kimi_k2_local_server.py)
+"""
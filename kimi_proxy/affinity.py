@@ -0,0 +1,161 @@
+"""
+Enrutado por afinidad de prefijo entre réplicas propias de vLLM/SGLang.
+
+Con varias réplicas data-parallel (ver docs/deploy_guidance.md) cada una
+guarda en su caché KV los prefijos que ha procesado. Si los turnos de una
+conversación caen en réplicas al azar, el system prompt y el historial se
+vuelven a calcular en cada turno. Aquí se calcula una clave del comienzo de
+la conversación (mensajes system, herramientas y los primeros turnos) y se
+usa hashing consistente con carga acotada (Mirrokni et al., "Consistent
+Hashing with Bounded Loads"): la petición va a la primera réplica del anillo
+a partir de su clave cuya carga no pase de `load_factor` veces la media; si
+la preferida está saturada, se desborda a la siguiente.
+
+La tasa de aciertos es una estimación: cuenta como acierto que un prefijo ya
+visto vuelva a la réplica que lo sirvió la última vez (no se sabe si la
+réplica lo ha desalojado de su caché).
+"""
+
+import bisect
+import hashlib
+import math
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import orjson
+
+T = TypeVar("T")
+
+# Puntos de cada réplica en el anillo (por unidad de weight)
+VIRTUAL_NODES = 100
+
+# Bytes del prefijo serializado que entran en la clave: más allá no cambia nada
+# para conversaciones distintas y solo cuesta CPU con contextos enormes
+MAX_KEY_BYTES = 64 * 1024
+
+
+def prefix_key(data: Dict[str, Any], messages: int = 1) -> Optional[str]:
+    """
+    Clave del prefijo común de una conversación
+
+    Incluye los mensajes system/developer iniciales, las herramientas y los
+    `messages` primeros mensajes de la conversación, que no cambian de un
+    turno al siguiente. None si la petición no tiene mensajes.
+    """
+    chat = data.get("messages")
+    if not isinstance(chat, list) or not chat:
+        return None
+    leading = 0
+    while leading < len(chat) and isinstance(chat[leading], dict) \
+            and chat[leading].get("role") in ("system", "developer"):
+        leading += 1
+    prefix = orjson.dumps(
+        {"tools": data.get("tools"), "messages": chat[:leading + messages]},
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.blake2b(prefix[:MAX_KEY_BYTES], digest_size=8).hexdigest()
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales ponderados"""
+
+    def __init__(self, nodes: Dict[str, float], virtual_nodes: int = VIRTUAL_NODES):
+        points = []
+        for name, weight in nodes.items():
+            for i in range(max(1, round(virtual_nodes * weight))):
+                points.append((_point(f"{name}#{i}"), name))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._names = [name for _, name in points]
+        self.nodes = list(nodes)
+
+    def walk(self, key: str) -> List[str]:
+        """Nodos distintos en el orden del anillo a partir de la clave"""
+        start = bisect.bisect(self._hashes, _point(key))
+        seen: List[str] = []
+        for i in range(len(self._names)):
+            name = self._names[(start + i) % len(self._names)]
+            if name not in seen:
+                seen.append(name)
+                if len(seen) == len(self.nodes):
+                    break
+        return seen
+
+
+def bounded_choice(
+    ring: HashRing,
+    key: str,
+    candidates: Sequence[T],
+    name: Callable[[T], str],
+    load: Callable[[T], int],
+    load_factor: float,
+) -> Tuple[T, bool]:
+    """
+    Primer candidato del anillo cuya carga cabe en el límite
+
+    El límite es ceil(load_factor x (carga total + 1) / réplicas), así que
+    siempre hay al menos un candidato que cabe. Los nodos del anillo que no
+    están en `candidates` (caídos, excluidos) se saltan.
+
+    Devuelve (candidato, si se desbordó desde el preferido por carga).
+    """
+    by_name = {name(c): c for c in candidates}
+    total = sum(load(c) for c in by_name.values())
+    limit = math.ceil(load_factor * (total + 1) / len(by_name))
+    spilled = False
+    for node in ring.walk(key):
+        candidate = by_name.get(node)
+        if candidate is None:
+            continue
+        if load(candidate) + 1 <= limit:
+            return candidate, spilled
+        spilled = True
+    # Solo si hay candidatos fuera del anillo
+    return min(by_name.values(), key=load), True
+
+
+@dataclass
+class AffinityStats:
+    """Aciertos estimados de caché de prefijo de un grupo de réplicas"""
+
+    max_keys: int = 100_000
+    requests: int = 0
+    repeats: int = 0
+    hits: int = 0
+    spills: int = 0
+    _last: "OrderedDict[str, str]" = field(default_factory=OrderedDict)
+
+    def record(self, key: str, replica: str, spilled: bool) -> str:
+        """
+        Anota a qué réplica fue el prefijo
+
+        Devuelve "new" (prefijo no visto), "hit" (misma réplica que la última
+        vez) o "miss".
+        """
+        self.requests += 1
+        self.spills += spilled
+        previous = self._last.pop(key, None)
+        self._last[key] = replica
+        if len(self._last) > self.max_keys:
+            self._last.popitem(last=False)
+        if previous is None:
+            return "new"
+        self.repeats += 1
+        if previous != replica:
+            return "miss"
+        self.hits += 1
+        return "hit"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "repeated_prefixes": self.repeats,
+            "estimated_hits": self.hits,
+            "estimated_hit_rate": round(self.hits / self.repeats, 4) if self.repeats else None,
+            "spills": self.spills,
+        }
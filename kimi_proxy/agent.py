@@ -0,0 +1,357 @@
+"""
+Bucle de herramientas en el servidor (modo agente, opt-in con X-Kimi-Agent: on).
+
+En lugar de que cada cliente repita el ciclo modelo -> tool_calls -> ejecutar
+-> reenviar todos los mensajes, el proxy registra herramientas propias
+(empezando por `buscar_informacion` sobre SearXNG) y hace las rondas él mismo:
+
+1. Llama al modelo con las herramientas del servidor añadidas a `tools`.
+2. Si la respuesta pide herramientas del servidor, ejecuta todas las llamadas
+   de ese turno a la vez, cada una con su timeout, y añade los resultados.
+3. Repite hasta que el modelo responde sin herramientas o se agotan las
+   rondas (entonces una última llamada sin `tools` fuerza la respuesta).
+
+Al cliente solo le llega la respuesta final (en streaming, el texto de cada
+ronda según se genera, sin los deltas de tool_calls) más una traza en
+`kimi_agent` con el tiempo de modelo y de herramientas de cada ronda. Si el
+modelo pide una herramienta que el servidor no conoce, el turno se devuelve
+para que la ejecute el cliente, solo con sus herramientas: las del servidor
+pedidas en ese mismo turno se descartan y el modelo las repite después.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import orjson
+
+from kimi_proxy.sse import DONE_EVENT, CompletionAccumulator, encode_event
+
+DEFAULT_SEARXNG_URL = "http://localhost:8888"
+DEFAULT_MAX_ROUNDS = 5
+DEFAULT_TOOL_TIMEOUT = 10.0
+
+# Ejecuta una herramienta: (cliente HTTP, argumentos) -> texto para el modelo
+ToolFunction = Callable[[httpx.AsyncClient, Dict[str, Any]], Awaitable[str]]
+
+# Una ronda de modelo: cuerpo de chat (stream=True) -> bytes SSE
+ModelCall = Callable[[Dict[str, Any]], AsyncIterator[bytes]]
+
+
+@dataclass
+class Tool:
+    """Herramienta ejecutada por el proxy"""
+    name: str
+    description: str
+    parameters: Dict[str, Any]
+    run: ToolFunction
+    timeout: Optional[float] = None
+
+    def schema(self) -> Dict[str, Any]:
+        """Declaración en formato OpenAI para `tools`"""
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+class ToolRegistry:
+    """Herramientas del servidor por nombre, con timeout por defecto"""
+
+    def __init__(self, tools: Tuple[Tool, ...] = (), timeout: float = DEFAULT_TOOL_TIMEOUT):
+        self.timeout = timeout
+        self.tools: Dict[str, Tool] = {}
+        for tool in tools:
+            self.register(tool)
+
+    def register(self, tool: Tool) -> None:
+        self.tools[tool.name] = tool
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tools
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        return [tool.schema() for tool in self.tools.values()]
+
+    async def execute(self, client: httpx.AsyncClient, call: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ejecuta una tool_call y devuelve su entrada de la traza
+
+        Nunca lanza: errores y timeouts se devuelven al modelo como texto
+        (campo `content`) para que pueda seguir con lo que tenga.
+        """
+        function = call.get("function") or {}
+        name = function.get("name", "")
+        arguments = function.get("arguments") or "{}"
+        tool = self.tools[name]
+        timeout = tool.timeout or self.timeout
+        started = time.perf_counter()
+        try:
+            args = orjson.loads(arguments) if isinstance(arguments, str) else arguments
+            content = await asyncio.wait_for(tool.run(client, args), timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            content = f"Error al ejecutar {name}: sin respuesta en {timeout:g} s"
+            status = "timeout"
+        except Exception as e:
+            content = f"Error al ejecutar {name}: {e}"
+            status = "error"
+        return {
+            "id": call.get("id"),
+            "name": name,
+            "arguments": arguments,
+            "status": status,
+            "seconds": round(time.perf_counter() - started, 4),
+            "content": content,
+        }
+
+
+def format_search_results(query: str, results: List[Dict[str, Any]]) -> str:
+    """Mismo formato que la herramienta de okimi_cli.py"""
+    if not results:
+        return "No se encontraron resultados para esta búsqueda."
+    formatted = f"Resultados de búsqueda para '{query}':\n\n"
+    for i, result in enumerate(results, 1):
+        formatted += f"{i}. {result.get('title', 'Sin título')}\n"
+        formatted += f"   URL: {result.get('url', '')}\n"
+        content = result.get("content", "")
+        if content:
+            preview = content[:200] + "..." if len(content) > 200 else content
+            formatted += f"   Contenido: {preview}\n"
+        formatted += f"   Motor: {result.get('engine', '')}\n\n"
+    return formatted
+
+
+def searxng_tool(base_url: str = DEFAULT_SEARXNG_URL, max_results: int = 5, timeout: Optional[float] = None) -> Tool:
+    """`buscar_informacion` contra una instancia de SearXNG con salida JSON"""
+    url = f"{base_url.rstrip('/')}/search"
+
+    async def search(client: httpx.AsyncClient, arguments: Dict[str, Any]) -> str:
+        query = arguments.get("consulta", "")
+        response = await client.get(url, params={"q": query, "format": "json"})
+        if response.status_code != 200:
+            return f"Error al buscar: HTTP {response.status_code}"
+        return format_search_results(query, response.json().get("results", [])[:max_results])
+
+    return Tool(
+        name="buscar_informacion",
+        description=(
+            "Busca información en internet usando SearXNG (meta-buscador con múltiples motores: "
+            "ArXiv, Google Scholar, GitHub, StackOverflow, Brave, DuckDuckGo)"
+        ),
+        parameters={
+            "type": "object",
+            "properties": {
+                "consulta": {
+                    "type": "string",
+                    "description": "Qué buscar (ej: 'chutes.ai API documentation balance endpoint')",
+                }
+            },
+            "required": ["consulta"],
+        },
+        run=search,
+        timeout=timeout,
+    )
+
+
+def _split_events(buffer: bytes, chunk: bytes) -> Tuple[List[bytes], bytes]:
+    if b"\r" in chunk:
+        chunk = chunk.replace(b"\r\n", b"\n")
+    *events, rest = (buffer + chunk).split(b"\n\n")
+    return events, rest
+
+
+def _visible(event: bytes) -> Optional[bytes]:
+    """El evento tal como lo ve el cliente: sin tool_calls, finish 'tool_calls', usage ni [DONE]"""
+    data = b"".join(line[5:].strip() for line in event.split(b"\n") if line.startswith(b"data:"))
+    if not data or data == b"[DONE]":
+        return None
+    try:
+        chunk = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    changed = False
+    for choice in choices:
+        delta = choice.get("delta") or {}
+        if "tool_calls" in delta:
+            delta.pop("tool_calls")
+            changed = True
+        if choice.get("finish_reason") == "tool_calls":
+            choice["finish_reason"] = None
+            changed = True
+    if not changed:
+        return event + b"\n\n"
+    if not any(choice.get("delta") or choice.get("finish_reason") for choice in choices):
+        return None
+    chunk.pop("usage", None)
+    return encode_event(chunk)
+
+
+class AgentLoop:
+    """
+    Rondas de modelo y herramientas de una petición
+
+    `call_model` hace una ronda (el cuerpo ya lleva stream=True) y devuelve
+    los bytes SSE; así las rondas pasan por el mismo camino que cualquier
+    petición (caché, límites, router, reintentos).
+    """
+
+    def __init__(
+        self,
+        registry: ToolRegistry,
+        call_model: ModelCall,
+        client: httpx.AsyncClient,
+        max_rounds: int = DEFAULT_MAX_ROUNDS,
+        on_round: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.registry = registry
+        self.call_model = call_model
+        self.client = client
+        self.max_rounds = max_rounds
+        self.on_round = on_round
+        self.rounds: List[Dict[str, Any]] = []
+        self.usage: Dict[str, int] = {}
+        self.stopped: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+
+    def trace(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "model_seconds": round(sum(r["model_seconds"] for r in self.rounds), 4),
+            "tool_seconds": round(sum(r["tool_seconds"] for r in self.rounds), 4),
+            "stopped": self.stopped,
+        }
+
+    def _request(self, data: Dict[str, Any], messages: List[Dict[str, Any]], final: bool) -> Dict[str, Any]:
+        request = {**data, "messages": messages, "stream": True}
+        request["stream_options"] = {**(data.get("stream_options") or {}), "include_usage": True}
+        if final:
+            # Sin más rondas: se fuerza la respuesta con lo ya recopilado
+            request.pop("tools", None)
+            request.pop("tool_choice", None)
+            return request
+        declared = {tool.get("function", {}).get("name") for tool in data.get("tools") or []}
+        request["tools"] = list(data.get("tools") or []) + [
+            schema for schema in self.registry.schemas() if schema["function"]["name"] not in declared
+        ]
+        request.setdefault("tool_choice", "auto")
+        return request
+
+    def _add_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        for name, value in (usage or {}).items():
+            if isinstance(value, int):
+                self.usage[name] = self.usage.get(name, 0) + value
+
+    async def _rounds(self, data: Dict[str, Any], forward: bool) -> AsyncIterator[bytes]:
+        messages = list(data["messages"])
+        for number in range(1, self.max_rounds + 2):
+            final = number > self.max_rounds
+            accumulator = CompletionAccumulator()
+            buffer = b""
+            started = time.perf_counter()
+            async for chunk in self.call_model(self._request(data, messages, final)):
+                accumulator.feed(chunk)
+                if forward:
+                    events, buffer = _split_events(buffer, chunk)
+                    for event in events:
+                        visible = _visible(event)
+                        if visible is not None:
+                            yield visible
+            model_seconds = time.perf_counter() - started
+            completion = accumulator.result()
+            self._add_usage(completion.get("usage"))
+            choices = completion.get("choices") or [{}]
+            message = choices[0].get("message") or {}
+            calls = message.get("tool_calls") or []
+            record = {"round": number, "model_seconds": round(model_seconds, 4), "tool_seconds": 0.0, "tool_calls": []}
+            self.rounds.append(record)
+
+            client_calls = [call for call in calls if call["function"]["name"] not in self.registry]
+            if not calls or final or client_calls:
+                if final:
+                    self.stopped = "max_rounds"
+                else:
+                    self.stopped = "client_tools" if calls else "answer"
+                if client_calls and len(client_calls) < len(calls):
+                    # Turno mixto: el cliente solo recibe sus herramientas. Las del
+                    # servidor no se ejecutan (su resultado no volvería en el
+                    # historial del cliente); el modelo las pedirá de nuevo en la
+                    # siguiente petición, ya con los resultados del cliente
+                    record["dropped_tool_calls"] = [
+                        call["function"]["name"] for call in calls if call not in client_calls
+                    ]
+                    completion = _with_tool_calls(completion, client_calls)
+                    calls = client_calls
+                if self.on_round is not None:
+                    self.on_round(record)
+                self.result = completion
+                if forward and calls:
+                    # Herramientas del cliente: el turno se entrega tal cual
+                    yield _tool_call_chunk(completion, calls)
+                return
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(self.registry.execute(self.client, call) for call in calls))
+            record["tool_seconds"] = round(time.perf_counter() - started, 4)
+            messages.append(message)
+            for result in results:
+                messages.append({
+                    "role": "tool", "tool_call_id": result["id"], "name": result["name"], "content": result["content"],
+                })
+                entry = {key: value for key, value in result.items() if key != "content"}
+                entry["result_chars"] = len(result["content"])
+                record["tool_calls"].append(entry)
+            if self.on_round is not None:
+                self.on_round(record)
+
+    async def run(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Hace todas las rondas y devuelve el chat.completion final con la traza"""
+        async for _ in self._rounds(data, forward=False):
+            pass
+        completion = dict(self.result or {})
+        if self.usage:
+            completion["usage"] = self.usage
+        completion["kimi_agent"] = self.trace()
+        return completion
+
+    async def stream(self, data: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """Como run, pero emitiendo el texto de cada ronda según llega (SSE)"""
+        async for event in self._rounds(data, forward=True):
+            yield event
+        result = self.result or {}
+        yield encode_event({
+            "id": result.get("id"),
+            "object": "chat.completion.chunk",
+            "created": result.get("created"),
+            "model": result.get("model"),
+            "choices": [],
+            "usage": self.usage or None,
+            "kimi_agent": self.trace(),
+        })
+        yield DONE_EVENT
+
+
+def _with_tool_calls(completion: Dict[str, Any], calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Copia de la respuesta con solo `calls` en el mensaje de choices[0]"""
+    choice = completion["choices"][0]
+    message = {**choice["message"], "tool_calls": calls}
+    return {**completion, "choices": [{**choice, "message": message}, *completion["choices"][1:]]}
+
+
+def _tool_call_chunk(completion: Dict[str, Any], calls: List[Dict[str, Any]]) -> bytes:
+    return encode_event({
+        "id": completion.get("id"),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created"),
+        "model": completion.get("model"),
+        "choices": [{
+            "index": 0,
+            "delta": {"tool_calls": [{"index": i, **call} for i, call in enumerate(calls)]},
+            "finish_reason": "tool_calls",
+        }],
+    })
@@ -0,0 +1,541 @@
+"""
+Batch API compatible con OpenAI (/v1/files + /v1/batches) y trabajos asíncronos.
+
+Los ficheros JSONL y las salidas viven en disco; el estado de cada lote y de
+cada una de sus peticiones se guarda en SQLite, así un lote interrumpido por
+un reinicio del proxy continúa donde lo dejó. Un BatchRunner en segundo plano
+ejecuta las peticiones pendientes con concurrencia acotada y va añadiendo los
+resultados al JSONL de salida a medida que terminan.
+
+Con varios workers todos abren el mismo almacén, pero solo uno ejecuta: el
+runner que consigue el bloqueo `runner.lock` del directorio. Los demás
+atienden los endpoints y reintentan el bloqueo en cada sondeo, así que si el
+worker que ejecutaba muere otro retoma sus lotes pendientes.
+
+Un "job" es un lote de una sola petición creado sin fichero: sirve para
+peticiones largas que el cliente consulta después en lugar de mantener la
+conexión HTTP abierta minutos.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso, no hace falta bloqueo
+    fcntl = None
+
+from kimi_proxy.cache import DEFAULT_CACHE_DIR
+
+DEFAULT_BATCH_DIR = DEFAULT_CACHE_DIR / "batches"
+
+# Ventanas de finalización aceptadas (como la API de OpenAI)
+COMPLETION_WINDOWS = {"24h": 24 * 3600}
+
+RUNNABLE_STATUSES = ("validating", "in_progress", "cancelling")
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Ejecuta una petición: (url, cuerpo, cabeceras) -> (estado HTTP, cuerpo JSON)
+Executor = Callable[[str, Dict[str, Any], Dict[str, str]], Awaitable[Tuple[int, Any]]]
+
+
+class BatchError(Exception):
+    """Entrada inválida para crear un lote (fichero inexistente, línea mal formada...)"""
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+@dataclass
+class BatchItem:
+    """Una petición de un lote"""
+    line: int
+    custom_id: str
+    url: str
+    body: Dict[str, Any]
+
+
+class BatchStore:
+    """
+    Ficheros, lotes y peticiones persistidos en `directory`
+
+    Las operaciones son síncronas; el proxy las ejecuta en un hilo.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.files_dir = self.directory / "files"
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.directory / "batches.sqlite", timeout=5, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id TEXT PRIMARY KEY, filename TEXT NOT NULL, purpose TEXT NOT NULL,"
+            " created_at INTEGER NOT NULL, path TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, input_file_id TEXT, endpoint TEXT NOT NULL,"
+            " completion_window TEXT NOT NULL, status TEXT NOT NULL, output_file_id TEXT NOT NULL,"
+            " created_at INTEGER NOT NULL, expires_at INTEGER NOT NULL, in_progress_at INTEGER,"
+            " cancelling_at INTEGER, finished_at INTEGER, total INTEGER NOT NULL,"
+            " completed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, metadata TEXT);"
+            "CREATE TABLE IF NOT EXISTS batch_items ("
+            " batch_id TEXT NOT NULL, line INTEGER NOT NULL, custom_id TEXT NOT NULL, url TEXT NOT NULL,"
+            " body BLOB NOT NULL, status TEXT NOT NULL DEFAULT 'pending', result BLOB, finished_at REAL,"
+            " PRIMARY KEY (batch_id, line));"
+        )
+
+    # -- ficheros ---------------------------------------------------------
+
+    def create_file(self, filename: str, content: bytes, purpose: str) -> Dict[str, Any]:
+        file_id = _new_id("file")
+        path = self.files_dir / f"{file_id}.jsonl"
+        path.write_bytes(content)
+        return self._insert_file(file_id, filename, purpose, path)
+
+    def _insert_file(self, file_id: str, filename: str, purpose: str, path: Path) -> Dict[str, Any]:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO files (id, filename, purpose, created_at, path) VALUES (?, ?, ?, ?, ?)",
+                (file_id, filename, purpose, int(time.time()), str(path))
+            )
+        return self.get_file(file_id)
+
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, purpose, created_at, path FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = Path(row[4])
+        return {
+            "id": row[0],
+            "object": "file",
+            "bytes": path.stat().st_size if path.exists() else 0,
+            "created_at": row[3],
+            "filename": row[1],
+            "purpose": row[2],
+        }
+
+    def file_path(self, file_id: str) -> Optional[Path]:
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM files WHERE id = ?", (file_id,)).fetchone()
+        return Path(row[0]) if row else None
+
+    # -- lotes ------------------------------------------------------------
+
+    def create_batch(
+        self,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str = "24h",
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Crea un lote a partir de un JSONL de peticiones {custom_id, method, url, body}
+
+        Raises:
+            BatchError: si el fichero no existe o alguna línea no es válida
+        """
+        path = self.file_path(input_file_id)
+        if path is None:
+            raise BatchError(f"File {input_file_id} not found")
+        items = parse_batch_lines(path.read_bytes(), endpoint)
+        return self._insert_batch("batch", items, endpoint, completion_window, metadata, input_file_id)
+
+    def create_job(self, url: str, body: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Lote de una sola petición, sin fichero de entrada"""
+        item = BatchItem(0, "job", url, body)
+        return self._insert_batch("job", [item], url, "24h", metadata, None)
+
+    def _insert_batch(self, kind, items, endpoint, completion_window, metadata, input_file_id) -> Dict[str, Any]:
+        if completion_window not in COMPLETION_WINDOWS:
+            raise BatchError(f"Unsupported completion_window {completion_window}")
+        if not items:
+            raise BatchError("Batch has no requests")
+        batch_id = _new_id("batch")
+        output_id = _new_id("file")
+        output_path = self.files_dir / f"{output_id}.jsonl"
+        output_path.touch()
+        now = int(time.time())
+        self._insert_file(output_id, f"{batch_id}_output.jsonl", "batch_output", output_path)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO batches (id, kind, input_file_id, endpoint, completion_window, status,"
+                    " output_file_id, created_at, expires_at, total, metadata)"
+                    " VALUES (?, ?, ?, ?, ?, 'validating', ?, ?, ?, ?, ?)",
+                    (batch_id, kind, input_file_id, endpoint, completion_window, output_id, now,
+                     now + COMPLETION_WINDOWS[completion_window], len(items),
+                     orjson.dumps(metadata).decode() if metadata else None)
+                )
+                self._conn.executemany(
+                    "INSERT INTO batch_items (batch_id, line, custom_id, url, body) VALUES (?, ?, ?, ?, ?)",
+                    [(batch_id, i.line, i.custom_id, i.url, orjson.dumps(i.body)) for i in items]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get_batch(batch_id)
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, input_file_id, endpoint, completion_window, status, output_file_id,"
+                " created_at, expires_at, in_progress_at, cancelling_at, finished_at, total, completed,"
+                " failed, metadata FROM batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, finished_at = row[5], row[11]
+        return {
+            "id": row[0],
+            "object": "batch",
+            "kind": row[1],
+            "endpoint": row[3],
+            "errors": None,
+            "input_file_id": row[2],
+            "completion_window": row[4],
+            "status": status,
+            "output_file_id": row[6],
+            "error_file_id": None,
+            "created_at": row[7],
+            "in_progress_at": row[9],
+            "expires_at": row[8],
+            "cancelling_at": row[10],
+            "completed_at": finished_at if status == "completed" else None,
+            "failed_at": finished_at if status == "failed" else None,
+            "expired_at": finished_at if status == "expired" else None,
+            "cancelled_at": finished_at if status == "cancelled" else None,
+            "request_counts": {"total": row[12], "completed": row[13], "failed": row[14]},
+            "metadata": orjson.loads(row[15]) if row[15] else None,
+        }
+
+    def list_batches(self, limit: int = 20, kind: str = "batch") -> List[Dict[str, Any]]:
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM batches WHERE kind = ? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (kind, limit)
+            )]
+        return [self.get_batch(i) for i in ids]
+
+    def runnable_batches(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                f"SELECT id FROM batches WHERE status IN ({','.join('?' * len(RUNNABLE_STATUSES))})"
+                " ORDER BY created_at, rowid", RUNNABLE_STATUSES
+            )]
+
+    def cancelling_batches(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id FROM batches WHERE status = 'cancelling'")]
+
+    def acquire_runner_lock(self):
+        """
+        Bloqueo exclusivo para ejecutar los lotes de este almacén
+
+        Devuelve el fichero abierto que lo mantiene (cerrarlo lo libera) o None
+        si otro proceso lo tiene. El sistema lo libera si el proceso muere.
+        """
+        lock_file = open(self.directory / "runner.lock", "a+b")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def start_batch(self, batch_id: str) -> List[BatchItem]:
+        """
+        Pasa el lote a in_progress y devuelve sus peticiones pendientes
+
+        La salida se reescribe desde la base de datos, así un reinicio a mitad
+        de una escritura no deja líneas duplicadas ni cortadas.
+        """
+        self._rebuild_output(batch_id)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = 'in_progress', in_progress_at = COALESCE(in_progress_at, ?)"
+                " WHERE id = ? AND status = 'validating'", (int(time.time()), batch_id)
+            )
+            rows = self._conn.execute(
+                "SELECT line, custom_id, url, body FROM batch_items"
+                " WHERE batch_id = ? AND status = 'pending' ORDER BY line", (batch_id,)
+            ).fetchall()
+        return [BatchItem(r[0], r[1], r[2], orjson.loads(r[3])) for r in rows]
+
+    def record_result(self, batch_id: str, item: BatchItem, ok: bool, result: Dict[str, Any]) -> None:
+        """Guarda el resultado de una petición y lo añade al JSONL de salida"""
+        line = orjson.dumps(result) + b"\n"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE batch_items SET status = ?, result = ?, finished_at = ?"
+                    " WHERE batch_id = ? AND line = ?",
+                    ("completed" if ok else "failed", line, time.time(), batch_id, item.line)
+                )
+                self._conn.execute(
+                    f"UPDATE batches SET {'completed' if ok else 'failed'} = "
+                    f"{'completed' if ok else 'failed'} + 1 WHERE id = ?", (batch_id,)
+                )
+                output_id = self._conn.execute(
+                    "SELECT output_file_id FROM batches WHERE id = ?", (batch_id,)
+                ).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        with open(self.files_dir / f"{output_id}.jsonl", "ab") as f:
+            f.write(line)
+
+    def _rebuild_output(self, batch_id: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT output_file_id FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            results = [r[0] for r in self._conn.execute(
+                "SELECT result FROM batch_items WHERE batch_id = ? AND result IS NOT NULL"
+                " ORDER BY finished_at", (batch_id,)
+            )]
+        if row is not None:
+            (self.files_dir / f"{row[0]}.jsonl").write_bytes(b"".join(results))
+
+    def item_result(self, batch_id: str, line: int = 0) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM batch_items WHERE batch_id = ? AND line = ?", (batch_id, line)
+            ).fetchone()
+        return orjson.loads(row[0]) if row and row[0] else None
+
+    def request_cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = 'cancelling', cancelling_at = ?"
+                " WHERE id = ? AND status IN ('validating', 'in_progress')", (int(time.time()), batch_id)
+            )
+        return self.get_batch(batch_id)
+
+    def finish_batch(self, batch_id: str) -> str:
+        """Estado final del lote: cancelled, expired, failed (todo falló) o completed"""
+        now = int(time.time())
+        with self._lock:
+            status, expires_at, total, completed, failed = self._conn.execute(
+                "SELECT status, expires_at, total, completed, failed FROM batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+            if status == "cancelling":
+                final = "cancelled"
+            elif completed + failed < total and now >= expires_at:
+                final = "expired"
+            elif failed == total:
+                final = "failed"
+            else:
+                final = "completed"
+            self._conn.execute(
+                "UPDATE batches SET status = ?, finished_at = ? WHERE id = ?", (final, now, batch_id)
+            )
+        return final
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def parse_batch_lines(content: bytes, endpoint: str) -> List[BatchItem]:
+    """
+    Valida un JSONL de entrada
+
+    Raises:
+        BatchError: con el número de línea de la primera entrada inválida
+    """
+    items = []
+    seen = set()
+    for number, raw in enumerate(content.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            entry = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            raise BatchError(f"Line {number}: invalid JSON ({e})")
+        if not isinstance(entry, dict) or not isinstance(entry.get("body"), dict):
+            raise BatchError(f"Line {number}: expected an object with a 'body' object")
+        url = entry.get("url", endpoint)
+        if url != endpoint:
+            raise BatchError(f"Line {number}: url {url} does not match batch endpoint {endpoint}")
+        custom_id = str(entry.get("custom_id", number))
+        if custom_id in seen:
+            raise BatchError(f"Line {number}: duplicate custom_id {custom_id}")
+        seen.add(custom_id)
+        items.append(BatchItem(len(items), custom_id, url, entry["body"]))
+    return items
+
+
+def result_line(item: BatchItem, status_code: Optional[int], body: Any, error: Optional[str] = None) -> Dict[str, Any]:
+    """Línea del JSONL de salida en el formato de la Batch API de OpenAI"""
+    return {
+        "id": _new_id("batch_req"),
+        "custom_id": item.custom_id,
+        "response": None if status_code is None else {
+            "status_code": status_code,
+            "request_id": _new_id("req"),
+            "body": body,
+        },
+        "error": None if error is None else {"code": "proxy_error", "message": error},
+    }
+
+
+class BatchRunner:
+    """Ejecuta en segundo plano los lotes pendientes con concurrencia acotada"""
+
+    def __init__(
+        self,
+        store: BatchStore,
+        execute: Executor,
+        concurrency: int = 8,
+        poll_interval: float = 5.0,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.store = store
+        self.execute = execute
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        # Cabeceras de cada petición interna (prioridad batch por defecto)
+        self.headers = headers if headers is not None else {"X-Kimi-Priority": "batch"}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelling: set = set()
+        self._progress_events: Dict[str, asyncio.Event] = {}
+        # Fichero con el bloqueo de runner.lock mientras este runner es el que ejecuta
+        self._runner_lock = None
+
+    def start(self) -> None:
+        """Arranca el bucle en segundo plano (retoma lo que quedó pendiente)"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Detiene la ejecución; lo que estaba en curso queda pendiente para el próximo arranque"""
+        tasks = [t for t in [self._task, *self._running.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._runner_lock is not None:
+            self._runner_lock.close()
+            self._runner_lock = None
+
+    def notify(self) -> None:
+        """Hay lotes nuevos: no esperar al siguiente sondeo"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = await asyncio.to_thread(self.store.request_cancel, batch_id)
+        if batch is not None and batch["status"] == "cancelling":
+            self._cancelling.add(batch_id)
+            self.notify()
+        self._changed(batch_id)
+        return batch
+
+    @property
+    def active(self) -> bool:
+        """Si este runner tiene el bloqueo y ejecuta los lotes"""
+        return self._runner_lock is not None
+
+    async def _loop(self) -> None:
+        while True:
+            if self._runner_lock is None:
+                self._runner_lock = await asyncio.to_thread(self.store.acquire_runner_lock)
+            if self._runner_lock is not None:
+                await self._poll()
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self) -> None:
+        # Las cancelaciones pueden llegar por otro worker: solo quedan en la base de datos
+        for batch_id in await asyncio.to_thread(self.store.cancelling_batches):
+            if batch_id in self._running:
+                self._cancelling.add(batch_id)
+        for batch_id in await asyncio.to_thread(self.store.runnable_batches):
+            if batch_id not in self._running:
+                self._running[batch_id] = asyncio.create_task(self.run_batch(batch_id))
+
+    async def run_batch(self, batch_id: str) -> str:
+        """Ejecuta las peticiones pendientes de un lote y lo da por terminado"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            batch = await asyncio.to_thread(self.store.get_batch, batch_id)
+            if batch["status"] == "cancelling":
+                self._cancelling.add(batch_id)
+            items = await asyncio.to_thread(self.store.start_batch, batch_id)
+            self._changed(batch_id)
+            expires_at = batch["expires_at"]
+            await asyncio.gather(*[self._run_item(batch_id, item, expires_at) for item in items])
+            status = await asyncio.to_thread(self.store.finish_batch, batch_id)
+            self._changed(batch_id)
+            return status
+        finally:
+            self._running.pop(batch_id, None)
+            self._cancelling.discard(batch_id)
+
+    async def _run_item(self, batch_id: str, item: BatchItem, expires_at: int) -> None:
+        async with self._semaphore:
+            if batch_id in self._cancelling or time.time() >= expires_at:
+                return
+            try:
+                status_code, body = await self.execute(item.url, item.body, self.headers)
+                ok = status_code < 400
+                result = result_line(item, status_code, body)
+            except Exception as e:
+                ok = False
+                result = result_line(item, None, None, f"{type(e).__name__}: {e}")
+            await asyncio.to_thread(self.store.record_result, batch_id, item, ok, result)
+            self._changed(batch_id)
+
+    def _changed(self, batch_id: str) -> None:
+        # Despierta a quienes siguen el progreso; el siguiente cambio usa un Event nuevo
+        event = self._progress_events.pop(batch_id, None)
+        if event is not None:
+            event.set()
+
+    async def watch(self, batch_id: str, heartbeat: float = 15.0) -> AsyncIterator[Dict[str, Any]]:
+        """Estado del lote cada vez que cambia, hasta que termina"""
+        while True:
+            event = self._progress_events.setdefault(batch_id, asyncio.Event())
+            batch = await asyncio.to_thread(self.store.get_batch, batch_id)
+            if batch is None:
+                return
+            yield batch
+            if batch["status"] in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                pass
+
+
+def open_batch_store(directory: Optional[str] = None) -> BatchStore:
+    """Abre el almacén de lotes en KIMI_BATCH_DIR (por defecto junto a la caché)"""
+    return BatchStore(Path(directory or os.getenv("KIMI_BATCH_DIR") or DEFAULT_BATCH_DIR).expanduser())
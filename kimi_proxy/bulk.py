@@ -0,0 +1,88 @@
+"""
+Peticiones en bloque: muchas completions pequeñas en una sola llamada HTTP.
+
+El cuerpo es NDJSON (una petición por línea). Cada línea se ejecuta como una
+petición independiente con concurrencia acotada y su resultado se devuelve en
+cuanto termina, también como una línea NDJSON etiquetada con su índice: una
+petición lenta no retrasa a las rápidas y un error solo afecta a su línea.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import orjson
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Ejecuta una petición del bloque: cuerpo -> (estado HTTP, cuerpo JSON ya serializado)
+Runner = Callable[[Any], Awaitable[Tuple[int, bytes]]]
+
+
+class BulkError(Exception):
+    """Cuerpo NDJSON que no se puede procesar en conjunto (p.ej. demasiadas líneas)"""
+
+
+def parse_ndjson(content: bytes, max_items: Optional[int] = None) -> List[Any]:
+    """
+    Separa el cuerpo en peticiones; las líneas vacías se ignoran
+
+    Una línea con JSON inválido no aborta el bloque: se devuelve como
+    excepción en su posición y acaba como error en la salida.
+
+    Raises:
+        BulkError: si hay más de `max_items` peticiones
+    """
+    items: List[Any] = []
+    for raw in content.splitlines():
+        if not raw.strip():
+            continue
+        if max_items is not None and len(items) >= max_items:
+            raise BulkError(f"Too many requests in bulk body (max {max_items})")
+        try:
+            items.append(orjson.loads(raw))
+        except orjson.JSONDecodeError as e:
+            items.append(ValueError(f"Invalid JSON: {e}"))
+    return items
+
+
+def result_line(index: int, status_code: int, body: bytes) -> bytes:
+    """Línea de salida; el cuerpo ya serializado se incrusta sin volver a parsearlo"""
+    return b'{"index":%d,"status_code":%d,"body":%s}\n' % (index, status_code, body)
+
+
+def error_line(index: int, status_code: int, message: str) -> bytes:
+    return orjson.dumps({
+        "index": index,
+        "status_code": status_code,
+        "error": {"message": message},
+    }) + b"\n"
+
+
+async def fan_out(items: List[Any], run: Runner, concurrency: int = 16) -> AsyncIterator[bytes]:
+    """
+    Ejecuta las peticiones y emite sus líneas NDJSON en orden de finalización
+
+    Si el consumidor deja de iterar (el cliente se desconectó), las peticiones
+    que quedan en curso se cancelan.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int, item: Any) -> bytes:
+        if isinstance(item, Exception):
+            return error_line(index, 400, str(item))
+        async with semaphore:
+            try:
+                status_code, body = await run(item)
+            except Exception as e:
+                return error_line(index, 500, f"{type(e).__name__}: {e}")
+        return result_line(index, status_code, body)
+
+    tasks = [asyncio.ensure_future(one(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        pending = [t for t in tasks if not t.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
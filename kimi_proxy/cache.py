@@ -0,0 +1,248 @@
+"""
+Caché de respuestas en dos niveles para /v1/chat/completions.
+
+1. MemoryLRU: LRU en proceso, acotado por bytes.
+2. DiskCache: SQLite en disco (modo WAL), compartido entre todos los workers
+   de uvicorn y los CLIs, con TTL y expulsión por tamaño (LRU por último acceso).
+
+Solo se cachean peticiones deterministas: temperature 0, o con opt-in
+explícito del cliente (cabecera X-Kimi-Cache: on).
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+import xxhash
+
+# Campos del payload que no cambian la respuesta; todo lo demás entra en la clave
+IGNORED_FIELDS = ("stream", "stream_options", "user")
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "kimi-k2"
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """
+    Hash canónico (claves ordenadas) del payload sin IGNORED_FIELDS
+
+    extra_body se mezcla en el primer nivel igual que hacen el SDK de OpenAI y
+    ChatBody, así la clave del CLI coincide con la del proxy.
+    """
+    canonical = dict(payload)
+    extra = canonical.pop("extra_body", None)
+    if isinstance(extra, dict):
+        canonical.update(extra)
+    for field in IGNORED_FIELDS:
+        canonical.pop(field, None)
+    return xxhash.xxh3_128_hexdigest(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS))
+
+
+def is_cacheable(payload: Dict[str, Any], opt_in: bool = False) -> bool:
+    """Una petición es cacheable si es determinista o el cliente lo pidió"""
+    if payload.get("n", 1) != 1:
+        return False
+    return opt_in or payload.get("temperature") == 0
+
+
+class MemoryLRU:
+    """LRU en memoria acotado por el tamaño total de los valores en bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + ttl, value)
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.bytes -= len(value)
+
+
+class DiskCache:
+    """
+    Caché en SQLite compartida entre procesos
+
+    Todas las operaciones son síncronas (rápidas, del orden de 100 µs); el
+    proxy las ejecuta en un hilo para no bloquear el event loop y los CLIs
+    las llaman directamente.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, ttl: float):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, expires, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now + self.ttl, now)
+                )
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float) -> None:
+        """Borra expirados y, si se supera max_bytes, los de acceso más antiguo"""
+        self._conn.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_disk_cache(
+    cache_dir: Optional[str] = None,
+    max_mb: Optional[float] = None,
+    ttl: Optional[float] = None,
+) -> DiskCache:
+    """Abre la caché en disco compartida con la configuración de entorno"""
+    directory = Path(cache_dir or os.getenv("KIMI_CACHE_DIR") or DEFAULT_CACHE_DIR)
+    max_mb = max_mb if max_mb is not None else float(os.getenv("KIMI_CACHE_DISK_MB", "1024"))
+    ttl = ttl if ttl is not None else float(os.getenv("KIMI_CACHE_TTL", "86400"))
+    return DiskCache(directory / "responses.sqlite", int(max_mb * 1024 * 1024), ttl)
+
+
+@dataclass
+class CacheStats:
+    """Contadores de la caché de respuestas"""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    bytes_served: int = 0
+    bytes_stored: int = 0
+
+
+class ResponseCache:
+    """Caché en dos niveles: MemoryLRU delante de DiskCache (opcional)"""
+
+    def __init__(self, memory: MemoryLRU, disk: Optional[DiskCache] = None, ttl: float = 86400):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = disk.ttl if disk is not None else ttl
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Tuple[Optional[bytes], str]:
+        """Devuelve (valor, nivel) con nivel 'memory', 'disk' o 'miss'"""
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats.memory_hits += 1
+            self.stats.bytes_served += len(value)
+            return value, "memory"
+
+        if self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.memory.put(key, value, self.ttl)
+                self.stats.disk_hits += 1
+                self.stats.bytes_served += len(value)
+                return value, "disk"
+
+        self.stats.misses += 1
+        return None, "miss"
+
+    async def put(self, key: str, value: bytes) -> None:
+        self.memory.put(key, value, self.ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, value)
+        self.stats.stores += 1
+        self.stats.bytes_stored += len(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado actual serializable a JSON"""
+        lookups = self.stats.memory_hits + self.stats.disk_hits + self.stats.misses
+        hits = self.stats.memory_hits + self.stats.disk_hits
+        return {
+            "memory_hits": self.stats.memory_hits,
+            "disk_hits": self.stats.disk_hits,
+            "misses": self.stats.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stats.stores,
+            "bytes_served": self.stats.bytes_served,
+            "bytes_stored": self.stats.bytes_stored,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "disk_path": str(self.disk.path) if self.disk is not None else None,
+            "disk_max_bytes": self.disk.max_bytes if self.disk is not None else None,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
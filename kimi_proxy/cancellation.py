@@ -0,0 +1,95 @@
+"""
+Detección de desconexión del cliente y cancelación de la petición upstream.
+
+Si el cliente se va (Ctrl+C en el CLI, timeout del lado cliente...) no tiene
+sentido seguir generando tokens que nadie va a leer: se corta la conexión
+upstream y se registra una estimación de los tokens ahorrados.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de recibir la respuesta"""
+
+
+async def wait_for_disconnect(receive: Receive) -> None:
+    """
+    Espera hasta recibir el mensaje ASGI `http.disconnect`
+
+    Debe usarse cuando el cuerpo de la petición ya fue leído: a partir de ahí
+    el único mensaje que puede llegar es la desconexión.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def call_until_disconnect(awaitable: Awaitable[Any], receive: Receive) -> Any:
+    """
+    Ejecuta `awaitable` y lo cancela si el cliente se desconecta antes
+
+    Raises:
+        ClientDisconnected: si el cliente se fue antes de que terminara
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # Esperar a que la cancelación cierre la conexión upstream
+            await asyncio.gather(task, return_exceptions=True)
+
+    if task.cancelled():
+        raise ClientDisconnected()
+    return task.result()
+
+
+@dataclass
+class CancellationStats:
+    """Contadores de peticiones canceladas por desconexión del cliente"""
+    cancelled_streams: int = 0
+    cancelled_requests: int = 0
+    tokens_saved: int = 0
+    recent: Deque[Dict[str, Any]] = field(default_factory=lambda: deque(maxlen=50))
+
+    def record(self, stream: bool, max_tokens: Optional[int], tokens_emitted: int = 0) -> int:
+        """
+        Registra una cancelación y devuelve los tokens ahorrados estimados
+
+        La estimación es max_tokens menos lo ya emitido, es decir, una cota
+        superior: el modelo podría haber terminado antes de max_tokens.
+        """
+        saved = max(0, (max_tokens or 0) - tokens_emitted)
+        if stream:
+            self.cancelled_streams += 1
+        else:
+            self.cancelled_requests += 1
+        self.tokens_saved += saved
+        self.recent.append({
+            "timestamp": time.time(),
+            "stream": stream,
+            "max_tokens": max_tokens,
+            "tokens_emitted": tokens_emitted,
+            "tokens_saved": saved,
+        })
+        return saved
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado actual serializable a JSON"""
+        return {
+            "cancelled_streams": self.cancelled_streams,
+            "cancelled_requests": self.cancelled_requests,
+            "tokens_saved": self.tokens_saved,
+            "recent": list(self.recent),
+        }
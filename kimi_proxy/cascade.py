@@ -0,0 +1,516 @@
+"""
+Enrutado en cascada: primero el nivel más barato, escalar solo si duda.
+
+Los niveles se definen en la sección `cascade` de models.yaml, del más
+barato al más caro (por defecto: Qwen3-Coder local por Ollama, Kimi K2 y
+Kimi K2 en Heavy Mode). Cada petición va al primer nivel y se puntúa la
+confianza de su respuesta con señales baratas:
+
+- consistencia: con `samples: 2` se piden dos muestras cortas en paralelo
+  y se compara su respuesta final (o su texto, si no hay una marcada);
+- extracción: en los niveles con `instruct`, que piden la respuesta final,
+  si se reconoce (\\boxed{...} o "Respuesta final: ...", ver kimi_proxy/heavy.py);
+- completa: que no esté vacía ni cortada por max_tokens;
+- negativa: frases de rechazo o de no saber ("no puedo", "I can't"...)
+  dejan la confianza en 0.
+
+Si la confianza no llega al umbral, la petición pasa al siguiente nivel; el
+último nivel responde siempre. Un nivel en Heavy Mode usa HeavyEngine y su
+confianza es la proporción de votos de la respuesta ganadora.
+
+El coste de cada nivel sale de su `price` (USD por millón de tokens) y se
+compara con lo que habría costado mandar la respuesta al nivel `baseline`
+(Kimi K2 normal por defecto). CascadeStats acumula, por nivel, la tasa de
+aciertos (peticiones que ese nivel respondió entre las que le llegaron), la
+latencia y el coste.
+
+Como en kimi_proxy/heavy.py, el transporte lo pone quien llama: el proxy
+pasa cada llamada por su camino de peticiones; `router_stream` las manda al
+proveedor que elige el router de models.yaml (CLIs).
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import yaml
+
+from kimi_proxy.heavy import (
+    DEFAULT_TRAJECTORIES, HEAVY_FIELDS, HeavyEngine, StreamFactory, extract_answer, normalize_answer,
+    stream_post, with_answer_instruction
+)
+from kimi_proxy.router import DEFAULT_CONFIG_PATH, Router, load_router
+from kimi_proxy.sse import CompletionAccumulator
+
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+# Temperatura de las muestras de consistencia si la petición no trae (o trae 0)
+SAMPLE_TEMPERATURE = 0.7
+
+# Peso de cada señal en la confianza (las que no se midan no cuentan)
+SIGNAL_WEIGHTS = {"consistency": 0.6, "extracted": 0.2, "complete": 0.2}
+
+# Rechazos y dudas explícitas: confianza 0 aunque las muestras coincidan
+_REFUSAL = re.compile(
+    r"\b(no puedo|no es posible|no tengo (?:acceso|información)|no estoy seguro|no lo sé|"
+    r"i can(?:no|')t|i am unable|i'm unable|i'm not sure|i am not sure|i don't know|as an ai)\b",
+    re.IGNORECASE
+)
+
+# Solo se mira el comienzo y el final: un "no puedo" en mitad de un razonamiento no es un rechazo
+REFUSAL_WINDOW = 400
+
+
+@dataclass
+class Tier:
+    """Un nivel de la cascada: modelo, cómo se muestrea y su precio"""
+
+    name: str
+    model: str
+    samples: int = 1
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    instruct: bool = False
+    heavy: bool = False
+    trajectories: int = DEFAULT_TRAJECTORIES
+    min_confidence: Optional[float] = None
+    price_input: float = 0.0
+    price_output: float = 0.0
+
+    def cost(self, usage: Optional[Dict[str, Any]]) -> float:
+        """USD de un uso de tokens a los precios del nivel"""
+        usage = usage or {}
+        return ((usage.get("prompt_tokens") or 0) * self.price_input
+                + (usage.get("completion_tokens") or 0) * self.price_output) / 1_000_000
+
+
+@dataclass
+class CascadeConfig:
+    tiers: List[Tier]
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE
+    baseline: Optional[str] = None
+
+    @property
+    def baseline_tier(self) -> Optional[Tier]:
+        return next((t for t in self.tiers if t.name == self.baseline), None)
+
+
+@dataclass
+class Attempt:
+    """Lo que hizo un nivel con la petición"""
+
+    tier: Tier
+    status: str = "error"  # accepted, escalated, fallback o error
+    confidence: Optional[float] = None
+    signals: Dict[str, float] = field(default_factory=dict)
+    completion: Optional[Dict[str, Any]] = None
+    answer_usage: Optional[Dict[str, Any]] = None
+    usage: Dict[str, int] = field(default_factory=dict)
+    seconds: float = 0.0
+    error: Optional[str] = None
+    exception: Optional[BaseException] = field(default=None, repr=False)
+    heavy: Optional[Dict[str, Any]] = None
+
+    @property
+    def cost(self) -> float:
+        return self.tier.cost(self.usage)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tier": self.tier.name,
+            "model": self.tier.model,
+            "status": self.status,
+            "confidence": round(self.confidence, 4) if self.confidence is not None else None,
+            "signals": {k: round(v, 4) for k, v in self.signals.items()},
+            "seconds": round(self.seconds, 4),
+            "usage": self.usage,
+            "cost_usd": round(self.cost, 6),
+            "error": self.error,
+            "heavy": self.heavy,
+        }
+
+
+@dataclass
+class CascadeResult:
+    attempts: List[Attempt]
+    elapsed: float
+    baseline: Optional[Tier] = None
+
+    @property
+    def answered(self) -> Optional[Attempt]:
+        return next((a for a in self.attempts if a.status in ("accepted", "fallback")), None)
+
+    @property
+    def completion(self) -> Optional[Dict[str, Any]]:
+        """La respuesta del nivel que contestó, con el uso sumado de todos los niveles"""
+        answered = self.answered
+        if answered is None:
+            return None
+        completion = dict(answered.completion)
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        for attempt in self.attempts:
+            for key in usage:
+                usage[key] += attempt.usage.get(key, 0)
+        completion["usage"] = {**usage, "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}
+        return completion
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """La excepción del último nivel que falló (para propagarla si nadie respondió)"""
+        return next((a.exception for a in reversed(self.attempts) if a.exception is not None), None)
+
+    @property
+    def cost(self) -> float:
+        return sum(a.cost for a in self.attempts)
+
+    @property
+    def baseline_cost(self) -> Optional[float]:
+        """Lo que habría costado la respuesta en el nivel `baseline`, con sus mismos tokens"""
+        answered = self.answered
+        if self.baseline is None or answered is None:
+            return None
+        return self.baseline.cost(answered.answer_usage)
+
+    def summary(self) -> Dict[str, Any]:
+        """Resumen para `kimi_cascade`"""
+        answered = self.answered
+        baseline_cost = self.baseline_cost
+        return {
+            "tier": answered.tier.name if answered is not None else None,
+            "attempts": [a.to_dict() for a in self.attempts],
+            "elapsed": round(self.elapsed, 4),
+            "cost_usd": round(self.cost, 6),
+            "baseline": self.baseline.name if self.baseline is not None else None,
+            "baseline_cost_usd": round(baseline_cost, 6) if baseline_cost is not None else None,
+            "cost_saved_usd": round(baseline_cost - self.cost, 6) if baseline_cost is not None else None,
+        }
+
+
+def answer_key(completion: Dict[str, Any]) -> Tuple[str, bool]:
+    """(lo que se compara entre muestras, si hay una respuesta final reconocible)"""
+    message = completion["choices"][0]["message"]
+    if message.get("tool_calls"):
+        calls = sorted(
+            (call["function"]["name"], call["function"].get("arguments") or "") for call in message["tool_calls"]
+        )
+        return "tool_calls:" + repr(calls), True
+    text = message.get("content") or ""
+    answer = extract_answer(text, strict=True)
+    if answer is not None:
+        return normalize_answer(answer), True
+    return normalize_answer(text), False
+
+
+def is_refusal(text: str) -> bool:
+    """Si la respuesta empieza o acaba negándose o diciendo que no sabe"""
+    return bool(_REFUSAL.search(text[:REFUSAL_WINDOW]) or _REFUSAL.search(text[-REFUSAL_WINDOW:]))
+
+
+def score_confidence(
+    completions: List[Dict[str, Any]], expect_answer: bool = True
+) -> Tuple[float, Dict[str, float]]:
+    """
+    Confianza (0-1) en la primera de `completions` y las señales medidas
+
+    Media ponderada (SIGNAL_WEIGHTS) de consistencia entre muestras,
+    extracción (solo con `expect_answer`, si se pidió la respuesta final) y
+    respuesta completa; un rechazo la deja en 0.
+    """
+    first = completions[0]["choices"][0]
+    text = first["message"].get("content") or ""
+    if not text.strip() and not first["message"].get("tool_calls"):
+        return 0.0, {"complete": 0.0}
+
+    keys = [answer_key(c) for c in completions]
+    signals = {"complete": 0.0 if first.get("finish_reason") == "length" else 1.0}
+    if expect_answer:
+        signals["extracted"] = 1.0 if keys[0][1] else 0.0
+    if len(completions) > 1:
+        signals["consistency"] = min(
+            1.0 if key == keys[0][0] else SequenceMatcher(None, keys[0][0], key).ratio()
+            for key, _ in keys[1:]
+        )
+    if is_refusal(text):
+        signals["refusal"] = 1.0
+        return 0.0, signals
+
+    weight = sum(SIGNAL_WEIGHTS[name] for name in signals if name in SIGNAL_WEIGHTS)
+    score = sum(SIGNAL_WEIGHTS[name] * value for name, value in signals.items() if name in SIGNAL_WEIGHTS)
+    return score / weight, signals
+
+
+async def collect(open_stream: StreamFactory, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Consume un stream de chat y devuelve el chat.completion equivalente"""
+    accumulator = CompletionAccumulator()
+    stream = open_stream(payload)
+    try:
+        async for chunk in stream:
+            accumulator.feed(chunk)
+    finally:
+        await stream.aclose()
+    if not accumulator.complete or not accumulator.choices:
+        raise RuntimeError("Stream ended before the completion finished")
+    return accumulator.result()
+
+
+def _add_usage(total: Dict[str, int], usage: Optional[Dict[str, Any]]) -> None:
+    for key in ("prompt_tokens", "completion_tokens"):
+        total[key] = total.get(key, 0) + ((usage or {}).get(key) or 0)
+
+
+class Cascade:
+    """
+    Recorre los niveles de `config` hasta que uno responde con confianza
+
+    `on_attempt(attempt)` se llama al terminar cada nivel.
+    """
+
+    def __init__(
+        self,
+        config: CascadeConfig,
+        open_stream: StreamFactory,
+        on_attempt: Optional[Callable[[Attempt], None]] = None
+    ):
+        self.config = config
+        self.open_stream = open_stream
+        self.on_attempt = on_attempt
+
+    def payload(self, tier: Tier, data: Dict[str, Any], seed: Optional[int] = None) -> Dict[str, Any]:
+        """Petición para un nivel: su modelo, en streaming y con su límite de tokens"""
+        payload = {k: v for k, v in data.items() if k not in HEAVY_FIELDS + ("extra_body", "n")}
+        extra = data.get("extra_body")
+        if isinstance(extra, dict):
+            payload.update({k: v for k, v in extra.items() if k not in HEAVY_FIELDS})
+        payload.update(model=tier.model, stream=True, stream_options={"include_usage": True})
+        if tier.max_tokens:
+            payload["max_tokens"] = min(payload.get("max_tokens") or tier.max_tokens, tier.max_tokens)
+        if tier.samples > 1:
+            # Muestras iguales no dicen nada: hace falta temperatura y seeds distintas
+            payload["seed"] = seed
+            payload["temperature"] = tier.temperature or payload.get("temperature") or SAMPLE_TEMPERATURE
+        elif tier.temperature is not None:
+            payload["temperature"] = tier.temperature
+        if tier.instruct:
+            payload["messages"] = with_answer_instruction(payload["messages"])
+        return payload
+
+    async def run(self, data: Dict[str, Any]) -> CascadeResult:
+        started = time.perf_counter()
+        attempts: List[Attempt] = []
+        for position, tier in enumerate(self.config.tiers):
+            attempt = await self._attempt(tier, data)
+            attempts.append(attempt)
+            if attempt.completion is not None:
+                threshold = tier.min_confidence if tier.min_confidence is not None else self.config.min_confidence
+                last = position == len(self.config.tiers) - 1
+                attempt.status = "accepted" if last or attempt.confidence >= threshold else "escalated"
+            if self.on_attempt is not None:
+                self.on_attempt(attempt)
+            if attempt.status == "accepted":
+                break
+        else:
+            # Falló el último nivel: mejor la respuesta dudosa más fiable que ninguna
+            escalated = [a for a in attempts if a.status == "escalated"]
+            if escalated:
+                max(escalated, key=lambda a: a.confidence).status = "fallback"
+        return CascadeResult(attempts, time.perf_counter() - started, self.config.baseline_tier)
+
+    async def _attempt(self, tier: Tier, data: Dict[str, Any]) -> Attempt:
+        attempt = Attempt(tier)
+        started = time.perf_counter()
+        try:
+            if tier.heavy:
+                await self._heavy(attempt, data)
+            else:
+                await self._sample(attempt, data)
+        except Exception as e:
+            attempt.error = str(e) or type(e).__name__
+            attempt.exception = e
+        finally:
+            attempt.seconds = time.perf_counter() - started
+        return attempt
+
+    async def _sample(self, attempt: Attempt, data: Dict[str, Any]) -> None:
+        tier = attempt.tier
+        base_seed = data.get("seed") if isinstance(data.get("seed"), int) else 0
+        results = await asyncio.gather(
+            *(collect(self.open_stream, self.payload(tier, data, base_seed + i)) for i in range(tier.samples)),
+            return_exceptions=True
+        )
+        completions = [r for r in results if isinstance(r, dict)]
+        for result in results:
+            if isinstance(result, dict):
+                _add_usage(attempt.usage, result.get("usage"))
+        if not completions:
+            raise next(r for r in results if isinstance(r, BaseException))
+        if len(completions) < tier.samples:
+            # Sin todas las muestras no hay consistencia que medir
+            attempt.signals["missing_samples"] = float(tier.samples - len(completions))
+            attempt.confidence = 0.0
+        else:
+            attempt.confidence, attempt.signals = score_confidence(completions, expect_answer=tier.instruct)
+        attempt.completion = completions[0]
+        attempt.answer_usage = completions[0].get("usage")
+
+    async def _heavy(self, attempt: Attempt, data: Dict[str, Any]) -> None:
+        tier = attempt.tier
+        engine = HeavyEngine(self.open_stream, trajectories=tier.trajectories)
+        result = await engine.run(self.payload(tier, data))
+        summary = result.summary(content=False)
+        attempt.heavy = {k: summary[k] for k in ("votes", "completed", "cancelled", "failed", "stopped_early")}
+        _add_usage(attempt.usage, result.usage())
+        if result.chosen is None:
+            raise result.error or RuntimeError("All heavy mode trajectories failed")
+        share = summary["votes"].get(result.chosen.vote, 0) / max(1, summary["completed"])
+        attempt.confidence, attempt.signals = share, {"votes": share}
+        attempt.completion = result.completion()
+        attempt.answer_usage = result.chosen.usage
+
+
+@dataclass
+class TierStats:
+    attempts: int = 0
+    answered: int = 0
+    escalated: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    cost: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "answered": self.answered,
+            "escalated": self.escalated,
+            "errors": self.errors,
+            "hit_rate": round(self.answered / self.attempts, 4) if self.attempts else None,
+            "mean_seconds": round(self.seconds / self.attempts, 4) if self.attempts else None,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class CascadeStats:
+    """Acumulado por nivel: tasa de aciertos, latencia y coste frente al baseline"""
+
+    def __init__(self):
+        self.requests = 0
+        self.unanswered = 0
+        self.cost = 0.0
+        self.baseline_cost = 0.0
+        self.tiers: Dict[str, TierStats] = {}
+
+    def record(self, summary: Dict[str, Any]) -> None:
+        """Una petición en cascada (CascadeResult.summary)"""
+        self.requests += 1
+        self.unanswered += summary["tier"] is None
+        self.cost += summary["cost_usd"]
+        self.baseline_cost += summary["baseline_cost_usd"] or 0.0
+        for attempt in summary["attempts"]:
+            stats = self.tiers.setdefault(attempt["tier"], TierStats())
+            stats.attempts += 1
+            stats.answered += attempt["status"] in ("accepted", "fallback")
+            stats.escalated += attempt["status"] == "escalated"
+            stats.errors += attempt["status"] == "error"
+            stats.seconds += attempt["seconds"]
+            stats.cost += attempt["cost_usd"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "unanswered": self.unanswered,
+            "cost_usd": round(self.cost, 6),
+            "baseline_cost_usd": round(self.baseline_cost, 6),
+            "cost_saved_usd": round(self.baseline_cost - self.cost, 6),
+            "tiers": {name: stats.snapshot() for name, stats in self.tiers.items()},
+        }
+
+
+def load_cascade(config_path: Optional[Path] = None) -> Optional[CascadeConfig]:
+    """
+    Niveles de la sección `cascade` de models.yaml (None si no hay)
+
+    Raises:
+        ValueError: si un nivel no tiene modelo, un nivel que no es el último
+            no mide ninguna señal de confianza real o el baseline no existe
+    """
+    with open(Path(config_path or DEFAULT_CONFIG_PATH)) as f:
+        section = (yaml.safe_load(f) or {}).get("cascade")
+    if not section:
+        return None
+
+    tiers = []
+    for spec in section.get("tiers") or []:
+        if not spec.get("model"):
+            raise ValueError(f"Nivel de cascada {spec.get('name')!r} sin model")
+        price = spec.get("price") or {}
+        tiers.append(Tier(
+            name=spec.get("name") or spec["model"],
+            model=spec["model"],
+            samples=max(1, int(spec.get("samples", 1))),
+            max_tokens=spec.get("max_tokens"),
+            temperature=spec.get("temperature"),
+            instruct=bool(spec.get("instruct", False)),
+            heavy=bool(spec.get("heavy", False)),
+            trajectories=int(spec.get("trajectories", DEFAULT_TRAJECTORIES)),
+            min_confidence=spec.get("min_confidence"),
+            price_input=float(price.get("input", 0.0)),
+            price_output=float(price.get("output", 0.0)),
+        ))
+    if not tiers:
+        raise ValueError("La sección cascade no tiene niveles")
+    for tier in tiers[:-1]:
+        # Con una muestra y sin respuesta final pedida solo queda "completa": aceptaría casi todo
+        if tier.samples < 2 and not tier.instruct and not tier.heavy:
+            raise ValueError(
+                f"Nivel de cascada {tier.name!r} sin señal de confianza: usa samples >= 2, instruct o heavy"
+            )
+    config = CascadeConfig(
+        tiers=tiers,
+        min_confidence=float(section.get("min_confidence", DEFAULT_MIN_CONFIDENCE)),
+        baseline=section.get("baseline"),
+    )
+    if config.baseline is not None and config.baseline_tier is None:
+        raise ValueError(f"Baseline de cascada desconocido: {config.baseline!r}")
+    return config
+
+
+def router_stream(client: httpx.AsyncClient, router: Router) -> StreamFactory:
+    """`open_stream` que manda cada petición al proveedor que elige el router"""
+    # Los proveedores de texto crudo necesitan la traducción del proxy
+    raw = [p.name for p in router.providers.values() if p.api != "chat"]
+
+    def open_stream(payload: Dict[str, Any]):
+        provider, upstream = router.choose(payload["model"], exclude=raw)
+        return stream_post(
+            client, provider.url("/chat/completions"), {**payload, "model": upstream}, provider.request_headers()
+        )
+
+    return open_stream
+
+
+def run_cascade(
+    data: Dict[str, Any],
+    config_path: Optional[Path] = None,
+    timeout: float = 600,
+    on_attempt: Optional[Callable[[Attempt], None]] = None
+) -> CascadeResult:
+    """
+    Cascada síncrona para los CLIs, contra los proveedores de models.yaml
+
+    Raises:
+        ValueError: si models.yaml no tiene sección cascade
+    """
+    config = load_cascade(config_path)
+    if config is None:
+        raise ValueError("models.yaml no tiene sección cascade")
+    router = load_router(config_path)
+
+    async def main():
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            return await Cascade(config, router_stream(client, router), on_attempt).run(data)
+
+    return asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Circuit breaker por proveedor (cerrado / abierto / semiabierto).
+
+Tras varios fallos seguidos el circuito se abre y el router deja de elegir al
+proveedor al instante, en lugar de esperar timeouts. Pasado el enfriamiento
+pasa a semiabierto: se deja pasar una sola petición de prueba; si va bien se
+cierra y si falla vuelve a abrirse.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Estado de salud de un proveedor según sus últimos resultados"""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.opens = 0
+
+    def state(self, now: Optional[float] = None) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        now = now if now is not None else time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return OPEN
+        return HALF_OPEN
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """True si se le puede enviar una petición ahora"""
+        now = now if now is not None else time.monotonic()
+        state = self.state(now)
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        # Semiabierto: una sola prueba a la vez (si se perdió, se permite otra)
+        return self.probe_started is None or now - self.probe_started > self.cooldown
+
+    def on_request(self, now: Optional[float] = None) -> None:
+        """Se va a enviar una petición; en semiabierto cuenta como la prueba"""
+        now = now if now is not None else time.monotonic()
+        if self.state(now) == HALF_OPEN:
+            self.probe_started = now
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self, now: Optional[float] = None) -> None:
+        now = now if now is not None else time.monotonic()
+        self.consecutive_failures += 1
+        state = self.state(now)
+        if state == HALF_OPEN or (state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = now
+            self.probe_started = None
+            self.opens += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state(),
+            "consecutive_failures": self.consecutive_failures,
+            "opens": self.opens,
+        }
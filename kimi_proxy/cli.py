@@ -0,0 +1,200 @@
+"""
+Llamadas al modelo compartidas por los CLIs kimi y okimi.
+
+Los dos CLIs solo cambian de proveedor, herramientas y textos; la forma de
+pedir una respuesta es la misma: caché en disco compartida con el proxy,
+streaming con TTFT y tokens/s en vivo, Heavy Mode con consenso en local y
+modo cascada. Cada CLI importa estas funciones si kimi_proxy está
+disponible y, si no, usa la llamada directa al SDK de OpenAI.
+"""
+
+import os
+import sys
+import time
+
+from openai.types.chat import ChatCompletion
+
+from kimi_proxy.cache import cache_key, is_cacheable, open_disk_cache
+from kimi_proxy.cascade import run_cascade
+from kimi_proxy.heavy import run_heavy
+from kimi_proxy.sse import CompletionAccumulator
+
+
+class Colors:
+    """Los mismos códigos ANSI que usan los CLIs"""
+    OKBLUE = '\033[94m'
+    OKCYAN = '\033[96m'
+    WARNING = '\033[93m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+
+class StreamView:
+    """
+    Muestra una respuesta en streaming según llega
+
+    Antes del primer token de la respuesta, una línea de estado con el TTFT y
+    los tokens/s de razonamiento o tool_calls (solo en una terminal); después,
+    el contenido tal cual y al final TTFT, tokens y tokens/s.
+    """
+
+    def __init__(self):
+        self.live = sys.stdout.isatty()
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.tokens = 0
+        self.answered = False
+        self.status = False
+
+    def delta(self, delta):
+        """Un delta de choices[0] (dict)"""
+        if not (delta.get("content") or delta.get("reasoning_content") or delta.get("tool_calls")):
+            return
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self.tokens += 1
+
+        if delta.get("content"):
+            if not self.answered:
+                self.clear_status()
+                print(f"{Colors.OKCYAN}⚡ Primer token en {self.first - self.start:.2f}s{Colors.ENDC}\n")
+                print(f"{Colors.BOLD}═══ RESPUESTA ═══{Colors.ENDC}\n")
+                self.answered = True
+            print(delta["content"], end="", flush=True)
+        elif self.live and not self.answered:
+            action = "Preparando herramientas" if delta.get("tool_calls") else "Razonando"
+            rate = self.tokens / max(now - self.first, 1e-3)
+            print(f"\r{Colors.OKCYAN}💭 {action}... TTFT {self.first - self.start:.2f}s · "
+                  f"{self.tokens:,} tokens · {rate:,.0f} tok/s{Colors.ENDC}\033[K", end="", flush=True)
+            self.status = True
+
+    def clear_status(self):
+        if self.status:
+            print("\r\033[K", end="")
+            self.status = False
+
+    def finish(self, usage):
+        """Cierra la salida y muestra TTFT y tokens/s (con la usage real si llegó)"""
+        self.clear_status()
+        if self.answered:
+            print()
+        if self.first is None:
+            return
+        end = time.perf_counter()
+        tokens = usage.get("completion_tokens") if usage else None
+        tokens = tokens or self.tokens
+        rate = tokens / max(end - self.first, 1e-3)
+        print(f"\n{Colors.OKBLUE}⏱  TTFT {self.first - self.start:.2f}s · {tokens:,} tokens en "
+              f"{end - self.start:.1f}s · {rate:,.0f} tok/s{Colors.ENDC}")
+
+
+def stream_completion(client, config, view):
+    """
+    Pide la respuesta en streaming y se la pasa a `view` según llega
+
+    Devuelve el mismo ChatCompletion que sin streaming: contenido, razonamiento
+    y tool_calls se ensamblan con CompletionAccumulator, y la usage llega en el
+    último chunk gracias a stream_options.include_usage.
+
+    Raises:
+        RuntimeError: si el stream se corta antes del finish_reason
+    """
+    accumulator = CompletionAccumulator()
+    stream = client.chat.completions.create(**config, stream=True, stream_options={"include_usage": True})
+    try:
+        for chunk in stream:
+            event = chunk.model_dump(exclude_none=True)
+            accumulator.feed_event(event)
+            for choice in event.get("choices") or []:
+                if choice.get("index", 0) == 0:
+                    view.delta(choice.get("delta") or {})
+    finally:
+        stream.close()
+        view.finish(accumulator.usage)
+    # Una respuesta cortada no se devuelve (ni llega a la caché en disco)
+    if not accumulator.complete or not accumulator.choices:
+        raise RuntimeError("El stream terminó antes de completar la respuesta")
+    return ChatCompletion.model_validate(accumulator.result())
+
+
+def create_completion(client, config, view=None):
+    """
+    Llama a client.chat.completions.create usando la caché en disco compartida
+
+    Solo se cachean peticiones deterministas (temperature 0) o todas si
+    KIMI_CACHE=1 está definido en el entorno. Con `view` la respuesta llega
+    en streaming y se muestra mientras se genera.
+    """
+    if view is not None:
+        view.reset()
+
+    def request():
+        if view is not None:
+            return stream_completion(client, config, view)
+        return client.chat.completions.create(**config)
+
+    if not is_cacheable(config, opt_in=os.getenv('KIMI_CACHE') == '1'):
+        return request()
+
+    cache = open_disk_cache()
+    try:
+        key = cache_key(config)
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"{Colors.OKCYAN}♻️  Respuesta desde caché{Colors.ENDC}\n")
+            return ChatCompletion.model_validate_json(cached)
+
+        response = request()
+        cache.put(key, response.model_dump_json().encode())
+        return response
+    finally:
+        cache.close()
+
+
+def create_heavy_completion(client, config):
+    """
+    Heavy Mode: KIMI_HEAVY_TRAJECTORIES trayectorias (8) en paralelo contra el proveedor
+
+    Vota la respuesta final (o las herramientas pedidas) de cada una y cancela
+    las que quedan en cuanto hay mayoría.
+    """
+    result = run_heavy(
+        config,
+        str(client.base_url),
+        client.api_key,
+        trajectories=int(os.getenv('KIMI_HEAVY_TRAJECTORIES', '8'))
+    )
+    summary = result.summary(content=False)
+    print(f"{Colors.WARNING}⚡ Trayectorias: {summary['completed']} completas, "
+          f"{summary['cancelled']} canceladas por consenso, {summary['failed']} con error{Colors.ENDC}")
+    print(f"{Colors.WARNING}   Convergencia: {summary['convergence_pattern']} · "
+          f"diversidad {summary['diversity_score']:.2f} · "
+          f"~{summary['estimated_tokens_saved']:,} tokens ahorrados · {summary['elapsed']:.1f}s{Colors.ENDC}\n")
+    if result.chosen is None:
+        raise RuntimeError(f"Ninguna trayectoria terminó: {result.error}")
+    return ChatCompletion.model_validate(result.completion())
+
+
+def create_cascade_completion(client, config):
+    """
+    Modo cascada: Qwen3-Coder local primero y Kimi K2 (normal y Heavy) solo si duda
+
+    Los niveles, sus precios y sus proveedores salen de la sección `cascade`
+    de kimi_k2_benchmark/config/models.yaml, así que `client` no se usa.
+    """
+    result = run_cascade(config)
+    summary = result.summary()
+    for attempt in summary['attempts']:
+        confidence = f"{attempt['confidence']:.2f}" if attempt['confidence'] is not None else "-"
+        print(f"{Colors.OKCYAN}🪜 {attempt['tier']}: {attempt['status']} · confianza {confidence} · "
+              f"{attempt['seconds']:.1f}s · {attempt['usage'].get('completion_tokens', 0):,} tokens · "
+              f"${attempt['cost_usd']:.6f}{Colors.ENDC}")
+    if summary['cost_saved_usd'] is not None:
+        print(f"{Colors.OKCYAN}   Ahorro frente a {summary['baseline']}: ${summary['cost_saved_usd']:.6f} USD{Colors.ENDC}\n")
+    if result.completion is None:
+        raise RuntimeError(f"Ningún nivel respondió: {result.error}")
+    return ChatCompletion.model_validate(result.completion)
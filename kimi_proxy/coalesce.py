@@ -0,0 +1,348 @@
+"""
+Coalescencia de eventos SSE hacia el cliente (opt-in).
+
+Kimi-K2 emite un evento por token: una respuesta de 16K tokens son ~16K
+escrituras pequeñas (y otras tantas llamadas al sistema) por cliente. Con la
+coalescencia activada, los deltas consecutivos de una misma choice se unen
+en un solo evento chat.completion.chunk hasta llenar `max_bytes` o pasar
+`window` segundos desde el primero retenido.
+
+El resultado sigue siendo un stream OpenAI válido:
+
+- content, reasoning_content y demás campos de texto se concatenan;
+- los fragmentos de `tool_calls` del mismo índice se concatenan en una
+  entrada; una llamada nueva (con `id`) abre otra entrada con su índice;
+- role, finish_reason, usage, logprobs y [DONE] no se unen: el evento que
+  los lleva sale tal cual, después de lo retenido.
+
+Camino rápido: los eventos de un mismo stream que solo traen un campo de
+texto (un token de content, de razonamiento o de argumentos) son idénticos
+salvo por ese texto, así que se unen concatenando los bytes ya escapados
+entre el prefijo y el sufijo comunes, sin parsear ni volver a serializar.
+Un evento que no llega a unirse con otro se reenvía con sus bytes originales.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from kimi_proxy.sse import encode_event
+
+DEFAULT_WINDOW = 0.02
+DEFAULT_MAX_BYTES = 4096
+
+_CHOICE_KEYS = {"index", "delta", "finish_reason", "logprobs"}
+
+
+class SSECoalescer:
+    """Une eventos chat.completion.chunk consecutivos (sin tiempos: ver WindowedCoalescer)"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.events_in = 0
+        self.events_out = 0
+        self._buffer = b""
+        # Racha de texto: prefijo y sufijo comunes y los trozos de texto escapado
+        self._prefix: Optional[bytes] = None
+        self._suffix = b""
+        self._pieces: List[bytes] = []
+        # Racha general: el chunk parseado al que se van uniendo los demás
+        self._pending: Optional[Dict[str, Any]] = None
+        self._pending_raw = b""
+        self._pending_count = 0
+        self._pending_bytes = 0
+
+    @property
+    def pending(self) -> bool:
+        return self._prefix is not None or self._pending is not None
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Procesa bytes del stream y devuelve los que ya deben enviarse"""
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        *events, self._buffer = (self._buffer + chunk).split(b"\n\n")
+        out: List[bytes] = []
+        for event in events:
+            if not event:
+                continue
+            self.events_in += 1
+            if not self._extend_text(event):
+                self._add(event, out)
+            if self.pending and self._pending_bytes >= self.max_bytes:
+                out.append(self.flush())
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        """Devuelve el evento retenido (vacío si no hay ninguno)"""
+        if self._prefix is not None:
+            out = self._prefix + b"".join(self._pieces) + self._suffix + b"\n\n"
+            self._prefix = None
+            self._pieces = []
+        elif self._pending is not None:
+            out = self._pending_raw + b"\n\n" if self._pending_count == 1 else encode_event(self._pending)
+            self._pending = None
+            self._pending_raw = b""
+        else:
+            return b""
+        self._pending_bytes = 0
+        self.events_out += 1
+        return out
+
+    def close(self) -> bytes:
+        """Fin del stream: lo retenido más los bytes de un evento sin terminar"""
+        rest, self._buffer = self._buffer, b""
+        return self.flush() + rest
+
+    def _extend_text(self, event: bytes) -> bool:
+        prefix, suffix = self._prefix, self._suffix
+        if prefix is None or len(event) < len(prefix) + len(suffix):
+            return False
+        if not event.startswith(prefix) or not event.endswith(suffix):
+            return False
+        piece = event[len(prefix):len(event) - len(suffix)]
+        # El texto debe ser un string JSON completo: comillas escapadas y sin \ colgando
+        if (b'"' in piece or piece.endswith(b"\\")) and _closing_quote(piece + b'"', 0) != len(piece):
+            return False
+        self._pieces.append(piece)
+        self._pending_bytes += len(event) + 2
+        return True
+
+    def _add(self, event: bytes, out: List[bytes]) -> None:
+        parsed = _mergeable(event)
+        if parsed is None:
+            out.append(self.flush())
+            out.append(event + b"\n\n")
+            self.events_out += 1
+            return
+        text = _text_slot(event, parsed)
+        if text is None and self._pending is not None and self._merge(parsed):
+            self._pending_count += 1
+        else:
+            out.append(self.flush())
+            if text is not None:
+                self._prefix, piece, self._suffix = text
+                self._pieces = [piece]
+            else:
+                self._pending = parsed
+                self._pending_raw = event
+                self._pending_count = 1
+        self._pending_bytes += len(event) + 2
+
+    def _merge(self, chunk: Dict[str, Any]) -> bool:
+        pending = self._pending
+        if chunk.get("id") != pending.get("id"):
+            return False
+        target, source = pending["choices"][0], chunk["choices"][0]
+        if target.get("index", 0) != source.get("index", 0):
+            return False
+        delta = target.setdefault("delta", {})
+        for key, value in (source.get("delta") or {}).items():
+            if value is None:
+                continue
+            if key == "tool_calls":
+                _merge_tool_calls(delta.setdefault("tool_calls", []), value)
+            elif isinstance(delta.get(key), str):
+                delta[key] += value
+            else:
+                delta[key] = value
+        return True
+
+
+def _mergeable(event: bytes) -> Optional[Dict[str, Any]]:
+    """El chunk parseado si es un delta que se puede unir con otros"""
+    if not event.startswith(b"data:") or b"\n" in event:
+        return None
+    data = event[5:].strip()
+    if data == b"[DONE]":
+        return None
+    try:
+        chunk = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(chunk, dict) or chunk.get("usage") is not None:
+        return None
+    choices = chunk.get("choices")
+    if not isinstance(choices, list) or len(choices) != 1:
+        return None
+    choice = choices[0]
+    if not isinstance(choice, dict) or not _CHOICE_KEYS.issuperset(choice):
+        return None
+    if choice.get("finish_reason") is not None or choice.get("logprobs") is not None:
+        return None
+    delta = choice.get("delta") or {}
+    if not isinstance(delta, dict) or delta.get("role") is not None:
+        return None
+    for key, value in delta.items():
+        if key == "tool_calls":
+            if not isinstance(value, list) or not all(isinstance(call, dict) for call in value):
+                return None
+        elif value is not None and not isinstance(value, str):
+            return None
+    return chunk
+
+
+def _text_slot(event: bytes, chunk: Dict[str, Any]) -> Optional[Tuple[bytes, bytes, bytes]]:
+    """(prefijo, texto escapado, sufijo) si el evento solo aporta un campo de texto"""
+    fields = {key: value for key, value in (chunk["choices"][0].get("delta") or {}).items() if value is not None}
+    if len(fields) != 1:
+        return None
+    key, value = fields.popitem()
+    if isinstance(value, str):
+        marker = b'"' + key.encode() + b'":"'
+    elif (len(value) == 1 and value[0].keys() == {"index", "function"}
+            and isinstance(value[0]["function"], dict) and value[0]["function"].keys() == {"arguments"}
+            and isinstance(value[0]["function"]["arguments"], str)):
+        marker = b'"arguments":"'
+    else:
+        return None
+    if event.count(marker) != 1:
+        return None
+    start = event.index(marker) + len(marker)
+    end = _closing_quote(event, start)
+    return event[:start], event[start:end], event[end:]
+
+
+def _closing_quote(data: bytes, start: int) -> int:
+    """Posición de la primera comilla sin escapar a partir de `start`"""
+    end = start
+    while True:
+        end = data.index(b'"', end)
+        backslashes = 0
+        while end - 1 - backslashes >= start and data[end - 1 - backslashes] == ord("\\"):
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end
+        end += 1
+
+
+def _merge_tool_calls(calls: List[Dict[str, Any]], incoming: List[Dict[str, Any]]) -> None:
+    for call in incoming:
+        last = calls[-1] if calls else None
+        if last is not None and last.get("index") == call.get("index") and not call.get("id"):
+            function = last.setdefault("function", {})
+            for key, value in (call.get("function") or {}).items():
+                if isinstance(value, str):
+                    function[key] = (function.get(key) or "") + value
+        else:
+            calls.append({**call, "function": dict(call.get("function") or {})})
+
+
+class WindowedCoalescer:
+    """
+    SSECoalescer con ventana de tiempo
+
+    `wake` se llama desde un temporizador del bucle cuando lo retenido cumple
+    la ventana; quien consume el stream responde llamando a `tick`. Así se
+    vacía aunque el upstream esté en silencio, sin esperar con timeout en
+    cada chunk.
+    """
+
+    def __init__(self, window: float, max_bytes: int, wake: Callable[[], None]):
+        self.window = window
+        self.coalescer = SSECoalescer(max_bytes)
+        self._wake = wake
+        self._loop = asyncio.get_running_loop()
+        self._deadline: Optional[float] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        out = self.coalescer.feed(chunk)
+        if out:
+            self._deadline = None
+        if self.coalescer.pending:
+            now = self._loop.time()
+            if self._deadline is None:
+                self._deadline = now + self.window
+            elif now >= self._deadline:
+                self._deadline = None
+                return out + self.coalescer.flush()
+            if self._timer is None:
+                self._timer = self._loop.call_at(self._deadline, self._expired)
+        return out
+
+    def _expired(self) -> None:
+        self._timer = None
+        if self._deadline is None:
+            return
+        if self._loop.time() < self._deadline:
+            # La ventana actual empezó después de programar el temporizador
+            self._timer = self._loop.call_at(self._deadline, self._expired)
+            return
+        self._wake()
+
+    def tick(self) -> bytes:
+        """Lo retenido, si la ventana ya se cumplió"""
+        if self._deadline is None or self._loop.time() < self._deadline:
+            return b""
+        self._deadline = None
+        return self.coalescer.flush()
+
+    def close(self) -> bytes:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._deadline = None
+        return self.coalescer.close()
+
+
+_END = object()
+TICK = object()
+
+
+async def coalesce_stream(
+    source: AsyncIterator[bytes],
+    window: float = DEFAULT_WINDOW,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> AsyncIterator[bytes]:
+    """
+    Envuelve cualquier stream SSE con coalescencia
+
+    Una tarea lee `source` con un chunk de adelanto como mucho (se conserva
+    el backpressure). relay_stream no la necesita: usa su propia cola.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(1)
+    coalescer = WindowedCoalescer(window, max_bytes, lambda: queue.put_nowait(TICK))
+
+    async def pump() -> None:
+        try:
+            async for chunk in source:
+                queue.put_nowait(chunk)
+                await slots.acquire()
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    await slots.acquire()
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is TICK:
+                out = coalescer.tick()
+            elif item is _END:
+                break
+            elif isinstance(item, Exception):
+                tail = coalescer.close()
+                if tail:
+                    yield tail
+                raise item
+            else:
+                slots.release()
+                out = coalescer.feed(item)
+            if out:
+                yield out
+        tail = coalescer.close()
+        if tail:
+            yield tail
+    finally:
+        coalescer.close()
+        if not reader.done():
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+        # Si el lector estaba esperando turno, el generador sigue abierto: cerrarlo
+        # ejecuta su limpieza (cerrar la respuesta upstream, contar la cancelación...)
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,264 @@
+"""
+Backends que solo sirven /v1/completions (vLLM/SGLang "en crudo").
+
+El proxy sigue exponiendo /v1/chat/completions: renderiza los mensajes con
+la plantilla de chat de Kimi-K2, pide texto crudo con los tokens especiales
+(skip_special_tokens=false) y traduce la respuesta al formato de chat sobre
+la marcha, con las llamadas a herramientas como deltas `tool_calls` gracias
+a ToolCallParser.
+
+Los traductores tienen la misma interfaz (feed/close sobre bytes) para que
+UpstreamCall los aplique al cuerpo sin saber si es SSE o JSON.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import orjson
+
+from kimi_proxy.payload import ChatBody
+from kimi_proxy.sse import DONE_EVENT, encode_event
+from kimi_proxy.toolcalls import ToolCallParser, assemble
+
+DEFAULT_SYSTEM_PROMPT = "You are Kimi, an AI assistant created by Moonshot AI."
+
+_ROLE_HEADERS = {
+    "system": "<|im_system|>system<|im_middle|>",
+    "user": "<|im_user|>user<|im_middle|>",
+    "assistant": "<|im_assistant|>assistant<|im_middle|>",
+    "tool": "<|im_system|>tool<|im_middle|>",
+}
+
+# Campos de muestreo que se copian tal cual a /v1/completions
+_SAMPLING_FIELDS = (
+    "max_tokens", "temperature", "top_p", "stop", "seed", "presence_penalty",
+    "frequency_penalty", "n", "stream_options",
+)
+
+
+def _text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content:
+        if part.get("type") == "text":
+            parts.append(part.get("text", ""))
+        else:
+            parts.append("<|media_start|>image<|media_content|><|media_pad|><|media_end|>")
+    return "".join(parts)
+
+
+def render_prompt(messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Plantilla de chat de Kimi-K2 (equivalente a apply_chat_template con add_generation_prompt)"""
+    out = []
+    if tools:
+        out.append("<|im_system|>tool_declare<|im_middle|>")
+        out.append(orjson.dumps(tools).decode())
+        out.append("<|im_end|>")
+    if not messages or messages[0].get("role") != "system":
+        out.append(_ROLE_HEADERS["system"] + DEFAULT_SYSTEM_PROMPT + "<|im_end|>")
+    for message in messages:
+        role = message.get("role", "user")
+        out.append(_ROLE_HEADERS.get(role, _ROLE_HEADERS["user"]))
+        if role == "tool":
+            out.append(f"## Return of {message.get('tool_call_id', '')}\n")
+        out.append(_text(message.get("content")))
+        if role == "assistant" and message.get("tool_calls"):
+            out.append("<|tool_calls_section_begin|>")
+            for call in message["tool_calls"]:
+                arguments = call["function"].get("arguments") or ""
+                if not isinstance(arguments, str):
+                    arguments = orjson.dumps(arguments).decode()
+                out.append(f"<|tool_call_begin|>{call['id']}<|tool_call_argument_begin|>{arguments}<|tool_call_end|>")
+            out.append("<|tool_calls_section_end|>")
+        out.append("<|im_end|>")
+    out.append(_ROLE_HEADERS["assistant"])
+    return "".join(out)
+
+
+def completion_request(body: ChatBody, upstream_model: str) -> bytes:
+    """Cuerpo de /v1/completions equivalente a la petición de chat"""
+    data = body.data
+    request = {
+        "model": upstream_model,
+        "prompt": render_prompt(data["messages"], data.get("tools")),
+        "stream": body.stream,
+        # Sin esto vLLM/SGLang quitan los tokens de las tool calls de la salida
+        "skip_special_tokens": False,
+    }
+    for name in _SAMPLING_FIELDS:
+        if data.get(name) is not None:
+            request[name] = data[name]
+    return orjson.dumps(request)
+
+
+def _delta(events: List[tuple]) -> Dict[str, Any]:
+    """Un delta de chat.completion.chunk con todos los eventos de un chunk"""
+    delta: Dict[str, Any] = {}
+    calls: List[Dict[str, Any]] = []
+    for event in events:
+        kind = event[0]
+        if kind == "content":
+            delta["content"] = delta.get("content", "") + event[1]
+        elif kind == "reasoning":
+            delta["reasoning_content"] = delta.get("reasoning_content", "") + event[1]
+        elif kind == "tool_call":
+            calls.append({
+                "index": event[1], "id": event[2], "type": "function",
+                "function": {"name": event[3], "arguments": ""},
+            })
+        elif calls and calls[-1]["index"] == event[1]:
+            calls[-1]["function"]["arguments"] += event[2]
+        else:
+            calls.append({"index": event[1], "function": {"arguments": event[2]}})
+    if calls:
+        delta["tool_calls"] = calls
+    return delta
+
+
+class _ChoiceState:
+    """Lo que StreamTranslator lleva de cada choice (con n>1 llegan intercaladas)"""
+
+    def __init__(self):
+        self.parser = ToolCallParser()
+        self.role_sent = False
+        self.finished = False
+
+
+class StreamTranslator:
+    """SSE de text_completion -> SSE de chat.completion.chunk"""
+
+    def __init__(self):
+        self.choices: Dict[int, _ChoiceState] = {}
+        self._buffer = b""
+        self.id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.created: Optional[int] = None
+
+    def _chunk(self, index: int, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+        state = self.choices[index]
+        if not state.role_sent:
+            delta = {"role": "assistant", **delta}
+            state.role_sent = True
+        return encode_event({
+            "id": self.id or "chatcmpl-proxy",
+            "object": "chat.completion.chunk",
+            "created": self.created or int(time.time()),
+            "model": self.model,
+            "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
+        })
+
+    def feed(self, chunk: bytes) -> bytes:
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        self._buffer += chunk
+        *events, self._buffer = self._buffer.split(b"\n\n")
+        out = []
+        for event in events:
+            for line in event.split(b"\n"):
+                if line.startswith(b"data:"):
+                    out.append(self._translate(line[5:].strip()))
+        return b"".join(out)
+
+    def _translate(self, data: bytes) -> bytes:
+        if data == b"[DONE]":
+            return self._flush() + DONE_EVENT
+        try:
+            event = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return b""
+        self.id = self.id or event.get("id")
+        self.model = self.model or event.get("model")
+        self.created = self.created or event.get("created")
+        out = []
+        for choice in event.get("choices") or []:
+            index = choice.get("index", 0)
+            state = self.choices.setdefault(index, _ChoiceState())
+            events = state.parser.feed(choice.get("text") or "")
+            finish_reason = choice.get("finish_reason")
+            if finish_reason is not None:
+                events += state.parser.finish()
+                if state.parser.tool_calls and finish_reason == "stop":
+                    finish_reason = "tool_calls"
+                state.finished = True
+            if events or finish_reason is not None:
+                out.append(self._chunk(index, _delta(events), finish_reason))
+        if event.get("usage"):
+            out.append(encode_event({
+                "id": self.id, "object": "chat.completion.chunk", "created": self.created,
+                "model": self.model, "choices": [], "usage": event["usage"],
+            }))
+        return b"".join(out)
+
+    def _flush(self) -> bytes:
+        out = []
+        for index, state in sorted(self.choices.items()):
+            if state.finished:
+                continue
+            state.finished = True
+            events = state.parser.finish()
+            if events:
+                out.append(self._chunk(index, _delta(events)))
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        return self._flush()
+
+
+class JsonTranslator:
+    """text_completion JSON -> chat.completion JSON (se emite entero al cerrar)"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._parts.append(chunk)
+        return b""
+
+    def close(self) -> bytes:
+        raw = b"".join(self._parts)
+        try:
+            completion = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return raw
+        choices = []
+        for choice in completion.get("choices") or []:
+            parser = ToolCallParser()
+            content, reasoning, calls = assemble(parser.feed(choice.get("text") or "") + parser.finish())
+            message: Dict[str, Any] = {"role": "assistant", "content": content or None}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            if calls:
+                message["tool_calls"] = calls
+            finish_reason = choice.get("finish_reason")
+            choices.append({
+                "index": choice.get("index", 0),
+                "message": message,
+                "finish_reason": "tool_calls" if calls and finish_reason == "stop" else finish_reason,
+            })
+        return orjson.dumps({
+            "id": completion.get("id"),
+            "object": "chat.completion",
+            "created": completion.get("created"),
+            "model": completion.get("model"),
+            "choices": choices,
+            "usage": completion.get("usage"),
+        })
+
+
+def translator_for(stream: bool):
+    """Traductor según lo que pidió el cliente (no el modo HTTP de la llamada)"""
+    return StreamTranslator() if stream else JsonTranslator()
+
+
+def translate_response(response: httpx.Response, translator: JsonTranslator) -> httpx.Response:
+    """Respuesta ya leída con el cuerpo traducido (llamadas sin stream)"""
+    content = translator.feed(response.content) + translator.close()
+    headers = [
+        (name, value) for name, value in response.headers.items()
+        if name.lower() not in ("content-length", "content-encoding", "transfer-encoding")
+    ]
+    return httpx.Response(response.status_code, headers=headers, content=content, request=response.request)
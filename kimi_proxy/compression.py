@@ -0,0 +1,337 @@
+"""
+Compresión de cuerpos HTTP: peticiones con Content-Encoding y respuestas
+negociadas con Accept-Encoding.
+
+Los prompts de contexto extremo (200K tokens) son megas de JSON en cada turno
+y los resultados de un lote pueden ser cientos de MB. Dos middlewares ASGI:
+
+- DecompressionMiddleware acepta `Content-Encoding: zstd|br|gzip` en la
+  petición. Descomprime a medida que llegan los trozos del cuerpo y corta con
+  413 en cuanto lo descomprimido pasa de `max_bytes`, sin llegar a inflar una
+  bomba de compresión entera.
+- CompressionMiddleware comprime las respuestas que no son streams (JSON,
+  descargas de ficheros de lotes) con el mejor algoritmo que acepte el
+  cliente. SSE y NDJSON se dejan tal cual: se entregan evento a evento y
+  comprimirlos obligaría a retenerlos.
+
+zstd usa `compression.zstd` (Python 3.14) o `backports.zstd`; sin ninguno de
+los dos se anuncia y se acepta solo br y gzip.
+"""
+
+import asyncio
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import brotli
+import orjson
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+# Preferencia del servidor cuando el cliente acepta varias con la misma q
+ENCODINGS: Tuple[str, ...] = (("zstd",) if zstd is not None else ()) + ("br", "gzip")
+
+# Niveles rápidos: el coste de comprimir no debe comerse lo ahorrado en la red
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+# Tipos que se envían por trozos según se generan
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+# Datos tras el final del frame (EOFError) o corruptos
+_DECODE_ERRORS = (zlib.error, brotli.error, EOFError) + ((zstd.ZstdError,) if zstd is not None else ())
+
+# Por encima de este tamaño la compresión de un cuerpo entero sale del bucle de eventos
+THREAD_THRESHOLD = 256 * 1024
+
+
+class DecodingError(ValueError):
+    """Cuerpo comprimido corrupto, truncado o demasiado grande al descomprimir"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Decoder:
+    """Descompresor incremental con límite de salida"""
+
+    def __init__(self, encoding: str, max_bytes: int):
+        self.encoding = encoding
+        self.remaining = max_bytes
+        if encoding == "gzip":
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._obj = brotli.Decompressor()
+        else:
+            self._obj = zstd.ZstdDecompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Descomprime un trozo del cuerpo
+
+        Raises:
+            DecodingError: si el trozo no es válido o se pasa del límite
+        """
+        # Pedir un byte más que lo que queda basta para detectar el exceso
+        # sin producir más salida que esa
+        limit = self.remaining + 1
+        try:
+            if self.encoding == "br":
+                out = self._obj.process(data, output_buffer_limit=limit)
+            else:
+                out = self._obj.decompress(data, limit)
+        except _DECODE_ERRORS as e:
+            raise DecodingError(f"Invalid {self.encoding} body: {e}")
+        if len(out) > self.remaining:
+            raise DecodingError("Decompressed request body too large", status_code=413)
+        self.remaining -= len(out)
+        return out
+
+    def finish(self) -> None:
+        """Raises: DecodingError si el cuerpo terminó a mitad de un frame"""
+        finished = self._obj.is_finished() if self.encoding == "br" else self._obj.eof
+        if not finished:
+            raise DecodingError(f"Truncated {self.encoding} body")
+
+
+class _Encoder:
+    """Compresor incremental con la misma interfaz para los tres algoritmos"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        if self.encoding == "zstd":
+            return self._obj.flush(zstd.ZstdCompressor.FLUSH_FRAME)
+        return self._obj.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Comprime un cuerpo entero"""
+    encoder = _Encoder(encoding)
+    return encoder.compress(data) + encoder.finish()
+
+
+def decompress(data: bytes, encoding: str, max_bytes: int) -> bytes:
+    """
+    Descomprime un cuerpo entero
+
+    Raises:
+        DecodingError: si no es válido o descomprimido pasa de `max_bytes`
+    """
+    decoder = _Decoder(encoding, max_bytes)
+    out = decoder.decompress(data)
+    decoder.finish()
+    return out
+
+
+def negotiate(accept_encoding: str, available: Iterable[str] = ENCODINGS) -> Optional[str]:
+    """
+    Codificación a usar según Accept-Encoding (None = sin comprimir)
+
+    Gana la q más alta; a igualdad, el orden de `available`. `*` cubre lo
+    que no aparece por nombre y q=0 excluye.
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+async def _error(send: Send, status_code: int, detail: str) -> None:
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class DecompressionMiddleware:
+    """
+    Descomprime los cuerpos de petición con Content-Encoding
+
+    El cuerpo descomprimido se entrega a la app como un único mensaje
+    `http.request` (los endpoints lo leen entero de todas formas); después,
+    `receive` vuelve a ser el del servidor para detectar la desconexión.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = _header(scope["headers"], b"content-encoding")
+        encoding = (encoding or b"").decode("latin-1").strip().lower()
+        if encoding in ("", "identity"):
+            return await self.app(scope, receive, send)
+        if encoding not in ENCODINGS:
+            return await _error(send, 415, f"Unsupported Content-Encoding: {encoding}")
+
+        decoder = _Decoder(encoding, self.max_bytes)
+        parts = []
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                parts.append(decoder.decompress(message.get("body", b"")))
+                if not message.get("more_body", False):
+                    break
+            decoder.finish()
+        except DecodingError as e:
+            return await _error(send, e.status_code, str(e))
+
+        body = b"".join(parts)
+        headers = [
+            (key, value) for key, value in scope["headers"]
+            if key.lower() not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app({**scope, "headers": headers}, replay, send)
+
+
+class CompressionMiddleware:
+    """
+    Comprime las respuestas según Accept-Encoding
+
+    Se salta las respuestas ya codificadas, los streams (SSE, NDJSON) y los
+    cuerpos enteros de menos de `min_size` bytes. Un cuerpo que llega en
+    varios mensajes (FileResponse) se comprime por trozos.
+    """
+
+    def __init__(self, app: ASGIApp, min_size: int = 1024, available: Iterable[str] = ENCODINGS):
+        self.app = app
+        self.min_size = min_size
+        self.available = tuple(available)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = _header(scope["headers"], b"accept-encoding")
+        encoding = negotiate(accept.decode("latin-1"), self.available) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Message] = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def compressing_send(message: Message) -> None:
+            nonlocal start, encoder, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                if (_header(headers, b"content-encoding") is not None
+                        or content_type.startswith(STREAMING_TYPES)):
+                    passthrough = True
+                    return await send(message)
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                if not more and len(body) < self.min_size:
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                encoder = _Encoder(encoding)
+                headers = [
+                    (key, value) for key, value in start.get("headers", [])
+                    if key.lower() != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode()))
+                _add_vary(headers)
+                if not more:
+                    compressed = await _run(compress, body, encoding)
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": headers})
+                    return await send({"type": "http.response.body", "body": compressed})
+                await send({**start, "headers": headers})
+            out = await _run(encoder.compress, body)
+            if not more:
+                out += encoder.finish()
+            if out or not more:
+                await send({"type": "http.response.body", "body": out, "more_body": more})
+
+        await self.app(scope, receive, compressing_send)
+
+
+async def _run(func: Callable[..., bytes], data: bytes, *args: Any) -> bytes:
+    if len(data) < THREAD_THRESHOLD:
+        return func(data, *args)
+    return await asyncio.to_thread(func, data, *args)
+
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> None:
+    for i, (key, value) in enumerate(headers):
+        if key.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (key, value + b", Accept-Encoding")
+            return
+    headers.append((b"vary", b"Accept-Encoding"))
@@ -0,0 +1,274 @@
+"""
+Límite de concurrencia adaptativo por proveedor (AIMD) con control de admisión.
+
+Cada proveedor tiene un límite de llamadas simultáneas que crece de forma
+aditiva mientras las respuestas llegan bien y se reduce de forma
+multiplicativa ante 429/5xx o cuando la latencia se dispara respecto a su
+media. Lo que no cabe espera en una cola acotada con plazo; si la cola está
+llena se rechaza en el acto (HTTP 503) en lugar de acumular timeouts.
+
+La cola tiene una subcola por clase de prioridad (interactive, batch...) y los
+huecos se reparten con weighted fair queuing: cada clase recibe una parte
+proporcional a su peso, así el tráfico batch aprovecha la capacidad sobrante
+sin hacer esperar al interactivo.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from kimi_proxy.upstream import UpstreamCall
+
+# Estados HTTP que indican saturación del proveedor
+OVERLOAD_STATUSES = (429, 503)
+
+DEFAULT_PRIORITY = "interactive"
+DEFAULT_WEIGHTS = {"interactive": 8.0, "batch": 1.0}
+
+
+class Overloaded(Exception):
+    """La petición no se admitió: cola llena o plazo de espera agotado"""
+
+    def __init__(self, provider: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"{provider} overloaded ({reason})")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class ClassStats:
+    """Tiempo de espera en cola de una clase de prioridad"""
+    admitted: int = 0
+    queued: int = 0
+    rejected: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "avg_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait": round(self.max_wait, 4),
+        }
+
+
+class AdaptiveLimiter:
+    """Semáforo con límite AIMD y cola WFQ acotada por clase de prioridad"""
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 32,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        queue_size: int = 64,
+        queue_timeout: float = 30.0,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 2.0,
+        decrease_interval: float = 1.0,
+        weights: Optional[Dict[str, float]] = None,
+        on_change: Optional[Callable[["AdaptiveLimiter"], None]] = None,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.decrease_interval = decrease_interval
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.on_change = on_change
+
+        self.in_flight = 0
+        # Subcolas por clase con etiquetas de fin WFQ (crecientes dentro de cada clase)
+        self._queues: Dict[str, Deque[Tuple[float, asyncio.Future]]] = {}
+        self._last_tag: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self.classes: Dict[str, ClassStats] = {}
+        # Latencia de referencia por tipo ("stream": TTFT, "json": respuesta completa)
+        self.baseline: Dict[str, float] = {}
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.decreases = 0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def class_depth(self, priority: str) -> int:
+        return len(self._queues.get(priority, ()))
+
+    async def acquire(self, priority: str = DEFAULT_PRIORITY, timeout: Optional[float] = None) -> float:
+        """
+        Espera un hueco para llamar al proveedor
+
+        Args:
+            priority: Clase de prioridad (las desconocidas pesan 1)
+            timeout: Espera máxima en cola (por defecto queue_timeout)
+
+        Returns:
+            Segundos esperados en cola
+
+        Raises:
+            Overloaded: si la cola de la clase está llena o se agota el plazo
+        """
+        stats = self.classes.setdefault(priority, ClassStats())
+        if self.in_flight < self.capacity and not self.queue_depth:
+            self._admit(stats)
+            return 0.0
+        queue = self._queues.setdefault(priority, deque())
+        if len(queue) >= self.queue_size:
+            self.rejected_full += 1
+            stats.rejected += 1
+            raise Overloaded(self.name, "queue_full")
+
+        # Etiqueta de fin WFQ: cada petición "cuesta" 1/peso en tiempo virtual
+        tag = max(self._virtual_time, self._last_tag.get(priority, 0.0)) + 1.0 / self.weights.get(priority, 1.0)
+        self._last_tag[priority] = tag
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append((tag, waiter))
+        self.queued += 1
+        stats.queued += 1
+        self._changed()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout if timeout is not None else self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget(priority, waiter)
+            self.rejected_timeout += 1
+            stats.rejected += 1
+            raise Overloaded(self.name, "queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Ya se nos había dado el hueco: devolverlo
+                self.release("cancelled")
+            else:
+                self._forget(priority, waiter)
+            raise
+        waited = time.perf_counter() - started
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        return waited
+
+    def _admit(self, stats: ClassStats) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        stats.admitted += 1
+        self._changed()
+
+    def _forget(self, priority: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(priority, deque())
+        for entry in queue:
+            if entry[1] is waiter:
+                queue.remove(entry)
+                break
+        self._changed()
+
+    def release(self, outcome: str, latency: Optional[float] = None, kind: str = "stream") -> None:
+        """
+        Libera el hueco y ajusta el límite
+
+        Args:
+            outcome: "ok", "overload" (429/503), "error" o "cancelled"
+            latency: TTFT (stream) o duración total (json) de la llamada
+            kind: Tipo de latencia, para compararla con su propia referencia
+        """
+        saturated = self.in_flight >= self.capacity or self.queue_depth > 0
+        self.in_flight -= 1
+
+        if outcome in ("overload", "error"):
+            self._decrease()
+        elif outcome == "ok" and latency is not None:
+            baseline = self.baseline.get(kind)
+            if baseline is not None and latency > self.latency_tolerance * baseline:
+                self._decrease()
+            elif saturated:
+                # +1 por cada `limit` respuestas buenas con el límite ocupado
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.baseline[kind] = latency if baseline is None else baseline + 0.05 * (latency - baseline)
+
+        self._wake()
+        self._changed()
+
+    def _decrease(self) -> None:
+        # Una ráfaga de errores simultáneos cuenta como una sola señal
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+
+    def _wake(self) -> None:
+        while self.in_flight < self.capacity:
+            # Siguiente por WFQ: la cabeza de subcola con menor etiqueta de fin
+            heads = [(queue[0][0], priority) for priority, queue in self._queues.items() if queue]
+            if not heads:
+                return
+            tag, priority = min(heads)
+            _, waiter = self._queues[priority].popleft()
+            if waiter.done():
+                continue
+            self._virtual_time = tag
+            self._admit(self.classes[priority])
+            waiter.set_result(None)
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def track(self, call: UpstreamCall) -> None:
+        """Libera el hueco cuando termine la llamada, con su resultado y latencia"""
+        def on_finish(call: UpstreamCall, outcome: str) -> None:
+            if outcome == "error" and call.response.status_code in OVERLOAD_STATUSES:
+                outcome = "overload"
+            self.release(outcome, call.ttft, "stream" if call.stream else "json")
+
+        call.add_listener(on_finish)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_queue_timeout": self.rejected_timeout,
+            "decreases": self.decreases,
+            "baseline_latency": {k: round(v, 4) for k, v in self.baseline.items()},
+            "classes": {name: stats.snapshot() for name, stats in self.classes.items()},
+        }
+
+
+class ConcurrencyLimits:
+    """Un AdaptiveLimiter por proveedor, creados bajo demanda con la misma configuración"""
+
+    def __init__(self, **limiter_options: Any):
+        self.limiter_options = limiter_options
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, provider: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limiter = AdaptiveLimiter(provider, **self.limiter_options)
+            self._limiters[provider] = limiter
+        return limiter
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: limiter.snapshot() for name, limiter in self._limiters.items()}
@@ -0,0 +1,485 @@
+"""
+Heavy Mode en el cliente: N trayectorias en paralelo con salida anticipada por consenso.
+
+`extra_body={"heavy_mode": True}` solo hace algo si el proveedor lo
+implementa, y la mayoría lo ignoran sin avisar. Este motor lanza él mismo N
+peticiones en streaming contra cualquier proveedor compatible con OpenAI,
+cada una con su propia seed, extrae la respuesta final de cada trayectoria y
+vota. En cuanto una respuesta tiene mayoría absoluta de las N, cancela los
+streams que quedan: no se esperan ni se pagan sus tokens restantes.
+
+Una trayectoria que termina pidiendo herramientas vota por esa acción
+("tool_calls:<nombres>"), así que el consenso también decide el siguiente
+paso de un bucle de herramientas.
+
+El resultado lleva todas las trayectorias (las canceladas con lo que
+llevaban generado), los votos, y el patrón de convergencia y la diversidad
+de las terminadas, con los mismos criterios que kimi_k2_benchmark/src/comparator.py.
+
+El transporte lo pone quien llama: `open_stream(payload)` devuelve los bytes
+SSE de una petición. `http_stream` lo implementa con httpx contra una
+base_url (CLIs, evaluador); el proxy pasa cada trayectoria por su propio
+camino de peticiones.
+"""
+
+import asyncio
+import math
+import re
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+from kimi_proxy.sse import CompletionAccumulator
+
+StreamFactory = Callable[[Dict[str, Any]], AsyncIterator[bytes]]
+
+DEFAULT_TRAJECTORIES = 8
+
+# Con temperature 0 (o sin ella) todas las trayectorias serían la misma
+DEFAULT_TEMPERATURE = 1.0
+
+# Para que la respuesta final se pueda extraer y comparar entre trayectorias
+ANSWER_INSTRUCTION = (
+    "Cuando termines de razonar, escribe en la última línea "
+    "'Respuesta final: ' seguido únicamente de la respuesta."
+)
+
+# Campos que piden Heavy Mode al proveedor: el motor no los reenvía
+HEAVY_FIELDS = ("heavy_mode", "num_trajectories", "hybridization")
+
+# Aproximación habitual: ~4 caracteres por token (trayectorias sin usage)
+CHARS_PER_TOKEN = 4
+
+_BOXED = re.compile(r"\\boxed\{([^{}]*)\}")
+_LABELED = re.compile(
+    r"(?:respuesta final|final answer|respuesta|answer)\W*?[:：]\s*(.+)",
+    re.IGNORECASE
+)
+_MARKUP = re.compile(r"[*_`$]")
+_SPACES = re.compile(r"\s+")
+
+
+def extract_answer(text: str, strict: bool = False) -> Optional[str]:
+    """
+    Respuesta final de una trayectoria
+
+    Por orden: el último \\boxed{...}, la última línea "Respuesta final: ..."
+    (o "Final answer:", "Answer:") y, si no hay ninguna, la última línea no
+    vacía (salvo con `strict`). None si no hay respuesta.
+    """
+    boxed = _BOXED.findall(text)
+    if boxed:
+        return boxed[-1].strip()
+    labeled = _LABELED.findall(text)
+    if labeled:
+        return labeled[-1].strip().strip("*").strip()
+    if strict:
+        return None
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return lines[-1] if lines else None
+
+
+def with_answer_instruction(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Los mensajes con ANSWER_INSTRUCTION tras los system iniciales"""
+    messages = list(messages)
+    leading = 0
+    while leading < len(messages) and messages[leading].get("role") in ("system", "developer"):
+        leading += 1
+    messages.insert(leading, {"role": "system", "content": ANSWER_INSTRUCTION})
+    return messages
+
+
+def normalize_answer(answer: str) -> str:
+    """Forma canónica para votar: sin markdown, minúsculas y sin puntuación final"""
+    answer = _SPACES.sub(" ", _MARKUP.sub("", answer)).strip().lower()
+    return answer.rstrip(".!;:, ")
+
+
+@dataclass
+class Trajectory:
+    """Una de las N peticiones paralelas y lo que devolvió (o llevaba al cancelarla)"""
+
+    index: int
+    seed: int
+    status: str = "running"  # complete, cancelled o error
+    content: str = ""
+    reasoning: str = ""
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+    answer: Optional[str] = None
+    vote: Optional[str] = None
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    ttft: Optional[float] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+    exception: Optional[BaseException] = field(default=None, repr=False)
+
+    @property
+    def completion_tokens(self) -> int:
+        """Tokens generados: los del usage o, sin él, estimados por caracteres"""
+        if self.usage and self.usage.get("completion_tokens") is not None:
+            return self.usage["completion_tokens"]
+        return (len(self.content) + len(self.reasoning)) // CHARS_PER_TOKEN
+
+    def message(self) -> Dict[str, Any]:
+        message: Dict[str, Any] = {"role": "assistant", "content": self.content or None}
+        if self.reasoning:
+            message["reasoning_content"] = self.reasoning
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls
+        return message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "seed": self.seed,
+            "status": self.status,
+            "answer": self.answer,
+            "vote": self.vote,
+            "finish_reason": self.finish_reason,
+            "completion_tokens": self.completion_tokens,
+            "ttft": round(self.ttft, 4) if self.ttft is not None else None,
+            "seconds": round(self.seconds, 4),
+            "error": self.error,
+            "content": self.content,
+            "reasoning": self.reasoning,
+            "tool_calls": self.tool_calls or None,
+        }
+
+
+def convergence_pattern(answers: List[str]) -> str:
+    """
+    'unanimous', 'majority' (más de la mitad), 'split' (alguna coincidencia),
+    'divergent' o 'unknown' si no hay respuestas
+
+    Los criterios de identify_convergence_pattern en el comparator del
+    benchmark, copiados para no depender de kimi_k2_benchmark.
+    """
+    if not answers:
+        return "unknown"
+    top = Counter(answers).most_common(1)[0][1]
+    if top == len(answers):
+        return "unanimous"
+    if top > len(answers) / 2:
+        return "majority"
+    return "split" if top >= 2 else "divergent"
+
+
+def diversity_score(answers: List[str]) -> float:
+    """Respuestas distintas / total (compute_trajectory_diversity del comparator)"""
+    if not answers:
+        return 0.0
+    return round(len(set(answers)) / len(answers), 4)
+
+
+@dataclass
+class HeavyResult:
+    """Trayectorias, votos y la elegida (la primera en terminar de las que ganan)"""
+
+    trajectories: List[Trajectory]
+    votes: Dict[str, int]
+    chosen: Optional[Trajectory]
+    stopped_early: bool
+    elapsed: float
+    model: Optional[str] = None
+
+    @property
+    def finished(self) -> List[Trajectory]:
+        return [t for t in self.trajectories if t.status == "complete"]
+
+    @property
+    def answers(self) -> List[str]:
+        return [t.vote for t in self.finished if t.vote is not None]
+
+    @property
+    def convergence_pattern(self) -> str:
+        return convergence_pattern(self.answers)
+
+    @property
+    def diversity_score(self) -> float:
+        return diversity_score(self.answers)
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """La excepción de la primera trayectoria fallida (para propagarla si no hay respuesta)"""
+        return next((t.exception for t in self.trajectories if t.exception is not None), None)
+
+    @property
+    def tokens_generated(self) -> int:
+        return sum(t.completion_tokens for t in self.trajectories)
+
+    @property
+    def estimated_tokens_saved(self) -> int:
+        """
+        Tokens que les faltaban a las canceladas, estimados con las terminadas
+
+        Las longitudes terminadas se ajustan a una lognormal y, para cada
+        cancelada, se toma la longitud esperada sabiendo que ya pasaba de lo
+        generado. Es una cota baja: las terminadas son las más cortas.
+        """
+        lengths = [t.completion_tokens for t in self.finished if t.completion_tokens > 0]
+        cancelled = [t for t in self.trajectories if t.status == "cancelled"]
+        if not lengths or not cancelled:
+            return 0
+        logs = [math.log(n) for n in lengths]
+        mu = statistics.fmean(logs)
+        sigma = statistics.pstdev(logs)
+        saved = 0.0
+        for trajectory in cancelled:
+            saved += max(0.0, _expected_length(mu, sigma, trajectory.completion_tokens) - trajectory.completion_tokens)
+        return int(saved)
+
+    def usage(self) -> Dict[str, int]:
+        """Uso sumado de todas las trayectorias: es lo que se paga"""
+        prompt = sum((t.usage or {}).get("prompt_tokens") or 0 for t in self.trajectories)
+        completion = self.tokens_generated
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def summary(self, content: bool = True) -> Dict[str, Any]:
+        """Resumen para `kimi_heavy` y para los resultados del benchmark"""
+        trajectories = [t.to_dict() for t in self.trajectories]
+        if not content:
+            for entry in trajectories:
+                entry.pop("content")
+                entry.pop("reasoning")
+        return {
+            "trajectories": trajectories,
+            "chosen": self.chosen.index if self.chosen is not None else None,
+            "answer": self.chosen.answer if self.chosen is not None else None,
+            "votes": self.votes,
+            "convergence_pattern": self.convergence_pattern,
+            "diversity_score": self.diversity_score,
+            "stopped_early": self.stopped_early,
+            "completed": len(self.finished),
+            "cancelled": sum(t.status == "cancelled" for t in self.trajectories),
+            "failed": sum(t.status == "error" for t in self.trajectories),
+            "tokens_generated": self.tokens_generated,
+            "estimated_tokens_saved": self.estimated_tokens_saved,
+            "elapsed": round(self.elapsed, 4),
+        }
+
+    def completion(self) -> Dict[str, Any]:
+        """chat.completion con el mensaje de la trayectoria elegida"""
+        chosen = self.chosen
+        return {
+            "id": f"chatcmpl-heavy-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [{
+                "index": 0,
+                "message": chosen.message() if chosen is not None else {"role": "assistant", "content": None},
+                "finish_reason": chosen.finish_reason if chosen is not None else None,
+            }],
+            "usage": self.usage(),
+        }
+
+
+class HeavyEngine:
+    """
+    Ejecuta una petición de chat como N trayectorias con voto por mayoría
+
+    `on_trajectory(trajectory)` se llama cuando cada trayectoria termina,
+    falla o se cancela.
+    """
+
+    def __init__(
+        self,
+        open_stream: StreamFactory,
+        trajectories: int = DEFAULT_TRAJECTORIES,
+        early_exit: bool = True,
+        instruct: bool = True,
+        on_trajectory: Optional[Callable[[Trajectory], None]] = None
+    ):
+        self.open_stream = open_stream
+        self.trajectories = max(1, trajectories)
+        self.early_exit = early_exit
+        self.instruct = instruct
+        self.on_trajectory = on_trajectory
+
+    @property
+    def quorum(self) -> int:
+        """Votos que forman mayoría absoluta de las N trayectorias"""
+        return self.trajectories // 2 + 1
+
+    def payload(self, data: Dict[str, Any], seed: int) -> Dict[str, Any]:
+        """Petición de una trayectoria: streaming, con su seed y sin los campos de Heavy Mode"""
+        payload = {k: v for k, v in data.items() if k not in HEAVY_FIELDS + ("extra_body", "n")}
+        extra = data.get("extra_body")
+        if isinstance(extra, dict):
+            payload.update({k: v for k, v in extra.items() if k not in HEAVY_FIELDS})
+        payload.update(stream=True, stream_options={"include_usage": True}, seed=seed)
+        if not payload.get("temperature"):
+            payload["temperature"] = DEFAULT_TEMPERATURE
+        if self.instruct:
+            payload["messages"] = with_answer_instruction(payload["messages"])
+        return payload
+
+    async def run(self, data: Dict[str, Any]) -> HeavyResult:
+        """Lanza las N trayectorias y vuelve con mayoría o cuando han terminado todas"""
+        started = time.perf_counter()
+        base_seed = data.get("seed") if isinstance(data.get("seed"), int) else 0
+        trajectories = [Trajectory(index=i, seed=base_seed + i) for i in range(self.trajectories)]
+        pending = {
+            asyncio.ensure_future(self._trajectory(t, self.payload(data, t.seed))) for t in trajectories
+        }
+        stopped_early = False
+        try:
+            while pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if pending and self.early_exit and self._leader(trajectories)[1] >= self.quorum:
+                    stopped_early = True
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        leader, _ = self._leader(trajectories)
+        votes = Counter(t.vote for t in trajectories if t.status == "complete" and t.vote is not None)
+        chosen = None
+        if leader is not None:
+            chosen = min(
+                (t for t in trajectories if t.status == "complete" and t.vote == leader),
+                key=lambda t: t.seconds
+            )
+        return HeavyResult(
+            trajectories=trajectories,
+            votes=dict(votes.most_common()),
+            chosen=chosen,
+            stopped_early=stopped_early,
+            elapsed=time.perf_counter() - started,
+            model=data.get("model"),
+        )
+
+    def _leader(self, trajectories: List[Trajectory]) -> tuple:
+        """(respuesta más votada, votos); empate: la que llegó antes a ese número de votos"""
+        votes: Counter = Counter()
+        leader, best = None, 0
+        for t in sorted((t for t in trajectories if t.status == "complete" and t.vote is not None),
+                        key=lambda t: t.seconds):
+            votes[t.vote] += 1
+            if votes[t.vote] > best:
+                leader, best = t.vote, votes[t.vote]
+        return leader, best
+
+    async def _trajectory(self, trajectory: Trajectory, payload: Dict[str, Any]) -> None:
+        accumulator = CompletionAccumulator()
+        started = time.perf_counter()
+        stream = None
+        try:
+            # Dentro del try: abrir el stream ya puede fallar (p. ej. sin proveedor)
+            stream = self.open_stream(payload)
+            async for chunk in stream:
+                accumulator.feed(chunk)
+                if trajectory.ttft is None and accumulator.choices:
+                    trajectory.ttft = time.perf_counter() - started
+            trajectory.status = "complete" if accumulator.complete else "error"
+            if not accumulator.complete:
+                trajectory.error = "Stream ended before the completion finished"
+        except asyncio.CancelledError:
+            trajectory.status = "cancelled"
+            raise
+        except Exception as e:
+            trajectory.status = "error"
+            trajectory.error = str(e) or type(e).__name__
+            trajectory.exception = e
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            trajectory.seconds = time.perf_counter() - started
+            _fill(trajectory, accumulator)
+            if trajectory.status != "complete":
+                trajectory.vote = None
+            if self.on_trajectory is not None:
+                self.on_trajectory(trajectory)
+
+
+def _expected_length(mu: float, sigma: float, generated: int) -> float:
+    """E[L | L > generated] con L lognormal(mu, sigma); sin dispersión, la media"""
+    mean = math.exp(mu + sigma ** 2 / 2)
+    if sigma <= 0 or generated <= 0:
+        return max(mean, generated)
+    normal = statistics.NormalDist()
+    log_generated = math.log(generated)
+    tail = 1 - normal.cdf((log_generated - mu) / sigma)
+    if tail < 1e-9:
+        return generated
+    return mean * (1 - normal.cdf((log_generated - mu - sigma ** 2) / sigma)) / tail
+
+
+def _fill(trajectory: Trajectory, accumulator: CompletionAccumulator) -> None:
+    """Copia a la trayectoria lo reconstruido del stream y calcula su voto"""
+    completion = accumulator.result()
+    trajectory.usage = completion.get("usage")
+    if not completion["choices"]:
+        return
+    choice = completion["choices"][0]
+    message = choice["message"]
+    trajectory.content = message.get("content") or ""
+    trajectory.reasoning = message.get("reasoning_content") or ""
+    trajectory.tool_calls = message.get("tool_calls") or []
+    trajectory.finish_reason = choice.get("finish_reason")
+    if trajectory.tool_calls:
+        names = sorted(call["function"]["name"] for call in trajectory.tool_calls)
+        trajectory.answer = None
+        trajectory.vote = "tool_calls:" + ",".join(names)
+        return
+    trajectory.answer = extract_answer(trajectory.content)
+    trajectory.vote = normalize_answer(trajectory.answer) if trajectory.answer else None
+
+
+async def stream_post(
+    client: httpx.AsyncClient, url: str, payload: Dict[str, Any], headers: Dict[str, str]
+) -> AsyncIterator[bytes]:
+    """Bytes del stream de un POST; un estado de error se lanza con el cuerpo"""
+    async with client.stream("POST", url, json=payload, headers=headers) as response:
+        if response.is_error:
+            await response.aread()
+            raise httpx.HTTPStatusError(
+                f"HTTP {response.status_code}: {response.text[:300]}",
+                request=response.request,
+                response=response
+            )
+        async for chunk in response.aiter_bytes():
+            yield chunk
+
+
+def http_stream(client: httpx.AsyncClient, base_url: str, api_key: Optional[str] = None) -> StreamFactory:
+    """`open_stream` contra el /chat/completions de un proveedor compatible con OpenAI"""
+    url = f"{base_url.rstrip('/')}/chat/completions"
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def open_stream(payload: Dict[str, Any]) -> AsyncIterator[bytes]:
+        return stream_post(client, url, payload, headers)
+
+    return open_stream
+
+
+def run_heavy(
+    data: Dict[str, Any],
+    base_url: str,
+    api_key: Optional[str] = None,
+    trajectories: int = DEFAULT_TRAJECTORIES,
+    early_exit: bool = True,
+    timeout: float = 600,
+    on_trajectory: Optional[Callable[[Trajectory], None]] = None
+) -> HeavyResult:
+    """Heavy Mode síncrono para los CLIs y el evaluador"""
+    async def main():
+        limits = httpx.Limits(max_connections=trajectories, max_keepalive_connections=trajectories)
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            engine = HeavyEngine(
+                http_stream(client, base_url, api_key),
+                trajectories=trajectories,
+                early_exit=early_exit,
+                on_trajectory=on_trajectory
+            )
+            return await engine.run(data)
+
+    return asyncio.run(main())
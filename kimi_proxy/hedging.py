@@ -0,0 +1,133 @@
+"""
+Peticiones "hedged": si el proveedor elegido tarda en dar el primer token más
+que un percentil de sus TTFT recientes, se lanza la misma petición a un
+proveedor alternativo y se queda la que responda antes; la otra se cancela.
+
+Un presupuesto (HedgeBudget) limita las peticiones extra a una fracción del
+tráfico para que el coste no se dispare.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from kimi_proxy.upstream import UpstreamCall
+
+# Abre la llamada upstream en un proveedor concreto (ya validada)
+Attempt = Callable[[], Awaitable[UpstreamCall]]
+
+
+@dataclass
+class HedgeBudget:
+    """
+    Cubo de tokens: cada petición elegible aporta `ratio` tokens y cada hedge
+    gasta uno, así a largo plazo hay como mucho ratio x peticiones extra
+    """
+    ratio: float = 0.05
+    max_tokens: float = 5.0
+    tokens: float = 0.0
+    requests: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    denied: int = 0
+
+    def record_request(self) -> None:
+        self.requests += 1
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1.0:
+            self.denied += 1
+            return False
+        self.tokens -= 1.0
+        self.hedges += 1
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ratio": self.ratio,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "denied": self.denied,
+            "extra_request_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "tokens": round(self.tokens, 3),
+        }
+
+
+async def first_token(attempt: Attempt) -> UpstreamCall:
+    """
+    Abre la llamada y espera a su primer chunk (que queda guardado en la llamada)
+
+    Si se cancela o falla a mitad, la llamada se cierra y se notifica su resultado.
+    """
+    call = await attempt()
+    if not call.stream:
+        # Sin streaming la llamada ya trae la respuesta completa
+        return call
+    try:
+        await call.prefetch()
+    except asyncio.CancelledError:
+        await call.aclose()
+        call.finish("cancelled")
+        raise
+    except Exception:
+        await call.aclose()
+        call.finish("error")
+        raise
+    return call
+
+
+async def _discard(task: "asyncio.Task[UpstreamCall]") -> None:
+    """Cancela un intento perdedor y cierra su llamada si ya estaba abierta"""
+    if not task.done():
+        task.cancel()
+    try:
+        call = await task
+    except BaseException:
+        return
+    await call.aclose()
+    call.finish("cancelled")
+
+
+async def hedged_call(
+    primary: Attempt,
+    alternate: Optional[Attempt],
+    delay: Optional[float],
+    budget: HedgeBudget,
+) -> Tuple[UpstreamCall, bool]:
+    """
+    Ejecuta `primary` y, si no da el primer token en `delay` segundos, lanza
+    `alternate` (si el presupuesto lo permite) y devuelve el primero que llegue
+
+    Returns:
+        (llamada ganadora con su primer chunk ya leído, se lanzó hedge)
+    """
+    budget.record_request()
+    if alternate is None or delay is None:
+        return await first_token(primary), False
+
+    tasks = [asyncio.ensure_future(first_token(primary))]
+    winner = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not budget.try_spend():
+            winner = tasks[0]
+            return await winner, False
+
+        tasks.append(asyncio.ensure_future(first_token(alternate)))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    if task is tasks[1]:
+                        budget.hedge_wins += 1
+                    return task.result(), True
+                error = error or task.exception()
+        raise error
+    finally:
+        # El perdedor (o todos, si nos cancelan) se corta
+        await asyncio.gather(*[_discard(t) for t in tasks if t is not winner])
@@ -0,0 +1,94 @@
+"""
+Arranque del proxy: modo desarrollo (un proceso con recarga) o producción
+con varios workers.
+
+En producción uvicorn hace de master pre-fork: abre el socket una vez y
+lanza N procesos que lo comparten. Lo que debe verse igual desde todos los
+workers vive fuera de su memoria:
+
+- caché de respuestas: la base SQLite en disco (ya compartida);
+- límites por cliente: buckets en una SQLite del directorio de estado;
+- métricas: modo multiproceso de prometheus_client (un mmap por worker,
+  agregados al servir /metrics).
+
+Con SIGTERM el master lo reenvía a los workers: cada uno deja de aceptar
+conexiones, espera a que terminen las peticiones y streams en curso hasta
+`drain_timeout` segundos, cancela lo que quede y sale.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+
+# Directorio con el estado compartido entre workers (lo crea el master)
+STATE_DIR_ENV = "KIMI_PROXY_STATE_DIR"
+METRICS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def default_workers() -> int:
+    """Un worker por núcleo disponible para este proceso"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def prepare_shared_state(directory: Optional[Path] = None) -> Path:
+    """
+    Crea el directorio de estado compartido y lo exporta a los workers
+
+    Debe llamarse en el master antes de lanzar los workers: prometheus_client
+    decide el modo multiproceso al importarse.
+    """
+    state = Path(directory) if directory else Path(tempfile.mkdtemp(prefix="kimi-proxy-"))
+    metrics_dir = state / "metrics"
+    # Restos de una ejecución anterior falsearían los contadores
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True)
+    os.environ[STATE_DIR_ENV] = str(state)
+    os.environ[METRICS_DIR_ENV] = str(metrics_dir)
+    return state
+
+
+def serve(
+    app: str,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    workers: Optional[int] = None,
+    drain_timeout: float = 30.0,
+    dev: bool = False,
+    log_level: str = "info",
+) -> None:
+    """
+    Arranca uvicorn con `app` ("modulo:atributo")
+
+    Con dev=True: un proceso con recarga al cambiar ficheros. Si no, `workers`
+    procesos (por defecto uno por núcleo) con estado compartido y drenado
+    ordenado al recibir SIGTERM.
+    """
+    if dev:
+        uvicorn.run(app, host=host, port=port, reload=True, log_level=log_level)
+        return
+
+    workers = workers or default_workers()
+    owned_state = None
+    if workers > 1:
+        configured = os.getenv(STATE_DIR_ENV)
+        state = prepare_shared_state(Path(configured) if configured else None)
+        owned_state = None if configured else state
+    try:
+        uvicorn.run(
+            app,
+            host=host,
+            port=port,
+            workers=workers,
+            timeout_graceful_shutdown=drain_timeout,
+            log_level=log_level,
+        )
+    finally:
+        if owned_state is not None:
+            shutil.rmtree(owned_state, ignore_errors=True)
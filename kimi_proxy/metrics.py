@@ -0,0 +1,279 @@
+"""
+Métricas Prometheus del proxy (endpoint /metrics).
+
+Las series por llamada upstream se alimentan desde UpstreamCall: el TTFT y
+los intervalos entre chunks se miden en mark_chunk con el hijo del histograma
+ya resuelto, sin crear objetos por chunk; el resto (estado, tokens, tokens/s)
+se registra una vez al terminar la llamada.
+
+Con varios workers (PROMETHEUS_MULTIPROC_DIR definido antes de importar
+prometheus_client) cada proceso escribe sus series en un mmap y /metrics
+agrega los de todos los workers vivos.
+"""
+
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from kimi_proxy.upstream import UpstreamCall
+
+# Buckets pensados para un modelo de razonamiento: TTFT de ms a minutos
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60, 120)
+CONNECT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+INTER_TOKEN_BUCKETS = (0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.2, 0.5, 1, 2.5)
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 30, 40, 60, 80, 120, 160, 250, 500)
+
+
+def _provider_name(call: UpstreamCall) -> str:
+    provider = call.provider
+    return getattr(provider, "name", None) or "unknown"
+
+
+def extract_usage(call: UpstreamCall) -> Optional[Dict[str, Any]]:
+    """
+    Bloque `usage` de la respuesta: el cuerpo JSON o el último evento SSE que lo traiga
+
+    En streaming solo se miran los dos últimos chunks (el de usage va justo antes de [DONE]).
+    """
+    try:
+        if not call.stream:
+            return orjson.loads(call.response.content).get("usage")
+        tail = call.previous_chunk + call.last_chunk
+        at = tail.rfind(b'"usage"')
+        if at < 0:
+            return None
+        start = tail.rfind(b"data:", 0, at)
+        end = tail.find(b"\n", at)
+        event = orjson.loads(tail[start + 5:end if end >= 0 else len(tail)])
+        return event.get("usage")
+    except (orjson.JSONDecodeError, AttributeError, ValueError):
+        return None
+
+
+class ProxyMetrics:
+    """Series Prometheus del proxy registradas en `registry`"""
+
+    def __init__(self, registry: Optional[CollectorRegistry] = None):
+        self.registry = registry if registry is not None else REGISTRY
+        r = self.registry
+
+        self.requests = Counter(
+            "kimi_proxy_upstream_requests", "Upstream calls by model, provider and status",
+            ["model", "provider", "status"], registry=r)
+        self.in_flight = Gauge(
+            "kimi_proxy_upstream_in_flight", "Upstream calls currently open",
+            ["provider"], multiprocess_mode="livesum", registry=r)
+        self.connect_time = Histogram(
+            "kimi_proxy_upstream_connect_seconds", "Time until upstream response headers",
+            ["provider"], buckets=CONNECT_BUCKETS, registry=r)
+        self.ttft = Histogram(
+            "kimi_proxy_ttft_seconds", "Time to first streamed chunk",
+            ["model", "provider"], buckets=TTFT_BUCKETS, registry=r)
+        self.inter_token = Histogram(
+            "kimi_proxy_inter_token_seconds", "Gap between consecutive streamed chunks",
+            ["provider"], buckets=INTER_TOKEN_BUCKETS, registry=r)
+        self.tokens_per_second = Histogram(
+            "kimi_proxy_output_tokens_per_second", "Completion tokens per second after the first chunk",
+            ["model", "provider"], buckets=TOKENS_PER_SECOND_BUCKETS, registry=r)
+        self.tokens = Counter(
+            "kimi_proxy_tokens", "Prompt and completion tokens reported by the upstream",
+            ["model", "provider", "type"], registry=r)
+        self.cache_lookups = Counter(
+            "kimi_proxy_cache_lookups", "Response cache lookups by result",
+            ["result"], registry=r)
+        self.cache_hit_ratio = Gauge(
+            "kimi_proxy_cache_hit_ratio", "Response cache hits / lookups since start",
+            multiprocess_mode="liveall", registry=r)
+        self.cancelled = Counter(
+            "kimi_proxy_cancelled_requests", "Requests cut because the client disconnected",
+            ["stream"], registry=r)
+        self.concurrency_limit = Gauge(
+            "kimi_proxy_concurrency_limit", "Adaptive concurrency limit per provider",
+            ["provider"], multiprocess_mode="liveall", registry=r)
+        self.queue_depth = Gauge(
+            "kimi_proxy_admission_queue_depth", "Requests waiting for an upstream slot",
+            ["provider"], multiprocess_mode="livesum", registry=r)
+        self.rejected = Counter(
+            "kimi_proxy_admission_rejected", "Requests rejected with 503 by admission control",
+            ["provider", "reason"], registry=r)
+        self.queue_wait = Histogram(
+            "kimi_proxy_queue_wait_seconds", "Time waiting for an upstream slot by priority class",
+            ["provider", "priority"], buckets=CONNECT_BUCKETS + (30, 60), registry=r)
+        self.rate_limited = Counter(
+            "kimi_proxy_rate_limited", "Requests rejected with 429 by per-client token buckets",
+            ["priority"], registry=r)
+        self.retries = Counter(
+            "kimi_proxy_upstream_retries", "Upstream calls retried after a transient error",
+            ["provider"], registry=r)
+        self.cancelled_tokens = Counter(
+            "kimi_proxy_cancelled_tokens_saved", "Estimated tokens not generated after disconnects",
+            registry=r)
+        self.agent_round = Histogram(
+            "kimi_proxy_agent_round_seconds", "Server-side agent rounds: model time vs tool time",
+            ["phase"], buckets=TTFT_BUCKETS, registry=r)
+        self.agent_tool_calls = Counter(
+            "kimi_proxy_agent_tool_calls", "Tool calls executed by the server-side agent loop",
+            ["tool", "status"], registry=r)
+        self.affinity = Counter(
+            "kimi_proxy_affinity_requests", "Prefix-affinity routing decisions (hit = same replica as last time)",
+            ["group", "result"], registry=r)
+        self.affinity_spills = Counter(
+            "kimi_proxy_affinity_spills", "Requests sent past their preferred replica because it was overloaded",
+            ["group"], registry=r)
+        self.session_bytes = Counter(
+            "kimi_proxy_session_bytes", "Session turns: bytes received vs history bytes reused from the store",
+            ["kind"], registry=r)
+        self.session_parse_saved = Counter(
+            "kimi_proxy_session_parse_saved_seconds", "Estimated JSON parse time saved by not receiving session history",
+            registry=r)
+        self.heavy_trajectories = Counter(
+            "kimi_proxy_heavy_trajectories", "Heavy Mode trajectories by outcome (complete, cancelled by consensus, error)",
+            ["status"], registry=r)
+        self.heavy_tokens_saved = Counter(
+            "kimi_proxy_heavy_tokens_saved", "Estimated completion tokens not generated thanks to early-exit consensus",
+            registry=r)
+        self.cascade_attempts = Counter(
+            "kimi_proxy_cascade_attempts", "Cascade tier attempts by outcome (accepted, escalated, fallback, error)",
+            ["tier", "status"], registry=r)
+        self.cascade_seconds = Histogram(
+            "kimi_proxy_cascade_tier_seconds", "Time spent in each cascade tier",
+            ["tier"], buckets=TTFT_BUCKETS, registry=r)
+        self.cascade_cost = Counter(
+            "kimi_proxy_cascade_cost_usd", "Cascade cost actually spent vs the same answers at the baseline tier",
+            ["kind"], registry=r)
+
+        self._cache_hits = 0
+        self._cache_total = 0
+
+    def track(self, call: UpstreamCall) -> None:
+        """Empieza a medir una llamada upstream recién abierta"""
+        provider = _provider_name(call)
+        self.in_flight.labels(provider).inc()
+        self.connect_time.labels(provider).observe(call.headers_at - call.started)
+        if call.stream:
+            call.on_gap = self.inter_token.labels(provider).observe
+        call.add_listener(self._on_finish)
+
+    def _on_finish(self, call: UpstreamCall, outcome: str) -> None:
+        provider = _provider_name(call)
+        model = call.model or "unknown"
+        self.in_flight.labels(provider).dec()
+        status = "cancelled" if outcome == "cancelled" else str(call.response.status_code)
+        if outcome == "error" and call.response.is_success:
+            status = "stream_error"
+        self.requests.labels(model, provider, status).inc()
+        if outcome != "ok":
+            return
+
+        if call.stream and call.ttft is not None:
+            self.ttft.labels(model, provider).observe(call.ttft)
+
+        usage = extract_usage(call) or {}
+        completion_tokens = usage.get("completion_tokens")
+        if usage.get("prompt_tokens"):
+            self.tokens.labels(model, provider, "prompt").inc(usage["prompt_tokens"])
+        if completion_tokens:
+            self.tokens.labels(model, provider, "completion").inc(completion_tokens)
+
+        if call.stream and call.first_chunk_at is not None:
+            # Sin usage en el stream, cada evento SSE se cuenta como un token
+            generated = completion_tokens or call.events
+            elapsed = call.last_chunk_at - call.first_chunk_at
+            if generated and elapsed > 0:
+                self.tokens_per_second.labels(model, provider).observe(generated / elapsed)
+
+    def observe_connect_error(self, provider: str, model: str) -> None:
+        """Llamada que no llegó a recibir cabeceras (DNS, conexión, timeout...)"""
+        self.requests.labels(model, provider, "connect_error").inc()
+
+    def observe_cache(self, level: str) -> None:
+        """Resultado de una consulta a la caché: 'memory', 'disk' o 'miss'"""
+        self.cache_lookups.labels(level).inc()
+        self._cache_total += 1
+        if level != "miss":
+            self._cache_hits += 1
+        self.cache_hit_ratio.set(self._cache_hits / self._cache_total)
+
+    def observe_cancellation(self, stream: bool, tokens_saved: int) -> None:
+        self.cancelled.labels("true" if stream else "false").inc()
+        self.cancelled_tokens.inc(tokens_saved)
+
+    def observe_limiter(self, limiter: Any) -> None:
+        """Estado de un AdaptiveLimiter tras cada cambio"""
+        self.concurrency_limit.labels(limiter.name).set(limiter.limit)
+        self.queue_depth.labels(limiter.name).set(limiter.queue_depth)
+
+    def observe_rejection(self, provider: str, reason: str) -> None:
+        self.rejected.labels(provider, reason).inc()
+
+    def observe_queue_wait(self, provider: str, priority: str, seconds: float) -> None:
+        self.queue_wait.labels(provider, priority).observe(seconds)
+
+    def observe_rate_limited(self, priority: str) -> None:
+        self.rate_limited.labels(priority).inc()
+
+    def observe_retry(self, provider: str) -> None:
+        self.retries.labels(provider).inc()
+
+    def observe_agent_round(self, record: Dict[str, Any]) -> None:
+        """Una ronda del bucle de agente (entrada de la traza `kimi_agent.rounds`)"""
+        self.agent_round.labels("model").observe(record["model_seconds"])
+        if record["tool_calls"]:
+            self.agent_round.labels("tools").observe(record["tool_seconds"])
+        for call in record["tool_calls"]:
+            self.agent_tool_calls.labels(call["name"], call["status"]).inc()
+
+    def observe_affinity(self, group: str, result: str, spilled: bool) -> None:
+        """Una decisión del router por afinidad de prefijo ("new", "hit" o "miss")"""
+        self.affinity.labels(group, result).inc()
+        if spilled:
+            self.affinity_spills.labels(group).inc()
+
+    def observe_session_turn(self, record: Dict[str, Any]) -> None:
+        """Un turno de sesión (Turn.stats): bytes recibidos, reutilizados y parseo ahorrado"""
+        self.session_bytes.labels("ingress").inc(record["ingress_bytes"])
+        self.session_bytes.labels("reused").inc(record["reused_bytes"])
+        self.session_parse_saved.inc(record["parse_saved_ms"] / 1000)
+
+    def observe_heavy(self, summary: Dict[str, Any]) -> None:
+        """Una petición en Heavy Mode (HeavyResult.summary): trayectorias y tokens ahorrados"""
+        for trajectory in summary["trajectories"]:
+            self.heavy_trajectories.labels(trajectory["status"]).inc()
+        self.heavy_tokens_saved.inc(summary["estimated_tokens_saved"])
+
+    def observe_cascade(self, summary: Dict[str, Any]) -> None:
+        """Una petición en cascada (CascadeResult.summary): niveles recorridos y coste"""
+        for attempt in summary["attempts"]:
+            self.cascade_attempts.labels(attempt["tier"], attempt["status"]).inc()
+            self.cascade_seconds.labels(attempt["tier"]).observe(attempt["seconds"])
+        self.cascade_cost.labels("actual").inc(summary["cost_usd"])
+        if summary["baseline_cost_usd"] is not None:
+            self.cascade_cost.labels("baseline").inc(summary["baseline_cost_usd"])
+
+    @property
+    def multiprocess(self) -> bool:
+        return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR")) and self.registry is REGISTRY
+
+    def render(self) -> Tuple[bytes, str]:
+        """Exposición en formato texto de Prometheus (agregada entre workers si los hay)"""
+        if self.multiprocess:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+    def close(self) -> None:
+        """Al apagar un worker: sus gauges dejan de contar en el agregado"""
+        if self.multiprocess:
+            multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,139 @@
+"""
+Cuerpo de una petición de chat tal como llegó del cliente.
+
+El proxy solo necesita unos pocos campos (model, messages, stream, max_tokens)
+para enrutar, limitar y cachear; el resto se reenvía sin tocar. En lugar de
+validar todo con Pydantic y reconstruir un dict nuevo, el JSON se parsea una
+vez con orjson, se comprueban esos campos y al upstream se envían los bytes
+originales, cambiando solo el nombre del modelo cuando el proveedor usa otro.
+Así no se pierden campos que el proxy no conoce (stream_options, contenido
+multimodal...) y no se vuelven a serializar contextos de cientos de KB.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+# Clave "model" con un string como valor. Dentro de un string JSON las comillas
+# van escapadas, así que solo puede coincidir con claves reales del documento
+_MODEL_FIELD = re.compile(rb'"model"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class InvalidRequest(ValueError):
+    """El cuerpo no es una petición de chat que el proxy pueda reenviar"""
+
+
+class ChatBody:
+    """
+    Petición de chat: dict parseado más, si se conservan, los bytes originales
+
+    Con `raw=None` (peticiones construidas por el propio proxy) el cuerpo
+    upstream se serializa desde `data`. Quien arma `raw` sabiendo dónde está
+    el valor de "model" puede pasar `model_span` y ahorrarse la búsqueda.
+    """
+
+    __slots__ = ("data", "raw", "_model_span", "_encoded")
+
+    def __init__(
+        self,
+        data: Dict[str, Any],
+        raw: Optional[bytes] = None,
+        model_span: Optional[Tuple[int, int]] = None
+    ):
+        self.data = data
+        self.raw = raw
+        self._model_span = model_span
+        self._encoded: Dict[str, bytes] = {}
+        _validate(data)
+        if raw is not None and model_span is None:
+            self._model_span = _find_model(raw, data["model"])
+
+    @classmethod
+    def parse(cls, raw: bytes, default_model: str) -> "ChatBody":
+        """
+        Parsea el cuerpo HTTP sin copiarlo
+
+        Raises:
+            InvalidRequest: si no es JSON o faltan campos obligatorios
+        """
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            raise InvalidRequest(f"Invalid JSON body: {e}")
+        if not isinstance(data, dict):
+            raise InvalidRequest("Request body must be a JSON object")
+        return cls.from_data(data, default_model, raw)
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any], default_model: str, raw: Optional[bytes] = None) -> "ChatBody":
+        """Completa el modelo por defecto y extra_body; ambos obligan a reserializar"""
+        if data.get("model") is None:
+            data = {**data, "model": default_model}
+            raw = None
+        if isinstance(data.get("extra_body"), dict):
+            # Igual que el SDK de OpenAI: extra_body se mezcla en el cuerpo
+            extra = data["extra_body"]
+            data = {k: v for k, v in data.items() if k != "extra_body"}
+            data.update(extra)
+            raw = None
+        return cls(data, raw)
+
+    @property
+    def model(self) -> str:
+        return self.data["model"]
+
+    @property
+    def messages(self) -> List[Any]:
+        return self.data["messages"]
+
+    @property
+    def stream(self) -> bool:
+        return bool(self.data.get("stream"))
+
+    @property
+    def max_tokens(self) -> Optional[int]:
+        return self.data.get("max_tokens")
+
+    def encode(self, upstream_model: str) -> bytes:
+        """Cuerpo para el proveedor, con su nombre del modelo"""
+        encoded = self._encoded.get(upstream_model)
+        if encoded is None:
+            if self.raw is not None and upstream_model == self.model:
+                encoded = self.raw
+            elif self.raw is not None and self._model_span is not None:
+                start, end = self._model_span
+                encoded = self.raw[:start] + orjson.dumps(upstream_model) + self.raw[end:]
+            else:
+                encoded = orjson.dumps({**self.data, "model": upstream_model})
+            self._encoded[upstream_model] = encoded
+        return encoded
+
+
+def _validate(data: Dict[str, Any]) -> None:
+    """Solo los campos que usa el proxy; el resto lo valida el upstream"""
+    if not isinstance(data.get("model"), str):
+        raise InvalidRequest("'model' must be a string")
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise InvalidRequest("'messages' must be a non-empty list")
+    if not all(isinstance(m, dict) and m.get("role") for m in messages):
+        raise InvalidRequest("'messages' must be a list of objects with a 'role'")
+    if not isinstance(data.get("stream", False), (bool, type(None))):
+        raise InvalidRequest("'stream' must be a boolean")
+    max_tokens = data.get("max_tokens")
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int)):
+        raise InvalidRequest("'max_tokens' must be an integer")
+
+
+def _find_model(raw: bytes, model: str) -> Optional[Tuple[int, int]]:
+    """
+    Posición del valor de "model" en los bytes originales
+
+    Si hay más de una clave "model" (p.ej. dentro de un JSON schema de tools)
+    no se puede saber cuál es la de primer nivel: None y se reserializa.
+    """
+    matches = list(_MODEL_FIELD.finditer(raw))
+    if len(matches) != 1 or orjson.loads(matches[0].group(1)) != model:
+        return None
+    return matches[0].span(1)
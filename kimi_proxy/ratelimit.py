@@ -0,0 +1,281 @@
+"""
+Límites por cliente con token buckets: peticiones/minuto y tokens/minuto.
+
+El cliente se identifica por la cabecera X-Kimi-Client, por la API key
+(solo se guarda su hash) o, en su defecto, por la IP. Los tokens se cobran
+por adelantado con una estimación (prompt + max_tokens) y se devuelve la
+diferencia cuando el upstream informa del uso real.
+
+Con varios workers, SharedRateLimiter guarda los buckets en una SQLite
+común para que la cuota de cada cliente sea la misma con 1 o N procesos.
+El proxy usa check_async() y refund_background(), que en ese caso llevan
+la transacción a un hilo para no bloquear el event loop esperando el
+bloqueo de escritura de otro worker.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+import xxhash
+
+
+def identify_client(headers: Mapping[str, str], host: Optional[str] = None) -> str:
+    """Identificador estable del cliente para aplicar sus límites"""
+    explicit = headers.get("x-kimi-client")
+    if explicit:
+        return explicit
+    authorization = headers.get("authorization", "")
+    if authorization.lower().startswith("bearer ") and len(authorization) > 7:
+        return "key:" + xxhash.xxh3_64_hexdigest(authorization[7:].strip().encode())
+    return f"ip:{host or 'unknown'}"
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int]) -> int:
+    """Cota aproximada de tokens de una petición (~4 caracteres por token de prompt)"""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Cubo de `capacity` tokens que se rellena a `rate` tokens/s"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """Segundos hasta que haya `amount` tokens (0 si ya los hay)"""
+        self._refill(now if now is not None else time.monotonic())
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Un par de token buckets (peticiones y tokens) por cliente
+
+    Los límites son por minuto y admiten ráfagas de hasta un minuto de cuota;
+    0 desactiva el límite correspondiente.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._clients: Dict[str, Dict[str, TokenBucket]] = {}
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _new_buckets(self) -> Dict[str, TokenBucket]:
+        buckets = {}
+        if self.requests_per_minute:
+            buckets["requests"] = TokenBucket(self.requests_per_minute / 60, self.requests_per_minute)
+        if self.tokens_per_minute:
+            buckets["tokens"] = TokenBucket(self.tokens_per_minute / 60, self.tokens_per_minute)
+        return buckets
+
+    def _buckets(self, client: str) -> Dict[str, TokenBucket]:
+        buckets = self._clients.get(client)
+        if buckets is None:
+            buckets = self._clients[client] = self._new_buckets()
+        return buckets
+
+    def check(self, client: str, tokens: int) -> float:
+        """
+        Cobra una petición de `tokens` tokens estimados
+
+        Returns:
+            0 si se admite; si no, segundos a esperar (nada se cobra)
+        """
+        if not self.enabled:
+            return 0.0
+        buckets = self._buckets(client)
+        now = time.monotonic()
+        cost = {"requests": 1, "tokens": tokens}
+        wait = max(bucket.wait_time(cost[name], now) for name, bucket in buckets.items())
+        if wait > 0:
+            self.rejected[client] = self.rejected.get(client, 0) + 1
+            return wait
+        for name, bucket in buckets.items():
+            bucket.take(cost[name])
+        return 0.0
+
+    def refund(self, client: str, tokens: int) -> None:
+        """Devuelve tokens cobrados de más (uso real menor que la estimación)"""
+        bucket = self._clients.get(client, {}).get("tokens")
+        if bucket is not None and tokens > 0:
+            bucket.refund(tokens)
+
+    async def check_async(self, client: str, tokens: int) -> float:
+        """check() desde el event loop; en memoria no hace falta un hilo"""
+        return self.check(client, tokens)
+
+    def refund_background(self, client: str, tokens: int) -> None:
+        """refund() sin bloquear a quien lo llama (callbacks del event loop)"""
+        self.refund(client, tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "clients": {
+                client: {
+                    **{f"{name}_available": round(bucket.tokens, 1) for name, bucket in buckets.items()},
+                    "rejected": self.rejected.get(client, 0),
+                }
+                for client, buckets in self._clients.items()
+            },
+        }
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter con los buckets en SQLite, compartidos entre procesos
+
+    Cada comprobación es una transacción corta (WAL, sin fsync: el estado es
+    efímero y se pierde sin problema si se cae la máquina). El reloj es
+    time.time() porque el estado lo leen varios procesos.
+    """
+
+    def __init__(self, path: Path, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " client TEXT NOT NULL, name TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL,"
+            " PRIMARY KEY (client, name))"
+        )
+
+    def _load(self, client: str) -> Dict[str, TokenBucket]:
+        buckets = self._new_buckets()
+        rows = self._conn.execute(
+            "SELECT name, tokens, updated FROM buckets WHERE client = ?", (client,)
+        ).fetchall()
+        now = time.time()
+        for bucket in buckets.values():
+            bucket.updated = now
+        for name, tokens, updated in rows:
+            if name in buckets:
+                buckets[name].tokens = tokens
+                buckets[name].updated = updated
+        return buckets
+
+    def _store(self, client: str, buckets: Dict[str, TokenBucket]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO buckets (client, name, tokens, updated) VALUES (?, ?, ?, ?)",
+            [(client, name, bucket.tokens, bucket.updated) for name, bucket in buckets.items()]
+        )
+
+    def check(self, client: str, tokens: int) -> float:
+        if not self.enabled:
+            return 0.0
+        cost = {"requests": 1, "tokens": tokens}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                buckets = self._load(client)
+                now = time.time()
+                wait = max(bucket.wait_time(cost[name], now) for name, bucket in buckets.items())
+                if wait <= 0:
+                    for name, bucket in buckets.items():
+                        bucket.take(cost[name])
+                self._store(client, buckets)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if wait > 0:
+            self.rejected[client] = self.rejected.get(client, 0) + 1
+            return wait
+        return 0.0
+
+    def refund(self, client: str, tokens: int) -> None:
+        if not self.tokens_per_minute or tokens <= 0:
+            return
+        with self._lock:
+            self._conn.execute(
+                "UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE client = ? AND name = 'tokens'",
+                (self.tokens_per_minute, tokens, client)
+            )
+
+    async def check_async(self, client: str, tokens: int) -> float:
+        if not self.enabled:
+            return 0.0
+        return await asyncio.to_thread(self.check, client, tokens)
+
+    def refund_background(self, client: str, tokens: int) -> None:
+        if not self.tokens_per_minute or tokens <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.refund(client, tokens)
+            return
+        loop.run_in_executor(None, self.refund, client, tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT client, name, tokens FROM buckets").fetchall()
+        clients: Dict[str, Dict[str, Any]] = {}
+        for client, name, tokens in rows:
+            clients.setdefault(client, {"rejected": self.rejected.get(client, 0)})[f"{name}_available"] = round(tokens, 1)
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "shared": True,
+            "clients": clients,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TokenCharge:
+    """
+    Estimación de tokens cobrada a un cliente antes de llamar upstream
+
+    Se liquida una sola vez: entera si la petición no llegó a gastar tokens
+    upstream (desconexión, error, seguidora de una llamada compartida) o con
+    la diferencia frente al uso real. Sirve a RateLimiter y SharedRateLimiter.
+    """
+
+    def __init__(self, limiter: Any, client: str, estimate: int):
+        self.limiter = limiter
+        self.client = client
+        self.estimate = estimate
+        self.settled = False
+
+    def settle(self, used: int) -> None:
+        """Devuelve lo cobrado de más según `used` tokens reales"""
+        if self.settled:
+            return
+        self.settled = True
+        self.limiter.refund_background(self.client, self.estimate - used)
+
+    def refund(self) -> None:
+        """Devuelve toda la estimación"""
+        self.settle(0)
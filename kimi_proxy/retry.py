@@ -0,0 +1,126 @@
+"""
+Reintentos de la apertura de llamadas upstream con backoff "decorrelated jitter".
+
+Solo se reintenta lo que es seguro repetir: errores de conexión (la petición
+no llegó a procesarse), 429 y 5xx. Como los reintentos envuelven la apertura
+de la llamada (cabeceras en streaming, cuerpo completo sin streaming), nunca
+se repite nada después de que el cliente haya recibido bytes.
+
+Se apoya en `backoff`: el generador de esperas recibe cada excepción, así
+puede respetar Retry-After cuando el proveedor lo envía.
+"""
+
+import email.utils
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Generator, Optional
+
+import backoff
+import httpx
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Errores en los que la petición no llegó a procesarse upstream
+RETRY_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Segundos pedidos en la cabecera Retry-After (número o fecha HTTP)"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, RETRY_TRANSPORT_ERRORS)
+
+
+def decorrelated_jitter(
+    base: float = 0.25,
+    cap: float = 8.0,
+    rng: Any = random,
+) -> Generator[Optional[float], BaseException, None]:
+    """
+    Generador de esperas para backoff: sleep = min(cap, U(base, 3 x sleep anterior))
+
+    Si el error trae Retry-After, se espera exactamente eso.
+    """
+    sleep = base
+    error = yield None
+    while True:
+        sleep = min(cap, rng.uniform(base, sleep * 3))
+        retry_after = retry_after_seconds(error) if error is not None else None
+        error = yield retry_after if retry_after is not None else sleep
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Cuántas veces y cómo reintentar
+
+    Un Retry-After mayor que `max_retry_after` no se espera: se devuelve el error.
+    """
+    max_tries: int = 3
+    base_delay: float = 0.25
+    max_delay: float = 8.0
+    max_retry_after: float = 30.0
+    retries: int = 0
+    exhausted: int = 0
+
+    def _give_up(self, error: BaseException) -> bool:
+        if not is_retryable(error):
+            return True
+        retry_after = retry_after_seconds(error)
+        return retry_after is not None and retry_after > self.max_retry_after
+
+    async def run(
+        self,
+        attempt: Callable[[], Awaitable[Any]],
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+    ) -> Any:
+        """
+        Ejecuta `attempt` reintentando los errores transitorios
+
+        Args:
+            attempt: Abre la llamada (puede elegir otro proveedor en cada intento)
+            on_retry: Se llama con el error antes de cada espera
+        """
+        def backoff_handler(details):
+            self.retries += 1
+            if on_retry is not None:
+                on_retry(details["exception"])
+
+        def giveup_handler(details):
+            if is_retryable(details["exception"]):
+                self.exhausted += 1
+
+        retrying = backoff.on_exception(
+            decorrelated_jitter,
+            (httpx.HTTPError,),
+            max_tries=self.max_tries,
+            jitter=None,
+            giveup=self._give_up,
+            on_backoff=backoff_handler,
+            on_giveup=giveup_handler,
+            base=self.base_delay,
+            cap=self.max_delay,
+        )(attempt)
+        return await retrying()
+
+    def snapshot(self):
+        return {"max_tries": self.max_tries, "retries": self.retries, "exhausted": self.exhausted}
@@ -0,0 +1,430 @@
+"""
+Router multi-proveedor con selección sensible a la latencia.
+
+Los proveedores se cargan de kimi_k2_benchmark/config/models.yaml (secciones
+`providers`, `model_aliases` y `env_keys`). Para cada petición se eligen los
+proveedores sanos que sirven el modelo y, entre ellos, se aplica "power of two
+choices": se toman dos al azar (ponderados por `weight`) y gana el de menor
+coste = EWMA del TTFT x (peticiones en curso + 1) / weight.
+
+Cada proveedor lleva un circuit breaker: tras varios fallos seguidos (429,
+5xx, errores de conexión) deja de elegirse hasta que una petición de prueba
+salga bien.
+
+Se puede fijar el proveedor por petición (cabecera X-Kimi-Provider) o para
+todo el proceso (KIMI_PROXY_PROVIDER).
+
+Un proveedor con `api: completions` solo sirve /v1/completions: el proxy le
+envía el prompt ya renderizado y traduce el texto crudo a formato de chat
+(ver kimi_proxy/completions.py).
+
+Un proveedor con `replicas` se despliega en un proveedor por réplica
+(`nombre/0`, `nombre/1`...), cada uno con su breaker, su límite de
+concurrencia y su carga. Con `routing: prefix_affinity` las peticiones que
+comparten el comienzo de la conversación van a la misma réplica para
+aprovechar su caché KV de prefijos (ver kimi_proxy/affinity.py).
+"""
+
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+
+from kimi_proxy.affinity import AffinityStats, HashRing, bounded_choice
+from kimi_proxy.circuit import CircuitBreaker
+from kimi_proxy.upstream import UpstreamCall
+
+DEFAULT_CONFIG_PATH = Path(__file__).parent.parent / "kimi_k2_benchmark" / "config" / "models.yaml"
+
+# TTFT supuesto (s) para proveedores sin observaciones todavía
+DEFAULT_PRIOR_TTFT = 1.0
+
+# Circuit breaker: fallos consecutivos para abrir y segundos hasta la prueba
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("KIMI_PROXY_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("KIMI_PROXY_BREAKER_COOLDOWN", "30"))
+
+# Estados HTTP que cuentan como fallo del proveedor (los demás 4xx son del cliente)
+PROVIDER_FAILURE_STATUSES = (408, 429)
+
+# Muestras de TTFT recientes por proveedor (para percentiles)
+TTFT_WINDOW = 200
+
+# API que habla cada proveedor: chat completions o completions con texto crudo
+PROVIDER_APIS = ("chat", "completions")
+
+# Reparto entre las réplicas de un proveedor: afinidad de prefijo o el p2c de siempre
+REPLICA_ROUTING = ("prefix_affinity", "p2c")
+
+# Carga máxima de una réplica con afinidad, relativa a la media del grupo
+AFFINITY_LOAD_FACTOR = float(os.getenv("KIMI_AFFINITY_LOAD_FACTOR", "1.25"))
+
+
+class NoProviderAvailable(Exception):
+    """Ningún proveedor configurado sirve el modelo pedido"""
+
+
+@dataclass
+class Provider:
+    """Un endpoint OpenAI-compatible y su estado de latencia/salud"""
+    name: str
+    api_base: str
+    api_key: Optional[str] = None
+    label: Optional[str] = None
+    models: Dict[str, str] = field(default_factory=dict)
+    weight: float = 1.0
+    default: bool = False
+    headers: Dict[str, str] = field(default_factory=dict)
+    requires_key: bool = True
+    api: str = "chat"
+    # Réplicas: proveedor del YAML al que pertenecen y si se reparten por afinidad
+    group: Optional[str] = None
+    affinity: bool = False
+
+    # Estado en tiempo de ejecución
+    ewma_ttft: Optional[float] = None
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    breaker: CircuitBreaker = field(
+        default_factory=lambda: CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+    )
+    # TTFT recientes separados por tipo: "stream" (primer byte) y "json" (respuesta completa)
+    ttft_samples: Dict[str, Deque[float]] = field(default_factory=dict)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key) or not self.requires_key
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        return self.configured and self.breaker.available(now)
+
+    def upstream_model(self, canonical: str) -> Optional[str]:
+        """Nombre del modelo para este proveedor (None si no lo sirve)"""
+        for public, upstream in self.models.items():
+            if public.lower() == canonical.lower():
+                return upstream
+        return None
+
+    def url(self, path: str) -> str:
+        return f"{self.api_base.rstrip('/')}/{path.lstrip('/')}"
+
+    def request_headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json", **self.headers}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def ttft_percentile(self, q: float, kind: str = "stream", min_samples: int = 1) -> Optional[float]:
+        """Percentil `q` (0-1) de los TTFT recientes; None si hay menos de `min_samples`"""
+        samples = sorted(self.ttft_samples.get(kind, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def cost(self, prior_ttft: float) -> float:
+        ttft = self.ewma_ttft if self.ewma_ttft is not None else prior_ttft
+        return ttft * (self.in_flight + 1) / max(self.weight, 1e-6)
+
+
+class Router:
+    """Elige proveedor por petición y lleva la cuenta de su latencia"""
+
+    def __init__(
+        self,
+        providers: Iterable[Provider],
+        aliases: Optional[Dict[str, str]] = None,
+        ewma_alpha: float = 0.3,
+        prior_ttft: float = DEFAULT_PRIOR_TTFT,
+        pinned: Optional[str] = None,
+        rng: Optional[random.Random] = None,
+        load_factor: float = AFFINITY_LOAD_FACTOR,
+    ):
+        self.providers: Dict[str, Provider] = {p.name: p for p in providers}
+        self.aliases = {k.lower(): v for k, v in (aliases or {}).items()}
+        self.ewma_alpha = ewma_alpha
+        self.prior_ttft = prior_ttft
+        self.pinned = pinned
+        self.rng = rng or random.Random()
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self.load_factor = load_factor
+        self.rings: Dict[str, HashRing] = {}
+        self.affinity_stats: Dict[str, AffinityStats] = {}
+        groups: Dict[str, Dict[str, float]] = {}
+        for p in self.providers.values():
+            if p.affinity and p.group:
+                groups.setdefault(p.group, {})[p.name] = p.weight
+        for group, nodes in groups.items():
+            self.rings[group] = HashRing(nodes)
+            self.affinity_stats[group] = AffinityStats()
+        # Callback (grupo, "new"|"hit"|"miss", desbordada) por cada decisión con afinidad
+        self.on_affinity: Optional[Callable[[str, str, bool], None]] = None
+
+    @property
+    def has_affinity(self) -> bool:
+        """Si algún grupo de réplicas se reparte por afinidad de prefijo"""
+        return bool(self.rings)
+
+    def canonical_model(self, model: str) -> str:
+        return self.aliases.get(model.lower(), model)
+
+    def candidates(self, model: str) -> List[Tuple[Provider, str]]:
+        """Proveedores configurados que sirven `model`, con el nombre upstream"""
+        canonical = self.canonical_model(model)
+        found = []
+        for provider in self.providers.values():
+            if not provider.configured:
+                continue
+            upstream = provider.upstream_model(canonical)
+            if upstream is not None:
+                found.append((provider, upstream))
+        if not found:
+            # Modelos desconocidos: al proveedor por defecto, con el nombre tal cual
+            found = [(p, model) for p in self.providers.values() if p.default and p.configured]
+        return found
+
+    def choose(
+        self,
+        model: str,
+        pinned: Optional[str] = None,
+        exclude: Iterable[str] = (),
+        affinity_key: Optional[str] = None,
+    ) -> Tuple[Provider, str]:
+        """
+        Elige proveedor para `model`
+
+        Con `affinity_key` (ver affinity.prefix_key) y réplicas con afinidad
+        entre los candidatos, se elige réplica por hashing consistente con
+        carga acotada en lugar de por latencia.
+
+        Si el elegido está semiabierto, esta petición pasa a ser su prueba
+        desde ya: las que se elijan mientras conecta no le llegan.
+
+        Raises:
+            NoProviderAvailable: si ningún proveedor configurado sirve el modelo
+        """
+        provider, upstream = self._select(model, pinned, exclude, affinity_key)
+        provider.breaker.on_request()
+        return provider, upstream
+
+    def _select(
+        self, model: str, pinned: Optional[str], exclude: Iterable[str], affinity_key: Optional[str]
+    ) -> Tuple[Provider, str]:
+        excluded = set(exclude)
+        candidates = [(p, m) for p, m in self.candidates(model) if p.name not in excluded]
+        if not candidates:
+            raise NoProviderAvailable(model)
+
+        pin = pinned or self.pinned
+        if pin:
+            for provider, upstream in candidates:
+                if provider.name == pin:
+                    self._record(model, provider, [provider], reason="pinned")
+                    return provider, upstream
+
+        now = time.monotonic()
+        healthy = [(p, m) for p, m in candidates if p.healthy(now)]
+        # Si todos están apartados, mejor intentar que rechazar
+        pool = healthy or candidates
+
+        if affinity_key is not None:
+            replicas = [(p, m) for p, m in pool if p.group in self.rings]
+            if replicas:
+                return self._choose_replica(model, replicas, affinity_key)
+
+        if len(pool) == 1:
+            provider, upstream = pool[0]
+            self._record(model, provider, [provider], reason="single")
+            return provider, upstream
+
+        first, second = self._sample_two(pool)
+        winner = min((first, second), key=lambda c: c[0].cost(self.prior_ttft))
+        self._record(model, winner[0], [first[0], second[0]], reason="p2c")
+        return winner
+
+    def _choose_replica(
+        self, model: str, replicas: List[Tuple[Provider, str]], key: str
+    ) -> Tuple[Provider, str]:
+        group = replicas[0][0].group
+        members = [(p, m) for p, m in replicas if p.group == group]
+        (provider, upstream), spilled = bounded_choice(
+            self.rings[group], key, members,
+            name=lambda c: c[0].name, load=lambda c: c[0].in_flight, load_factor=self.load_factor,
+        )
+        result = self.affinity_stats[group].record(key, provider.name, spilled)
+        if self.on_affinity is not None:
+            self.on_affinity(group, result, spilled)
+        self._record(model, provider, [p for p, _ in members], reason="spill" if spilled else "affinity")
+        return provider, upstream
+
+    def _sample_two(self, pool: List[Tuple[Provider, str]]) -> List[Tuple[Provider, str]]:
+        """Dos candidatos distintos al azar, ponderados por weight"""
+        remaining = list(pool)
+        picked = []
+        for _ in range(2):
+            weights = [max(p.weight, 0.0) for p, _ in remaining]
+            if sum(weights) <= 0:
+                weights = [1.0] * len(remaining)
+            choice = self.rng.choices(range(len(remaining)), weights=weights)[0]
+            picked.append(remaining.pop(choice))
+        return picked
+
+    def _record(self, model: str, chosen: Provider, compared: List[Provider], reason: str) -> None:
+        self.decisions.append({
+            "timestamp": time.time(),
+            "model": model,
+            "chosen": chosen.name,
+            "reason": reason,
+            "compared": {
+                p.name: {"cost": round(p.cost(self.prior_ttft), 4), "in_flight": p.in_flight}
+                for p in compared
+            },
+        })
+
+    def begin(self, provider: Provider) -> None:
+        """
+        Cuenta una petición al proveedor como en curso antes de enviarla
+
+        Así el coste p2c y el límite de carga de la afinidad ven también las
+        que esperan turno o conexión. Termina con track() (cuando hay
+        respuesta) o con abandon() (si no se llegó a enviar o no conectó).
+        """
+        provider.in_flight += 1
+        provider.requests += 1
+
+    def abandon(self, provider: Provider) -> None:
+        """La petición contada con begin() no llegó a tener respuesta"""
+        provider.in_flight -= 1
+
+    def track(self, provider: Provider, call: UpstreamCall) -> None:
+        """Sigue contando la llamada como en curso hasta que termine"""
+        call.add_listener(self._on_finish)
+
+    def _on_finish(self, call: UpstreamCall, outcome: str) -> None:
+        provider = call.provider
+        provider.in_flight -= 1
+        if call.ttft is not None:
+            self.observe_ttft(provider, call.ttft, "stream" if call.stream else "json")
+        status = call.response.status_code
+        if outcome == "ok":
+            provider.breaker.record_success()
+        elif outcome == "error" and (status >= 500 or status in PROVIDER_FAILURE_STATUSES or status < 400):
+            # 5xx/429, o un stream que se cortó tras un 200
+            self.observe_failure(provider)
+
+    def observe_ttft(self, provider: Provider, ttft: float, kind: str = "stream") -> None:
+        samples = provider.ttft_samples.setdefault(kind, deque(maxlen=TTFT_WINDOW))
+        samples.append(ttft)
+        if provider.ewma_ttft is None:
+            provider.ewma_ttft = ttft
+        else:
+            provider.ewma_ttft += self.ewma_alpha * (ttft - provider.ewma_ttft)
+
+    def observe_failure(self, provider: Provider) -> None:
+        """Registra un fallo del proveedor en su circuit breaker"""
+        provider.failures += 1
+        provider.breaker.record_failure()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado actual serializable a JSON (endpoint de administración)"""
+        now = time.monotonic()
+        return {
+            "pinned": self.pinned,
+            "providers": {
+                p.name: {
+                    "label": p.label or p.name,
+                    "api_base": p.api_base,
+                    "configured": p.configured,
+                    "healthy": p.healthy(now),
+                    "circuit": p.breaker.snapshot(),
+                    "weight": p.weight,
+                    "models": p.models,
+                    "ewma_ttft": round(p.ewma_ttft, 4) if p.ewma_ttft is not None else None,
+                    "p95_ttft": p.ttft_percentile(0.95),
+                    "in_flight": p.in_flight,
+                    "requests": p.requests,
+                    "failures": p.failures,
+                }
+                for p in self.providers.values()
+            },
+            "affinity": {
+                group: {
+                    "replicas": ring.nodes,
+                    "load_factor": self.load_factor,
+                    **self.affinity_stats[group].snapshot(),
+                }
+                for group, ring in self.rings.items()
+            },
+            "recent_decisions": list(self.decisions),
+        }
+
+
+def load_router(
+    config_path: Optional[Path] = None,
+    env: Optional[Dict[str, str]] = None,
+    overrides: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Router:
+    """
+    Construye el router a partir de models.yaml
+
+    Args:
+        config_path: Ruta del YAML (por defecto la del benchmark)
+        env: Variables de entorno con las API keys (por defecto os.environ)
+        overrides: Campos a sobrescribir por proveedor, p. ej. {"chutes": {"api_base": ...}}
+    """
+    env = os.environ if env is None else env
+    path = Path(config_path or DEFAULT_CONFIG_PATH)
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    env_keys = config.get("env_keys", {})
+    providers = []
+    for name, spec in (config.get("providers") or {}).items():
+        spec = {**spec, **(overrides or {}).get(name, {})}
+        key_var = env_keys.get(name)
+        api = spec.get("api", "chat")
+        if api not in PROVIDER_APIS:
+            raise ValueError(f"Proveedor {name}: api desconocida {api!r} (usa {', '.join(PROVIDER_APIS)})")
+        routing = spec.get("routing", "prefix_affinity")
+        if routing not in REPLICA_ROUTING:
+            raise ValueError(f"Proveedor {name}: routing desconocido {routing!r} (usa {', '.join(REPLICA_ROUTING)})")
+        common = dict(
+            api_key=env.get(key_var) if key_var else None,
+            models=spec.get("models") or {},
+            default=bool(spec.get("default", False)),
+            headers=spec.get("headers") or {},
+            requires_key=key_var is not None,
+            api=api,
+        )
+        replicas = spec.get("replicas")
+        if not replicas:
+            providers.append(Provider(
+                name=name,
+                api_base=spec["api_base"],
+                label=spec.get("label"),
+                weight=float(spec.get("weight", 1.0)),
+                **common,
+            ))
+            continue
+        for i, replica in enumerate(replicas):
+            # Cada réplica es una URL o {api_base, weight}
+            replica = {"api_base": replica} if isinstance(replica, str) else replica
+            providers.append(Provider(
+                name=f"{name}/{i}",
+                api_base=replica["api_base"],
+                label=f"{spec.get('label') or name} #{i}",
+                weight=float(replica.get("weight", spec.get("weight", 1.0))),
+                group=name,
+                affinity=routing == "prefix_affinity",
+                **common,
+            ))
+
+    return Router(
+        providers,
+        aliases=config.get("model_aliases"),
+        pinned=env.get("KIMI_PROXY_PROVIDER") or None,
+    )
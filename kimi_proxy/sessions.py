@@ -0,0 +1,616 @@
+"""
+Sesiones de chat con estado en el proxy (/v1/sessions).
+
+Un cliente de chat normal reenvía la conversación entera en cada turno: con
+un contexto de 256K son megabytes por petición que el proxy recibe y vuelve
+a parsear. En una sesión el proxy guarda el historial y el cliente solo
+envía el mensaje nuevo. Cada mensaje se serializa una vez, al entrar, y el
+cuerpo upstream se arma concatenando esos bytes: el historial no se vuelve
+a parsear ni a serializar en cada turno.
+
+El almacén está acotado por número de sesiones, bytes de historial y tiempo
+de inactividad; al pasar de los límites se expulsan las menos usadas. Una
+sesión expulsada responde 404 y el cliente debe crearla de nuevo con la
+conversación completa.
+
+Con varios workers, SharedSessionStore guarda las sesiones en una SQLite
+común: cualquier worker atiende cualquier turno. Cada worker conserva su
+copia de las sesiones que ha visto y solo relee el historial cuando otro
+worker lo cambió.
+
+El ahorro de parseo es una estimación: bytes de historial no recibidos por
+el coste por byte medido al parsear los cuerpos de sesión grandes que sí
+llegan (normalmente el de creación, con el system prompt).
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from kimi_proxy.payload import ChatBody, InvalidRequest
+
+# Cuerpos más pequeños no sirven para medir el coste por byte del parseo:
+# en ellos domina el coste fijo de cada llamada
+PARSE_SAMPLE_MIN_BYTES = 16 * 1024
+
+# Campos del cuerpo que no son parámetros de generación ("type" lo usan los frames WebSocket)
+_RESERVED = ("model", "messages", "message", "stream", "extra_body", "type")
+
+# Un turno que no termina en este tiempo (worker caído) deja de bloquear la sesión
+TURN_LEASE_SECONDS = 900
+
+
+class SessionNotFound(Exception):
+    """La sesión no existe, expiró, fue expulsada o es de otro cliente"""
+
+
+class SessionBusy(Exception):
+    """La sesión ya tiene un turno en curso"""
+
+
+class SessionTooLarge(Exception):
+    """El historial de la sesión no cabe en el almacén"""
+
+
+def _parse_object(raw: bytes) -> Dict[str, Any]:
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError as e:
+        raise InvalidRequest(f"Invalid JSON body: {e}")
+    if not isinstance(data, dict):
+        raise InvalidRequest("Request body must be a JSON object")
+    return data
+
+
+def _messages(data: Dict[str, Any], required: bool) -> List[Dict[str, Any]]:
+    """`message` (uno) o `messages` (lista) del cuerpo, validados por encima"""
+    messages = [data["message"]] if "message" in data else data.get("messages") or []
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and m.get("role") for m in messages):
+        raise InvalidRequest("'messages' must be a list of objects with a 'role'")
+    if required and not messages:
+        raise InvalidRequest("A turn needs 'message' or a non-empty 'messages'")
+    return messages
+
+
+def _settings(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Parámetros de generación; extra_body se mezcla como hace ChatBody"""
+    settings = {k: v for k, v in data.items() if k not in _RESERVED}
+    if isinstance(data.get("extra_body"), dict):
+        settings.update(data["extra_body"])
+    return settings
+
+
+def completion_reply(completion: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Mensaje del asistente que se guarda en el historial (None si no hay)"""
+    choices = completion.get("choices") or []
+    message = choices[0].get("message") if choices else None
+    return message if isinstance(message, dict) else None
+
+
+@dataclass
+class Turn:
+    """Un turno preparado: mensajes nuevos ya serializados y su coste de entrada"""
+
+    session: "Session"
+    messages: List[Dict[str, Any]]
+    encoded: List[bytes]
+    stream: bool
+    overrides: Dict[str, Any]
+    ingress_bytes: int
+    reused_bytes: int
+    parse_seconds: float
+    parse_saved_seconds: float
+
+    def body(self) -> ChatBody:
+        """Petición de chat completa: historial guardado + mensajes nuevos"""
+        return self.session.build(self)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ingress_bytes": self.ingress_bytes,
+            "reused_bytes": self.reused_bytes,
+            "parse_ms": round(self.parse_seconds * 1000, 3),
+            "parse_saved_ms": round(self.parse_saved_seconds * 1000, 3),
+        }
+
+
+class Session:
+    """Historial de una conversación: dicts para el proxy y bytes para el upstream"""
+
+    def __init__(
+        self,
+        owner: str,
+        model: str,
+        settings: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        session_id: Optional[str] = None
+    ):
+        self.id = session_id or f"sess_{uuid.uuid4().hex}"
+        self.owner = owner
+        self.model = model
+        self.settings = settings
+        self.messages = messages
+        # Mensajes serializados y separados por comas: el interior de "messages":[...]
+        self._history = bytearray(b",".join(orjson.dumps(m) for m in messages))
+        self.created = int(time.time())
+        self.last_used = time.monotonic()
+        self.turns = 0
+        self.busy = False
+        self.ingress_bytes = 0
+        self.reused_bytes = 0
+        self.parse_saved_seconds = 0.0
+        self.last_turn: Optional[Dict[str, Any]] = None
+
+    @property
+    def bytes(self) -> int:
+        return len(self._history)
+
+    @property
+    def history(self) -> bytes:
+        """Mensajes serializados y separados por comas (lo que se guarda en SharedSessionStore)"""
+        return bytes(self._history)
+
+    def replace_history(self, history: bytes) -> None:
+        """Historial guardado por otro worker: se parsea una vez para la copia local"""
+        self._history = bytearray(history)
+        self.messages = orjson.loads(b"[" + history + b"]")
+
+    def build(self, turn: Turn) -> ChatBody:
+        """
+        ChatBody del turno sin parsear el historial
+
+        Los bytes se concatenan con "model" en primera posición, así que su
+        posición es conocida y ChatBody no tiene que buscarla.
+        """
+        model = orjson.dumps(self.model)
+        settings = {**self.settings, **turn.overrides}
+        parts = [b'{"model":', model, b',"stream":', b"true" if turn.stream else b"false"]
+        if settings:
+            parts += [b",", orjson.dumps(settings)[1:-1]]
+        parts += [b',"messages":[', self._history]
+        if self._history and turn.encoded:
+            parts.append(b",")
+        parts += [b",".join(turn.encoded), b"]}"]
+        data = {**settings, "model": self.model, "stream": turn.stream, "messages": self.messages + turn.messages}
+        start = len(b'{"model":')
+        return ChatBody(data, b"".join(parts), model_span=(start, start + len(model)))
+
+    def commit(self, turn: Turn, reply: Dict[str, Any]) -> None:
+        """Añade al historial los mensajes del turno y la respuesta del modelo"""
+        pieces = turn.encoded + [orjson.dumps(reply)]
+        if self._history:
+            self._history += b","
+        self._history += b",".join(pieces)
+        self.messages.extend(turn.messages)
+        self.messages.append(reply)
+        self.turns += 1
+        self.busy = False
+        self.last_used = time.monotonic()
+
+    def abort(self) -> None:
+        """El turno falló o se cortó: el historial queda como estaba"""
+        self.busy = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "chat.session",
+            "created": self.created,
+            "model": self.model,
+            "messages": len(self.messages),
+            "history_bytes": self.bytes,
+            "turns": self.turns,
+            "busy": self.busy,
+            "ingress_bytes": self.ingress_bytes,
+            "reused_bytes": self.reused_bytes,
+            "parse_saved_ms": round(self.parse_saved_seconds * 1000, 3),
+            "last_turn": self.last_turn,
+        }
+
+
+class SessionStore:
+    """
+    Sesiones en memoria, LRU acotado por número, bytes e inactividad
+
+    Los cuerpos se parsean con `parse`, que además mide el coste por byte
+    con el que se estima el parseo ahorrado. `on_turn(stats)` se llama con
+    las cifras de cada turno preparado (métricas).
+
+    Las operaciones son síncronas y el proxy las ejecuta en un hilo: un lock
+    reentrante las serializa.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 512 * 1024 * 1024, ttl: float = 3600):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_turn: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._lock = threading.RLock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.bytes = 0
+        self.created = 0
+        self.evicted = 0
+        self.turns = 0
+        self.ingress_bytes = 0
+        self.reused_bytes = 0
+        self.parse_saved_seconds = 0.0
+        # Coste de parseo medido en los cuerpos grandes que sí llegan
+        self._parsed_bytes = 0
+        self._parse_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def parse(self, raw: bytes) -> Tuple[Dict[str, Any], float]:
+        """
+        Cuerpo JSON de una petición o frame de sesión y los segundos que costó
+
+        Raises:
+            InvalidRequest: si no es un objeto JSON
+        """
+        started = time.perf_counter()
+        data = _parse_object(raw)
+        elapsed = time.perf_counter() - started
+        if len(raw) >= PARSE_SAMPLE_MIN_BYTES:
+            self._parsed_bytes += len(raw)
+            self._parse_seconds += elapsed
+        return data, elapsed
+
+    @property
+    def parse_seconds_per_byte(self) -> float:
+        return self._parse_seconds / self._parsed_bytes if self._parsed_bytes else 0.0
+
+    def create(self, data: Dict[str, Any], owner: str, default_model: str) -> Session:
+        """
+        Nueva sesión a partir del cuerpo de POST /v1/sessions
+
+        Raises:
+            InvalidRequest: cuerpo inválido
+            SessionTooLarge: los mensajes iniciales no caben en el almacén
+        """
+        model = data.get("model") or default_model
+        if not isinstance(model, str):
+            raise InvalidRequest("'model' must be a string")
+        session = Session(owner, model, _settings(data), _messages(data, required=False))
+        if session.bytes > self.max_bytes:
+            raise SessionTooLarge(f"Session history exceeds {self.max_bytes} bytes")
+        with self._lock:
+            self._sessions[session.id] = session
+            self.bytes += session.bytes
+            self.created += 1
+            self._evict(keep=session.id)
+        return session
+
+    def get(self, session_id: str, owner: str) -> Session:
+        """
+        La sesión del cliente `owner`, marcada como recién usada
+
+        Raises:
+            SessionNotFound: si no existe o es de otro cliente
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.owner != owner:
+                raise SessionNotFound(f"Session {session_id} not found")
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str, owner: str) -> None:
+        with self._lock:
+            session = self.get(session_id, owner)
+            self._remove(session.id)
+
+    def begin(self, session: Session, data: Dict[str, Any], ingress_bytes: int, parse_seconds: float) -> Turn:
+        """
+        Prepara un turno a partir del cuerpo que envió el cliente
+
+        El cuerpo lleva `message` o `messages` (los nuevos), `stream` y, si
+        se quiere, parámetros que solo valen para este turno.
+
+        Raises:
+            InvalidRequest: cuerpo inválido
+            SessionBusy: si la sesión ya tiene un turno en curso
+        """
+        with self._lock:
+            if session.busy:
+                raise SessionBusy(f"Session {session.id} already has a turn in progress")
+            if not isinstance(data.get("stream", False), (bool, type(None))):
+                raise InvalidRequest("'stream' must be a boolean")
+            messages = _messages(data, required=True)
+            turn = Turn(
+                session=session,
+                messages=messages,
+                encoded=[orjson.dumps(m) for m in messages],
+                stream=bool(data.get("stream")),
+                overrides=_settings(data),
+                ingress_bytes=ingress_bytes,
+                reused_bytes=session.bytes,
+                parse_seconds=parse_seconds,
+                parse_saved_seconds=session.bytes * self.parse_seconds_per_byte,
+            )
+            session.busy = True
+            session.ingress_bytes += turn.ingress_bytes
+            session.reused_bytes += turn.reused_bytes
+            session.parse_saved_seconds += turn.parse_saved_seconds
+            session.last_turn = turn.stats()
+            self.turns += 1
+            self.ingress_bytes += turn.ingress_bytes
+            self.reused_bytes += turn.reused_bytes
+            self.parse_saved_seconds += turn.parse_saved_seconds
+            if self.on_turn is not None:
+                self.on_turn(session.last_turn)
+            return turn
+
+    def finish(self, turn: Turn, reply: Optional[Dict[str, Any]]) -> None:
+        """
+        Cierra el turno guardando la respuesta y aplica los límites de memoria
+
+        Sin respuesta (error, desconexión) el historial queda como estaba y
+        el cliente puede repetir el mensaje.
+        """
+        session = turn.session
+        with self._lock:
+            if reply is None:
+                session.abort()
+                return
+            before = session.bytes
+            session.commit(turn, reply)
+            if self._sessions.get(session.id) is not session:
+                return  # expulsada durante el turno
+            self.bytes += session.bytes - before
+            if session.bytes > self.max_bytes:
+                self._remove(session.id)
+                self.evicted += 1
+                return
+            self._evict(keep=session.id)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_used > deadline:
+                return
+            self._remove(oldest.id)
+            self.evicted += 1
+
+    def _evict(self, keep: str) -> None:
+        self._expire()
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                self._sessions.move_to_end(oldest)
+                continue
+            self._remove(oldest)
+            self.evicted += 1
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id)
+        self.bytes -= session.bytes
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "history_bytes": self.bytes,
+            "created": self.created,
+            "evicted": self.evicted,
+            "turns": self.turns,
+            "ingress_bytes": self.ingress_bytes,
+            "reused_bytes": self.reused_bytes,
+            "parse_saved_ms": round(self.parse_saved_seconds * 1000, 3),
+        }
+
+
+class SharedSessionStore(SessionStore):
+    """
+    SessionStore con las sesiones en SQLite, comunes a todos los workers
+
+    La SQLite es la fuente de verdad: historial, dueño, parámetros, contadores
+    y el turno en curso (un lease con `busy_until`, para que dos workers no
+    ejecuten a la vez turnos de la misma sesión). Los límites de número,
+    bytes e inactividad se aplican sobre todas las sesiones. Cada worker
+    guarda una copia local de cada sesión con su número de turnos y solo
+    relee el historial si otro worker añadió turnos desde entonces.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_sessions: int = 1000,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttl: float = 3600
+    ):
+        super().__init__(max_sessions, max_bytes, ttl)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, owner TEXT NOT NULL, model TEXT NOT NULL, settings BLOB NOT NULL,"
+            " history BLOB NOT NULL, bytes INTEGER NOT NULL, turns INTEGER NOT NULL DEFAULT 0,"
+            " created INTEGER NOT NULL, last_used REAL NOT NULL, busy_until REAL NOT NULL DEFAULT 0,"
+            " ingress_bytes INTEGER NOT NULL DEFAULT 0, reused_bytes INTEGER NOT NULL DEFAULT 0,"
+            " parse_saved REAL NOT NULL DEFAULT 0, last_turn BLOB)"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def create(self, data: Dict[str, Any], owner: str, default_model: str) -> Session:
+        model = data.get("model") or default_model
+        if not isinstance(model, str):
+            raise InvalidRequest("'model' must be a string")
+        session = Session(owner, model, _settings(data), _messages(data, required=False))
+        if session.bytes > self.max_bytes:
+            raise SessionTooLarge(f"Session history exceeds {self.max_bytes} bytes")
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (id, owner, model, settings, history, bytes, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (session.id, owner, model, orjson.dumps(session.settings), session.history,
+                 session.bytes, session.created, time.time())
+            )
+            self._evict_shared(keep=session.id)
+            self.created += 1
+            self._cache(session)
+        return session
+
+    def get(self, session_id: str, owner: str) -> Session:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, turns, last_used, busy_until FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is not None and row[2] < now - self.ttl and row[3] < now:
+                self._delete(session_id)
+                self.evicted += 1
+                row = None
+            if row is None or row[0] != owner:
+                self._sessions.pop(session_id, None)
+                raise SessionNotFound(f"Session {session_id} not found")
+            self._conn.execute("UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id))
+            session = self._sessions.get(session_id)
+            if session is None or session.turns != row[1]:
+                session = self._load(session_id, session)
+            session.busy = row[3] >= now
+            session.last_used = time.monotonic()
+            self._cache(session)
+        return session
+
+    def delete(self, session_id: str, owner: str) -> None:
+        with self._lock:
+            self.get(session_id, owner)
+            self._delete(session_id)
+
+    def begin(self, session: Session, data: Dict[str, Any], ingress_bytes: int, parse_seconds: float) -> Turn:
+        now = time.time()
+        with self._lock:
+            claimed = self._conn.execute(
+                "UPDATE sessions SET busy_until = ?, last_used = ? WHERE id = ? AND busy_until < ?",
+                (now + TURN_LEASE_SECONDS, now, session.id, now)
+            ).rowcount
+            if not claimed:
+                if self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session.id,)).fetchone() is None:
+                    raise SessionNotFound(f"Session {session.id} not found")
+                raise SessionBusy(f"Session {session.id} already has a turn in progress")
+            # Con el lease nadie más puede cambiarla: si otro worker añadió turnos, se relee ahora
+            turns = self._conn.execute("SELECT turns FROM sessions WHERE id = ?", (session.id,)).fetchone()[0]
+            if turns != session.turns:
+                self._load(session.id, session)
+            session.busy = False
+            try:
+                return super().begin(session, data, ingress_bytes, parse_seconds)
+            except BaseException:
+                self._release(session)
+                raise
+
+    def finish(self, turn: Turn, reply: Optional[Dict[str, Any]]) -> None:
+        session = turn.session
+        with self._lock:
+            if reply is None:
+                session.abort()
+                self._release(session)
+                return
+            session.commit(turn, reply)
+            if session.bytes > self.max_bytes:
+                self._delete(session.id)
+                self.evicted += 1
+                return
+            self._conn.execute(
+                "UPDATE sessions SET history = ?, bytes = ?, turns = ?, last_used = ?, busy_until = 0,"
+                " ingress_bytes = ?, reused_bytes = ?, parse_saved = ?, last_turn = ? WHERE id = ?",
+                (session.history, session.bytes, session.turns, time.time(), session.ingress_bytes,
+                 session.reused_bytes, session.parse_saved_seconds, orjson.dumps(session.last_turn), session.id)
+            )
+            self._evict_shared(keep=session.id)
+
+    def _release(self, session: Session) -> None:
+        """Libera el lease del turno guardando los contadores que ya sumó"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET busy_until = 0, ingress_bytes = ?, reused_bytes = ?, parse_saved = ?,"
+                " last_turn = ? WHERE id = ?",
+                (session.ingress_bytes, session.reused_bytes, session.parse_saved_seconds,
+                 orjson.dumps(session.last_turn), session.id)
+            )
+
+    def _load(self, session_id: str, session: Optional[Session]) -> Session:
+        """Copia local al día con la SQLite (se actualiza en su sitio si ya existía)"""
+        (owner, model, settings, history, turns, created,
+         ingress_bytes, reused_bytes, parse_saved, last_turn) = self._conn.execute(
+            "SELECT owner, model, settings, history, turns, created, ingress_bytes, reused_bytes,"
+            " parse_saved, last_turn FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if session is None:
+            session = Session(owner, model, {}, [], session_id=session_id)
+        session.model = model
+        session.settings = orjson.loads(settings)
+        session.replace_history(history)
+        session.turns = turns
+        session.created = created
+        session.ingress_bytes = ingress_bytes
+        session.reused_bytes = reused_bytes
+        session.parse_saved_seconds = parse_saved
+        session.last_turn = orjson.loads(last_turn) if last_turn else None
+        return session
+
+    def _cache(self, session: Session) -> None:
+        """Copia local LRU; salir de ella no borra la sesión"""
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _delete(self, session_id: str) -> None:
+        self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self._sessions.pop(session_id, None)
+
+    def _evict_shared(self, keep: str) -> None:
+        """Aplica los límites sobre todas las sesiones (con el lock tomado)"""
+        now = time.time()
+        for (session_id,) in self._conn.execute(
+            "SELECT id FROM sessions WHERE last_used < ? AND busy_until < ? AND id != ?",
+            (now - self.ttl, now, keep)
+        ).fetchall():
+            self._delete(session_id)
+            self.evicted += 1
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+        while count > 1 and (count > self.max_sessions or total > self.max_bytes):
+            oldest = self._conn.execute(
+                "SELECT id, bytes FROM sessions WHERE id != ? ORDER BY last_used LIMIT 1", (keep,)
+            ).fetchone()
+            self._delete(oldest[0])
+            self.evicted += 1
+            count, total = count - 1, total - oldest[1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+            return {**self._snapshot(), "sessions": count, "history_bytes": total}
+
+
+async def sse_payloads(chunks: AsyncIterator[bytes], tap: Callable[[bytes], None]) -> AsyncIterator[bytes]:
+    """El `data` de cada evento SSE del stream, sin [DONE] (frames de WebSocket)"""
+    buffer = b""
+    async for chunk in chunks:
+        tap(chunk)
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        *events, buffer = (buffer + chunk).split(b"\n\n")
+        for event in events:
+            data = b"".join(line[5:].strip() for line in event.split(b"\n") if line.startswith(b"data:"))
+            if data and data != b"[DONE]":
+                yield data
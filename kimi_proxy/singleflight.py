@@ -0,0 +1,196 @@
+"""
+Single-flight: agrupa peticiones idénticas que están en curso a la vez.
+
+La primera petición (líder) abre la llamada upstream; las idénticas que llegan
+mientras tanto (seguidoras) se enganchan a ella en lugar de pagar otra llamada.
+Todo lo que devuelve el upstream se guarda en un buffer compartido, así que una
+seguidora en streaming recibe también los chunks emitidos antes de unirse.
+
+El líder es un suscriptor más: si su cliente se desconecta, las seguidoras
+siguen recibiendo. La llamada upstream solo se cancela cuando no queda ningún
+suscriptor. Como el buffer guarda la respuesta entera, solo se usa para
+peticiones deterministas (las mismas que acepta la caché).
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from kimi_proxy.cancellation import Receive, wait_for_disconnect
+from kimi_proxy.upstream import UpstreamCall
+
+
+class Flight:
+    """Una llamada upstream en curso compartida por varios suscriptores"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.events = 0
+        self.status_code: Optional[int] = None
+        self.content_type: Optional[str] = None
+        self.call: Optional[UpstreamCall] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        """Despierta a todos los suscriptores que esperan cambios"""
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    async def wait_changed(self) -> None:
+        await self._changed.wait()
+
+    async def wait_done(self) -> None:
+        while not self.done:
+            await self.wait_changed()
+
+    def body(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+@dataclass
+class SingleFlightStats:
+    """Contadores de coalescencia"""
+    leaders: int = 0
+    followers: int = 0
+    in_flight: int = 0
+    abandoned: int = 0
+
+
+class SingleFlight:
+    """Registro de llamadas upstream en curso indexado por hash del payload"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.stats = SingleFlightStats()
+
+    def join(
+        self,
+        key: str,
+        start: Callable[[], Awaitable[UpstreamCall]],
+        on_complete: Optional[Callable[[Flight], Awaitable[None]]] = None,
+        on_abandon: Optional[Callable[[Flight], None]] = None,
+    ) -> Tuple[Flight, bool]:
+        """
+        Se une a la llamada en curso para `key` o la inicia
+
+        Args:
+            key: Hash canónico de la petición
+            start: Abre la llamada upstream (stream=True) y valida su estado
+            on_complete: Se ejecuta una vez cuando el upstream terminó bien
+            on_abandon: Se ejecuta si la llamada se cancela por quedarse sin suscriptores
+
+        Returns:
+            (flight, es_líder)
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, start, on_complete, on_abandon))
+            self.stats.leaders += 1
+            self.stats.in_flight += 1
+        else:
+            self.stats.followers += 1
+        flight.subscribers += 1
+        return flight, leader
+
+    def leave(self, flight: Flight) -> None:
+        """Un suscriptor se va; si era el último se cancela la llamada upstream"""
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.done and flight.task is not None:
+            flight.task.cancel()
+
+    async def _run(self, key, flight, start, on_complete, on_abandon) -> None:
+        call = None
+        try:
+            call = await start()
+            flight.call = call
+            try:
+                flight.status_code = call.response.status_code
+                flight.content_type = call.response.headers.get("content-type")
+                flight.ready.set()
+                async for chunk in call.aiter_chunks():
+                    flight.chunks.append(chunk)
+                    flight.events += chunk.count(b"data:")
+                    flight.notify()
+                call.finish("ok")
+            finally:
+                await call.aclose()
+        except asyncio.CancelledError:
+            if call is not None:
+                call.finish("cancelled")
+            self.stats.abandoned += 1
+            if on_abandon is not None:
+                on_abandon(flight)
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            if call is not None:
+                call.finish("error")
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.ready.set()
+            flight.notify()
+            self.stats.in_flight -= 1
+
+        try:
+            if flight.error is None and on_complete is not None:
+                await on_complete(flight)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def subscribe(self, flight: Flight, receive: Optional[Receive] = None) -> AsyncIterator[bytes]:
+        """
+        Itera los chunks del flight desde el principio hasta que termina
+
+        Si `receive` se indica, una desconexión del cliente hace que este
+        suscriptor se separe (sin afectar a los demás).
+        """
+        disconnected = False
+        watcher = None
+
+        if receive is not None:
+            watcher = asyncio.create_task(wait_for_disconnect(receive))
+
+            def on_disconnect(task: asyncio.Task) -> None:
+                nonlocal disconnected
+                if not task.cancelled() and task.exception() is None:
+                    disconnected = True
+                    flight.notify()
+
+            watcher.add_done_callback(on_disconnect)
+
+        position = 0
+        try:
+            while True:
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    if flight.error is not None and not isinstance(flight.error, asyncio.CancelledError):
+                        raise flight.error
+                    return
+                if disconnected:
+                    return
+                await flight.wait_changed()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self.leave(flight)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado actual serializable a JSON"""
+        return {
+            "leaders": self.stats.leaders,
+            "followers": self.stats.followers,
+            "upstream_calls_saved": self.stats.followers,
+            "in_flight": self.stats.in_flight,
+            "abandoned": self.stats.abandoned,
+        }
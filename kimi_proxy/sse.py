@@ -0,0 +1,179 @@
+"""
+Utilidades SSE para respuestas de chat en streaming (formato OpenAI).
+
+- CompletionAccumulator: reconstruye el chat.completion completo a partir de
+  los chunks SSE que van pasando por el relay.
+- completion_to_sse: el camino inverso, reproduce un chat.completion guardado
+  como una secuencia de eventos chat.completion.chunk.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional
+
+import orjson
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def encode_event(data: Dict[str, Any]) -> bytes:
+    """Serializa un evento SSE `data: {...}`"""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+class CompletionAccumulator:
+    """Ensambla un chat.completion a partir de bytes SSE recibidos en orden"""
+
+    def __init__(self):
+        self._buffer = b""
+        self.done = False
+        self.id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.created: Optional[int] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.choices: Dict[int, Dict[str, Any]] = {}
+
+    def feed(self, chunk: bytes) -> None:
+        """Procesa un trozo del stream (puede cortar eventos a la mitad)"""
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n")
+        self._buffer += chunk
+        *events, self._buffer = self._buffer.split(b"\n\n")
+        for event in events:
+            for line in event.split(b"\n"):
+                if line.startswith(b"data:"):
+                    self._feed_data(line[5:].strip())
+
+    def _feed_data(self, data: bytes) -> None:
+        if data == b"[DONE]":
+            self.done = True
+            return
+        try:
+            event = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return
+        self.feed_event(event)
+
+    def feed_event(self, event: Dict[str, Any]) -> None:
+        """Procesa un chunk ya decodificado (p. ej. `chunk.model_dump()` del SDK de OpenAI)"""
+        self.id = self.id or event.get("id")
+        self.model = self.model or event.get("model")
+        self.created = self.created or event.get("created")
+        if event.get("usage"):
+            self.usage = event["usage"]
+
+        for choice in event.get("choices") or []:
+            self._merge_choice(choice)
+
+    def _merge_choice(self, choice: Dict[str, Any]) -> None:
+        index = choice.get("index", 0)
+        state = self.choices.setdefault(index, {
+            "role": "assistant", "content": [], "reasoning_content": [],
+            "tool_calls": {}, "finish_reason": None,
+        })
+        delta = choice.get("delta") or {}
+
+        if delta.get("role"):
+            state["role"] = delta["role"]
+        if delta.get("content"):
+            state["content"].append(delta["content"])
+        if delta.get("reasoning_content"):
+            state["reasoning_content"].append(delta["reasoning_content"])
+        for call in delta.get("tool_calls") or []:
+            slot = state["tool_calls"].setdefault(call.get("index", 0), {
+                "id": None, "type": "function", "name": "", "arguments": [],
+            })
+            if call.get("id"):
+                slot["id"] = call["id"]
+            function = call.get("function") or {}
+            if function.get("name"):
+                slot["name"] += function["name"]
+            if function.get("arguments"):
+                slot["arguments"].append(function["arguments"])
+        if choice.get("finish_reason"):
+            state["finish_reason"] = choice["finish_reason"]
+
+    @property
+    def complete(self) -> bool:
+        """True si el stream terminó ([DONE] o finish_reason en todas las choices)"""
+        if self.done:
+            return True
+        return bool(self.choices) and all(c["finish_reason"] for c in self.choices.values())
+
+    def result(self) -> Dict[str, Any]:
+        """El chat.completion equivalente a lo recibido hasta ahora"""
+        choices = []
+        for index in sorted(self.choices):
+            state = self.choices[index]
+            message: Dict[str, Any] = {
+                "role": state["role"],
+                "content": "".join(state["content"]) or None,
+            }
+            if state["reasoning_content"]:
+                message["reasoning_content"] = "".join(state["reasoning_content"])
+            if state["tool_calls"]:
+                message["tool_calls"] = [
+                    {
+                        "id": slot["id"],
+                        "type": slot["type"],
+                        "function": {"name": slot["name"], "arguments": "".join(slot["arguments"])},
+                    }
+                    for _, slot in sorted(state["tool_calls"].items())
+                ]
+            choices.append({"index": index, "message": message, "finish_reason": state["finish_reason"]})
+
+        completion = {
+            "id": self.id,
+            "object": "chat.completion",
+            "created": self.created,
+            "model": self.model,
+            "choices": choices,
+        }
+        if self.usage is not None:
+            completion["usage"] = self.usage
+        return completion
+
+
+def completion_to_sse(completion: Dict[str, Any], chunk_chars: int = 64) -> Iterator[bytes]:
+    """
+    Reproduce un chat.completion como eventos SSE chat.completion.chunk
+
+    El contenido se parte en trozos de `chunk_chars` caracteres; tool_calls se
+    emiten con su índice, y la usage va en un chunk final sin choices (igual
+    que `stream_options.include_usage`).
+    """
+    base = {
+        "id": completion.get("id"),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created"),
+        "model": completion.get("model"),
+    }
+
+    def chunk(index: int, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+        return encode_event({
+            **base,
+            "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
+        })
+
+    for choice in completion.get("choices") or []:
+        index = choice.get("index", 0)
+        message = choice.get("message") or {}
+        yield chunk(index, {"role": message.get("role", "assistant"), "content": ""})
+
+        for field in ("reasoning_content", "content"):
+            text = message.get(field) or ""
+            for start in range(0, len(text), chunk_chars):
+                yield chunk(index, {field: text[start:start + chunk_chars]})
+
+        tool_calls: List[Dict[str, Any]] = message.get("tool_calls") or []
+        for position, call in enumerate(tool_calls):
+            yield chunk(index, {"tool_calls": [{
+                "index": position,
+                "id": call.get("id"),
+                "type": call.get("type", "function"),
+                "function": call.get("function") or {},
+            }]})
+
+        yield chunk(index, {}, choice.get("finish_reason") or "stop")
+
+    if completion.get("usage"):
+        yield encode_event({**base, "choices": [], "usage": completion["usage"]})
+    yield DONE_EVENT
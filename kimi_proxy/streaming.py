@@ -0,0 +1,155 @@
+"""
+Relay de streaming SSE entre el upstream y el cliente.
+
+Los bytes se reenvían tal cual llegan del upstream: sin partir en líneas ni
+volver a unir, así que los separadores de eventos (líneas en blanco) se
+conservan y no hay una copia extra por chunk.
+
+Backpressure: una tarea "pump" lee del upstream y entrega cada chunk por una
+cola de una sola posición. StreamingResponse solo pide el siguiente chunk
+cuando el anterior se entregó al socket del cliente (uvicorn espera a que el
+buffer de escritura drene), así que un cliente lento frena la lectura upstream
+vía TCP en lugar de acumular la respuesta entera en memoria.
+
+Cancelación: si se pasa `receive`, una segunda tarea vigila la desconexión del
+cliente y corta la conexión upstream aunque el upstream esté en silencio
+(p. ej. razonando antes del primer token).
+
+Coalescencia (opt-in, `coalesce_window`): los eventos se unen antes de
+escribirlos al cliente (ver kimi_proxy/coalesce.py); el aviso de fin de
+ventana llega por la misma cola, sin tareas extra.
+"""
+
+import asyncio
+from typing import AsyncIterator, Callable, Optional
+
+from kimi_proxy.cancellation import Receive, wait_for_disconnect
+from kimi_proxy.coalesce import DEFAULT_MAX_BYTES, TICK, WindowedCoalescer
+from kimi_proxy.upstream import UpstreamCall
+
+# Cabeceras para que proxies intermedios no almacenen ni agrupen el stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+_END = object()
+_DISCONNECTED = object()
+
+
+async def _pump(call: UpstreamCall, queue: asyncio.Queue) -> None:
+    """Lee el cuerpo upstream y lo entrega chunk a chunk por la cola"""
+    try:
+        async for chunk in call.aiter_chunks():
+            await queue.put(chunk)
+        call.finish("ok")
+        await queue.put(_END)
+    except asyncio.CancelledError:
+        call.finish("cancelled")
+        raise
+    except Exception as e:
+        call.finish("error")
+        await queue.put(e)
+    finally:
+        await call.aclose()
+
+
+def _signal(queue: asyncio.Queue, item: object) -> None:
+    """Deja `item` como único elemento de la cola (sin bloquear)"""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+async def relay_stream(
+    call: UpstreamCall,
+    receive: Optional[Receive] = None,
+    on_cancel: Optional[Callable[[int], None]] = None,
+    tap: Optional[Callable[[bytes], None]] = None,
+    on_complete: Optional[Callable[[], None]] = None,
+    coalesce_window: float = 0.0,
+    coalesce_bytes: int = DEFAULT_MAX_BYTES,
+) -> AsyncIterator[bytes]:
+    """
+    Reenvía el cuerpo de una llamada upstream abierta con stream=True
+
+    Args:
+        call: Llamada upstream con la respuesta abierta
+        receive: Canal ASGI de la petición del cliente, para detectar desconexiones
+        on_cancel: Callback con el número de eventos SSE ya emitidos cuando el
+            stream se corta antes de terminar
+        tap: Callback que observa cada chunk antes de reenviarlo (p. ej. caché)
+        on_complete: Callback cuando el upstream terminó el stream sin errores
+        coalesce_window: Segundos que se retienen eventos para unirlos (0 = no unir)
+        coalesce_bytes: Tamaño a partir del cual se envía lo retenido sin esperar
+
+    La respuesta upstream se cierra siempre al terminar, tanto si el stream se
+    completa como si el cliente se desconecta o el generador se cierra antes,
+    y el resultado se notifica con `call.finish`.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    pump = asyncio.create_task(_pump(call, queue))
+    watcher = None
+
+    if receive is not None:
+        watcher = asyncio.create_task(wait_for_disconnect(receive))
+
+        def disconnected(task: asyncio.Task) -> None:
+            if not task.cancelled() and task.exception() is None:
+                pump.cancel()
+                _signal(queue, _DISCONNECTED)
+
+        watcher.add_done_callback(disconnected)
+
+    coalescer = None
+    if coalesce_window > 0:
+        # Con la cola llena ya hay un chunk esperando: al procesarlo se vacía lo retenido
+        coalescer = WindowedCoalescer(
+            coalesce_window, coalesce_bytes, lambda: queue.full() or queue.put_nowait(TICK)
+        )
+
+    finished = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is TICK:
+                out = coalescer.tick()
+                if out:
+                    yield out
+                continue
+            if item is _END:
+                finished = True
+                if coalescer is not None:
+                    tail = coalescer.close()
+                    if tail:
+                        yield tail
+                if on_complete is not None:
+                    on_complete()
+                return
+            if item is _DISCONNECTED:
+                return
+            if isinstance(item, Exception):
+                finished = True
+                if coalescer is not None:
+                    tail = coalescer.close()
+                    if tail:
+                        yield tail
+                raise item
+            if tap is not None:
+                tap(item)
+            if coalescer is None:
+                yield item
+                continue
+            out = coalescer.feed(item)
+            if out:
+                yield out
+    finally:
+        if coalescer is not None:
+            coalescer.close()
+        if watcher is not None:
+            watcher.cancel()
+        if not pump.done():
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+        if not finished and on_cancel is not None:
+            on_cancel(call.events)
@@ -0,0 +1,211 @@
+"""
+Parser incremental de las llamadas a herramientas de Kimi-K2 en texto crudo.
+
+Cuando el backend no tiene parser de tool calls (vLLM/SGLang sin
+`--tool-call-parser kimi_k2`), el modelo devuelve las llamadas como tokens
+especiales dentro del texto (ver docs/tool_call_guidance.md):
+
+    <|tool_calls_section_begin|>
+    <|tool_call_begin|>functions.get_weather:0<|tool_call_argument_begin|>{"city": "Beijing"}<|tool_call_end|>
+    <|tool_calls_section_end|>
+
+ToolCallParser convierte ese texto en eventos a medida que llega: texto
+normal, razonamiento (<think>...</think>), inicio de cada llamada (id y
+nombre) y fragmentos de argumentos. Es una máquina de estados de una sola
+pasada: cada carácter se mira una vez y solo se retiene el final del chunk
+cuando puede ser el principio de un token especial partido entre chunks.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+SECTION_BEGIN = "<|tool_calls_section_begin|>"
+SECTION_END = "<|tool_calls_section_end|>"
+CALL_BEGIN = "<|tool_call_begin|>"
+ARGUMENT_BEGIN = "<|tool_call_argument_begin|>"
+CALL_END = "<|tool_call_end|>"
+THINK_BEGIN = "<think>"
+THINK_END = "</think>"
+
+# Estados
+TEXT = "text"
+THINK = "think"
+SECTION = "section"
+CALL_ID = "call_id"
+ARGUMENTS = "arguments"
+
+# Tokens especiales que se reconocen en cada estado
+_MARKERS = {
+    TEXT: (SECTION_BEGIN, THINK_BEGIN),
+    THINK: (THINK_END,),
+    SECTION: (CALL_BEGIN, SECTION_END),
+    CALL_ID: (ARGUMENT_BEGIN,),
+    ARGUMENTS: (CALL_END,),
+}
+
+_TRANSITIONS = {
+    SECTION_BEGIN: SECTION,
+    THINK_BEGIN: THINK,
+    THINK_END: TEXT,
+    CALL_BEGIN: CALL_ID,
+    ARGUMENT_BEGIN: ARGUMENTS,
+    CALL_END: SECTION,
+    SECTION_END: TEXT,
+}
+
+# Eventos: ("content", texto), ("reasoning", texto),
+# ("tool_call", índice, id, nombre), ("arguments", índice, fragmento)
+Event = Tuple[Any, ...]
+
+
+def function_name(call_id: str) -> str:
+    """`functions.get_weather:0` -> `get_weather`"""
+    name = call_id.rsplit(":", 1)[0]
+    return name.split(".", 1)[1] if name.startswith("functions.") else name
+
+
+class ToolCallParser:
+    """Máquina de estados que traduce texto crudo de Kimi-K2 en eventos"""
+
+    def __init__(self):
+        self.state = TEXT
+        self.tool_calls = 0
+        self._pending = ""
+        self._call_id: List[str] = []
+        self._arguments_started = False
+        self._whitespace = ""
+
+    def feed(self, text: str) -> List[Event]:
+        """Procesa un chunk de texto y devuelve los eventos que ya son seguros"""
+        events: List[Event] = []
+        data = self._pending + text if self._pending else text
+        self._pending = ""
+        start = position = 0
+        while True:
+            at = data.find("<", position)
+            if at < 0:
+                self._emit(data[start:], events)
+                break
+            marker, partial = self._match(data, at)
+            if marker is not None:
+                self._emit(data[start:at], events)
+                self._transition(marker, events)
+                start = position = at + len(marker)
+            elif partial:
+                # Posible token especial partido: se espera al siguiente chunk
+                self._emit(data[start:at], events)
+                self._pending = data[at:]
+                break
+            else:
+                position = at + 1
+        return events
+
+    def finish(self) -> List[Event]:
+        """Fin del texto: lo retenido no era un token especial"""
+        events: List[Event] = []
+        pending, self._pending = self._pending, ""
+        self._emit(pending, events)
+        return events
+
+    def _match(self, data: str, at: int) -> Tuple[Optional[str], bool]:
+        remaining = len(data) - at
+        partial = False
+        for marker in _MARKERS[self.state]:
+            if data.startswith(marker, at):
+                return marker, False
+            if remaining < len(marker) and marker.startswith(data[at:]):
+                partial = True
+        return None, partial
+
+    def _emit(self, text: str, events: List[Event]) -> None:
+        if not text:
+            return
+        state = self.state
+        if state == TEXT or state == THINK:
+            kind = "content" if state == TEXT else "reasoning"
+            if events and events[-1][0] == kind:
+                events[-1] = (kind, events[-1][1] + text)
+            else:
+                events.append((kind, text))
+        elif state == CALL_ID:
+            self._call_id.append(text)
+        elif state == ARGUMENTS:
+            self._emit_arguments(text, events)
+        # SECTION: solo separadores entre llamadas
+
+    def _emit_arguments(self, text: str, events: List[Event]) -> None:
+        # Como el regex de referencia: sin espacios al principio ni al final
+        if not self._arguments_started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._arguments_started = True
+        body = text.rstrip()
+        if not body:
+            self._whitespace += text
+            return
+        fragment = self._whitespace + body
+        self._whitespace = text[len(body):]
+        index = self.tool_calls
+        if events and events[-1][0] == "arguments" and events[-1][1] == index:
+            events[-1] = ("arguments", index, events[-1][2] + fragment)
+        else:
+            events.append(("arguments", index, fragment))
+
+    def _transition(self, marker: str, events: List[Event]) -> None:
+        if marker == CALL_BEGIN:
+            self._call_id = []
+        elif marker == ARGUMENT_BEGIN:
+            call_id = "".join(self._call_id).strip()
+            events.append(("tool_call", self.tool_calls, call_id, function_name(call_id)))
+            self._arguments_started = False
+            self._whitespace = ""
+        elif marker == CALL_END:
+            self.tool_calls += 1
+        self.state = _TRANSITIONS[marker]
+
+
+def assemble(events: List[Event]) -> Tuple[str, str, List[Dict[str, Any]]]:
+    """Contenido, razonamiento y tool_calls (formato OpenAI) a partir de los eventos"""
+    content: List[str] = []
+    reasoning: List[str] = []
+    calls: List[Dict[str, Any]] = []
+    arguments: List[List[str]] = []
+    for event in events:
+        kind = event[0]
+        if kind == "content":
+            content.append(event[1])
+        elif kind == "reasoning":
+            reasoning.append(event[1])
+        elif kind == "tool_call":
+            calls.append({"id": event[2], "type": "function", "function": {"name": event[3], "arguments": ""}})
+            arguments.append([])
+        elif kind == "arguments":
+            arguments[event[1]].append(event[2])
+    for call, parts in zip(calls, arguments):
+        call["function"]["arguments"] = "".join(parts)
+    return "".join(content), "".join(reasoning), calls
+
+
+def extract_tool_call_info(tool_call_rsp: str) -> List[Dict[str, Any]]:
+    """
+    Versión de referencia de docs/tool_call_guidance.md: regex sobre la salida completa
+
+    Se mantiene para comparar resultados y rendimiento con ToolCallParser.
+    """
+    if SECTION_BEGIN not in tool_call_rsp:
+        return []
+    pattern = r"<\|tool_calls_section_begin\|>(.*?)<\|tool_calls_section_end\|>"
+    tool_calls_sections = re.findall(pattern, tool_call_rsp, re.DOTALL)
+    func_call_pattern = (
+        r"<\|tool_call_begin\|>\s*(?P<tool_call_id>[\w\.]+:\d+)\s*<\|tool_call_argument_begin\|>"
+        r"\s*(?P<function_arguments>.*?)\s*<\|tool_call_end\|>"
+    )
+    tool_calls = []
+    for function_id, function_args in re.findall(func_call_pattern, tool_calls_sections[0], re.DOTALL):
+        tool_calls.append({
+            "id": function_id,
+            "type": "function",
+            "function": {"name": function_id.split(".")[1].split(":")[0], "arguments": function_args},
+        })
+    return tool_calls
@@ -0,0 +1,165 @@
+"""
+Cliente HTTP asíncrono compartido para las llamadas upstream del proxy.
+
+Un único httpx.AsyncClient por proceso (creado en el lifespan de la app)
+reutiliza conexiones TLS con keep-alive y multiplexa sobre HTTP/2 cuando
+el paquete `h2` está instalado. UpstreamCall envuelve cada respuesta abierta
+y mide TTFT y eventos emitidos para el router y las métricas.
+"""
+
+import importlib.util
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """Indica si el soporte HTTP/2 de httpx (paquete h2) está instalado"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def create_upstream_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    timeout: float = 120.0,
+    connect_timeout: float = 10.0,
+    http2: bool = True,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> httpx.AsyncClient:
+    """
+    Crea el cliente upstream con pool de conexiones configurable
+
+    Args:
+        max_connections: Conexiones simultáneas máximas en el pool
+        max_keepalive_connections: Conexiones ociosas que se mantienen abiertas
+        keepalive_expiry: Segundos que una conexión ociosa sigue viva
+        timeout: Timeout de lectura/escritura por petición (segundos)
+        connect_timeout: Timeout de conexión (segundos)
+        http2: Negociar HTTP/2 si el servidor lo soporta
+        transport: Transporte alternativo (tests y benchmarks)
+    """
+    if http2 and not http2_available():
+        logger.warning("Paquete 'h2' no instalado: el cliente upstream usará HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=limits,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        transport=transport,
+    )
+
+
+class UpstreamCall:
+    """
+    Una llamada upstream en curso: respuesta abierta, proveedor y tiempos
+
+    Los componentes que necesitan observar la llamada (router, métricas...)
+    se registran con `add_listener` y reciben (call, outcome) una sola vez al
+    terminar. outcome es "ok", "error" o "cancelled".
+    """
+
+    def __init__(
+        self,
+        response: httpx.Response,
+        provider: Any = None,
+        started: Optional[float] = None,
+        stream: bool = True,
+        model: Optional[str] = None,
+    ):
+        self.response = response
+        self.provider = provider
+        self.stream = stream
+        self.model = model
+        self.started = started if started is not None else time.perf_counter()
+        # Se crea al recibir las cabeceras de respuesta
+        self.headers_at = time.perf_counter()
+        self.first_chunk_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.events = 0
+        # Últimos dos chunks (referencias, sin copiar) para leer `usage` al final
+        self.previous_chunk = b""
+        self.last_chunk = b""
+        # Recibe el intervalo entre chunks consecutivos (métricas de inter-token)
+        self.on_gap: Optional[Callable[[float], None]] = None
+        # Traduce el cuerpo antes de entregarlo (backends de /v1/completions)
+        self.translator: Any = None
+        self.outcome: Optional[str] = None
+        self._prefetched: List[bytes] = []
+        self._body: Optional[AsyncIterator[bytes]] = None
+        self._listeners: List[Callable[["UpstreamCall", str], None]] = []
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Segundos desde el envío hasta el primer chunk del cuerpo"""
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.started
+
+    def add_listener(self, listener: Callable[["UpstreamCall", str], None]) -> None:
+        self._listeners.append(listener)
+
+    def mark_chunk(self, chunk: bytes) -> None:
+        now = time.perf_counter()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        elif self.on_gap is not None:
+            self.on_gap(now - self.last_chunk_at)
+        self.last_chunk_at = now
+        self.events += chunk.count(b"data:")
+        self.previous_chunk, self.last_chunk = self.last_chunk, chunk
+
+    def _body_iterator(self) -> AsyncIterator[bytes]:
+        # httpx solo permite recorrer el cuerpo una vez: se comparte el iterador
+        if self._body is None:
+            self._body = self.response.aiter_bytes()
+            if self.translator is not None:
+                self._body = self._translated(self._body)
+        return self._body
+
+    async def _translated(self, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in body:
+            chunk = self.translator.feed(chunk)
+            if chunk:
+                yield chunk
+        tail = self.translator.close()
+        if tail:
+            yield tail
+
+    async def prefetch(self) -> Optional[bytes]:
+        """Lee el primer chunk por adelantado (se entregará luego en aiter_chunks)"""
+        async for chunk in self._body_iterator():
+            self.mark_chunk(chunk)
+            self._prefetched.append(chunk)
+            return chunk
+        return None
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Itera el cuerpo upstream tal cual llega, registrando los tiempos"""
+        while self._prefetched:
+            yield self._prefetched.pop(0)
+        async for chunk in self._body_iterator():
+            self.mark_chunk(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+    def finish(self, outcome: str) -> None:
+        """Notifica el resultado a los listeners (solo la primera vez)"""
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        for listener in self._listeners:
+            listener(self, outcome)
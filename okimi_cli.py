@@ -8,12 +8,14 @@ Uso:
   okimi "tu pregunta aquí"        # Modo comando único
   okimi -h, --help                # Ayuda
   okimi --heavy "pregunta"        # Heavy Mode (8 trayectorias paralelas)
+  okimi --cascade "pregunta"      # Cascada: Qwen3-Coder local y Kimi K2 solo si duda
   okimi --simple "pregunta"       # Modo simple (sin razonamiento extendido)
 """
 
 import os
 import sys
 import json
+import functools
 from pathlib import Path
 
 # Intentar importar dependencias
@@ -27,6 +29,23 @@ except ImportError as e:
     print("   pip install python-dotenv openai requests")
     sys.exit(1)
 
+# Caché en disco, streaming, Heavy Mode y cascada, compartidos con okimi/kimi y
+# el proxy local (opcional, ver SETUP_LOCAL.md). Sin kimi_proxy: llamada directa
+try:
+    from kimi_proxy.cli import StreamView, create_cascade_completion, create_completion, create_heavy_completion
+except ImportError:
+    StreamView = None
+
+    def create_completion(client, config, view=None):
+        return client.chat.completions.create(**config)
+
+    def create_heavy_completion(client, config):
+        """Sin el motor local, se pide heavy_mode al proveedor"""
+        return client.chat.completions.create(**config, extra_body={"heavy_mode": True})
+
+    def create_cascade_completion(client, config):
+        raise RuntimeError("El modo cascada necesita kimi_proxy (instala las dependencias del proxy)")
+
 # Colores para terminal
 class Colors:
     HEADER = '\033[95m'
@@ -208,7 +227,8 @@ def execute_tool(tool_name, arguments):
     except Exception as e:
         return f"Error al ejecutar {tool_name}: {str(e)}"
 
-def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=False, interactive=False, api_key=None):
+def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=False, interactive=False, api_key=None,
+               cascade_mode=False):
     """
     Consulta a Kimi K2 Thinking vía OpenRouter con todas las capacidades activadas
 
@@ -220,6 +240,7 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=Fal
         web_mode: Activar herramientas (web, código, memoria) sin heavy mode
         interactive: Modo interactivo (permite conversación continua)
         api_key: API key para consultar balance de créditos
+        cascade_mode: Modo cascada (modelo local primero, Kimi K2 solo si duda)
     """
 
     # Configuración base
@@ -245,10 +266,11 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=Fal
 
     # Activar Heavy Mode si se solicita (8 trayectorias + tools)
     if heavy_mode:
-        config["extra_body"] = {"heavy_mode": True}
         print(f"\n{Colors.WARNING}⚡ Heavy Mode activado: 8 trayectorias paralelas + herramientas{Colors.ENDC}")
     elif web_mode:
         print(f"\n{Colors.OKCYAN}🌐 Web Mode activado: razonamiento + herramientas{Colors.ENDC}")
+    if cascade_mode:
+        print(f"\n{Colors.OKCYAN}🪜 Modo cascada: Qwen3-Coder local primero, Kimi K2 solo si duda{Colors.ENDC}")
 
     if simple_mode:
         config["max_tokens"] = 1000
@@ -272,6 +294,17 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=Fal
     try:
         print(f"\n{Colors.OKCYAN}🤔 Procesando...{Colors.ENDC}\n")
 
+        # En Heavy Mode cada llamada del bucle se vota entre trayectorias; en cascada, se escala.
+        # Si no, cada ronda llega en streaming (KIMI_STREAM=0 para esperarla entera)
+        view = None
+        if heavy_mode:
+            completion_fn = create_heavy_completion
+        elif cascade_mode:
+            completion_fn = create_cascade_completion
+        else:
+            view = StreamView() if StreamView is not None and os.getenv('KIMI_STREAM', '1') != '0' else None
+            completion_fn = functools.partial(create_completion, view=view)
+
         # Loop iterativo de tool calling (máximo 5 rondas)
         max_iterations = 5
         iteration = 0
@@ -280,7 +313,7 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=Fal
             iteration += 1
 
             # Llamar al modelo
-            response = client.chat.completions.create(**config)
+            response = completion_fn(client, config)
             message = response.choices[0].message
 
             # Si el modelo ya no quiere usar tools, terminar el loop
@@ -365,22 +398,23 @@ def query_kimi(client, prompt, heavy_mode=False, simple_mode=False, web_mode=Fal
             config_final.pop("tools", None)
             config_final.pop("tool_choice", None)
 
-            response = client.chat.completions.create(**config_final)
+            response = completion_fn(client, config_final)
             message = response.choices[0].message
 
         # Mostrar número de rondas si hubo tool calling
         if iteration > 0:
             print(f"{Colors.OKCYAN}✨ Respuesta final (después de {iteration} ronda{'s' if iteration > 1 else ''} de búsquedas){Colors.ENDC}\n")
 
-        # Mostrar respuesta final
-        print(f"{Colors.BOLD}═══ RESPUESTA ═══{Colors.ENDC}\n")
-        if message.content:
-            print(message.content)
-        else:
-            print(f"{Colors.WARNING}(Sin contenido de texto){Colors.ENDC}")
+        # Mostrar respuesta final (si no llegó ya en streaming)
+        if not (view is not None and view.answered):
+            print(f"{Colors.BOLD}═══ RESPUESTA ═══{Colors.ENDC}\n")
+            if message.content:
+                print(message.content)
+            else:
+                print(f"{Colors.WARNING}(Sin contenido de texto){Colors.ENDC}")
 
-        # Mostrar uso de tokens
-        if response.usage:
+        # Mostrar uso de tokens (la cascada ya mostró el coste de cada nivel)
+        if response.usage and not cascade_mode:
             print(f"\n{Colors.OKBLUE}═══ USO DE TOKENS ═══{Colors.ENDC}")
             print(f"  Input: {response.usage.prompt_tokens:,} tokens")
             print(f"  Output: {response.usage.completion_tokens:,} tokens")
@@ -504,12 +538,14 @@ def show_help():
   --simple "pregunta"            Modo simple (respuesta rápida sin razonamiento)
   --web "pregunta"               Web Mode (razonamiento + herramientas)
   --heavy "pregunta"             Heavy Mode (8 trayectorias + herramientas)
+  --cascade "pregunta"           Cascada: Qwen3-Coder local, Kimi K2 solo si duda
 
 {Colors.OKGREEN}Ejemplos:{Colors.ENDC}
   okimi "¿Qué es un sistema de memoria distribuida?"
   okimi --simple "Resume en 3 líneas qué es K2 Thinking"
   okimi --web "Busca info reciente sobre Kimi K2"
   okimi --heavy "Diseña arquitectura completa multi-agente"
+  okimi --cascade "¿Cuántos segundos tiene un día?"
 
 {Colors.OKGREEN}Capacidades activadas:{Colors.ENDC}
   ✓ Contexto: 256K tokens
@@ -522,11 +558,13 @@ def show_help():
   • Normal (default): Razonamiento completo sin herramientas
   • Web (--web): Razonamiento + herramientas (1 trayectoria)
   • Heavy (--heavy): Razonamiento + herramientas (8 trayectorias)
+  • Cascada (--cascade): Qwen3-Coder local; escala a Kimi K2 (normal y Heavy) si duda
 
 {Colors.OKGREEN}Configuración:{Colors.ENDC}
   API Key: ~/.env (OPENROUTER_API_KEY)
   Endpoint: openrouter.ai/api/v1
   Modelo: moonshotai/kimi-k2-thinking
+  Streaming: activado (KIMI_STREAM=0 espera la respuesta completa)
 
 {Colors.OKGREEN}Diferencia con kimi (Chutes.ai):{Colors.ENDC}
   • okimi usa OpenRouter (acceso multi-proveedor)
@@ -582,6 +620,15 @@ def main():
             query_kimi(client, prompt, heavy_mode=True, api_key=api_key)
             sys.exit(0)
 
+        # Modo cascada (modelo local primero, Kimi K2 solo si duda)
+        if arg == '--cascade' and len(sys.argv) > 2:
+            print_banner()
+            api_key = load_api_key()
+            client = create_client(api_key)
+            prompt = ' '.join(sys.argv[2:])
+            query_kimi(client, prompt, cascade_mode=True, api_key=api_key)
+            sys.exit(0)
+
         # Comando único (cualquier texto)
         print_banner()
         api_key = load_api_key()
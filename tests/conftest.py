@@ -0,0 +1,133 @@
+"""
+Shared fixtures for proxy tests.
+The upstream is replaced by an httpx.MockTransport, so no network is used.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# tests/ is not a package (it would clash with kimi_k2_benchmark/tests), so pytest only
+# puts tests/ itself on sys.path; the repo root is needed for kimi_proxy and the server
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def completion_body(content="ok", model="moonshot/kimi-k2-thinking"):
+    """Minimal non-streaming chat.completion body"""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 1730000000,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+    }
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """The proxy module with an API key configured and fresh routing state"""
+    # Through monkeypatch, so the key does not leak into kimi_k2_benchmark/tests
+    monkeypatch.setenv("CHUTES_API_KEY", "test-key")
+    import kimi_k2_local_server as server
+    from kimi_proxy.concurrency import ConcurrencyLimits
+    from kimi_proxy.ratelimit import RateLimiter
+    from kimi_proxy.retry import RetryPolicy
+    from kimi_proxy.router import load_router
+    monkeypatch.setattr(server, "CHUTES_API_KEY", "test-key")
+    monkeypatch.setattr(server, "router", load_router(env={"CHUTES_API_KEY": "test-key"}))
+    monkeypatch.setattr(
+        server, "concurrency", ConcurrencyLimits(**server.concurrency.limiter_options)
+    )
+    monkeypatch.setattr(
+        server, "rate_limiter", RateLimiter(server.RATE_LIMIT_RPM, server.RATE_LIMIT_TPM)
+    )
+    # Reintentos sin esperas reales
+    monkeypatch.setattr(server, "retry_policy", RetryPolicy(base_delay=0.001, max_delay=0.01))
+    server.app.state.response_cache = None
+    yield server
+    server.app.state.response_cache = None
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    """A memory + disk response cache in a temporary directory"""
+    from kimi_proxy.cache import DiskCache, MemoryLRU, ResponseCache
+
+    cache = ResponseCache(MemoryLRU(1024 * 1024), DiskCache(tmp_path / "responses.sqlite", 1024 * 1024, 60))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def run_proxy(server):
+    """
+    Run an async scenario against the proxy app.
+
+    Usage: run_proxy(handler, scenario) where handler is the mock upstream
+    and scenario is `async def scenario(client)`.
+    """
+    def runner(handler, scenario):
+        async def main():
+            server.app.state.upstream_client = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            transport = httpx.ASGITransport(app=server.app)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+                    return await scenario(client)
+            finally:
+                await server.app.state.upstream_client.aclose()
+
+        return asyncio.run(main())
+
+    return runner
+
+
+def asgi_request(app, path, body, disconnect_after=None, headers=()):
+    """
+    Call an ASGI app directly, optionally simulating a client disconnect.
+
+    Returns the list of ASGI messages sent by the app.
+    """
+    async def main():
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"proxy"), (b"content-type", b"application/json"), *headers],
+            "client": ("127.0.0.1", 12345),
+            "server": ("proxy", 80),
+        }
+        messages = []
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            if disconnect_after is None:
+                await asyncio.Event().wait()
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        await app(scope, receive, send)
+        return messages
+
+    return asyncio.run(main())
@@ -0,0 +1,160 @@
+"""
+Tests for prefix-affinity routing across self-hosted replicas (kimi_proxy/affinity.py)
+"""
+from collections import Counter
+
+import httpx
+import pytest
+
+from kimi_proxy.affinity import HashRing, bounded_choice, prefix_key
+from kimi_proxy.router import load_router
+from conftest import completion_body
+
+REPLICAS_YAML = """
+providers:
+  vllm:
+    label: "vLLM DP"
+    api_base: "http://unused/v1"
+    routing: {routing}
+    replicas:
+      - "http://replica0/v1"
+      - "http://replica1/v1"
+      - "http://replica2/v1"
+      - api_base: "http://replica3/v1"
+        weight: 1.0
+    default: true
+    models:
+      moonshotai/Kimi-K2-Thinking: "kimi-k2"
+model_aliases:
+  moonshot/kimi-k2-thinking: "moonshotai/Kimi-K2-Thinking"
+"""
+
+SYSTEM = {"role": "system", "content": "Eres un asistente."}
+
+
+def conversation(topic, turns):
+    messages = [SYSTEM, {"role": "user", "content": f"Hablemos de {topic}"}]
+    for i in range(turns):
+        messages += [{"role": "assistant", "content": f"respuesta {i}"}, {"role": "user", "content": f"y {i}?"}]
+    return {"model": "moonshot/kimi-k2-thinking", "messages": messages}
+
+
+@pytest.fixture
+def replicas_router(tmp_path):
+    def build(routing="prefix_affinity"):
+        path = tmp_path / "models.yaml"
+        path.write_text(REPLICAS_YAML.format(routing=routing))
+        return load_router(path, env={})
+    return build
+
+
+class TestPrefixKey:
+    def test_stable_across_turns(self):
+        """Should give every turn of a conversation the same key"""
+        keys = {prefix_key(conversation("vLLM", turns)) for turns in range(5)}
+
+        assert len(keys) == 1
+
+    def test_depends_on_system_tools_and_first_turn(self):
+        """Should change the key when the shared prefix changes"""
+        base = conversation("vLLM", 1)
+        other_system = {**base, "messages": [{"role": "system", "content": "Otro"}] + base["messages"][1:]}
+        with_tools = {**base, "tools": [{"type": "function", "function": {"name": "f"}}]}
+
+        keys = {prefix_key(d) for d in (base, conversation("SGLang", 1), other_system, with_tools)}
+
+        assert len(keys) == 4
+        assert prefix_key({"messages": []}) is None
+
+
+class TestBoundedConsistentHashing:
+    def test_removing_a_replica_only_moves_its_keys(self):
+        """Should keep the keys of the surviving replicas where they were"""
+        ring = HashRing({"a": 1, "b": 1, "c": 1})
+        keys = [f"key-{i}" for i in range(300)]
+        before = {k: ring.walk(k)[0] for k in keys}
+        after = {k: [n for n in ring.walk(k) if n != "c"][0] for k in keys}
+
+        moved = [k for k in keys if before[k] != after[k]]
+
+        assert all(before[k] == "c" for k in moved)
+        assert 60 < len(moved) < 140
+
+    def test_spills_past_an_overloaded_replica(self):
+        """Should send the request to the next replica when the preferred one is over the bound"""
+        ring = HashRing({"a": 1, "b": 1})
+        preferred, other = ring.walk("k")
+        load = {preferred: 4, other: 0}
+
+        choice, spilled = bounded_choice(ring, "k", ["a", "b"], name=str, load=load.get, load_factor=1.25)
+
+        assert (choice, spilled) == (other, True)
+        load[preferred] = 1
+        assert bounded_choice(ring, "k", ["a", "b"], name=str, load=load.get, load_factor=1.25) == (preferred, False)
+
+
+class TestReplicaRouting:
+    def test_replicas_expand_to_providers(self, replicas_router):
+        """Should create one provider per replica in the same group"""
+        router = replicas_router()
+
+        assert sorted(router.providers) == ["vllm/0", "vllm/1", "vllm/2", "vllm/3"]
+        assert router.providers["vllm/3"].url("chat/completions") == "http://replica3/v1/chat/completions"
+        assert router.has_affinity
+
+    def test_same_prefix_same_replica_and_spread(self, replicas_router):
+        """Should pin conversations to one replica and spread different ones"""
+        router = replicas_router()
+        chosen = {}
+        for topic in range(40):
+            for turns in range(3):
+                key = prefix_key(conversation(topic, turns))
+                provider, model = router.choose("moonshot/kimi-k2-thinking", affinity_key=key)
+                chosen.setdefault(topic, set()).add(provider.name)
+
+        assert model == "kimi-k2"
+        assert all(len(names) == 1 for names in chosen.values())
+        assert len(Counter(next(iter(names)) for names in chosen.values())) == 4
+        stats = router.snapshot()["affinity"]["vllm"]
+        assert stats["estimated_hit_rate"] == 1.0
+        assert stats["repeated_prefixes"] == 80
+
+    def test_overloaded_replica_spills(self, replicas_router):
+        """Should move the request and count a miss when the preferred replica is saturated"""
+        router = replicas_router()
+        key = prefix_key(conversation("carga", 0))
+        preferred, _ = router.choose("moonshot/kimi-k2-thinking", affinity_key=key)
+        preferred.in_flight = 10
+
+        provider, _ = router.choose("moonshot/kimi-k2-thinking", affinity_key=key)
+
+        assert provider is not preferred
+        stats = router.snapshot()["affinity"]["vllm"]
+        assert (stats["spills"], stats["estimated_hits"]) == (1, 0)
+
+    def test_p2c_routing_ignores_the_key(self, replicas_router):
+        """Should keep latency-based routing for replicas with routing: p2c"""
+        router = replicas_router("p2c")
+
+        assert not router.has_affinity
+        assert router.snapshot()["affinity"] == {}
+
+    def test_conversation_reaches_the_same_mock_replica(self, server, run_proxy, replicas_router, monkeypatch):
+        """Should route every turn through the proxy to the replica holding the prefix"""
+        monkeypatch.setattr(server, "router", replicas_router())
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            for turns in range(4):
+                response = await client.post("/v1/chat/completions", json=conversation("proxy", turns))
+                assert response.status_code == 200
+            return (await client.get("/admin/providers")).json()
+
+        snapshot = run_proxy(handler, scenario)
+
+        assert len(set(hosts)) == 1 and len(hosts) == 4
+        assert snapshot["affinity"]["vllm"]["estimated_hit_rate"] == 1.0
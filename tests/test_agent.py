@@ -0,0 +1,175 @@
+"""
+Tests for the server-side agent loop (X-Kimi-Agent: on).
+"""
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.agent import ToolRegistry, searxng_tool
+from kimi_proxy.sse import completion_to_sse
+from conftest import completion_body
+
+AGENT = {"X-Kimi-Agent": "on"}
+QUESTION = {"model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": "news?"}]}
+
+
+def tool_call_turn(*queries, name="buscar_informacion"):
+    body = completion_body(content=None)
+    body["choices"][0]["message"]["tool_calls"] = [
+        {"id": f"functions.{name}:{i}", "type": "function",
+         "function": {"name": name, "arguments": orjson.dumps({"consulta": q}).decode()}}
+        for i, q in enumerate(queries)
+    ]
+    body["choices"][0]["finish_reason"] = "tool_calls"
+    return body
+
+
+def sse_response(completion):
+    return httpx.Response(200, content=b"".join(completion_to_sse(completion)),
+                          headers={"content-type": "text/event-stream"})
+
+
+class Upstream:
+    """Mock model + SearXNG: returns the scripted turns in order"""
+
+    def __init__(self, *turns, search_delay=0.0):
+        self.turns = list(turns)
+        self.model_requests = []
+        self.searches = []
+        self.search_delay = search_delay
+
+    async def __call__(self, request):
+        if request.url.path == "/search":
+            self.searches.append(request.url.params["q"])
+            await asyncio.sleep(self.search_delay)
+            return httpx.Response(200, json={"results": [
+                {"title": "Result", "url": "https://example.com", "content": "text", "engine": "brave"}
+            ]})
+        self.model_requests.append(orjson.loads(request.content))
+        return sse_response(self.turns.pop(0))
+
+
+def post(body, headers=AGENT):
+    async def scenario(client):
+        return await client.post("/v1/chat/completions", json=body, headers=headers)
+    return scenario
+
+
+class TestAgentLoop:
+    def test_runs_tool_rounds_on_the_server(self, run_proxy):
+        """Should execute the search, resend the results and return only the final answer"""
+        upstream = Upstream(tool_call_turn("kimi k2"), completion_body("final answer"))
+
+        response = run_proxy(upstream, post(QUESTION))
+        body = response.json()
+
+        assert response.status_code == 200
+        assert body["choices"][0]["message"]["content"] == "final answer"
+        assert upstream.searches == ["kimi k2"]
+        first, second = upstream.model_requests
+        assert first["stream"] is True
+        assert [t["function"]["name"] for t in first["tools"]] == ["buscar_informacion"]
+        tool_message = second["messages"][-1]
+        assert tool_message["role"] == "tool"
+        assert tool_message["tool_call_id"] == "functions.buscar_informacion:0"
+        assert "https://example.com" in tool_message["content"]
+
+        trace = body["kimi_agent"]
+        assert trace["stopped"] == "answer"
+        assert [len(r["tool_calls"]) for r in trace["rounds"]] == [1, 0]
+        assert trace["rounds"][0]["tool_calls"][0]["status"] == "ok"
+        assert body["usage"]["total_tokens"] == 12
+
+    def test_tool_calls_of_one_turn_run_concurrently(self, run_proxy):
+        """Should run all tool calls of an assistant turn at the same time"""
+        upstream = Upstream(tool_call_turn("a", "b", "c"), completion_body(), search_delay=0.2)
+
+        trace = run_proxy(upstream, post(QUESTION)).json()["kimi_agent"]
+
+        assert sorted(upstream.searches) == ["a", "b", "c"]
+        assert trace["rounds"][0]["tool_seconds"] < 0.5
+
+    def test_tool_timeout_is_reported_to_the_model(self, server, run_proxy, monkeypatch):
+        """Should answer a slow tool with an error message instead of waiting"""
+        monkeypatch.setattr(server, "agent_tools", ToolRegistry((searxng_tool(),), timeout=0.05))
+        upstream = Upstream(tool_call_turn("slow"), completion_body(), search_delay=1)
+
+        trace = run_proxy(upstream, post(QUESTION)).json()["kimi_agent"]
+
+        assert trace["rounds"][0]["tool_calls"][0]["status"] == "timeout"
+        assert "sin respuesta" in upstream.model_requests[1]["messages"][-1]["content"]
+
+    def test_client_tools_are_returned_to_the_client(self, run_proxy):
+        """Should stop and return the turn when the model calls a tool the proxy does not have"""
+        upstream = Upstream(tool_call_turn("x", name="run_code"))
+
+        body = run_proxy(upstream, post(QUESTION)).json()
+
+        assert body["choices"][0]["finish_reason"] == "tool_calls"
+        assert body["choices"][0]["message"]["tool_calls"][0]["function"]["name"] == "run_code"
+        assert body["kimi_agent"]["stopped"] == "client_tools"
+        assert upstream.searches == []
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_mixed_turn_returns_only_client_tools(self, run_proxy, stream):
+        """Should hand back only the client's tool calls when a turn mixes them with server tools"""
+        turn = tool_call_turn("x", name="run_code")
+        turn["choices"][0]["message"]["tool_calls"].insert(0, tool_call_turn("kimi")["choices"][0]["message"]["tool_calls"][0])
+        upstream = Upstream(turn)
+
+        response = run_proxy(upstream, post({**QUESTION, "stream": stream}))
+
+        if stream:
+            events = [orjson.loads(line[6:]) for line in response.content.split(b"\n\n") if line.startswith(b"data: {")]
+            calls = [call for c in events if c["choices"] for call in c["choices"][0]["delta"].get("tool_calls") or []]
+            trace = events[-1]["kimi_agent"]
+        else:
+            body = response.json()
+            calls = body["choices"][0]["message"]["tool_calls"]
+            trace = body["kimi_agent"]
+        assert [call["function"]["name"] for call in calls] == ["run_code"]
+        assert trace["stopped"] == "client_tools"
+        assert trace["rounds"][0]["dropped_tool_calls"] == ["buscar_informacion"]
+        assert upstream.searches == []
+
+    def test_round_limit_forces_an_answer(self, server, run_proxy, monkeypatch):
+        """Should make a last call without tools after the round limit"""
+        monkeypatch.setattr(server, "AGENT_MAX_ROUNDS", 1)
+        upstream = Upstream(tool_call_turn("a"), completion_body("forced"))
+
+        body = run_proxy(upstream, post(QUESTION)).json()
+
+        assert body["choices"][0]["message"]["content"] == "forced"
+        assert body["kimi_agent"]["stopped"] == "max_rounds"
+        assert "tools" not in upstream.model_requests[-1]
+
+    def test_streaming_hides_tool_rounds(self, run_proxy):
+        """Should stream the answer without tool_calls deltas and end with the trace"""
+        upstream = Upstream(tool_call_turn("a"), completion_body("streamed answer"))
+
+        response = run_proxy(upstream, post({**QUESTION, "stream": True}))
+        events = [orjson.loads(line[6:]) for line in response.content.split(b"\n\n") if line.startswith(b"data: {")]
+
+        assert response.content.endswith(b"data: [DONE]\n\n")
+        deltas = [c["choices"][0]["delta"] for c in events if c["choices"]]
+        assert not any("tool_calls" in d for d in deltas)
+        assert "".join(d.get("content") or "" for d in deltas) == "streamed answer"
+        assert events[-1]["kimi_agent"]["stopped"] == "answer"
+        assert events[-1]["usage"]["total_tokens"] == 12
+
+    @pytest.mark.parametrize("headers", [{}, {"X-Kimi-Agent": "off"}])
+    def test_off_by_default(self, run_proxy, headers):
+        """Should forward tool calls to the client unless the agent mode is requested"""
+        seen = []
+
+        def handler(request):
+            seen.append(orjson.loads(request.content))
+            return httpx.Response(200, json=tool_call_turn("a"))
+
+        body = run_proxy(handler, post(QUESTION, headers=headers)).json()
+
+        assert "kimi_agent" not in body
+        assert body["choices"][0]["finish_reason"] == "tool_calls"
+        assert "tools" not in seen[0]
@@ -0,0 +1,339 @@
+"""
+Tests for the Batch API: persistent store, background runner and endpoints.
+"""
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.batches import BatchError, BatchRunner, BatchStore, parse_batch_lines
+from conftest import completion_body
+
+
+def jsonl(*bodies, url="/v1/chat/completions"):
+    """Batch input with one request per body"""
+    return b"".join(
+        orjson.dumps({"custom_id": f"req-{i}", "method": "POST", "url": url, "body": body}) + b"\n"
+        for i, body in enumerate(bodies)
+    )
+
+
+def chat(content="hi"):
+    return {"model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": content}]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BatchStore(tmp_path / "batches")
+    yield store
+    store.close()
+
+
+def read_output(store, batch):
+    content = store.file_path(batch["output_file_id"]).read_bytes()
+    return [orjson.loads(line) for line in content.splitlines()]
+
+
+class TestParseBatchLines:
+    def test_parses_requests_and_skips_blank_lines(self):
+        """Should return one item per non-empty line"""
+        items = parse_batch_lines(jsonl(chat("a"), chat("b")) + b"\n", "/v1/chat/completions")
+
+        assert [(i.line, i.custom_id) for i in items] == [(0, "req-0"), (1, "req-1")]
+
+    def test_reports_line_of_invalid_json(self):
+        """Should name the first malformed line"""
+        with pytest.raises(BatchError, match="Line 2"):
+            parse_batch_lines(jsonl(chat()) + b"{not json\n", "/v1/chat/completions")
+
+    def test_rejects_mismatched_url_and_duplicate_ids(self):
+        """Should reject other endpoints and repeated custom_ids"""
+        with pytest.raises(BatchError, match="does not match"):
+            parse_batch_lines(jsonl(chat(), url="/v1/embeddings"), "/v1/chat/completions")
+        line = orjson.dumps({"custom_id": "x", "body": chat()}) + b"\n"
+        with pytest.raises(BatchError, match="duplicate"):
+            parse_batch_lines(line * 2, "/v1/chat/completions")
+
+
+class TestBatchStore:
+    def test_create_batch_from_file(self, store):
+        """Should validate the file and count its requests"""
+        file = store.create_file("input.jsonl", jsonl(chat(), chat()), "batch")
+        batch = store.create_batch(file["id"], "/v1/chat/completions")
+
+        assert batch["status"] == "validating"
+        assert batch["request_counts"] == {"total": 2, "completed": 0, "failed": 0}
+        assert store.runnable_batches() == [batch["id"]]
+
+    def test_missing_file_is_an_error(self, store):
+        """Should raise BatchError for unknown input files"""
+        with pytest.raises(BatchError, match="not found"):
+            store.create_batch("file_missing", "/v1/chat/completions")
+
+    def test_progress_survives_reopening(self, store, tmp_path):
+        """Should resume only the pending requests after a restart"""
+        file = store.create_file("input.jsonl", jsonl(chat("a"), chat("b")), "batch")
+        batch = store.create_batch(file["id"], "/v1/chat/completions")
+        first, _ = store.start_batch(batch["id"])
+        store.record_result(batch["id"], first, True, {"custom_id": first.custom_id})
+        store.close()
+
+        reopened = BatchStore(tmp_path / "batches")
+        try:
+            pending = reopened.start_batch(batch["id"])
+
+            assert [i.custom_id for i in pending] == ["req-1"]
+            assert reopened.get_batch(batch["id"])["request_counts"]["completed"] == 1
+            assert read_output(reopened, batch) == [{"custom_id": "req-0"}]
+        finally:
+            reopened.close()
+
+
+class TestBatchRunner:
+    def test_runs_all_requests_and_writes_output(self, store):
+        """Should execute every request and mark the batch completed"""
+        seen = []
+
+        async def execute(url, body, headers):
+            seen.append(headers["X-Kimi-Priority"])
+            if body["messages"][0]["content"] == "fail":
+                return 500, {"error": {"message": "boom"}}
+            return 200, completion_body(body["messages"][0]["content"])
+
+        file = store.create_file("input.jsonl", jsonl(chat("a"), chat("fail")), "batch")
+        batch = store.create_batch(file["id"], "/v1/chat/completions")
+
+        status = asyncio.run(BatchRunner(store, execute, concurrency=2).run_batch(batch["id"]))
+
+        assert status == "completed"
+        assert seen == ["batch", "batch"]
+        assert store.get_batch(batch["id"])["request_counts"] == {"total": 2, "completed": 1, "failed": 1}
+        lines = {line["custom_id"]: line for line in read_output(store, batch)}
+        assert lines["req-0"]["response"]["status_code"] == 200
+        assert lines["req-1"]["response"]["status_code"] == 500
+
+    def test_exceptions_become_failed_lines(self, store):
+        """Should record executor errors in the output instead of aborting the batch"""
+        async def execute(url, body, headers):
+            raise httpx.ConnectError("down")
+
+        job = store.create_job("/v1/chat/completions", chat())
+
+        status = asyncio.run(BatchRunner(store, execute).run_batch(job["id"]))
+
+        assert status == "failed"
+        assert "ConnectError" in store.item_result(job["id"])["error"]["message"]
+
+    def test_cancel_skips_requests_not_started(self, store):
+        """Should stop launching requests once the batch is cancelled"""
+        started = []
+
+        async def main():
+            release = asyncio.Event()
+            runner = BatchRunner(store, None, concurrency=1)
+
+            async def execute(url, body, headers):
+                started.append(body["messages"][0]["content"])
+                await release.wait()
+                return 200, completion_body()
+
+            runner.execute = execute
+            file = store.create_file("input.jsonl", jsonl(chat("a"), chat("b"), chat("c")), "batch")
+            batch = store.create_batch(file["id"], "/v1/chat/completions")
+            task = asyncio.create_task(runner.run_batch(batch["id"]))
+            while not started:
+                await asyncio.sleep(0.01)
+            await runner.cancel(batch["id"])
+            release.set()
+            return await task, store.get_batch(batch["id"])
+
+        status, batch = asyncio.run(main())
+
+        assert status == "cancelled"
+        assert started == ["a"]
+        assert batch["request_counts"]["completed"] == 1
+
+
+class TestSeveralWorkers:
+    """Runners of several workers sharing one batch directory"""
+
+    async def _wait_for(self, store, batch_id):
+        while store.get_batch(batch_id)["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.01)
+
+    def test_each_request_runs_once(self, store, tmp_path):
+        """Should execute every request exactly once with two runners on one store"""
+        executed = []
+
+        async def execute(url, body, headers):
+            executed.append(body["messages"][0]["content"])
+            await asyncio.sleep(0.01)
+            return 200, completion_body()
+
+        async def main():
+            other = BatchStore(tmp_path / "batches")
+            runners = [BatchRunner(s, execute, poll_interval=0.01) for s in (store, other)]
+            for runner in runners:
+                runner.start()
+            try:
+                file = store.create_file("input.jsonl", jsonl(*[chat(str(i)) for i in range(5)]), "batch")
+                batch = store.create_batch(file["id"], "/v1/chat/completions")
+                await asyncio.wait_for(self._wait_for(store, batch["id"]), 5)
+                return [runner.active for runner in runners]
+            finally:
+                for runner in runners:
+                    await runner.stop()
+                other.close()
+
+        active = asyncio.run(main())
+
+        assert sorted(executed) == ["0", "1", "2", "3", "4"]
+        assert active.count(True) == 1
+
+    def test_another_worker_takes_over(self, store, tmp_path):
+        """Should let a waiting runner resume the batches once the active one stops"""
+        async def execute(url, body, headers):
+            return 200, completion_body()
+
+        async def main():
+            other = BatchStore(tmp_path / "batches")
+            first = BatchRunner(store, execute, poll_interval=0.01)
+            second = BatchRunner(other, execute, poll_interval=0.01)
+            first.start()
+            await asyncio.sleep(0.05)
+            second.start()
+            try:
+                await asyncio.sleep(0.05)
+                assert (first.active, second.active) == (True, False)
+                await first.stop()
+                job = store.create_job("/v1/chat/completions", chat())
+                await asyncio.wait_for(self._wait_for(store, job["id"]), 5)
+                return second.active
+            finally:
+                await second.stop()
+                other.close()
+
+        assert asyncio.run(main()) is True
+
+
+@pytest.fixture
+def batch_proxy(server, run_proxy, tmp_path):
+    """run_proxy with a batch runner executing requests through the app"""
+    def runner(handler, scenario):
+        async def with_runner(client):
+            store = BatchStore(tmp_path / "batches")
+            server.app.state.batch_runner = server.create_batch_runner(server.app, store)
+            server.app.state.batch_runner.poll_interval = 0.05
+            server.app.state.batch_runner.start()
+            try:
+                return await scenario(client)
+            finally:
+                await server.app.state.batch_runner.stop()
+                await server.app.state.batch_client.aclose()
+                store.close()
+
+        return run_proxy(handler, with_runner)
+
+    yield runner
+    server.app.state.batch_runner = None
+
+
+async def wait_for(client, path, statuses=("completed", "failed", "cancelled", "expired")):
+    for _ in range(200):
+        body = (await client.get(path)).json()
+        if body["status"] in statuses:
+            return body
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"{path} did not finish: {body}")
+
+
+class TestBatchEndpoints:
+    def test_batch_end_to_end(self, server, batch_proxy):
+        """Should upload a file, run the batch through the proxy and serve the results"""
+        def handler(request):
+            payload = orjson.loads(request.content)
+            assert payload["stream"] is False
+            return httpx.Response(200, json=completion_body(payload["messages"][0]["content"]))
+
+        async def scenario(client):
+            upload = await client.post(
+                "/v1/files",
+                files={"file": ("input.jsonl", jsonl(chat("a"), chat("b")))},
+                data={"purpose": "batch"}
+            )
+            assert upload.status_code == 200
+            created = await client.post("/v1/batches", json={"input_file_id": upload.json()["id"]})
+            assert created.status_code == 200
+            batch = await wait_for(client, f"/v1/batches/{created.json()['id']}")
+            output = await client.get(f"/v1/files/{batch['output_file_id']}/content")
+            listed = await client.get("/v1/batches")
+            return batch, output, listed.json()
+
+        batch, output, listed = batch_proxy(handler, scenario)
+
+        assert batch["status"] == "completed"
+        assert batch["request_counts"] == {"total": 2, "completed": 2, "failed": 0}
+        lines = sorted((orjson.loads(line) for line in output.content.splitlines()), key=lambda l: l["custom_id"])
+        assert [l["response"]["body"]["choices"][0]["message"]["content"] for l in lines] == ["a", "b"]
+        assert [b["id"] for b in listed["data"]] == [batch["id"]]
+        assert server.concurrency.snapshot()["chutes"]["classes"]["batch"]["admitted"] == 2
+
+    def test_invalid_input_is_rejected(self, batch_proxy):
+        """Should answer 400 for malformed files and unsupported endpoints"""
+        async def scenario(client):
+            upload = await client.post("/v1/files", files={"file": ("bad.jsonl", b"nope\n")})
+            bad_file = await client.post("/v1/batches", json={"input_file_id": upload.json()["id"]})
+            bad_endpoint = await client.post(
+                "/v1/batches", json={"input_file_id": upload.json()["id"], "endpoint": "/v1/embeddings"}
+            )
+            missing = await client.get("/v1/batches/batch_missing")
+            return bad_file, bad_endpoint, missing
+
+        bad_file, bad_endpoint, missing = batch_proxy(lambda r: httpx.Response(500), scenario)
+
+        assert bad_file.status_code == 400
+        assert "Line 1" in bad_file.json()["detail"]
+        assert bad_endpoint.status_code == 400
+        assert missing.status_code == 404
+
+    def test_job_returns_result_when_done(self, batch_proxy):
+        """Should accept a job with 202 and expose its response once finished"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body("long answer"))
+
+        async def scenario(client):
+            created = await client.post("/v1/jobs", json={"body": chat()})
+            assert created.status_code == 202
+            return await wait_for(client, f"/v1/jobs/{created.json()['id']}")
+
+        job = batch_proxy(handler, scenario)
+
+        assert job["status"] == "completed"
+        assert job["status_code"] == 200
+        assert job["result"]["choices"][0]["message"]["content"] == "long answer"
+
+    def test_events_stream_progress_until_done(self, batch_proxy):
+        """Should emit batch snapshots over SSE and finish with [DONE]"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            upload = await client.post("/v1/files", files={"file": ("input.jsonl", jsonl(chat()))})
+            created = await client.post("/v1/batches", json={"input_file_id": upload.json()["id"]})
+            return await client.get(f"/v1/batches/{created.json()['id']}/events")
+
+        response = batch_proxy(handler, scenario)
+
+        events = [e[len("data: "):] for e in response.text.split("\n\n") if e]
+        assert events[-1] == "[DONE]"
+        assert orjson.loads(events[-2])["status"] == "completed"
+
+    def test_disabled_batch_api_is_not_found(self, server, run_proxy):
+        """Should answer 404 when no batch runner is configured"""
+        server.app.state.batch_runner = None
+
+        async def scenario(client):
+            return await client.get("/v1/batches")
+
+        assert run_proxy(lambda r: httpx.Response(500), scenario).status_code == 404
@@ -0,0 +1,141 @@
+"""
+Tests for the NDJSON bulk endpoint and its fan-out helper.
+"""
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.bulk import BulkError, fan_out, parse_ndjson
+from conftest import completion_body
+
+
+def ndjson(*items):
+    return b"".join(orjson.dumps(item) + b"\n" for item in items)
+
+
+def chat(content):
+    return {"messages": [{"role": "user", "content": content}], "temperature": 0.7}
+
+
+def collect(agen):
+    async def main():
+        return [orjson.loads(line) async for line in agen]
+    return asyncio.run(main())
+
+
+class TestParseNdjson:
+    def test_invalid_lines_stay_in_place(self):
+        """Should keep bad lines as errors at their index instead of failing the body"""
+        items = parse_ndjson(b'{"a": 1}\n\nnot json\n{"b": 2}\n')
+
+        assert items[0] == {"a": 1}
+        assert isinstance(items[1], ValueError)
+        assert items[2] == {"b": 2}
+
+    def test_too_many_items(self):
+        """Should reject bodies over the item limit"""
+        with pytest.raises(BulkError):
+            parse_ndjson(b"{}\n" * 3, max_items=2)
+
+
+class TestFanOut:
+    def test_results_in_completion_order(self):
+        """Should emit fast items before slow ones, tagged with their index"""
+        async def run(item):
+            await asyncio.sleep(item["delay"])
+            return 200, orjson.dumps({"delay": item["delay"]})
+
+        lines = collect(fan_out([{"delay": 0.05}, {"delay": 0}, {"delay": 0.02}], run))
+
+        assert [line["index"] for line in lines] == [1, 2, 0]
+        assert lines[0]["body"] == {"delay": 0}
+
+    def test_errors_do_not_abort(self):
+        """Should turn exceptions and parse errors into error lines"""
+        async def run(item):
+            if item.get("boom"):
+                raise RuntimeError("kaput")
+            return 200, b"{}"
+
+        lines = collect(fan_out([{"boom": True}, ValueError("Invalid JSON"), {}], run))
+        by_index = {line["index"]: line for line in lines}
+
+        assert by_index[0]["status_code"] == 500
+        assert "kaput" in by_index[0]["error"]["message"]
+        assert by_index[1]["status_code"] == 400
+        assert by_index[2] == {"index": 2, "status_code": 200, "body": {}}
+
+    def test_bounded_concurrency(self):
+        """Should never run more than `concurrency` items at once"""
+        active = peak = 0
+
+        async def run(item):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return 200, b"{}"
+
+        assert len(collect(fan_out([{}] * 10, run, concurrency=3))) == 10
+        assert peak == 3
+
+    def test_closing_cancels_pending_items(self):
+        """Should cancel in-flight items when the consumer stops early"""
+        cancelled = []
+
+        async def run(item):
+            try:
+                await asyncio.sleep(item["delay"])
+            except asyncio.CancelledError:
+                cancelled.append(item["delay"])
+                raise
+            return 200, b"{}"
+
+        async def main():
+            stream = fan_out([{"delay": 0}, {"delay": 10}], run)
+            first = await stream.__anext__()
+            await stream.aclose()
+            return first
+
+        assert orjson.loads(asyncio.run(main()))["index"] == 0
+        assert cancelled == [10]
+
+
+class TestBulkEndpoint:
+    def test_fans_out_and_streams_ndjson(self, run_proxy):
+        """Should run every line upstream without streaming and report per-item status"""
+        def handler(request):
+            payload = orjson.loads(request.content)
+            assert payload["stream"] is False
+            content = payload["messages"][0]["content"]
+            if content == "fail":
+                return httpx.Response(400, json={"error": "bad"})
+            return httpx.Response(200, json=completion_body(content))
+
+        async def scenario(client):
+            body = ndjson(chat("a"), {"stream": True, **chat("b")}, chat("fail"), {"messages": "nope"}, [1])
+            return await client.post("/v1/chat/completions/bulk", content=body)
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = {line["index"]: line for line in map(orjson.loads, response.content.splitlines())}
+        assert sorted(lines) == [0, 1, 2, 3, 4]
+        assert lines[0]["body"]["choices"][0]["message"]["content"] == "a"
+        assert lines[1]["status_code"] == 200
+        assert lines[2]["status_code"] == 500
+        assert lines[3]["status_code"] == 422
+        assert lines[4]["status_code"] == 422
+
+    def test_too_many_lines(self, server, run_proxy, monkeypatch):
+        """Should answer 413 when the body exceeds KIMI_BULK_MAX_ITEMS"""
+        monkeypatch.setattr(server, "BULK_MAX_ITEMS", 1)
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions/bulk", content=ndjson(chat("a"), chat("b")))
+
+        assert run_proxy(lambda r: httpx.Response(500), scenario).status_code == 413
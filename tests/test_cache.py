@@ -0,0 +1,271 @@
+"""
+Tests for the tiered response cache (kimi_proxy/cache.py)
+"""
+import asyncio
+import time
+
+import httpx
+
+from conftest import completion_body
+
+
+PAYLOAD = {
+    "model": "moonshot/kimi-k2-thinking",
+    "messages": [{"role": "user", "content": "¿Capital de Francia?"}],
+    "temperature": 0,
+    "max_tokens": 64
+}
+
+
+class TestCacheKey:
+    """Tests for cache_key / is_cacheable"""
+
+    def test_key_is_order_independent(self):
+        """Dict key order should not change the hash"""
+        from kimi_proxy.cache import cache_key
+
+        a = {"model": "m", "messages": [{"role": "user", "content": "x"}], "temperature": 0}
+        b = {"temperature": 0, "messages": [{"content": "x", "role": "user"}], "model": "m"}
+
+        assert cache_key(a) == cache_key(b)
+
+    def test_key_ignores_stream_flag(self):
+        """Streaming and non-streaming requests share the cache entry"""
+        from kimi_proxy.cache import cache_key
+
+        assert cache_key({**PAYLOAD, "stream": True}) == cache_key({**PAYLOAD, "stream": False})
+
+    def test_key_depends_on_tools_and_extra_body(self):
+        """tools and extra_body change the answer, so they change the key"""
+        from kimi_proxy.cache import cache_key
+
+        base = cache_key(PAYLOAD)
+
+        assert cache_key({**PAYLOAD, "tools": [{"type": "function"}]}) != base
+        assert cache_key({**PAYLOAD, "extra_body": {"heavy_mode": True}}) != base
+
+    def test_key_depends_on_every_generation_parameter(self):
+        """Fields outside the old allowlist must not share an entry"""
+        from kimi_proxy.cache import cache_key
+
+        short = cache_key({**PAYLOAD, "max_completion_tokens": 10})
+
+        assert short != cache_key({**PAYLOAD, "max_completion_tokens": 4000})
+        assert cache_key({**PAYLOAD, "logprobs": True}) != cache_key(PAYLOAD)
+        assert cache_key({**PAYLOAD, "user": "alice"}) == cache_key(PAYLOAD)
+
+    def test_key_sees_parameters_sent_in_extra_body(self):
+        """extra_body merged by ChatBody should give the same key as the nested CLI config"""
+        import orjson
+
+        from kimi_proxy.cache import cache_key
+        from kimi_proxy.payload import ChatBody
+
+        def key(thinking):
+            extra = {"extra_body": {"chat_template_kwargs": {"thinking": thinking}}}
+            body = ChatBody.parse(orjson.dumps({**PAYLOAD, **extra}), "m")
+            return cache_key(body.data), cache_key({**PAYLOAD, **extra})
+
+        (proxy_on, cli_on), (proxy_off, _) = key(True), key(False)
+
+        assert proxy_on != proxy_off
+        assert proxy_on == cli_on
+
+    def test_only_deterministic_requests_are_cacheable(self):
+        """temperature 0 or explicit opt-in"""
+        from kimi_proxy.cache import is_cacheable
+
+        assert is_cacheable({"temperature": 0})
+        assert not is_cacheable({"temperature": 0.7})
+        assert is_cacheable({"temperature": 0.7}, opt_in=True)
+
+
+class TestMemoryLRU:
+    """Tests for MemoryLRU"""
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        """Should stay under max_bytes evicting the LRU entry"""
+        from kimi_proxy.cache import MemoryLRU
+
+        lru = MemoryLRU(max_bytes=10)
+        lru.put("a", b"aaaa", ttl=60)
+        lru.put("b", b"bbbb", ttl=60)
+        lru.get("a")
+        lru.put("c", b"cccc", ttl=60)
+
+        assert lru.get("b") is None
+        assert lru.get("a") == b"aaaa"
+        assert lru.bytes <= 10
+
+    def test_expired_entries_are_misses(self):
+        """Entries past their TTL should not be served"""
+        from kimi_proxy.cache import MemoryLRU
+
+        lru = MemoryLRU(max_bytes=100)
+        lru.put("a", b"x", ttl=-1)
+
+        assert lru.get("a") is None
+        assert lru.bytes == 0
+
+
+class TestDiskCache:
+    """Tests for DiskCache"""
+
+    def test_shared_between_instances(self, tmp_path):
+        """Two processes (instances) on the same file should see each other's entries"""
+        from kimi_proxy.cache import DiskCache
+
+        writer = DiskCache(tmp_path / "c.sqlite", 1024, 60)
+        reader = DiskCache(tmp_path / "c.sqlite", 1024, 60)
+        writer.put("k", b"value")
+
+        assert reader.get("k") == b"value"
+        writer.close()
+        reader.close()
+
+    def test_ttl_expiry(self, tmp_path):
+        """Expired entries should be misses"""
+        from kimi_proxy.cache import DiskCache
+
+        cache = DiskCache(tmp_path / "c.sqlite", 1024, ttl=0.01)
+        cache.put("k", b"value")
+        time.sleep(0.02)
+
+        assert cache.get("k") is None
+        cache.close()
+
+    def test_size_eviction(self, tmp_path):
+        """Should evict least recently accessed entries over max_bytes"""
+        from kimi_proxy.cache import DiskCache
+
+        cache = DiskCache(tmp_path / "c.sqlite", max_bytes=10, ttl=60)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        cache.get("a")
+        cache.put("c", b"cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.size_bytes() <= 10
+        cache.close()
+
+
+class TestResponseCache:
+    """Tests for the two-tier ResponseCache"""
+
+    def test_disk_hit_promotes_to_memory(self, response_cache):
+        """A disk hit should be copied into the memory tier"""
+        async def main():
+            await response_cache.put("k", b"v")
+            response_cache.memory = type(response_cache.memory)(1024)
+            first = await response_cache.get("k")
+            second = await response_cache.get("k")
+            miss = await response_cache.get("other")
+            return first, second, miss
+
+        first, second, miss = asyncio.run(main())
+
+        assert first == (b"v", "disk")
+        assert second == (b"v", "memory")
+        assert miss == (None, "miss")
+        snapshot = response_cache.snapshot()
+        assert snapshot["disk_hits"] == 1
+        assert snapshot["memory_hits"] == 1
+        assert snapshot["misses"] == 1
+        assert snapshot["hit_ratio"] == round(2 / 3, 4)
+
+
+class TestProxyCache:
+    """Tests for the cache in front of /v1/chat/completions"""
+
+    def test_second_identical_request_is_served_from_cache(self, server, run_proxy, response_cache):
+        """Deterministic requests should hit the upstream only once"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=completion_body("París"))
+
+        async def scenario(client):
+            server.app.state.response_cache = response_cache
+            first = await client.post("/v1/chat/completions", json=PAYLOAD)
+            await asyncio.sleep(0.05)  # background cache write
+            second = await client.post("/v1/chat/completions", json=PAYLOAD)
+            return first, second
+
+        first, second = run_proxy(handler, scenario)
+
+        assert len(calls) == 1
+        assert first.headers["x-kimi-cache"] == "miss"
+        assert second.headers["x-kimi-cache"] == "hit-memory"
+        assert second.json() == first.json()
+
+    def test_streaming_hit_is_replayed_as_sse(self, server, run_proxy, response_cache):
+        """A cached completion should be replayed as chat.completion.chunk events"""
+        from kimi_proxy.sse import CompletionAccumulator
+
+        def handler(request):
+            return httpx.Response(200, json=completion_body("París"))
+
+        async def scenario(client):
+            server.app.state.response_cache = response_cache
+            await client.post("/v1/chat/completions", json=PAYLOAD)
+            await asyncio.sleep(0.05)
+            return await client.post("/v1/chat/completions", json={**PAYLOAD, "stream": True})
+
+        response = run_proxy(handler, scenario)
+
+        acc = CompletionAccumulator()
+        acc.feed(response.content)
+        assert response.headers["x-kimi-cache"] == "hit-memory"
+        assert acc.done
+        assert acc.result()["choices"][0]["message"]["content"] == "París"
+
+    def test_streaming_miss_populates_cache(self, server, run_proxy, response_cache):
+        """A streamed deterministic answer should be cached for later requests"""
+        from test_sse import STREAM
+
+        calls = []
+
+        async def body():
+            yield STREAM
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            server.app.state.response_cache = response_cache
+            await client.post("/v1/chat/completions", json={**PAYLOAD, "stream": True})
+            await asyncio.sleep(0.05)
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(handler, scenario)
+
+        assert len(calls) == 1
+        assert response.headers["x-kimi-cache"] == "hit-memory"
+        assert response.json()["choices"][0]["message"]["content"] == "Hola mundo"
+
+    def test_non_deterministic_requests_bypass_cache(self, server, run_proxy, response_cache):
+        """temperature > 0 without opt-in should always go upstream"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            server.app.state.response_cache = response_cache
+            payload = {**PAYLOAD, "temperature": 0.7}
+            first = await client.post("/v1/chat/completions", json=payload)
+            await client.post("/v1/chat/completions", json=payload)
+            await client.post("/v1/chat/completions", json=payload, headers={"X-Kimi-Cache": "on"})
+            await asyncio.sleep(0.05)
+            opted = await client.post("/v1/chat/completions", json=payload, headers={"X-Kimi-Cache": "on"})
+            return first, opted
+
+        first, opted = run_proxy(handler, scenario)
+
+        assert first.headers["x-kimi-cache"] == "bypass"
+        assert opted.headers["x-kimi-cache"] == "hit-memory"
+        assert len(calls) == 3
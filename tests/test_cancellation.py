@@ -0,0 +1,160 @@
+"""
+Tests for upstream cancellation on client disconnect (kimi_proxy/cancellation.py)
+"""
+import asyncio
+import json
+import time
+
+import httpx
+
+from conftest import asgi_request
+
+
+class EndlessStream(httpx.AsyncByteStream):
+    """Upstream SSE body that never ends; records when it gets closed"""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = 0
+
+    async def __aiter__(self):
+        while True:
+            await asyncio.sleep(0.01)
+            self.sent += 1
+            yield b'data: {"choices":[{"delta":{"content":"x"}}]}\n\n'
+
+    async def aclose(self):
+        self.closed = True
+
+
+def request_body(stream, max_tokens=16384):
+    return json.dumps({
+        "model": "moonshot/kimi-k2-thinking",
+        "messages": [{"role": "user", "content": "Escribe un ensayo largo"}],
+        "max_tokens": max_tokens,
+        "stream": stream
+    }).encode()
+
+
+class TestCancellationStats:
+    """Tests for CancellationStats"""
+
+    def test_record_estimates_tokens_saved(self):
+        """Tokens saved should be max_tokens minus tokens already emitted"""
+        from kimi_proxy.cancellation import CancellationStats
+
+        stats = CancellationStats()
+        saved = stats.record(stream=True, max_tokens=1000, tokens_emitted=250)
+
+        assert saved == 750
+        assert stats.cancelled_streams == 1
+        assert stats.tokens_saved == 750
+        assert stats.snapshot()["recent"][0]["tokens_emitted"] == 250
+
+    def test_record_never_negative(self):
+        """Emitting more than max_tokens should not produce negative savings"""
+        from kimi_proxy.cancellation import CancellationStats
+
+        stats = CancellationStats()
+
+        assert stats.record(stream=False, max_tokens=10, tokens_emitted=20) == 0
+        assert stats.cancelled_requests == 1
+
+
+class TestCallUntilDisconnect:
+    """Tests for call_until_disconnect"""
+
+    def test_returns_result_when_client_stays(self):
+        """Should return the awaitable result if no disconnect happens"""
+        from kimi_proxy.cancellation import call_until_disconnect
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def work():
+            return 42
+
+        assert asyncio.run(call_until_disconnect(work(), receive)) == 42
+
+    def test_cancels_work_on_disconnect(self):
+        """Should cancel the awaitable and raise ClientDisconnected"""
+        from kimi_proxy.cancellation import ClientDisconnected, call_until_disconnect
+
+        state = {"cancelled": False}
+
+        async def receive():
+            await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        async def main():
+            try:
+                await call_until_disconnect(work(), receive)
+            except ClientDisconnected:
+                return True
+            return False
+
+        assert asyncio.run(main())
+        assert state["cancelled"]
+
+
+class TestProxyCancellation:
+    """Tests for disconnect handling in /v1/chat/completions"""
+
+    def test_streaming_disconnect_closes_upstream(self, server, monkeypatch):
+        """A client disconnect mid-stream should close the upstream and record savings"""
+        from kimi_proxy.cancellation import CancellationStats
+
+        stats = CancellationStats()
+        monkeypatch.setattr(server, "cancellation_stats", stats)
+        upstream = EndlessStream()
+
+        def handler(request):
+            return httpx.Response(200, stream=upstream, headers={"content-type": "text/event-stream"})
+
+        server.app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        start = time.perf_counter()
+        asgi_request(server.app, "/v1/chat/completions", request_body(True), disconnect_after=0.1)
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 2
+        assert upstream.closed
+        assert stats.cancelled_streams == 1
+        assert 16384 - upstream.sent <= stats.tokens_saved < 16384
+
+    def test_non_streaming_disconnect_cancels_upstream(self, server, monkeypatch):
+        """A client disconnect while waiting should abort the upstream call"""
+        from kimi_proxy.cancellation import CancellationStats
+
+        stats = CancellationStats()
+        monkeypatch.setattr(server, "cancellation_stats", stats)
+        state = {"cancelled": False}
+
+        async def handler(request):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+            return httpx.Response(200, json={})
+
+        server.app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        start = time.perf_counter()
+        messages = asgi_request(
+            server.app, "/v1/chat/completions", request_body(False, max_tokens=4096), disconnect_after=0.1
+        )
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 2
+        assert state["cancelled"]
+        assert messages[0]["status"] == 499
+        assert stats.cancelled_requests == 1
+        assert stats.tokens_saved == 4096
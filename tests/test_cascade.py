@@ -0,0 +1,210 @@
+"""
+Tests for cascade routing (kimi_proxy/cascade.py, X-Kimi-Cascade: on)
+"""
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.cascade import (
+    Cascade, CascadeConfig, CascadeStats, Tier, collect, load_cascade, router_stream, score_confidence
+)
+from kimi_proxy.router import load_router
+from kimi_proxy.sse import completion_to_sse
+from conftest import completion_body
+
+LOCAL = "qwen3-coder:30b"
+KIMI = "moonshotai/Kimi-K2-Thinking"
+
+
+def completion(content, finish_reason="stop", tokens=10):
+    body = completion_body(content)
+    body["choices"][0]["finish_reason"] = finish_reason
+    body["usage"] = {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens}
+    return body
+
+
+def config():
+    return CascadeConfig(
+        tiers=[
+            Tier("local", LOCAL, samples=2, instruct=True),
+            Tier("kimi", KIMI, price_input=0.6, price_output=2.5),
+        ],
+        baseline="kimi",
+    )
+
+
+def scripted(answers, seen):
+    """open_stream answering per model with answers[model][seed] (or an exception)"""
+    async def open_stream(payload):
+        seen.append(payload)
+        answer = answers[payload["model"]]
+        if isinstance(answer, dict):
+            answer = answer[payload.get("seed") or 0]
+        if isinstance(answer, Exception):
+            raise answer
+        yield b"".join(completion_to_sse(completion(answer)))
+    return open_stream
+
+
+class TestConfidence:
+    def test_agreeing_samples_are_confident(self):
+        """Should trust matching extracted answers and distrust disagreement"""
+        same = [completion("Razono.\nRespuesta final: 7"), completion("Otra forma.\nRespuesta final: 7.")]
+        different = [completion("Respuesta final: 7"), completion("Respuesta final: 12")]
+
+        score, signals = score_confidence(same)
+        assert score == 1.0 and signals["consistency"] == 1.0
+
+        score, signals = score_confidence(different)
+        assert score < 0.7 and signals["consistency"] < 1.0
+
+    def test_refusals_and_truncation(self):
+        """Should zero refusals and penalize truncated or unmarked answers"""
+        refusal = [completion("Lo siento, no puedo ayudar con eso."), completion("No puedo ayudar.")]
+        truncated = [completion("Respuesta final: 7", finish_reason="length"), completion("Respuesta final: 7")]
+
+        assert score_confidence(refusal)[0] == 0.0
+        assert score_confidence(truncated)[0] == pytest.approx(0.8)
+        assert score_confidence([completion("Una explicación larga")])[0] == pytest.approx(0.5)
+        assert score_confidence([completion("Una explicación larga")], expect_answer=False)[0] == 1.0
+        assert score_confidence([completion("")])[0] == 0.0
+
+    def test_loads_repository_tiers(self):
+        """Should read the cascade section shipped in models.yaml"""
+        loaded = load_cascade()
+
+        assert [t.name for t in loaded.tiers] == ["qwen3_coder_30b", "kimi_k2_normal", "kimi_k2_heavy"]
+        assert loaded.tiers[0].samples == 2 and loaded.tiers[-1].heavy
+        assert loaded.baseline_tier.price_output == 2.5
+
+    def test_shipped_tiers_can_escalate_on_low_confidence(self):
+        """Every tier but the last should measure more than completeness"""
+        loaded = load_cascade()
+
+        for tier in loaded.tiers[:-1]:
+            assert tier.samples > 1 or tier.instruct or tier.heavy, tier.name
+        normal = next(t for t in loaded.tiers if t.name == "kimi_k2_normal")
+        unmarked = [completion("Una explicación larga sin respuesta marcada")]
+        assert score_confidence(unmarked, expect_answer=normal.instruct)[0] < loaded.min_confidence
+
+    def test_rejects_tiers_without_a_confidence_signal(self, tmp_path):
+        """Should refuse a non-final tier whose only signal is completeness"""
+        config = tmp_path / "models.yaml"
+        config.write_text(
+            "cascade:\n  tiers:\n    - {name: single, model: a}\n    - {name: last, model: b}\n"
+        )
+
+        with pytest.raises(ValueError, match="single"):
+            load_cascade(config)
+
+
+class TestCascade:
+    def test_confident_local_answer_stops_the_cascade(self):
+        """Should answer from the cheap tier and report the baseline cost saved"""
+        seen = []
+        cascade = Cascade(config(), scripted({LOCAL: "Respuesta final: 7", KIMI: "no"}, seen))
+
+        result = asyncio.run(cascade.run({"messages": [{"role": "user", "content": "3+4"}], "temperature": 0}))
+
+        assert result.answered.tier.name == "local"
+        assert [p["model"] for p in seen] == [LOCAL, LOCAL]
+        assert sorted(p["seed"] for p in seen) == [0, 1] and seen[0]["temperature"] == 0.7
+        assert seen[0]["messages"][0]["role"] == "system"
+        summary = result.summary()
+        assert summary["cost_usd"] == 0 and summary["cost_saved_usd"] == pytest.approx(100 * 0.6e-6 + 10 * 2.5e-6)
+        assert result.completion["usage"]["prompt_tokens"] == 200
+
+    def test_disagreement_escalates(self):
+        """Should escalate when samples disagree and sum the usage of every tier"""
+        seen = []
+        answers = {LOCAL: {0: "Respuesta final: 7", 1: "Respuesta final: 9"}, KIMI: "Son 7."}
+        attempts = []
+        cascade = Cascade(config(), scripted(answers, seen), on_attempt=attempts.append)
+
+        result = asyncio.run(cascade.run({"messages": [{"role": "user", "content": "3+4"}]}))
+
+        assert [(a.tier.name, a.status) for a in attempts] == [("local", "escalated"), ("kimi", "accepted")]
+        assert result.completion["choices"][0]["message"]["content"] == "Son 7."
+        assert result.completion["usage"]["prompt_tokens"] == 300
+        assert result.summary()["cost_saved_usd"] == 0
+
+    def test_failing_tiers(self):
+        """Should skip a failing tier and fall back to a doubtful answer if the last one fails"""
+        down = Cascade(config(), scripted({LOCAL: ConnectionError("ollama down"), KIMI: "Son 7."}, []))
+        result = asyncio.run(down.run({"messages": []}))
+        assert [a.status for a in result.attempts] == ["error", "accepted"]
+        assert result.attempts[0].error == "ollama down"
+
+        answers = {LOCAL: {0: "Respuesta final: 7", 1: "Respuesta final: 9"}, KIMI: RuntimeError("quota")}
+        result = asyncio.run(Cascade(config(), scripted(answers, [])).run({"messages": []}))
+        assert [a.status for a in result.attempts] == ["fallback", "error"]
+        assert result.answered.tier.name == "local"
+
+    def test_stats_per_tier(self):
+        """Should aggregate hit rate, latency and cost per tier"""
+        stats = CascadeStats()
+        answers = {LOCAL: {0: "Respuesta final: 7", 1: "Respuesta final: 9"}, KIMI: "Son 7."}
+        stats.record(asyncio.run(Cascade(config(), scripted(answers, [])).run({"messages": []})).summary())
+        stats.record(asyncio.run(Cascade(config(), scripted({LOCAL: "Respuesta final: 7", KIMI: "x"}, []))
+                                 .run({"messages": []})).summary())
+
+        snapshot = stats.snapshot()
+        assert snapshot["tiers"]["local"]["hit_rate"] == 0.5
+        assert snapshot["tiers"]["kimi"]["hit_rate"] == 1.0
+        assert snapshot["cost_saved_usd"] > 0
+
+    def test_router_stream_uses_each_tier_provider(self):
+        """Should send each tier to its provider with the provider's model name and key"""
+        seen = []
+
+        def handler(request):
+            seen.append((str(request.url), request.headers.get("authorization"), orjson.loads(request.content)["model"]))
+            return httpx.Response(200, content=b"".join(completion_to_sse(completion("ok"))))
+
+        async def main():
+            router = load_router(env={"CHUTES_API_KEY": "chutes-key"})
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                open_stream = router_stream(client, router)
+                await collect(open_stream, {"model": LOCAL, "messages": []})
+                await collect(open_stream, {"model": KIMI, "messages": []})
+
+        asyncio.run(main())
+
+        assert seen == [
+            ("http://localhost:11434/v1/chat/completions", None, "qwen3-coder:30b"),
+            ("https://llm.chutes.ai/v1/chat/completions", "Bearer chutes-key", KIMI),
+        ]
+
+
+class TestCascadeEndpoint:
+    def test_header_routes_through_the_tiers(self, run_proxy):
+        """Should send the cheap tier to Ollama, escalate to Kimi and report the tiers"""
+        hosts = []
+
+        def handler(request):
+            payload = orjson.loads(request.content)
+            hosts.append((request.url.host, payload["model"]))
+            if payload["model"] == "qwen3-coder:30b":
+                content = f"Respuesta final: {payload['seed']}"
+            else:
+                content = "Son 7.\nRespuesta final: 7"
+            return httpx.Response(200, content=b"".join(completion_to_sse(completion(content))),
+                                  headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            response = await client.post(
+                "/v1/chat/completions",
+                json={"model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": "3+4"}]},
+                headers={"X-Kimi-Cascade": "on"}
+            )
+            return response, (await client.get("/admin/stats")).json()["cascade"]
+
+        response, stats = run_proxy(handler, scenario)
+
+        data = response.json()
+        assert data["choices"][0]["message"]["content"] == "Son 7.\nRespuesta final: 7"
+        assert [a["status"] for a in data["kimi_cascade"]["attempts"]] == ["escalated", "accepted"]
+        assert ("localhost", "qwen3-coder:30b") in hosts and ("llm.chutes.ai", KIMI) in hosts
+        assert stats["tiers"]["qwen3_coder_30b"]["escalated"] >= 1
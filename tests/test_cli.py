@@ -0,0 +1,103 @@
+"""
+Tests for the completion helpers shared by the CLIs (kimi_proxy/cli.py)
+"""
+from openai.types.chat import ChatCompletionChunk
+
+
+def chunk(choices, usage=None):
+    data = {"id": "c1", "object": "chat.completion.chunk", "model": "m", "created": 1, "choices": choices}
+    if usage:
+        data["usage"] = usage
+    return ChatCompletionChunk.model_validate(data)
+
+
+class FakeStream(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Just enough of the OpenAI client for client.chat.completions.create"""
+
+    def __init__(self, chunks):
+        self.stream = FakeStream(chunks)
+        self.calls = []
+        self.chat = self.completions = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.stream
+
+
+class RecordingView:
+    def __init__(self):
+        self.deltas = []
+        self.usage = None
+
+    def reset(self):
+        pass
+
+    def delta(self, delta):
+        self.deltas.append(delta)
+
+    def finish(self, usage):
+        self.usage = usage
+
+
+CONFIG = {"model": "m", "messages": [{"role": "user", "content": "hola"}], "temperature": 0.7}
+
+
+class TestStreamCompletion:
+    """Tests for stream_completion"""
+
+    def test_returns_the_assembled_completion(self):
+        """Should stream with usage, show each delta and return a ChatCompletion"""
+        from kimi_proxy.cli import stream_completion
+
+        client = FakeClient([
+            chunk([{"index": 0, "delta": {"role": "assistant", "content": "Hola "}}]),
+            chunk([{"index": 0, "delta": {"content": "mundo"}, "finish_reason": "stop"}]),
+            chunk([], usage={"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}),
+        ])
+        view = RecordingView()
+
+        completion = stream_completion(client, CONFIG, view)
+
+        assert completion.choices[0].message.content == "Hola mundo"
+        assert completion.usage.completion_tokens == 2
+        assert client.calls[0]["stream"] is True
+        assert client.calls[0]["stream_options"] == {"include_usage": True}
+        assert [d.get("content") for d in view.deltas] == ["Hola ", "mundo"]
+        assert view.usage["total_tokens"] == 5
+        assert client.stream.closed
+
+    def test_truncated_stream_raises(self):
+        """Should not return a completion whose stream ended before finish_reason"""
+        import pytest
+
+        from kimi_proxy.cli import stream_completion
+
+        client = FakeClient([chunk([{"index": 0, "delta": {"role": "assistant", "content": "Hola"}}])])
+
+        with pytest.raises(RuntimeError):
+            stream_completion(client, CONFIG, RecordingView())
+        assert client.stream.closed
+
+
+class TestCreateCompletion:
+    """Tests for create_completion"""
+
+    def test_streams_through_the_view(self):
+        """Should use the streaming path when a view is given"""
+        from kimi_proxy.cli import create_completion
+
+        client = FakeClient([
+            chunk([{"index": 0, "delta": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}]),
+        ])
+
+        completion = create_completion(client, CONFIG, view=RecordingView())
+
+        assert completion.choices[0].message.content == "ok"
+        assert client.calls[0]["stream"] is True
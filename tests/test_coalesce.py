@@ -0,0 +1,143 @@
+"""
+Tests for SSE chunk coalescing towards the client.
+"""
+import asyncio
+import time
+
+import httpx
+import orjson
+
+from kimi_proxy.coalesce import SSECoalescer, coalesce_stream
+from kimi_proxy.sse import DONE_EVENT, CompletionAccumulator, encode_event
+
+
+def chunk(delta=None, finish_reason=None, **extra):
+    return encode_event({
+        "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1, "model": "m",
+        "choices": [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}], **extra,
+    })
+
+
+def token_stream():
+    events = [chunk({"role": "assistant", "content": ""})]
+    events += [chunk({"reasoning_content": f"r{i} "}) for i in range(5)]
+    events += [chunk({"content": f"t{i} "}) for i in range(20)]
+    events += [
+        chunk({"tool_calls": [{"index": 0, "id": "call_a", "type": "function",
+                               "function": {"name": "search", "arguments": ""}}]}),
+        chunk({"tool_calls": [{"index": 0, "function": {"arguments": '{"q":'}}]}),
+        chunk({"tool_calls": [{"index": 0, "function": {"arguments": ' "x"}'}}]}),
+        chunk({"tool_calls": [{"index": 1, "id": "call_b", "type": "function",
+                               "function": {"name": "fetch", "arguments": "{}"}}]}),
+        chunk(finish_reason="tool_calls"),
+        encode_event({"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1, "model": "m",
+                      "choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 29, "total_tokens": 32}}),
+        DONE_EVENT,
+    ]
+    return events
+
+
+def events_of(payload):
+    return [event for event in payload.split(b"\n\n") if event]
+
+
+def accumulate(payload):
+    accumulator = CompletionAccumulator()
+    accumulator.feed(payload)
+    return accumulator.result()
+
+
+class TestSSECoalescer:
+    def test_merged_stream_is_equivalent(self):
+        """Should produce fewer events that accumulate to the same completion"""
+        original = b"".join(token_stream())
+        coalescer = SSECoalescer()
+
+        merged = b"".join(coalescer.feed(event) for event in token_stream()) + coalescer.close()
+
+        assert accumulate(merged) == accumulate(original)
+        assert len(events_of(merged)) < len(events_of(original)) // 3
+        assert merged.endswith(DONE_EVENT)
+        assert orjson.loads(events_of(merged)[-2][6:])["usage"]["total_tokens"] == 32
+
+    def test_tool_call_indices_are_kept(self):
+        """Should merge argument fragments per index and keep each call's id"""
+        coalescer = SSECoalescer()
+        events = token_stream()[26:30]
+        merged = b"".join(coalescer.feed(event) for event in events) + coalescer.flush()
+
+        calls = [
+            call for event in events_of(merged)
+            for call in orjson.loads(event[6:])["choices"][0]["delta"]["tool_calls"]
+        ]
+
+        assert [(c["index"], c.get("id")) for c in calls] == [(0, "call_a"), (0, None), (1, "call_b")]
+        assert calls[1]["function"] == {"arguments": '{"q": "x"}'}
+        assert accumulate(merged) == accumulate(b"".join(events))
+
+    def test_byte_threshold_flushes(self):
+        """Should emit the held event once it reaches max_bytes"""
+        event = chunk({"content": "abc"})
+        coalescer = SSECoalescer(max_bytes=3 * len(event))
+
+        out = b"".join(coalescer.feed(event) for _ in range(7))
+
+        assert len(events_of(out)) == 2
+        assert coalescer.pending
+
+    def test_lone_event_keeps_its_bytes(self):
+        """Should forward an event that was not merged exactly as received"""
+        event = b'data: {"id":"x","choices":[{"index":0,"delta":{"content":"hi"},"finish_reason":null}]}\n\n'
+        coalescer = SSECoalescer()
+
+        assert coalescer.feed(event) == b""
+        assert coalescer.flush() == event
+
+    def test_window_flushes_while_upstream_is_silent(self):
+        """Should send held text when the window expires, not wait for the next token"""
+        async def source():
+            yield chunk({"content": "a"})
+            yield chunk({"content": "b"})
+            await asyncio.sleep(0.2)
+            yield chunk({"content": "c"}, finish_reason="stop")
+
+        async def main():
+            start = time.perf_counter()
+            return [(time.perf_counter() - start, out) async for out in coalesce_stream(source(), window=0.02)]
+
+        received = asyncio.run(main())
+
+        assert len(received) == 2
+        assert received[0][0] < 0.15
+        assert orjson.loads(received[0][1][6:])["choices"][0]["delta"]["content"] == "ab"
+
+
+class TestCoalescingEndpoint:
+    def run(self, run_proxy, headers):
+        def handler(request):
+            return httpx.Response(200, content=b"".join(token_stream()), headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", headers=headers, json={
+                "model": "moonshot/kimi-k2-thinking", "stream": True,
+                "messages": [{"role": "user", "content": "hi"}],
+            })
+
+        return run_proxy(handler, scenario).content
+
+    def test_opt_in_per_request(self, run_proxy):
+        """Should coalesce only when X-Kimi-Coalesce is set"""
+        original = b"".join(token_stream())
+
+        assert self.run(run_proxy, {}) == original
+        merged = self.run(run_proxy, {"X-Kimi-Coalesce": "20"})
+        assert len(events_of(merged)) < len(events_of(original))
+        assert accumulate(merged) == accumulate(original)
+
+    def test_configured_default(self, server, run_proxy, monkeypatch):
+        """Should coalesce every stream when KIMI_SSE_COALESCE_MS is set, unless the request opts out"""
+        monkeypatch.setattr(server, "SSE_COALESCE_MS", 20)
+        original = b"".join(token_stream())
+
+        assert len(events_of(self.run(run_proxy, {}))) < len(events_of(original))
+        assert self.run(run_proxy, {"X-Kimi-Coalesce": "off"}) == original
@@ -0,0 +1,163 @@
+"""
+Tests for compressed request bodies and negotiated response compression.
+"""
+import asyncio
+import gzip
+
+import httpx
+import orjson
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.routing import Route
+
+from kimi_proxy.compression import (
+    ENCODINGS, CompressionMiddleware, DecompressionMiddleware, compress, decompress, negotiate
+)
+from conftest import completion_body
+
+LONG_PROMPT = "contexto " * 20000
+
+
+def chat_request(content=LONG_PROMPT):
+    return orjson.dumps({
+        "model": "moonshot/kimi-k2-thinking",
+        "messages": [{"role": "user", "content": content}],
+    })
+
+
+def call(app, method, url, **kwargs):
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(main())
+
+
+async def echo(request: Request) -> Response:
+    return Response(await request.body(), media_type="application/octet-stream")
+
+
+class TestNegotiation:
+    @pytest.mark.parametrize("header, expected", [
+        ("gzip, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("*", ENCODINGS[0]),
+        ("br;q=0, *;q=0.1", ENCODINGS[0] if ENCODINGS[0] != "br" else "gzip"),
+        ("identity", None),
+        ("deflate", None),
+    ])
+    def test_picks_best_accepted_encoding(self, header, expected):
+        """Should honour q-values and prefer the server order on ties"""
+        assert negotiate(header) == expected
+
+
+class TestRequestDecompression:
+    @pytest.mark.parametrize("encoding", ENCODINGS)
+    def test_compressed_chat_request(self, run_proxy, encoding):
+        """Should forward the decompressed body upstream"""
+        seen = []
+
+        def handler(request):
+            seen.append(request.content)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await client.post(
+                "/v1/chat/completions",
+                content=compress(chat_request(), encoding),
+                headers={"Content-Encoding": encoding, "Content-Type": "application/json"},
+            )
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert orjson.loads(seen[0])["messages"][0]["content"] == LONG_PROMPT
+
+    def test_inflated_size_is_capped(self):
+        """Should reject a body that decompresses past the limit without inflating it all"""
+        app = DecompressionMiddleware(Starlette(routes=[Route("/", echo, methods=["POST"])]), max_bytes=1000)
+        bomb = gzip.compress(b"\0" * 10_000_000)
+
+        response = call(app, "POST", "/", content=bomb, headers={"Content-Encoding": "gzip"})
+
+        assert response.status_code == 413
+        with pytest.raises(ValueError):
+            decompress(bomb, "gzip", max_bytes=1000)
+
+    @pytest.mark.parametrize("body, headers, status", [
+        (b"not gzip", {"Content-Encoding": "gzip"}, 400),
+        (gzip.compress(b"x" * 1000)[:-12], {"Content-Encoding": "gzip"}, 400),
+        (b"data", {"Content-Encoding": "compress"}, 415),
+    ])
+    def test_invalid_bodies(self, body, headers, status):
+        """Should answer corrupt, truncated or unknown encodings with a client error"""
+        app = DecompressionMiddleware(Starlette(routes=[Route("/", echo, methods=["POST"])]), max_bytes=1 << 20)
+
+        response = call(app, "POST", "/", content=body, headers=headers)
+
+        assert response.status_code == status
+        assert "detail" in response.json()
+
+    def test_uncompressed_bodies_pass_through(self):
+        """Should not touch requests without Content-Encoding"""
+        app = DecompressionMiddleware(Starlette(routes=[Route("/", echo, methods=["POST"])]), max_bytes=10)
+
+        assert call(app, "POST", "/", content=b"x" * 100).content == b"x" * 100
+
+
+class TestResponseCompression:
+    def test_large_completion_is_compressed(self, run_proxy):
+        """Should compress a non-streaming completion the client accepts compressed"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body("respuesta " * 500))
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", content=chat_request("hi"),
+                                     headers={"Accept-Encoding": "gzip"})
+
+        response = run_proxy(handler, scenario)
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert "accept-encoding" in response.headers["vary"].lower()
+        assert int(response.headers["content-length"]) < len(response.content) // 10
+        assert response.json()["choices"][0]["message"]["content"] == "respuesta " * 500
+
+    def test_streams_and_small_bodies_are_not_compressed(self, run_proxy):
+        """Should leave SSE and responses under the minimum size untouched"""
+        def handler(request):
+            if orjson.loads(request.content).get("stream"):
+                return httpx.Response(200, content=b"data: {}\n\ndata: [DONE]\n\n",
+                                      headers={"content-type": "text/event-stream"})
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            headers = {"Accept-Encoding": "br, gzip"}
+            small = await client.post("/v1/chat/completions", content=chat_request("a"), headers=headers)
+            stream = await client.post("/v1/chat/completions", headers=headers, content=orjson.dumps({
+                "messages": [{"role": "user", "content": "b"}], "stream": True,
+            }))
+            return small, stream
+
+        small, stream = run_proxy(handler, scenario)
+
+        assert "content-encoding" not in small.headers
+        assert "content-encoding" not in stream.headers
+
+    def test_file_download_is_compressed_in_chunks(self, tmp_path):
+        """Should compress a multi-chunk FileResponse as it is sent"""
+        lines = b"".join(orjson.dumps({"custom_id": f"req-{i}", "response": {"status_code": 200}}) + b"\n"
+                         for i in range(20000))
+        path = tmp_path / "results.jsonl"
+        path.write_bytes(lines)
+
+        async def download(request):
+            return FileResponse(path, media_type="application/jsonl")
+
+        app = CompressionMiddleware(Starlette(routes=[Route("/file", download)]), available=("br", "gzip"))
+        response = call(app, "GET", "/file", headers={"Accept-Encoding": "br"})
+
+        assert response.headers["content-encoding"] == "br"
+        assert "content-length" not in response.headers
+        assert response.content == lines
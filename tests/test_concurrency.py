@@ -0,0 +1,163 @@
+"""
+Tests for adaptive concurrency and admission control (kimi_proxy/concurrency.py)
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import completion_body
+from test_upstream import PAYLOAD
+
+
+def limiter(**options):
+    from kimi_proxy.concurrency import AdaptiveLimiter
+    return AdaptiveLimiter("test", **options)
+
+
+class TestAdaptiveLimiter:
+    """Tests for AdaptiveLimiter"""
+
+    def test_queues_beyond_limit_and_wakes_in_order(self):
+        """Should admit up to the limit and hand freed slots to waiters FIFO"""
+        lim = limiter(initial_limit=1, queue_size=5)
+        order = []
+
+        async def worker(i):
+            await lim.acquire()
+            order.append(i)
+
+        async def main():
+            await lim.acquire()
+            waiters = [asyncio.ensure_future(worker(i)) for i in range(3)]
+            await asyncio.sleep(0)
+            assert lim.queue_depth == 3
+            for _ in range(3):
+                lim.release("cancelled")
+                await asyncio.sleep(0)
+            await asyncio.gather(*waiters)
+
+        asyncio.run(main())
+
+        assert order == [0, 1, 2]
+        assert lim.in_flight == 1
+
+    def test_rejects_immediately_when_queue_is_full(self):
+        """A full queue should raise Overloaded without waiting"""
+        from kimi_proxy.concurrency import Overloaded
+        lim = limiter(initial_limit=1, queue_size=0)
+
+        async def main():
+            await lim.acquire()
+            with pytest.raises(Overloaded) as info:
+                await lim.acquire()
+            return info.value
+
+        error = asyncio.run(main())
+
+        assert error.reason == "queue_full"
+        assert lim.rejected_full == 1
+
+    def test_queue_deadline(self):
+        """A waiter should give up with Overloaded after the queue timeout"""
+        from kimi_proxy.concurrency import Overloaded
+        lim = limiter(initial_limit=1, queue_timeout=0.01)
+
+        async def main():
+            await lim.acquire()
+            with pytest.raises(Overloaded) as info:
+                await lim.acquire()
+            return info.value
+
+        assert asyncio.run(main()).reason == "queue_timeout"
+        assert lim.queue_depth == 0
+
+    def test_cancelled_waiter_does_not_leak_a_slot(self):
+        """Cancelling a queued acquire should leave in_flight unchanged"""
+        lim = limiter(initial_limit=1)
+
+        async def main():
+            await lim.acquire()
+            waiter = asyncio.ensure_future(lim.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            lim.release("cancelled")
+
+        asyncio.run(main())
+
+        assert lim.in_flight == 0
+        assert lim.queue_depth == 0
+
+    def test_overload_decreases_and_success_increases(self):
+        """429s should shrink the limit multiplicatively, successes grow it additively"""
+        lim = limiter(initial_limit=10, decrease_factor=0.5)
+
+        async def main():
+            await lim.acquire()
+            lim.release("overload")
+            shrunk = lim.limit
+            for _ in range(50):
+                for _ in range(lim.capacity):
+                    await lim.acquire()
+                for _ in range(lim.capacity):
+                    lim.release("ok", latency=0.1)
+            return shrunk
+
+        shrunk = asyncio.run(main())
+
+        assert shrunk == 5
+        assert lim.limit > 5
+
+    def test_latency_spike_decreases(self):
+        """Latency well above the baseline should count as congestion"""
+        lim = limiter(initial_limit=10, latency_tolerance=2.0)
+
+        async def main():
+            for latency in (0.1, 0.1, 1.0):
+                await lim.acquire()
+                lim.release("ok", latency=latency)
+
+        asyncio.run(main())
+
+        assert lim.decreases == 1
+        assert lim.limit < 10
+
+
+class TestAdmissionEndpoint:
+    """Tests for admission control in /v1/chat/completions"""
+
+    def test_saturated_provider_returns_503(self, run_proxy, server, monkeypatch):
+        """Requests beyond limit + queue should get a fast 503 with Retry-After"""
+        from kimi_proxy.concurrency import ConcurrencyLimits
+        monkeypatch.setattr(server, "concurrency", ConcurrencyLimits(initial_limit=1, queue_size=0))
+
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(3)
+            ])
+
+        responses = run_proxy(handler, scenario)
+        rejected = [r for r in responses if r.status_code == 503]
+        snapshot = server.concurrency.snapshot()["chutes"]
+
+        assert sorted(r.status_code for r in responses) == [200, 503, 503]
+        assert rejected[0].headers["retry-after"] == "1"
+        assert snapshot["rejected_queue_full"] == 2
+        assert snapshot["in_flight"] == 0
+
+    def test_upstream_429_lowers_the_limit(self, run_proxy, server):
+        """A 429 from the provider should reduce its concurrency limit"""
+        def handler(request):
+            return httpx.Response(429, json={"error": "slow down"})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        run_proxy(handler, scenario)
+
+        assert server.concurrency.get("chutes").limit < server.CONCURRENCY_INITIAL
@@ -0,0 +1,217 @@
+"""
+Tests for the local Heavy Mode engine (kimi_proxy/heavy.py) and its proxy route
+"""
+import asyncio
+
+import httpx
+import orjson
+
+from kimi_k2_benchmark.src.comparator import compute_trajectory_diversity, identify_convergence_pattern
+from kimi_proxy.heavy import HeavyEngine, convergence_pattern, diversity_score, extract_answer, normalize_answer
+from kimi_proxy.sse import completion_to_sse
+from conftest import completion_body
+
+# Respuesta y retardo de cada seed: 0-2 coinciden pronto, 3 difiere, 4 es lenta
+SCRIPT = {
+    0: ("Pienso...\nRespuesta final: **42**", 0.01),
+    1: ("Otra vía.\nRespuesta final: 42.", 0.02),
+    2: ("\\boxed{42}", 0.03),
+    3: ("Respuesta final: 41", 0.015),
+    4: ("Respuesta final: 42", 5.0),
+}
+
+
+def sse(content, usage_tokens=100):
+    completion = completion_body(content)
+    completion["usage"]["completion_tokens"] = usage_tokens
+    return b"".join(completion_to_sse(completion, chunk_chars=8))
+
+
+def scripted_stream(opened, closed):
+    """open_stream serving SCRIPT by seed, sleeping before the last chunk"""
+    async def open_stream(payload):
+        opened.append(payload)
+        content, delay = SCRIPT[payload["seed"]]
+        events = sse(content).split(b"\n\n")
+        try:
+            yield events[0] + b"\n\n"
+            await asyncio.sleep(delay)
+            yield b"\n\n".join(events[1:])
+        finally:
+            closed.append(payload["seed"])
+    return open_stream
+
+
+class SlowStream(httpx.AsyncByteStream):
+    def __init__(self, events, delay):
+        self.events = events
+        self.delay = delay
+
+    async def __aiter__(self):
+        yield self.events[0] + b"\n\n"
+        await asyncio.sleep(self.delay)
+        yield b"\n\n".join(self.events[1:])
+
+
+class TestAnswers:
+    def test_extract_answer(self):
+        """Should prefer boxed answers, then labeled lines, then the last line"""
+        assert extract_answer("a \\boxed{1} b \\boxed{2}") == "2"
+        assert extract_answer("Respuesta final: París\nNota al pie") == "París"
+        assert extract_answer("Final answer: **Paris**") == "Paris"
+        assert extract_answer("**Respuesta final:** 7") == "7"
+        assert extract_answer("uno\ndos\n\n") == "dos"
+        assert extract_answer("") is None
+
+    def test_normalize_answer(self):
+        """Should ignore markdown, case and trailing punctuation"""
+        assert normalize_answer("**París.**") == normalize_answer("parís") == "parís"
+        assert normalize_answer("`x  =  2`") == "x = 2"
+
+    def test_convergence_matches_the_benchmark_comparator(self):
+        """Should classify votes exactly like the benchmark comparator"""
+        for answers in ([], ["a"] * 4, ["a", "a", "a", "b"], ["a", "a", "b", "b"], ["a", "b", "c"]):
+            assert convergence_pattern(answers) == identify_convergence_pattern(answers)
+            assert diversity_score(answers) == compute_trajectory_diversity(answers)
+
+
+class TestHeavyEngine:
+    def test_majority_cancels_remaining_streams(self):
+        """Should stop once a majority agrees and close the streams left running"""
+        opened, closed = [], []
+        engine = HeavyEngine(scripted_stream(opened, closed), trajectories=5)
+
+        result = asyncio.run(engine.run({"model": "m", "messages": [{"role": "user", "content": "?"}]}))
+
+        assert result.stopped_early and result.elapsed < 1
+        assert result.votes == {"42": 3, "41": 1}
+        assert result.chosen.index == 0 and result.chosen.answer == "42"
+        slow = result.trajectories[4]
+        assert slow.status == "cancelled" and 4 in closed
+        assert result.estimated_tokens_saved > 0
+        assert result.convergence_pattern == "majority"
+        assert 0 < result.diversity_score < 1
+
+    def test_payloads_are_independent_samples(self):
+        """Should send streaming payloads with distinct seeds and no heavy fields"""
+        opened, closed = [], []
+        engine = HeavyEngine(scripted_stream(opened, closed), trajectories=3, early_exit=False)
+
+        result = asyncio.run(engine.run({
+            "model": "m", "temperature": 0, "n": 3,
+            "messages": [{"role": "system", "content": "s"}, {"role": "user", "content": "?"}],
+            "extra_body": {"heavy_mode": True, "top_k": 5}
+        }))
+
+        assert sorted(p["seed"] for p in opened) == [0, 1, 2]
+        payload = opened[0]
+        assert payload["stream"] is True and payload["stream_options"] == {"include_usage": True}
+        assert payload["temperature"] == 1.0 and payload["top_k"] == 5
+        assert not {"heavy_mode", "extra_body", "n"} & payload.keys()
+        assert [m["role"] for m in payload["messages"]] == ["system", "system", "user"]
+        assert not result.stopped_early and len(result.finished) == 3
+
+    def test_tool_calls_vote_on_the_next_action(self):
+        """Should vote on the requested tools when trajectories call tools"""
+        completion = completion_body(None)
+        completion["choices"][0]["message"]["tool_calls"] = [
+            {"id": "c1", "type": "function", "function": {"name": "web_search", "arguments": "{}"}}
+        ]
+        completion["choices"][0]["finish_reason"] = "tool_calls"
+
+        async def open_stream(payload):
+            yield b"".join(completion_to_sse(completion))
+
+        result = asyncio.run(HeavyEngine(open_stream, trajectories=3).run({"messages": []}))
+
+        assert result.chosen.vote == "tool_calls:web_search"
+        assert result.completion()["choices"][0]["message"]["tool_calls"][0]["function"]["name"] == "web_search"
+
+    def test_all_failed(self):
+        """Should return no choice and keep the first error"""
+        async def open_stream(payload):
+            raise RuntimeError(f"boom {payload['seed']}")
+            yield b""
+
+        result = asyncio.run(HeavyEngine(open_stream, trajectories=2).run({"messages": []}))
+
+        assert result.chosen is None
+        assert [t.status for t in result.trajectories] == ["error", "error"]
+        assert str(result.error) == "boom 0"
+
+    def test_opening_the_stream_fails(self):
+        """Should record an error trajectory when open_stream raises before returning a stream"""
+        from kimi_proxy.router import NoProviderAvailable
+
+        def open_stream(payload):
+            raise NoProviderAvailable("no provider")
+
+        result = asyncio.run(HeavyEngine(open_stream, trajectories=2).run({"messages": []}))
+
+        assert result.chosen is None
+        assert [t.status for t in result.trajectories] == ["error", "error"]
+        assert isinstance(result.error, NoProviderAvailable)
+
+
+class TestHeavyEndpoint:
+    def handler(self, seen):
+        async def handler(request):
+            payload = orjson.loads(request.content)
+            seen.append(payload)
+            content, delay = SCRIPT[payload["seed"]]
+            return httpx.Response(200, stream=SlowStream(sse(content).split(b"\n\n"), delay),
+                                  headers={"content-type": "text/event-stream"})
+        return handler
+
+    def test_header_runs_trajectories_through_the_proxy(self, run_proxy):
+        """Should fan out upstream, answer with the chosen trajectory and report them all"""
+        seen = []
+
+        async def scenario(client):
+            return await client.post(
+                "/v1/chat/completions",
+                json={"model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": "?"}]},
+                headers={"X-Kimi-Heavy": "5"}
+            )
+
+        response = run_proxy(self.handler(seen), scenario)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert extract_answer(data["choices"][0]["message"]["content"]) == "42"
+        heavy = data["kimi_heavy"]
+        assert (heavy["completed"], heavy["cancelled"], heavy["stopped_early"]) == (4, 1, True)
+        assert len(seen) == 5 and all(p["stream"] for p in seen)
+        assert data["usage"]["completion_tokens"] >= 400
+
+    def test_streamed_body_flag(self, run_proxy):
+        """Should honour heavy_mode in the body and stream the result with the summary"""
+        seen = []
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json={
+                "model": "moonshot/kimi-k2-thinking", "stream": True, "num_trajectories": 3,
+                "messages": [{"role": "user", "content": "?"}], "extra_body": {"heavy_mode": True}
+            })
+
+        response = run_proxy(self.handler(seen), scenario)
+
+        events = [line[6:] for line in response.text.split("\n") if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        summary = orjson.loads(events[-2])["kimi_heavy"]
+        assert summary["votes"] == {"42": 2} and len(seen) == 3
+        assert ": heavy trajectory" in response.text
+
+    def test_upstream_errors_propagate(self, run_proxy):
+        """Should return the upstream error when no trajectory completes"""
+        def handler(request):
+            return httpx.Response(400, json={"error": {"message": "bad"}})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json={
+                "model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": "?"}]
+            }, headers={"X-Kimi-Heavy": "on"})
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code >= 400
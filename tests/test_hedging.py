@@ -0,0 +1,154 @@
+"""
+Tests for hedged requests (kimi_proxy/hedging.py)
+"""
+import asyncio
+
+import httpx
+
+from test_router import KEYS
+from test_upstream import PAYLOAD
+
+
+def slow_call(delay, body=b"data: x\n\n", closed=None):
+    """Attempt whose stream produces its first chunk after `delay` seconds"""
+    from kimi_proxy.upstream import UpstreamCall
+
+    async def content():
+        try:
+            await asyncio.sleep(delay)
+            yield body
+        finally:
+            if closed is not None:
+                closed.append(body)
+
+    async def attempt():
+        return UpstreamCall(httpx.Response(200, content=content()))
+    return attempt
+
+
+def failing_call():
+    async def attempt():
+        raise httpx.ConnectError("boom")
+    return attempt
+
+
+def run_hedge(primary, alternate, delay, budget=None):
+    from kimi_proxy.hedging import HedgeBudget, hedged_call
+    budget = budget or HedgeBudget(ratio=1.0, tokens=5.0)
+
+    async def main():
+        call, hedged = await hedged_call(primary, alternate, delay, budget)
+        first = await call.aiter_chunks().__anext__()
+        await call.aclose()
+        return first, hedged, budget
+
+    return asyncio.run(main())
+
+
+class TestHedgeBudget:
+    """Tests for HedgeBudget"""
+
+    def test_caps_extra_requests_at_ratio(self):
+        """Should allow at most ratio x requests hedges over time"""
+        from kimi_proxy.hedging import HedgeBudget
+        budget = HedgeBudget(ratio=0.05)
+
+        for _ in range(200):
+            budget.record_request()
+            budget.try_spend()
+
+        assert budget.hedges == 10
+        assert budget.denied == 190
+
+
+class TestHedgedCall:
+    """Tests for hedged_call"""
+
+    def test_fast_primary_is_not_hedged(self):
+        """Should not start the alternate when the primary answers in time"""
+        started = []
+
+        async def alternate():
+            started.append(True)
+            return await slow_call(0)()
+
+        first, hedged, budget = run_hedge(slow_call(0, b"data: a\n\n"), alternate, delay=0.5)
+
+        assert first == b"data: a\n\n"
+        assert not hedged
+        assert started == []
+        assert budget.hedges == 0
+
+    def test_faster_alternate_wins_and_primary_is_cancelled(self):
+        """Should return the first stream to produce a token and close the other"""
+        closed = []
+        first, hedged, budget = run_hedge(
+            slow_call(5, b"data: a\n\n", closed), slow_call(0.01, b"data: b\n\n"), delay=0.05
+        )
+
+        assert first == b"data: b\n\n"
+        assert hedged
+        assert budget.hedge_wins == 1
+        assert closed == [b"data: a\n\n"]
+
+    def test_no_hedge_without_budget(self):
+        """Should keep waiting on the primary when the budget is spent"""
+        from kimi_proxy.hedging import HedgeBudget
+        started = []
+
+        async def alternate():
+            started.append(True)
+            return await slow_call(0)()
+
+        first, hedged, budget = run_hedge(
+            slow_call(0.1, b"data: a\n\n"), alternate, delay=0.01, budget=HedgeBudget(ratio=0.05)
+        )
+
+        assert first == b"data: a\n\n"
+        assert not hedged
+        assert started == []
+        assert budget.denied == 1
+
+    def test_failed_alternate_falls_back_to_primary(self):
+        """An alternate error should not fail the request while the primary is alive"""
+        first, hedged, _ = run_hedge(slow_call(0.1, b"data: a\n\n"), failing_call(), delay=0.01)
+
+        assert first == b"data: a\n\n"
+        assert hedged
+
+
+class TestHedgingEndpoint:
+    """Tests for hedging through /v1/chat/completions"""
+
+    def test_slow_provider_is_hedged_to_alternate(self, run_proxy, server, monkeypatch):
+        """Should stream from the alternate provider when the first one stalls"""
+        from kimi_proxy.hedging import HedgeBudget
+        from kimi_proxy.router import load_router
+
+        router = load_router(env=KEYS)
+        for _ in range(30):
+            router.observe_ttft(router.providers["chutes"], 0.02)
+        router.observe_ttft(router.providers["openrouter"], 5.0)
+        monkeypatch.setattr(server, "router", router)
+        monkeypatch.setattr(server, "hedge_budget", HedgeBudget(ratio=1.0, tokens=1.0))
+
+        def handler(request):
+            async def body(delay, text):
+                await asyncio.sleep(delay)
+                yield text
+            if "openrouter" in str(request.url):
+                return httpx.Response(200, content=body(0, b"data: fast\n\n"))
+            return httpx.Response(200, content=body(5, b"data: slow\n\n"))
+
+        async def scenario(client):
+            return await client.post(
+                "/v1/chat/completions",
+                json={**PAYLOAD, "stream": True},
+                headers={"X-Kimi-Hedge": "on"}
+            )
+
+        response = run_proxy(handler, scenario)
+
+        assert response.headers["x-kimi-provider"] == "openrouter"
+        assert response.content == b"data: fast\n\n"
+        assert router.providers["chutes"].in_flight == 0
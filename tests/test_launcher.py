@@ -0,0 +1,57 @@
+"""
+Tests for the production launcher (kimi_proxy/launcher.py)
+"""
+import os
+from pathlib import Path
+
+
+class TestLauncher:
+    """Tests for serve and the shared state it prepares for workers"""
+
+    def test_prepare_shared_state_exports_directories(self, tmp_path, monkeypatch):
+        """Should create a clean metrics directory and export it to the workers"""
+        from kimi_proxy.launcher import METRICS_DIR_ENV, STATE_DIR_ENV, prepare_shared_state
+        monkeypatch.delenv(STATE_DIR_ENV, raising=False)
+        monkeypatch.delenv(METRICS_DIR_ENV, raising=False)
+        stale = tmp_path / "metrics" / "counter_123.db"
+        stale.parent.mkdir()
+        stale.write_bytes(b"old")
+
+        state = prepare_shared_state(tmp_path)
+
+        assert state == tmp_path
+        assert not stale.exists()
+        assert os.environ[STATE_DIR_ENV] == str(tmp_path)
+        assert os.environ[METRICS_DIR_ENV] == str(tmp_path / "metrics")
+
+    def test_production_mode_uses_workers_and_drain(self, monkeypatch):
+        """Should run several workers with a graceful shutdown deadline and clean up"""
+        import kimi_proxy.launcher as launcher
+        calls = []
+        monkeypatch.delenv(launcher.STATE_DIR_ENV, raising=False)
+        monkeypatch.delenv(launcher.METRICS_DIR_ENV, raising=False)
+
+        def fake_run(app, **options):
+            calls.append((app, options, os.environ[launcher.STATE_DIR_ENV]))
+
+        monkeypatch.setattr(launcher.uvicorn, "run", fake_run)
+
+        launcher.serve("kimi_k2_local_server:app", workers=3, drain_timeout=12)
+
+        app, options, state = calls[0]
+        assert app == "kimi_k2_local_server:app"
+        assert options["workers"] == 3
+        assert options["timeout_graceful_shutdown"] == 12
+        assert "reload" not in options
+        assert not Path(state).exists()
+
+    def test_dev_mode_reloads_in_one_process(self, monkeypatch):
+        """Should keep the single-process reload mode for development"""
+        import kimi_proxy.launcher as launcher
+        calls = []
+        monkeypatch.setattr(launcher.uvicorn, "run", lambda app, **options: calls.append(options))
+
+        launcher.serve("kimi_k2_local_server:app", dev=True)
+
+        assert calls[0]["reload"] is True
+        assert "workers" not in calls[0]
@@ -0,0 +1,134 @@
+"""
+Tests for the Prometheus metrics (kimi_proxy/metrics.py)
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import completion_body
+from test_sse import STREAM
+from test_upstream import PAYLOAD
+
+
+MODEL = "moonshotai/Kimi-K2-Thinking"
+
+
+@pytest.fixture
+def metrics(server, monkeypatch):
+    """A ProxyMetrics instance on its own registry, installed in the proxy"""
+    from prometheus_client import CollectorRegistry
+    from kimi_proxy.metrics import ProxyMetrics
+
+    fresh = ProxyMetrics(CollectorRegistry())
+    monkeypatch.setattr(server, "metrics", fresh)
+    return fresh
+
+
+def sample(metrics, name, **labels):
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+class TestExtractUsage:
+    """Tests for extract_usage"""
+
+    def test_reads_usage_from_last_sse_chunks(self):
+        """Should find the usage event even when split across the last two chunks"""
+        from kimi_proxy.metrics import extract_usage
+        from kimi_proxy.upstream import UpstreamCall
+
+        call = UpstreamCall(httpx.Response(200))
+        split = STREAM.index(b'"usage"') - 10
+        for chunk in (STREAM[:split], STREAM[split:]):
+            call.mark_chunk(chunk)
+
+        assert extract_usage(call)["completion_tokens"] == 4
+
+    def test_missing_usage_returns_none(self):
+        """Should not fail on streams without a usage block"""
+        from kimi_proxy.metrics import extract_usage
+        from kimi_proxy.upstream import UpstreamCall
+
+        call = UpstreamCall(httpx.Response(200))
+        call.mark_chunk(b"data: {\"choices\": []}\n\n")
+
+        assert extract_usage(call) is None
+
+
+class TestProxyMetrics:
+    """Tests for metrics recorded by /v1/chat/completions"""
+
+    def test_streaming_request_records_latency_series(self, run_proxy, metrics):
+        """Should record TTFT, inter-token gaps, tokens and tokens/s for a stream"""
+        async def body():
+            for event in STREAM.split(b"\n\n")[:-1]:
+                await asyncio.sleep(0.001)
+                yield event + b"\n\n"
+
+        def handler(request):
+            return httpx.Response(200, content=body())
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json={**PAYLOAD, "stream": True})
+
+        run_proxy(handler, scenario)
+
+        labels = {"model": MODEL, "provider": "chutes"}
+        assert sample(metrics, "kimi_proxy_upstream_requests_total", status="200", **labels) == 1
+        assert sample(metrics, "kimi_proxy_ttft_seconds_count", **labels) == 1
+        assert sample(metrics, "kimi_proxy_inter_token_seconds_count", provider="chutes") > 1
+        assert sample(metrics, "kimi_proxy_output_tokens_per_second_count", **labels) == 1
+        assert sample(metrics, "kimi_proxy_tokens_total", type="completion", **labels) == 4
+        assert sample(metrics, "kimi_proxy_upstream_in_flight", provider="chutes") == 0
+        assert sample(metrics, "kimi_proxy_upstream_connect_seconds_count", provider="chutes") == 1
+
+    def test_upstream_errors_are_counted_by_status(self, run_proxy, server, metrics):
+        """Should label every failed attempt with the upstream HTTP status"""
+        def handler(request):
+            return httpx.Response(429, json={"error": "rate limited"})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        run_proxy(handler, scenario)
+
+        assert sample(
+            metrics, "kimi_proxy_upstream_requests_total", model=MODEL, provider="chutes", status="429"
+        ) == server.retry_policy.max_tries
+        assert sample(metrics, "kimi_proxy_upstream_retries_total", provider="chutes") == \
+            server.retry_policy.max_tries - 1
+
+    def test_cache_hit_ratio(self, run_proxy, server, metrics, response_cache):
+        """Should expose cache lookups and the running hit ratio"""
+        payload = {**PAYLOAD, "temperature": 0}
+
+        def handler(request):
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            server.app.state.response_cache = response_cache
+            await client.post("/v1/chat/completions", json=payload)
+            await asyncio.sleep(0.05)  # background cache write
+            await client.post("/v1/chat/completions", json=payload)
+
+        run_proxy(handler, scenario)
+
+        assert sample(metrics, "kimi_proxy_cache_lookups_total", result="miss") == 1
+        assert sample(metrics, "kimi_proxy_cache_lookups_total", result="memory") == 1
+        assert sample(metrics, "kimi_proxy_cache_hit_ratio") == 0.5
+
+    def test_metrics_endpoint_serves_text_format(self, run_proxy, metrics):
+        """GET /metrics should return the Prometheus exposition format"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            await client.post("/v1/chat/completions", json=PAYLOAD)
+            return await client.get("/metrics")
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "kimi_proxy_upstream_requests_total" in response.text
+        assert "kimi_proxy_tokens_total" in response.text
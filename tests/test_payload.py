@@ -0,0 +1,120 @@
+"""
+Tests for the raw-body passthrough of chat requests.
+"""
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.payload import ChatBody, InvalidRequest
+from conftest import completion_body
+
+DEFAULT = "moonshot/kimi-k2-thinking"
+
+
+def raw(**fields):
+    return orjson.dumps({"model": DEFAULT, "messages": [{"role": "user", "content": "hi"}], **fields})
+
+
+class TestChatBody:
+    def test_same_model_forwards_original_bytes(self):
+        """Should return the exact client bytes when the model name is unchanged"""
+        original = b'{ "model" : "m",  "messages": [{"role":"user","content":"x"}], "stream_options": {} }'
+        body = ChatBody.parse(original, DEFAULT)
+
+        assert body.encode("m") is original
+
+    def test_model_rewrite_only_touches_the_model_value(self):
+        """Should splice the upstream model name into the original bytes"""
+        original = b'{"messages": [{"role":"user","content":"say \\"model\\": \\"x\\""}], "model": "m", "top_k": 3}'
+        body = ChatBody.parse(original, DEFAULT)
+
+        encoded = body.encode("upstream/M")
+
+        assert encoded == original.replace(b'"model": "m"', b'"model": "upstream/M"')
+        assert orjson.loads(encoded)["messages"] == orjson.loads(original)["messages"]
+
+    def test_nested_model_keys_fall_back_to_reserializing(self):
+        """Should not guess which "model" key to rewrite when there are several"""
+        original = raw(response_format={"schema": {"model": DEFAULT}})
+        encoded = ChatBody.parse(original, DEFAULT).encode("upstream")
+
+        assert orjson.loads(encoded)["model"] == "upstream"
+        assert orjson.loads(encoded)["response_format"]["schema"]["model"] == DEFAULT
+
+    def test_defaults_and_extra_body(self):
+        """Should fill the default model and merge extra_body like the OpenAI SDK"""
+        body = ChatBody.parse(b'{"messages": [{"role": "user", "content": "hi"}], "extra_body": {"top_k": 5}}', DEFAULT)
+
+        assert body.model == DEFAULT
+        assert body.stream is False
+        assert orjson.loads(body.encode("x")) == {
+            "messages": [{"role": "user", "content": "hi"}], "model": "x", "top_k": 5
+        }
+
+    @pytest.mark.parametrize("content", [
+        b"not json",
+        b"[1, 2]",
+        b'{"messages": []}',
+        b'{"messages": ["hi"]}',
+        b'{"messages": [{"content": "hi"}]}',
+        b'{"messages": [{"role": "user"}], "stream": "yes"}',
+        b'{"messages": [{"role": "user"}], "max_tokens": "10"}',
+    ])
+    def test_rejects_what_the_proxy_needs(self, content):
+        """Should validate model, messages, stream and max_tokens only"""
+        with pytest.raises(InvalidRequest):
+            ChatBody.parse(content, DEFAULT)
+
+
+class TestPassthroughEndpoint:
+    def test_unknown_fields_reach_upstream(self, run_proxy):
+        """Should forward fields the proxy does not model, including non-string content"""
+        seen = []
+
+        def handler(request):
+            seen.append(orjson.loads(request.content))
+            return httpx.Response(200, json=completion_body())
+
+        messages = [{"role": "user", "content": [{"type": "text", "text": "hi"}]}]
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", content=orjson.dumps({
+                "model": DEFAULT, "messages": messages, "stream_options": {"include_usage": True}, "top_k": 4
+            }))
+
+        assert run_proxy(handler, scenario).status_code == 200
+        assert seen[0]["messages"] == messages
+        assert seen[0]["stream_options"] == {"include_usage": True}
+        assert seen[0]["top_k"] == 4
+        assert seen[0]["model"] == "moonshotai/Kimi-K2-Thinking"
+        assert "temperature" not in seen[0]
+
+    def test_invalid_body_is_422(self, run_proxy):
+        """Should reject bodies without messages before calling upstream"""
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", content=b'{"model": "x"}')
+
+        assert run_proxy(lambda r: httpx.Response(500), scenario).status_code == 422
+
+    def test_messages_that_are_not_objects_are_422(self, run_proxy):
+        """Should reject string messages instead of failing later with a 500"""
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", content=b'{"model": "m", "messages": ["hi"]}')
+
+        assert run_proxy(lambda r: httpx.Response(500), scenario).status_code == 422
+
+    def test_strict_mode_rebuilds_the_payload(self, server, run_proxy, monkeypatch):
+        """Should keep the Pydantic path when KIMI_PROXY_PASSTHROUGH=0"""
+        monkeypatch.setattr(server, "PASSTHROUGH", False)
+        seen = []
+
+        def handler(request):
+            seen.append(orjson.loads(request.content))
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", content=raw(top_k=4))
+
+        assert run_proxy(handler, scenario).status_code == 200
+        assert "top_k" not in seen[0]
+        assert seen[0]["temperature"] == 0.7
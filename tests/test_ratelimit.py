@@ -0,0 +1,209 @@
+"""
+Tests for per-client rate limits (kimi_proxy/ratelimit.py) and
+weighted fair queuing between priority classes (kimi_proxy/concurrency.py)
+"""
+import asyncio
+
+import httpx
+
+from conftest import completion_body
+from test_upstream import PAYLOAD
+
+
+class TestIdentifyClient:
+    """Tests for identify_client"""
+
+    def test_explicit_header_wins(self):
+        """X-Kimi-Client should take precedence over the API key"""
+        from kimi_proxy.ratelimit import identify_client
+
+        headers = {"x-kimi-client": "bench-runner", "authorization": "Bearer sk-1"}
+
+        assert identify_client(headers, "10.0.0.1") == "bench-runner"
+
+    def test_api_key_is_hashed(self):
+        """Should identify by API key without keeping the key itself"""
+        from kimi_proxy.ratelimit import identify_client
+
+        client = identify_client({"authorization": "Bearer sk-secret"}, "10.0.0.1")
+
+        assert client.startswith("key:")
+        assert "sk-secret" not in client
+        assert client == identify_client({"authorization": "Bearer sk-secret"}, "10.0.0.2")
+
+    def test_falls_back_to_ip(self):
+        from kimi_proxy.ratelimit import identify_client
+
+        assert identify_client({}, "10.0.0.1") == "ip:10.0.0.1"
+
+
+class TestRateLimiter:
+    """Tests for RateLimiter"""
+
+    def test_requests_per_minute(self):
+        """Should admit a minute's burst and then ask to wait"""
+        from kimi_proxy.ratelimit import RateLimiter
+        limiter = RateLimiter(requests_per_minute=3)
+
+        results = [limiter.check("a", 0) for _ in range(4)]
+
+        assert results[:3] == [0, 0, 0]
+        assert 0 < results[3] <= 20
+        assert limiter.check("b", 0) == 0
+
+    def test_tokens_per_minute_with_refund(self):
+        """Unused estimated tokens should be returned to the bucket"""
+        from kimi_proxy.ratelimit import RateLimiter
+        limiter = RateLimiter(tokens_per_minute=1000)
+
+        assert limiter.check("a", 800) == 0
+        assert limiter.check("a", 800) > 0
+        limiter.refund("a", 700)
+
+        assert limiter.check("a", 800) == 0
+
+    def test_disabled_by_default(self):
+        from kimi_proxy.ratelimit import RateLimiter
+        limiter = RateLimiter()
+
+        assert not limiter.enabled
+        assert all(limiter.check("a", 10 ** 6) == 0 for _ in range(100))
+
+
+class TestSharedRateLimiter:
+    """Tests for SharedRateLimiter (buckets shared between workers)"""
+
+    def test_quota_is_shared_between_instances(self, tmp_path):
+        """Two workers on the same file should draw from one bucket"""
+        from kimi_proxy.ratelimit import SharedRateLimiter
+        first = SharedRateLimiter(tmp_path / "ratelimit.sqlite", requests_per_minute=3)
+        second = SharedRateLimiter(tmp_path / "ratelimit.sqlite", requests_per_minute=3)
+
+        results = [first.check("a", 0), second.check("a", 0), first.check("a", 0), second.check("a", 0)]
+
+        assert results[:3] == [0, 0, 0]
+        assert results[3] > 0
+        assert second.snapshot()["clients"]["a"]["rejected"] == 1
+        first.close()
+        second.close()
+
+    def test_refund_is_visible_to_other_workers(self, tmp_path):
+        """Tokens refunded by one worker should be available to the others"""
+        from kimi_proxy.ratelimit import SharedRateLimiter
+        first = SharedRateLimiter(tmp_path / "ratelimit.sqlite", tokens_per_minute=1000)
+        second = SharedRateLimiter(tmp_path / "ratelimit.sqlite", tokens_per_minute=1000)
+
+        assert first.check("a", 800) == 0
+        assert second.check("a", 800) > 0
+        first.refund("a", 700)
+        assert second.check("a", 800) == 0
+        first.close()
+        second.close()
+
+    def test_async_check_does_not_block_the_event_loop(self, tmp_path):
+        """Should wait for another worker's write lock in a thread, not on the loop"""
+        import sqlite3
+
+        from kimi_proxy.ratelimit import SharedRateLimiter, TokenCharge
+        limiter = SharedRateLimiter(tmp_path / "ratelimit.sqlite", tokens_per_minute=1000)
+        other = sqlite3.connect(tmp_path / "ratelimit.sqlite", isolation_level=None)
+
+        async def main():
+            ticks = 0
+            other.execute("BEGIN IMMEDIATE")
+            check = asyncio.ensure_future(limiter.check_async("a", 800))
+            for _ in range(5):
+                await asyncio.sleep(0.02)
+                ticks += 1
+            blocked = not check.done()
+            other.execute("COMMIT")
+            assert await check == 0
+            TokenCharge(limiter, "a", 800).refund()
+            for _ in range(50):
+                if limiter.snapshot()["clients"]["a"]["tokens_available"] >= 999:
+                    break
+                await asyncio.sleep(0.01)
+            return ticks, blocked
+
+        try:
+            assert asyncio.run(main()) == (5, True)
+            assert limiter.snapshot()["clients"]["a"]["tokens_available"] >= 999
+        finally:
+            other.close()
+            limiter.close()
+
+
+class TestWeightedFairQueuing:
+    """Tests for priority classes in AdaptiveLimiter"""
+
+    def test_interactive_gets_its_weighted_share(self):
+        """With weights 4:1, interactive should get ~4 of every 5 freed slots"""
+        from kimi_proxy.concurrency import AdaptiveLimiter
+        limiter = AdaptiveLimiter("p", initial_limit=1, weights={"interactive": 4, "batch": 1})
+        order = []
+
+        async def waiter(priority):
+            await limiter.acquire(priority)
+            order.append(priority)
+
+        async def main():
+            await limiter.acquire("batch")
+            tasks = [asyncio.ensure_future(waiter("batch")) for _ in range(10)]
+            await asyncio.sleep(0)
+            tasks += [asyncio.ensure_future(waiter("interactive")) for _ in range(10)]
+            await asyncio.sleep(0)
+            for _ in range(20):
+                limiter.release("cancelled")
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+
+        assert order[:5].count("interactive") == 4
+        assert order[:10].count("batch") <= 3
+        assert sorted(order) == ["batch"] * 10 + ["interactive"] * 10
+
+    def test_wait_time_is_reported_per_class(self):
+        """Should expose queue wait statistics per priority class"""
+        from kimi_proxy.concurrency import AdaptiveLimiter
+        limiter = AdaptiveLimiter("p", initial_limit=1)
+
+        async def main():
+            await limiter.acquire("interactive")
+            queued = asyncio.ensure_future(limiter.acquire("batch"))
+            await asyncio.sleep(0.05)
+            limiter.release("cancelled")
+            return await queued
+
+        waited = asyncio.run(main())
+        classes = limiter.snapshot()["classes"]
+
+        assert waited >= 0.04
+        assert classes["batch"]["queued"] == 1
+        assert classes["batch"]["max_wait"] >= 0.04
+        assert classes["interactive"]["avg_wait"] == 0
+
+
+class TestRateLimitEndpoint:
+    """Tests for rate limiting in /v1/chat/completions"""
+
+    def test_exhausted_client_gets_429(self, run_proxy, server, monkeypatch):
+        """Should reject a client over its quota without affecting others"""
+        from kimi_proxy.ratelimit import RateLimiter
+        monkeypatch.setattr(server, "rate_limiter", RateLimiter(requests_per_minute=2))
+
+        def handler(request):
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            headers = {"X-Kimi-Client": "benchmark", "X-Kimi-Priority": "batch"}
+            batch = [await client.post("/v1/chat/completions", json=PAYLOAD, headers=headers)
+                     for _ in range(3)]
+            other = await client.post("/v1/chat/completions", json=PAYLOAD, headers={"X-Kimi-Client": "cli"})
+            return batch, other
+
+        batch, other = run_proxy(handler, scenario)
+
+        assert [r.status_code for r in batch] == [200, 200, 429]
+        assert int(batch[2].headers["retry-after"]) >= 1
+        assert other.status_code == 200
@@ -0,0 +1,198 @@
+"""
+Tests for retries (kimi_proxy/retry.py) and circuit breakers (kimi_proxy/circuit.py)
+"""
+import asyncio
+import email.utils
+import random
+import time
+
+import httpx
+import pytest
+
+from conftest import completion_body
+from test_router import KEYS
+from test_upstream import PAYLOAD
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "https://upstream/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+class TestRetryAfter:
+    """Tests for retry_after_seconds"""
+
+    def test_seconds_and_http_date(self):
+        from kimi_proxy.retry import retry_after_seconds
+        later = email.utils.formatdate(time.time() + 10, usegmt=True)
+
+        assert retry_after_seconds(status_error(429, {"Retry-After": "3"})) == 3
+        assert 8 <= retry_after_seconds(status_error(503, {"Retry-After": later})) <= 10
+        assert retry_after_seconds(status_error(503)) is None
+
+
+class TestDecorrelatedJitter:
+    """Tests for the decorrelated_jitter wait generator"""
+
+    def test_waits_stay_within_bounds(self):
+        from kimi_proxy.retry import decorrelated_jitter
+        waits = decorrelated_jitter(base=0.1, cap=2.0, rng=random.Random(1))
+        waits.send(None)
+
+        values = [waits.send(status_error(502)) for _ in range(50)]
+
+        assert all(0.1 <= v <= 2.0 for v in values)
+        assert len(set(values)) > 10
+
+    def test_honors_retry_after(self):
+        from kimi_proxy.retry import decorrelated_jitter
+        waits = decorrelated_jitter()
+        waits.send(None)
+
+        assert waits.send(status_error(429, {"Retry-After": "2"})) == 2
+
+
+class TestRetryPolicy:
+    """Tests for RetryPolicy.run"""
+
+    def run(self, errors, policy=None):
+        from kimi_proxy.retry import RetryPolicy
+        policy = policy or RetryPolicy(max_tries=3, base_delay=0.001, max_delay=0.01)
+        calls = []
+
+        async def attempt():
+            calls.append(True)
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        return asyncio.run(policy.run(attempt)), calls, policy
+
+    def test_retries_transient_errors(self):
+        """502 and connection errors should be retried until success"""
+        result, calls, policy = self.run([status_error(502), httpx.ConnectError("refused")])
+
+        assert result == "ok"
+        assert len(calls) == 3
+        assert policy.retries == 2
+
+    def test_does_not_retry_client_errors(self):
+        """A 400 is not transient and should fail at once"""
+        with pytest.raises(httpx.HTTPStatusError):
+            self.run([status_error(400)])
+
+    def test_gives_up_on_long_retry_after(self):
+        """A Retry-After beyond the limit should not be waited for"""
+        from kimi_proxy.retry import RetryPolicy
+        policy = RetryPolicy(max_retry_after=5)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            self.run([status_error(429, {"Retry-After": "120"})], policy)
+        assert policy.retries == 0
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker"""
+
+    def test_opens_after_consecutive_failures(self):
+        from kimi_proxy.circuit import OPEN, CircuitBreaker
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=10)
+
+        for _ in range(3):
+            breaker.record_failure(now=100)
+
+        assert breaker.state(now=101) == OPEN
+        assert not breaker.available(now=101)
+
+    def test_half_open_allows_one_probe(self):
+        """After the cooldown a single probe is allowed; its result decides"""
+        from kimi_proxy.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+        breaker.record_failure(now=100)
+
+        assert breaker.state(now=111) == HALF_OPEN
+        assert breaker.available(now=111)
+        breaker.on_request(now=111)
+        assert not breaker.available(now=112)
+
+        breaker.record_failure(now=113)
+        assert breaker.state(now=114) == OPEN
+
+        breaker.on_request(now=124)
+        breaker.record_success()
+        assert breaker.state() == CLOSED
+
+
+class TestRetryEndpoint:
+    """Tests for retries and breakers through /v1/chat/completions"""
+
+    def test_transient_error_is_retried_on_another_provider(self, run_proxy, server, monkeypatch):
+        """A 502 from one provider should be retried transparently on the other"""
+        from kimi_proxy.router import load_router
+        router = load_router(env=KEYS)
+        router.observe_ttft(router.providers["chutes"], 0.1)
+        router.observe_ttft(router.providers["openrouter"], 1.0)
+        monkeypatch.setattr(server, "router", router)
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == "llm.chutes.ai":
+                return httpx.Response(502, json={"error": "bad gateway"})
+            return httpx.Response(200, json=completion_body("recuperado"))
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.headers["x-kimi-provider"] == "openrouter"
+        assert hosts == ["llm.chutes.ai", "openrouter.ai"]
+
+    def test_no_retry_after_bytes_were_streamed(self, run_proxy):
+        """A stream that breaks mid-body must not be replayed to the client"""
+        calls = []
+
+        async def body():
+            yield b'data: {"choices":[{"delta":{"content":"Ho"}}]}\n\n'
+            raise httpx.ReadError("connection reset")
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, content=body())
+
+        async def scenario(client):
+            try:
+                async with client.stream(
+                    "POST", "/v1/chat/completions", json={**PAYLOAD, "stream": True}
+                ) as response:
+                    return b"".join([chunk async for chunk in response.aiter_bytes()])
+            except httpx.HTTPError:
+                return None
+
+        run_proxy(handler, scenario)
+
+        assert len(calls) == 1
+
+    def test_open_breaker_routes_around_provider(self, run_proxy, server, monkeypatch):
+        """Once chutes trips its breaker, requests should go straight to the other provider"""
+        from kimi_proxy.router import load_router
+        router = load_router(env=KEYS)
+        for _ in range(3):
+            router.observe_failure(router.providers["chutes"])
+        monkeypatch.setattr(server, "router", router)
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return [await client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(5)]
+
+        responses = run_proxy(handler, scenario)
+
+        assert all(r.status_code == 200 for r in responses)
+        assert set(hosts) == {"openrouter.ai"}
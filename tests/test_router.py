@@ -0,0 +1,216 @@
+"""
+Tests for the latency-aware provider router (kimi_proxy/router.py)
+"""
+import json
+import random
+
+import httpx
+
+from conftest import completion_body
+from test_upstream import PAYLOAD
+
+
+KEYS = {"CHUTES_API_KEY": "chutes-key", "OPENROUTER_API_KEY": "or-key"}
+CANONICAL = "moonshotai/Kimi-K2-Thinking"
+
+
+def make_router(**kwargs):
+    from kimi_proxy.router import load_router
+    return load_router(env={**KEYS, **kwargs.pop("env", {})}, **kwargs)
+
+
+class TestLoadRouter:
+    """Tests for building the router from models.yaml"""
+
+    def test_providers_without_key_are_not_configured(self):
+        """Should only route to providers whose API key is present"""
+        router = make_router()
+
+        names = [p.name for p, _ in router.candidates("moonshot/kimi-k2-thinking")]
+
+        assert sorted(names) == ["chutes", "openrouter"]
+        assert not router.providers["moonshot"].configured
+
+    def test_aliases_resolve_to_provider_model_names(self):
+        """Should map any alias to the name each provider expects"""
+        router = make_router()
+
+        models = dict((p.name, m) for p, m in router.candidates("kimi-k2-thinking"))
+
+        assert models == {"chutes": CANONICAL, "openrouter": "moonshotai/kimi-k2-thinking"}
+
+    def test_unknown_model_goes_to_default_provider(self):
+        """Should forward unknown models unchanged to the default provider"""
+        router = make_router()
+
+        provider, model = router.choose("some/other-model")
+
+        assert provider.name == "chutes"
+        assert model == "some/other-model"
+
+    def test_overrides_replace_api_base(self):
+        """Should let the caller override provider fields (e.g. CHUTES_BASE_URL)"""
+        router = make_router(overrides={"chutes": {"api_base": "http://localhost:9000/v1/"}})
+
+        assert router.providers["chutes"].url("chat/completions") == \
+            "http://localhost:9000/v1/chat/completions"
+
+
+class TestChoose:
+    """Tests for Router.choose"""
+
+    def test_prefers_lower_latency(self):
+        """With two candidates P2C should always pick the faster one"""
+        router = make_router(env={})
+        router.rng = random.Random(0)
+        router.observe_ttft(router.providers["chutes"], 2.0)
+        router.observe_ttft(router.providers["openrouter"], 0.5)
+
+        chosen = {router.choose(CANONICAL)[0].name for _ in range(20)}
+
+        assert chosen == {"openrouter"}
+
+    def test_in_flight_load_raises_cost(self):
+        """A fast provider that is saturated should lose to an idle one"""
+        router = make_router()
+        router.observe_ttft(router.providers["chutes"], 1.0)
+        router.observe_ttft(router.providers["openrouter"], 0.5)
+        router.providers["openrouter"].in_flight = 5
+
+        assert router.choose(CANONICAL)[0].name == "chutes"
+
+    def test_pinned_provider_wins(self):
+        """A pinned provider should be used regardless of latency"""
+        router = make_router()
+        router.observe_ttft(router.providers["chutes"], 5.0)
+        router.observe_ttft(router.providers["openrouter"], 0.1)
+
+        assert router.choose(CANONICAL, pinned="chutes")[0].name == "chutes"
+
+    def test_ejects_after_consecutive_failures(self):
+        """Should skip a provider after repeated failures while others are healthy"""
+        router = make_router()
+        router.observe_ttft(router.providers["chutes"], 0.1)
+        router.observe_ttft(router.providers["openrouter"], 5.0)
+        for _ in range(3):
+            router.observe_failure(router.providers["chutes"])
+
+        assert not router.providers["chutes"].healthy()
+        assert router.choose(CANONICAL)[0].name == "openrouter"
+
+    def test_fails_open_when_all_ejected(self):
+        """Should still return a provider when every candidate is ejected"""
+        router = make_router(env={"OPENROUTER_API_KEY": ""})
+        for _ in range(3):
+            router.observe_failure(router.providers["chutes"])
+
+        assert router.choose(CANONICAL)[0].name == "chutes"
+
+
+class TestRoutingEndpoint:
+    """Tests for routing through /v1/chat/completions"""
+
+    def test_routes_with_provider_model_and_headers(self, run_proxy, server, monkeypatch):
+        """Should send the provider's model name, key and extra headers"""
+        monkeypatch.setattr(server, "router", make_router())
+        seen = {}
+
+        def handler(request):
+            seen["url"] = str(request.url)
+            seen["auth"] = request.headers["authorization"]
+            seen["title"] = request.headers.get("x-title")
+            seen["model"] = json.loads(request.content)["model"]
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await client.post(
+                "/v1/chat/completions", json=PAYLOAD, headers={"X-Kimi-Provider": "openrouter"}
+            )
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.headers["x-kimi-provider"] == "openrouter"
+        assert seen["url"] == "https://openrouter.ai/api/v1/chat/completions"
+        assert seen["auth"] == "Bearer or-key"
+        assert seen["title"]
+        assert seen["model"] == "moonshotai/kimi-k2-thinking"
+
+    def test_admin_providers_reports_latency(self, run_proxy):
+        """Should expose per-provider TTFT and request counts"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            await client.post("/v1/chat/completions", json=PAYLOAD)
+            return await client.get("/admin/providers")
+
+        snapshot = run_proxy(handler, scenario).json()
+        chutes = snapshot["providers"]["chutes"]
+
+        assert chutes["requests"] == 1
+        assert chutes["in_flight"] == 0
+        assert chutes["ewma_ttft"] is not None
+        assert snapshot["recent_decisions"][-1]["chosen"] == "chutes"
+
+    def test_half_open_provider_gets_a_single_probe(self, run_proxy, server, monkeypatch):
+        """Requests routed while the probe is still connecting should avoid the provider"""
+        import asyncio
+        import time
+
+        router = make_router()
+        router.observe_ttft(router.providers["chutes"], 0.01)
+        router.observe_ttft(router.providers["openrouter"], 10.0)
+        breaker = router.providers["chutes"].breaker
+        breaker.opened_at = time.monotonic() - breaker.cooldown - 1
+        monkeypatch.setattr(server, "router", router)
+        hosts = []
+
+        async def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == "llm.chutes.ai":
+                await asyncio.sleep(0.1)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await asyncio.gather(*[client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(2)])
+
+        responses = run_proxy(handler, scenario)
+
+        assert [r.status_code for r in responses] == [200, 200]
+        assert sorted(hosts) == ["llm.chutes.ai", "openrouter.ai"]
+        assert breaker.state() == "closed"
+
+    def test_calls_count_as_in_flight_before_the_response(self, run_proxy, server, monkeypatch):
+        """Should count a call from before send, and release it after a connect error too"""
+        router = make_router()
+        monkeypatch.setattr(server, "router", router)
+        seen = []
+
+        def handler(request):
+            seen.append(sum(p.in_flight for p in router.providers.values()))
+            if len(seen) == 1:
+                raise httpx.ConnectError("refused")
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert seen == [1, 1]
+        assert all(p.in_flight == 0 for p in router.providers.values())
+
+    def test_no_configured_provider_returns_500(self, run_proxy, server, monkeypatch):
+        """Should fail clearly when no API key is configured"""
+        from kimi_proxy.router import load_router
+        monkeypatch.setattr(server, "router", load_router(env={}))
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(lambda request: httpx.Response(200), scenario)
+
+        assert response.status_code == 500
+        assert "No upstream provider" in response.json()["detail"]
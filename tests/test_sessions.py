@@ -0,0 +1,283 @@
+"""
+Tests for stateful chat sessions (kimi_proxy/sessions.py, /v1/sessions)
+"""
+import httpx
+import orjson
+import pytest
+from starlette.testclient import TestClient
+
+from kimi_proxy.payload import InvalidRequest
+from kimi_proxy.sessions import SessionBusy, SessionNotFound, SessionStore, SharedSessionStore
+from kimi_proxy.sse import completion_to_sse
+from conftest import completion_body
+
+SYSTEM = {"role": "system", "content": "Eres un asistente. " + "contexto " * 2000}
+
+
+def begin(store, session, data):
+    raw = orjson.dumps(data)
+    parsed, seconds = store.parse(raw)
+    return store.begin(session, parsed, len(raw), seconds)
+
+
+def echo_handler(seen):
+    """Mock upstream answering with the number of messages it received"""
+    def handler(request):
+        data = orjson.loads(request.content)
+        seen.append(data)
+        completion = completion_body(f"turno {len(data['messages'])}")
+        if data.get("stream"):
+            return httpx.Response(200, content=b"".join(completion_to_sse(completion)),
+                                  headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=completion)
+    return handler
+
+
+@pytest.fixture(params=["memory", "shared"])
+def store(request, server, monkeypatch, tmp_path):
+    store = SessionStore() if request.param == "memory" else SharedSessionStore(tmp_path / "sessions.sqlite")
+    monkeypatch.setattr(server, "sessions", store)
+    return store
+
+
+class TestSessionStore:
+    def test_body_matches_a_full_request(self):
+        """Should build the same upstream payload a stateless client would send"""
+        store = SessionStore()
+        session = store.create({"model": "m", "messages": [SYSTEM], "temperature": 0.3,
+                                "extra_body": {"top_k": 5}}, "client", "default")
+        turn = begin(store, session, {"message": {"role": "user", "content": "hola"}, "max_tokens": 9})
+        body = turn.body()
+
+        expected = {"model": "m", "stream": False, "temperature": 0.3, "top_k": 5, "max_tokens": 9,
+                    "messages": [SYSTEM, {"role": "user", "content": "hola"}]}
+        assert orjson.loads(body.raw) == expected
+        assert body.data == expected
+        assert orjson.loads(body.encode("kimi-k2"))["model"] == "kimi-k2"
+
+    def test_commit_appends_and_failure_leaves_history(self):
+        """Should store the turn and the reply only when the turn completes"""
+        store = SessionStore()
+        session = store.create({"messages": [SYSTEM]}, "client", "default")
+        turn = begin(store, session, {"message": {"role": "user", "content": "uno"}})
+        with pytest.raises(SessionBusy):
+            begin(store, session, {"message": {"role": "user", "content": "otro"}})
+        store.finish(turn, None)
+        assert len(session.messages) == 1
+
+        turn = begin(store, session, {"message": {"role": "user", "content": "uno"}})
+        store.finish(turn, {"role": "assistant", "content": "respuesta"})
+
+        assert [m["role"] for m in session.messages] == ["system", "user", "assistant"]
+        assert orjson.loads(b"[" + session._history + b"]") == session.messages
+        assert store.bytes == session.bytes
+
+    def test_reports_reused_bytes(self):
+        """Should count the stored history as bytes the client did not resend"""
+        store = SessionStore()
+        session = store.create({"messages": [SYSTEM]}, "client", "default")
+        history = session.bytes
+
+        turn = begin(store, session, {"message": {"role": "user", "content": "hola"}})
+
+        assert turn.reused_bytes == history
+        assert turn.ingress_bytes < history / 100
+        assert store.snapshot()["reused_bytes"] == history
+
+    def test_evicts_least_recently_used(self):
+        """Should drop idle sessions past the count or byte limits"""
+        store = SessionStore(max_sessions=2)
+        first = store.create({"messages": []}, "client", "default")
+        second = store.create({"messages": []}, "client", "default")
+        store.get(first.id, "client")
+        store.create({"messages": []}, "client", "default")
+
+        with pytest.raises(SessionNotFound):
+            store.get(second.id, "client")
+        assert store.get(first.id, "client") is first
+        assert store.evicted == 1
+
+        small = SessionStore(max_bytes=len(orjson.dumps(SYSTEM)) + 10)
+        old = small.create({"messages": [SYSTEM]}, "client", "default")
+        small.create({"messages": [SYSTEM]}, "client", "default")
+        with pytest.raises(SessionNotFound):
+            small.get(old.id, "client")
+
+    def test_other_clients_cannot_see_a_session(self):
+        """Should treat another client's session as not found"""
+        store = SessionStore()
+        session = store.create({"messages": []}, "alice", "default")
+
+        with pytest.raises(SessionNotFound):
+            store.get(session.id, "bob")
+        with pytest.raises(InvalidRequest):
+            begin(store, session, {"messages": []})
+
+
+class TestSharedSessionStore:
+    def test_session_is_visible_from_every_worker(self, tmp_path):
+        """Should let any worker run the next turn on the current history"""
+        a = SharedSessionStore(tmp_path / "sessions.sqlite")
+        b = SharedSessionStore(tmp_path / "sessions.sqlite")
+        session = a.create({"model": "m", "messages": [SYSTEM], "temperature": 0.3}, "client", "default")
+
+        turn = begin(b, b.get(session.id, "client"), {"message": {"role": "user", "content": "uno"}})
+        b.finish(turn, {"role": "assistant", "content": "1"})
+        turn = begin(a, a.get(session.id, "client"), {"message": {"role": "user", "content": "dos"}})
+
+        assert orjson.loads(turn.body().raw)["messages"] == [
+            SYSTEM, {"role": "user", "content": "uno"}, {"role": "assistant", "content": "1"},
+            {"role": "user", "content": "dos"},
+        ]
+        a.finish(turn, {"role": "assistant", "content": "2"})
+        shared = b.get(session.id, "client")
+        assert (shared.turns, len(shared.messages), shared.settings) == (2, 5, {"temperature": 0.3})
+        assert a.snapshot()["sessions"] == b.snapshot()["sessions"] == 1
+        with pytest.raises(SessionNotFound):
+            b.get(session.id, "other")
+
+    def test_one_turn_at_a_time_across_workers(self, tmp_path):
+        """Should refuse a concurrent turn from another worker until the first one ends"""
+        a = SharedSessionStore(tmp_path / "sessions.sqlite")
+        b = SharedSessionStore(tmp_path / "sessions.sqlite")
+        session = a.create({"messages": [SYSTEM]}, "client", "default")
+        turn = begin(a, session, {"message": {"role": "user", "content": "uno"}})
+
+        with pytest.raises(SessionBusy):
+            begin(b, b.get(session.id, "client"), {"message": {"role": "user", "content": "dos"}})
+        assert b.get(session.id, "client").busy
+
+        a.finish(turn, None)
+        begin(b, b.get(session.id, "client"), {"message": {"role": "user", "content": "dos"}})
+        a.delete(session.id, "client")
+        with pytest.raises(SessionNotFound):
+            b.get(session.id, "client")
+
+    def test_limits_apply_to_all_workers(self, tmp_path):
+        """Should evict the least recently used session whichever worker created it"""
+        a = SharedSessionStore(tmp_path / "sessions.sqlite", max_sessions=1)
+        b = SharedSessionStore(tmp_path / "sessions.sqlite", max_sessions=1)
+        old = a.create({"messages": []}, "client", "default")
+        b.create({"messages": []}, "client", "default")
+
+        with pytest.raises(SessionNotFound):
+            a.get(old.id, "client")
+
+
+class TestSessionEndpoints:
+    def test_turns_send_only_the_new_message(self, run_proxy, store):
+        """Should rebuild the conversation upstream from one message per turn"""
+        seen = []
+
+        async def scenario(client):
+            created = (await client.post("/v1/sessions", json={"messages": [SYSTEM], "temperature": 0.5})).json()
+            responses = []
+            for i in range(3):
+                responses.append(await client.post(
+                    f"/v1/sessions/{created['id']}/messages",
+                    json={"message": {"role": "user", "content": f"pregunta {i}"}}
+                ))
+            return created, responses, (await client.get(f"/v1/sessions/{created['id']}")).json()
+
+        created, responses, info = run_proxy(echo_handler(seen), scenario)
+
+        assert [r.json()["choices"][0]["message"]["content"] for r in responses] == ["turno 2", "turno 4", "turno 6"]
+        assert [m["role"] for m in seen[-1]["messages"]] == ["system", "user", "assistant", "user", "assistant", "user"]
+        assert seen[-1]["messages"][2] == {"role": "assistant", "content": "turno 2"}
+        assert seen[-1]["temperature"] == 0.5
+        last = responses[-1].headers
+        assert int(last["x-kimi-session-reused-bytes"]) > 50 * int(last["x-kimi-session-ingress-bytes"])
+        assert (info["turns"], info["messages"]) == (3, 7)
+
+    def test_streamed_turn_is_stored(self, run_proxy, store):
+        """Should rebuild the streamed reply and append it to the history"""
+        seen = []
+
+        async def scenario(client):
+            session_id = (await client.post("/v1/sessions", json={"messages": [SYSTEM]})).json()["id"]
+            for i in range(2):
+                response = await client.post(f"/v1/sessions/{session_id}/messages",
+                                             json={"message": {"role": "user", "content": "hola"}, "stream": True})
+                assert response.headers["content-type"].startswith("text/event-stream")
+            return session_id
+
+        session_id = run_proxy(echo_handler(seen), scenario)
+
+        assert seen[-1]["stream"] is True
+        assert seen[-1]["messages"][2] == {"role": "assistant", "content": "turno 2"}
+        assert store.get(session_id, "ip:127.0.0.1").turns == 2
+
+    def test_failed_turn_can_be_retried(self, run_proxy, store):
+        """Should leave the history unchanged when the upstream fails"""
+        def handler(request):
+            return httpx.Response(400, json={"error": {"message": "bad"}})
+
+        async def scenario(client):
+            session_id = (await client.post("/v1/sessions", json={"messages": [SYSTEM]})).json()["id"]
+            response = await client.post(f"/v1/sessions/{session_id}/messages",
+                                         json={"message": {"role": "user", "content": "hola"}})
+            missing = await client.post("/v1/sessions/sess_missing/messages", json={"message": {"role": "user"}})
+            return session_id, response, missing
+
+        session_id, response, missing = run_proxy(handler, scenario)
+
+        assert response.status_code == 500
+        session = store.get(session_id, "ip:127.0.0.1")
+        assert (len(session.messages), session.busy) == (1, False)
+        assert missing.status_code == 404
+
+    def test_locked_shared_store_does_not_block_the_loop(self, run_proxy, server, monkeypatch, tmp_path):
+        """Should wait for another worker's write lock in a thread while other requests go on"""
+        import asyncio
+        import sqlite3
+
+        store = SharedSessionStore(tmp_path / "sessions.sqlite")
+        monkeypatch.setattr(server, "sessions", store)
+        other = sqlite3.connect(tmp_path / "sessions.sqlite", isolation_level=None)
+
+        async def scenario(client):
+            session_id = (await client.post("/v1/sessions", json={"messages": [SYSTEM]})).json()["id"]
+            other.execute("BEGIN IMMEDIATE")
+            turn = asyncio.ensure_future(client.post(
+                f"/v1/sessions/{session_id}/messages", json={"message": {"role": "user", "content": "hola"}}
+            ))
+            health = await asyncio.wait_for(client.get("/"), 2)
+            blocked = not turn.done()
+            other.execute("COMMIT")
+            return health, blocked, await turn
+
+        try:
+            health, blocked, turn = run_proxy(echo_handler([]), scenario)
+        finally:
+            other.close()
+
+        assert (health.status_code, blocked, turn.status_code) == (200, True, 200)
+
+    def test_websocket_streams_deltas(self, server, store):
+        """Should stream chunks and store each turn over one WebSocket"""
+        seen = []
+        server.app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(echo_handler(seen)))
+        client = TestClient(server.app)
+
+        with client.websocket_connect("/v1/sessions/ws") as ws:
+            ws.send_json({"type": "session.create", "messages": [SYSTEM]})
+            created = ws.receive_json()
+            frames = []
+            for i in range(2):
+                ws.send_json({"type": "message", "message": {"role": "user", "content": f"pregunta {i}"}})
+                while True:
+                    frames.append(ws.receive_json())
+                    if frames[-1]["type"] != "chunk":
+                        break
+            ws.send_json({"type": "message"})
+            error = ws.receive_json()
+
+        assert created["type"] == "session.created"
+        text = "".join(f["chunk"]["choices"][0]["delta"].get("content") or ""
+                       for f in frames if f["type"] == "chunk" and f["chunk"]["choices"])
+        assert text == "turno 2turno 4"
+        done = frames[-1]
+        assert done["type"] == "turn.done" and done["session"]["turns"] == 2
+        assert done["turn"]["reused_bytes"] > done["turn"]["ingress_bytes"]
+        assert seen[-1]["stream"] is True and len(seen[-1]["messages"]) == 4
+        assert error["type"] == "error" and error["error"]["code"] == 422
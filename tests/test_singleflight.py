@@ -0,0 +1,258 @@
+"""
+Tests for single-flight coalescing (kimi_proxy/singleflight.py)
+"""
+import asyncio
+
+import httpx
+
+from conftest import completion_body
+
+
+PAYLOAD = {
+    "model": "moonshot/kimi-k2-thinking",
+    "messages": [{"role": "user", "content": "Resume el informe"}],
+    "temperature": 0,
+    "max_tokens": 128
+}
+
+
+class GatedStream(httpx.AsyncByteStream):
+    """Upstream SSE body: emits `before`, waits for `gate`, then emits `after`"""
+
+    def __init__(self, before, after, gate):
+        self.before = before
+        self.after = after
+        self.gate = gate
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.before:
+            yield chunk
+        await self.gate.wait()
+        for chunk in self.after:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+def open_response(stream):
+    from kimi_proxy.upstream import UpstreamCall
+
+    async def start():
+        return UpstreamCall(
+            httpx.Response(200, stream=stream, headers={"content-type": "text/event-stream"})
+        )
+    return start
+
+
+class TestSingleFlight:
+    """Tests for the SingleFlight registry"""
+
+    def test_late_follower_receives_earlier_chunks(self):
+        """A follower joining mid-stream should replay the chunks it missed"""
+        from kimi_proxy.singleflight import SingleFlight
+
+        async def main():
+            group = SingleFlight()
+            gate = asyncio.Event()
+            start = open_response(GatedStream([b"data: 1\n\n"], [b"data: 2\n\n"], gate))
+
+            leader_flight, leader = group.join("k", start)
+            leader_iter = group.subscribe(leader_flight)
+            first = await leader_iter.__anext__()
+
+            follower_flight, is_leader = group.join("k", start)
+            gate.set()
+            follower_body = b"".join([c async for c in group.subscribe(follower_flight)])
+            leader_body = first + b"".join([c async for c in leader_iter])
+            return leader, is_leader, leader_flight is follower_flight, leader_body, follower_body, group
+
+        leader, is_leader, same, leader_body, follower_body, group = asyncio.run(main())
+
+        assert leader and not is_leader and same
+        assert leader_body == follower_body == b"data: 1\n\ndata: 2\n\n"
+        assert group.snapshot()["upstream_calls_saved"] == 1
+
+    def test_leader_disconnect_does_not_affect_followers(self):
+        """The upstream call should keep going while any subscriber remains"""
+        from kimi_proxy.singleflight import SingleFlight
+
+        async def main():
+            group = SingleFlight()
+            gate = asyncio.Event()
+            stream = GatedStream([b"data: 1\n\n"], [b"data: 2\n\n"], gate)
+            start = open_response(stream)
+
+            flight, _ = group.join("k", start)
+            leader_iter = group.subscribe(flight)
+            await leader_iter.__anext__()
+            group.join("k", start)
+            follower_iter = group.subscribe(flight)
+
+            await leader_iter.aclose()
+            gate.set()
+            body = b"".join([c async for c in follower_iter])
+            return body, flight, group
+
+        body, flight, group = asyncio.run(main())
+
+        assert body == b"data: 1\n\ndata: 2\n\n"
+        assert flight.error is None
+        assert group.snapshot()["abandoned"] == 0
+
+    def test_last_subscriber_leaving_cancels_upstream(self):
+        """With no subscribers left, the upstream call should be cancelled"""
+        from kimi_proxy.singleflight import SingleFlight
+
+        abandoned = []
+
+        async def main():
+            group = SingleFlight()
+            stream = GatedStream([b"data: 1\n\n"], [], asyncio.Event())
+
+            flight, _ = group.join("k", open_response(stream), on_abandon=abandoned.append)
+            subscriber = group.subscribe(flight)
+            await subscriber.__anext__()
+            await subscriber.aclose()
+            await asyncio.gather(flight.task, return_exceptions=True)
+            return stream, group
+
+        stream, group = asyncio.run(main())
+
+        assert stream.closed
+        assert len(abandoned) == 1
+        assert abandoned[0].events == 1
+        assert group.snapshot()["in_flight"] == 0
+
+
+class TestProxySingleFlight:
+    """Tests for coalescing in /v1/chat/completions"""
+
+    def test_identical_concurrent_requests_share_one_upstream_call(self, run_proxy):
+        """Byte-identical deterministic requests should hit the upstream once"""
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, json=completion_body("resumen"))
+
+        async def scenario(client):
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(5)
+            ])
+
+        responses = run_proxy(handler, scenario)
+
+        assert len(calls) == 1
+        assert all(r.status_code == 200 for r in responses)
+        assert {r.json()["choices"][0]["message"]["content"] for r in responses} == {"resumen"}
+        roles = sorted(r.headers["x-kimi-coalesced"] for r in responses)
+        assert roles == ["follower"] * 4 + ["leader"]
+
+    def test_streaming_followers_get_the_full_stream(self, run_proxy):
+        """Streaming followers should receive the same bytes as the leader"""
+        from test_sse import STREAM
+
+        calls = []
+
+        async def body():
+            for i in range(0, len(STREAM), 40):
+                await asyncio.sleep(0.005)
+                yield STREAM[i:i + 40]
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json={**PAYLOAD, "stream": True}) for _ in range(3)
+            ])
+
+        responses = run_proxy(handler, scenario)
+
+        assert len(calls) == 1
+        assert all(r.content == STREAM for r in responses)
+
+    def test_non_deterministic_requests_are_not_coalesced(self, run_proxy):
+        """Sampling requests (temperature > 0) must each get their own call"""
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            payload = {**PAYLOAD, "temperature": 0.7}
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=payload) for _ in range(3)
+            ])
+
+        run_proxy(handler, scenario)
+
+        assert len(calls) == 3
+
+    def test_upstream_error_reaches_every_subscriber(self, run_proxy):
+        """An upstream failure should be reported to leader and followers"""
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(503, json={"error": "overloaded"})
+
+        async def scenario(client):
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(3)
+            ])
+
+        responses = run_proxy(handler, scenario)
+
+        assert [r.status_code for r in responses] == [500, 500, 500]
+
+    def test_only_the_leader_pays_tokens(self, run_proxy, server, monkeypatch):
+        """Followers should get their estimate back and the leader pay the real usage"""
+        from kimi_proxy.ratelimit import RateLimiter
+        from test_sse import STREAM
+
+        monkeypatch.setattr(server, "rate_limiter", RateLimiter(tokens_per_minute=100_000))
+
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, content=STREAM, headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            headers = {"X-Kimi-Client": "bench"}
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json={**PAYLOAD, "stream": True}, headers=headers)
+                for _ in range(3)
+            ])
+
+        responses = run_proxy(handler, scenario)
+
+        assert all(r.content == STREAM for r in responses)
+        available = server.rate_limiter.snapshot()["clients"]["bench"]["tokens_available"]
+        # Sin ajuste se habrían quedado cobradas tres estimaciones de más de 128 tokens
+        assert available >= 100_000 - 7 - 10
+
+    def test_failed_shared_call_is_refunded(self, run_proxy, server, monkeypatch):
+        """Leader and followers should get their estimate back when the upstream fails"""
+        from kimi_proxy.ratelimit import RateLimiter
+
+        monkeypatch.setattr(server, "rate_limiter", RateLimiter(tokens_per_minute=100_000))
+
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(503, json={"error": "overloaded"})
+
+        async def scenario(client):
+            return await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=PAYLOAD, headers={"X-Kimi-Client": "bench"})
+                for _ in range(3)
+            ])
+
+        responses = run_proxy(handler, scenario)
+
+        assert [r.status_code for r in responses] == [500, 500, 500]
+        assert server.rate_limiter.snapshot()["clients"]["bench"]["tokens_available"] >= 100_000 - 10
+
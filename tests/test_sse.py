@@ -0,0 +1,113 @@
+"""
+Tests for SSE helpers (kimi_proxy/sse.py)
+"""
+import json
+
+
+def event(data):
+    return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+
+STREAM = (
+    event({"id": "c1", "model": "m", "created": 1, "choices": [{"index": 0, "delta": {"role": "assistant"}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {"reasoning_content": "pienso"}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {"content": "Hola "}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {"content": "mundo"}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "id": "call_1", "type": "function", "function": {"name": "buscar", "arguments": '{"q":'}}
+    ]}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "function": {"arguments": '"kimi"}'}}
+    ]}}]})
+    + event({"id": "c1", "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]})
+    + event({"id": "c1", "choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7}})
+    + b"data: [DONE]\n\n"
+)
+
+
+class TestCompletionAccumulator:
+    """Tests for CompletionAccumulator"""
+
+    def test_assembles_completion_from_split_chunks(self):
+        """Should rebuild the completion even when events are split mid-way"""
+        from kimi_proxy.sse import CompletionAccumulator
+
+        acc = CompletionAccumulator()
+        for i in range(0, len(STREAM), 11):
+            acc.feed(STREAM[i:i + 11])
+
+        result = acc.result()
+        message = result["choices"][0]["message"]
+
+        assert acc.complete
+        assert result["id"] == "c1"
+        assert message["content"] == "Hola mundo"
+        assert message["reasoning_content"] == "pienso"
+        assert message["tool_calls"][0]["function"] == {"name": "buscar", "arguments": '{"q":"kimi"}'}
+        assert result["choices"][0]["finish_reason"] == "tool_calls"
+        assert result["usage"]["total_tokens"] == 7
+
+    def test_incomplete_stream_is_not_complete(self):
+        """A stream cut before finish_reason/[DONE] should not be complete"""
+        from kimi_proxy.sse import CompletionAccumulator
+
+        acc = CompletionAccumulator()
+        acc.feed(STREAM[:len(STREAM) // 3])
+
+        assert not acc.complete
+
+    def test_handles_crlf_line_endings(self):
+        """SSE allows \\r\\n line endings"""
+        from kimi_proxy.sse import CompletionAccumulator
+
+        acc = CompletionAccumulator()
+        acc.feed(STREAM.replace(b"\n", b"\r\n"))
+
+        assert acc.result()["choices"][0]["message"]["content"] == "Hola mundo"
+
+    def test_feeds_openai_sdk_chunks(self):
+        """Should assemble decoded SDK chunks (CLI streaming) into a valid ChatCompletion"""
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+        from kimi_proxy.sse import CompletionAccumulator
+
+        acc = CompletionAccumulator()
+        for data in STREAM.split(b"\n\n")[:-2]:
+            chunk = ChatCompletionChunk.model_validate(
+                {"object": "chat.completion.chunk", "created": 1, "model": "m", **json.loads(data[6:])}
+            )
+            acc.feed_event(chunk.model_dump(exclude_none=True))
+
+        completion = ChatCompletion.model_validate(acc.result())
+        message = completion.choices[0].message
+
+        assert message.content == "Hola mundo"
+        assert message.tool_calls[0].function.arguments == '{"q":"kimi"}'
+        assert completion.usage.completion_tokens == 4
+
+
+class TestCompletionToSSE:
+    """Tests for completion_to_sse"""
+
+    def test_round_trip(self):
+        """Replaying a completion and re-assembling it should give it back"""
+        from kimi_proxy.sse import CompletionAccumulator, completion_to_sse
+
+        original = CompletionAccumulator()
+        original.feed(STREAM)
+        completion = original.result()
+
+        replayed = CompletionAccumulator()
+        for chunk in completion_to_sse(completion, chunk_chars=3):
+            replayed.feed(chunk)
+
+        assert replayed.done
+        assert replayed.result() == completion
+
+    def test_ends_with_done(self):
+        """The replay should end with data: [DONE]"""
+        from kimi_proxy.sse import DONE_EVENT, completion_to_sse
+
+        events = list(completion_to_sse({"choices": [{"index": 0, "message": {"content": "x"}}]}))
+
+        assert events[-1] == DONE_EVENT
@@ -0,0 +1,115 @@
+"""
+Tests for the SSE streaming relay (kimi_proxy/streaming.py)
+"""
+import asyncio
+
+import httpx
+
+from test_upstream import PAYLOAD
+
+
+SSE_BODY = (
+    b'data: {"choices":[{"delta":{"content":"Ho"}}]}\n\n'
+    b'data: {"choices":[{"delta":{"content":"la"}}]}\n\n'
+    b'data: [DONE]\n\n'
+)
+
+
+def chunked(data, size):
+    """Split bytes at arbitrary boundaries (not aligned with SSE events)"""
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestRelayStream:
+    """Tests for relay_stream"""
+
+    def test_forwards_bytes_unchanged(self):
+        """Should yield exactly the upstream bytes, blank separators included"""
+        from kimi_proxy.streaming import relay_stream
+        from kimi_proxy.upstream import UpstreamCall
+
+        async def upstream():
+            for part in chunked(SSE_BODY, 7):
+                yield part
+
+        async def main():
+            response = httpx.Response(200, content=upstream())
+            return b"".join([chunk async for chunk in relay_stream(UpstreamCall(response))])
+
+        assert asyncio.run(main()) == SSE_BODY
+
+    def test_applies_backpressure(self):
+        """Should not read ahead of a slow consumer"""
+        from kimi_proxy.streaming import relay_stream
+        from kimi_proxy.upstream import UpstreamCall
+
+        produced = []
+
+        async def upstream():
+            for i in range(50):
+                produced.append(i)
+                yield b"data: x\n\n"
+
+        async def main():
+            response = httpx.Response(200, content=upstream())
+            consumed = 0
+            max_lead = 0
+            async for _ in relay_stream(UpstreamCall(response)):
+                consumed += 1
+                max_lead = max(max_lead, len(produced) - consumed)
+                await asyncio.sleep(0)
+            return consumed, max_lead
+
+        consumed, max_lead = asyncio.run(main())
+
+        assert consumed == 50
+        assert max_lead <= 2
+
+    def test_closes_upstream_when_consumer_stops(self):
+        """Closing the relay early should close the upstream response"""
+        from kimi_proxy.streaming import relay_stream
+        from kimi_proxy.upstream import UpstreamCall
+
+        async def upstream():
+            for _ in range(100):
+                yield b"data: x\n\n"
+
+        async def main():
+            response = httpx.Response(200, content=upstream())
+            relay = relay_stream(UpstreamCall(response))
+            await relay.__anext__()
+            await relay.aclose()
+            return response.is_closed
+
+        assert asyncio.run(main())
+
+
+class TestStreamingEndpoint:
+    """Tests for stream=True through /v1/chat/completions"""
+
+    def test_preserves_sse_framing(self, run_proxy):
+        """Client should receive the upstream SSE stream byte-for-byte"""
+        async def body():
+            for part in chunked(SSE_BODY, 5):
+                yield part
+
+        def handler(request):
+            return httpx.Response(
+                200,
+                content=body(),
+                headers={"content-type": "text/event-stream"}
+            )
+
+        async def scenario(client):
+            async with client.stream(
+                "POST", "/v1/chat/completions", json={**PAYLOAD, "stream": True}
+            ) as response:
+                body = b"".join([chunk async for chunk in response.aiter_bytes()])
+                return response, body
+
+        response, body = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.headers["cache-control"] == "no-cache"
+        assert body == SSE_BODY
@@ -0,0 +1,205 @@
+"""
+Tests for the incremental Kimi-K2 tool-call parser and the completions-only backend translation.
+"""
+import httpx
+import orjson
+import pytest
+
+from kimi_proxy.completions import JsonTranslator, StreamTranslator, completion_request, render_prompt
+from kimi_proxy.payload import ChatBody
+from kimi_proxy.toolcalls import ToolCallParser, assemble, extract_tool_call_info
+
+RAW = (
+    "<think>Need the weather.</think>Let me check."
+    "<|tool_calls_section_begin|>"
+    "<|tool_call_begin|>functions.get_weather:0<|tool_call_argument_begin|> {\"city\": \"Beijing\"} <|tool_call_end|>"
+    "<|tool_call_begin|>functions.get_time:1<|tool_call_argument_begin|>{\"tz\": \"<UTC>\"}<|tool_call_end|>"
+    "<|tool_calls_section_end|>"
+)
+
+
+def parse_in_chunks(text, size):
+    parser = ToolCallParser()
+    events = []
+    for i in range(0, len(text), size):
+        events += parser.feed(text[i:i + size])
+    return assemble(events + parser.finish())
+
+
+def sse(*texts, finish_reason="stop"):
+    events = [
+        {"id": "cmpl-1", "object": "text_completion", "created": 1, "model": "m",
+         "choices": [{"index": 0, "text": text, "finish_reason": None}]}
+        for text in texts
+    ]
+    events[-1]["choices"][0]["finish_reason"] = finish_reason
+    return b"".join(b"data: " + orjson.dumps(e) + b"\n\n" for e in events) + b"data: [DONE]\n\n"
+
+
+def chunks_of(payload):
+    return [orjson.loads(line[6:]) for line in payload.split(b"\n\n") if line.startswith(b"data: {")]
+
+
+class TestToolCallParser:
+    @pytest.mark.parametrize("size", [1, 2, 3, 7, 16, 1000])
+    def test_markers_split_across_chunks(self, size):
+        """Should give the same result however the text is split"""
+        content, reasoning, calls = parse_in_chunks(RAW, size)
+
+        assert content == "Let me check."
+        assert reasoning == "Need the weather."
+        assert calls == extract_tool_call_info(RAW)
+        assert calls[1]["function"] == {"name": "get_time", "arguments": '{"tz": "<UTC>"}'}
+
+    def test_partial_marker_is_held_back(self):
+        """Should not emit text that may be the start of a special token"""
+        parser = ToolCallParser()
+
+        assert parser.feed("Hi <|tool_calls") == [("content", "Hi ")]
+        assert parser.feed("_sect") == []
+        assert parser.finish() == [("content", "<|tool_calls_sect")]
+
+    def test_arguments_stream_incrementally(self):
+        """Should emit the call header first and argument fragments as they arrive"""
+        parser = ToolCallParser()
+        events = parser.feed("<|tool_calls_section_begin|><|tool_call_begin|>functions.f:0<|tool_call_argument_begin|>{\"a\"")
+
+        assert events == [("tool_call", 0, "functions.f:0", "f"), ("arguments", 0, '{"a"')]
+        assert parser.feed(": 1}<|tool_call_end|>") == [("arguments", 0, ": 1}")]
+        assert parser.tool_calls == 1
+
+
+class TestCompletionsBackend:
+    def test_prompt_follows_the_chat_template(self):
+        """Should render tools, default system prompt, tool calls and results"""
+        prompt = render_prompt(
+            [
+                {"role": "user", "content": "weather?"},
+                {"role": "assistant", "content": "", "tool_calls": [
+                    {"id": "functions.get_weather:0", "type": "function",
+                     "function": {"name": "get_weather", "arguments": "{}"}}
+                ]},
+                {"role": "tool", "tool_call_id": "functions.get_weather:0", "content": "sunny"},
+            ],
+            tools=[{"type": "function", "function": {"name": "get_weather"}}],
+        )
+
+        assert prompt.startswith("<|im_system|>tool_declare<|im_middle|>[")
+        assert "<|im_system|>system<|im_middle|>You are Kimi" in prompt
+        assert "<|tool_call_begin|>functions.get_weather:0<|tool_call_argument_begin|>{}<|tool_call_end|>" in prompt
+        assert "<|im_system|>tool<|im_middle|>## Return of functions.get_weather:0\nsunny<|im_end|>" in prompt
+        assert prompt.endswith("<|im_assistant|>assistant<|im_middle|>")
+
+    def test_request_keeps_special_tokens(self):
+        """Should ask for raw text with the sampling fields of the chat request"""
+        body = ChatBody({"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0.2})
+
+        request = orjson.loads(completion_request(body, "upstream/M"))
+
+        assert request["model"] == "upstream/M"
+        assert request["skip_special_tokens"] is False
+        assert request["temperature"] == 0.2
+        assert "messages" not in request
+
+    def test_stream_translation(self):
+        """Should turn text_completion events into tool_calls deltas"""
+        upstream = sse(*[RAW[i:i + 5] for i in range(0, len(RAW), 5)])
+        translator = StreamTranslator()
+
+        out = b"".join(translator.feed(upstream[i:i + 11]) for i in range(0, len(upstream), 11)) + translator.close()
+        chunks = chunks_of(out)
+
+        assert out.endswith(b"data: [DONE]\n\n")
+        assert chunks[0]["choices"][0]["delta"]["role"] == "assistant"
+        assert all(c["object"] == "chat.completion.chunk" for c in chunks)
+        assert chunks[-1]["choices"][0]["finish_reason"] == "tool_calls"
+        calls = [d for c in chunks for d in c["choices"][0]["delta"].get("tool_calls", [])]
+        assert [c["id"] for c in calls if "id" in c] == ["functions.get_weather:0", "functions.get_time:1"]
+        assert "".join(c["function"]["arguments"] for c in calls if c["index"] == 0) == '{"city": "Beijing"}'
+
+    def test_stream_translation_keeps_choices_apart(self):
+        """Should parse each choice of an n>1 stream separately and keep its index"""
+        pieces = [RAW[i:i + 7] for i in range(0, len(RAW), 7)]
+        events = []
+        for i, piece in enumerate(pieces):
+            events.append({"choices": [{"index": 0, "text": piece, "finish_reason": None}]})
+            events.append({"choices": [{"index": 1, "text": f"plain {i} ", "finish_reason": None}]})
+        events[-2]["choices"][0]["finish_reason"] = events[-1]["choices"][0]["finish_reason"] = "stop"
+        upstream = b"".join(b"data: " + orjson.dumps(e) + b"\n\n" for e in events) + b"data: [DONE]\n\n"
+
+        chunks = chunks_of(StreamTranslator().feed(upstream))
+
+        deltas = {0: [], 1: []}
+        finish = {}
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            deltas[choice["index"]].append(choice["delta"])
+            finish[choice["index"]] = choice["finish_reason"] or finish.get(choice["index"])
+        assert deltas[0][0]["role"] == deltas[1][0]["role"] == "assistant"
+        assert "".join(d.get("content", "") for d in deltas[0]) == "Let me check."
+        assert "".join(d.get("content", "") for d in deltas[1]) == "".join(f"plain {i} " for i in range(len(pieces)))
+        assert not any("tool_calls" in d for d in deltas[1])
+        assert finish == {0: "tool_calls", 1: "stop"}
+
+    def test_json_translation(self):
+        """Should build a chat.completion message from the raw text"""
+        translator = JsonTranslator()
+        translator.feed(orjson.dumps({
+            "id": "cmpl-1", "object": "text_completion", "created": 1, "model": "m",
+            "choices": [{"index": 0, "text": RAW, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 9, "total_tokens": 12},
+        }))
+
+        completion = orjson.loads(translator.close())
+
+        assert completion["object"] == "chat.completion"
+        assert completion["choices"][0]["finish_reason"] == "tool_calls"
+        assert completion["choices"][0]["message"]["content"] == "Let me check."
+        assert completion["choices"][0]["message"]["tool_calls"] == extract_tool_call_info(RAW)
+        assert completion["usage"]["total_tokens"] == 12
+
+
+class TestCompletionsEndpoint:
+    @pytest.fixture
+    def completions_provider(self, server):
+        server.router.providers["chutes"].api = "completions"
+
+    def test_streaming_chat_over_completions(self, run_proxy, completions_provider):
+        """Should call /v1/completions and stream chat chunks with tool_calls"""
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, content=sse(RAW[:40], RAW[40:]), headers={"content-type": "text/event-stream"})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json={
+                "model": "moonshot/kimi-k2-thinking", "stream": True,
+                "messages": [{"role": "user", "content": "weather?"}],
+            })
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert seen[0].url.path.endswith("/completions")
+        assert not seen[0].url.path.endswith("/chat/completions")
+        chunks = chunks_of(response.content)
+        assert chunks[-1]["choices"][0]["finish_reason"] == "tool_calls"
+
+    def test_non_streaming_chat_over_completions(self, run_proxy, completions_provider):
+        """Should return a chat.completion built from the raw text"""
+        def handler(request):
+            return httpx.Response(200, json={
+                "id": "cmpl-1", "object": "text_completion", "created": 1, "model": "m",
+                "choices": [{"index": 0, "text": "plain answer", "finish_reason": "stop"}],
+            })
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json={
+                "model": "moonshot/kimi-k2-thinking", "messages": [{"role": "user", "content": "hi"}],
+            })
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"] == {"role": "assistant", "content": "plain answer"}
@@ -0,0 +1,109 @@
+"""
+Tests for the pooled async upstream client (kimi_proxy/upstream.py)
+"""
+import asyncio
+import time
+
+import httpx
+
+from conftest import completion_body
+
+
+PAYLOAD = {
+    "model": "moonshot/kimi-k2-thinking",
+    "messages": [{"role": "user", "content": "Hola"}],
+    "max_tokens": 32
+}
+
+
+class TestCreateUpstreamClient:
+    """Tests for create_upstream_client"""
+
+    def test_returns_async_client(self):
+        """Should build an httpx.AsyncClient"""
+        from kimi_proxy.upstream import create_upstream_client
+
+        client = create_upstream_client(max_connections=5, timeout=30)
+
+        assert isinstance(client, httpx.AsyncClient)
+        assert client.timeout.read == 30
+        asyncio.run(client.aclose())
+
+    def test_http2_falls_back_without_h2(self, monkeypatch):
+        """Should not fail when h2 is missing, just use HTTP/1.1"""
+        from kimi_proxy import upstream
+
+        monkeypatch.setattr(upstream, "http2_available", lambda: False)
+        client = upstream.create_upstream_client(http2=True)
+
+        assert isinstance(client, httpx.AsyncClient)
+        asyncio.run(client.aclose())
+
+
+class TestChatCompletionUpstream:
+    """Tests for /v1/chat/completions over the shared client"""
+
+    def test_forwards_request_and_returns_body(self, run_proxy):
+        """Should POST to the upstream with the API key and return its JSON"""
+        seen = {}
+
+        def handler(request):
+            seen["auth"] = request.headers["authorization"]
+            seen["url"] = str(request.url)
+            return httpx.Response(200, json=completion_body("hola"))
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "hola"
+        assert seen["auth"] == "Bearer test-key"
+        assert seen["url"].endswith("/chat/completions")
+
+    def test_concurrent_requests_do_not_serialize(self, run_proxy):
+        """N concurrent requests should take ~1x the upstream latency, not Nx"""
+        delay = 0.2
+
+        async def handler(request):
+            await asyncio.sleep(delay)
+            return httpx.Response(200, json=completion_body())
+
+        async def scenario(client):
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/v1/chat/completions", json=PAYLOAD) for _ in range(20)
+            ])
+            return time.perf_counter() - start, responses
+
+        elapsed, responses = run_proxy(handler, scenario)
+
+        assert all(r.status_code == 200 for r in responses)
+        assert elapsed < delay * 5
+
+    def test_upstream_error_returns_500(self, run_proxy):
+        """Upstream HTTP errors should surface as HTTP 500"""
+        def handler(request):
+            return httpx.Response(502, json={"error": "bad gateway"})
+
+        async def scenario(client):
+            return await client.post("/v1/chat/completions", json=PAYLOAD)
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 500
+        assert "Chutes.ai" in response.json()["detail"]
+
+    def test_simple_test_uses_shared_client(self, run_proxy):
+        """/test/simple should go through the same async client"""
+        def handler(request):
+            return httpx.Response(200, json=completion_body("Kimi K2 es un modelo"))
+
+        async def scenario(client):
+            return await client.post("/test/simple", params={"prompt": "hola"})
+
+        response = run_proxy(handler, scenario)
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Kimi K2 es un modelo"